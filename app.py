@@ -2,11 +2,11 @@ import json
 import os
 import pyodbc
 import pandas as pd
-import smtplib
-import requests  # Para chamar a API do Render
+import requests  # Exceções (requests.exceptions.*) das chamadas ao Render
+import cliente_http  # Chamadas de saída (Render/TOTVS): sessão por host, novas tentativas, circuit breaker
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response, stream_with_context
 from flask_caching import Cache
 from datetime import datetime, timedelta
 from io import BytesIO
@@ -14,6 +14,13 @@ import re
 
 # Importar módulo de banco de dados local (cotações)
 import database as db
+from fila_email import EnviadorEmails
+from transporte_email import criar_transporte
+from servir_arquivos import ServidorArquivos
+from armazenamento_anexos import ArmazenamentoAnexos, AnexoMuitoGrande
+from indice_fornecedores import IndiceFornecedores
+from catalogo_produtos import CatalogoProdutos
+from tarefa_periodica import Indisponivel
 
 app = Flask(__name__)
 app.secret_key = 'sua_chave_secreta_aqui'
@@ -167,6 +174,35 @@ SENHA_EMAIL = 'krikozmhqmzdraiu'
 SMTP_SERVER = 'smtp.gmail.com'
 SMTP_PORT = 587
 
+# Fila de saída: as rotas gravam a mensagem pronta e respondem na hora com o
+# lote_id; o envio (uma conexão SMTP reaproveitada, limite por minuto, novas
+# tentativas) roda em segundo plano - ver fila_email.py
+EMAIL_ENVIOS_POR_MINUTO = int(os.environ.get('EMAIL_ENVIOS_POR_MINUTO', 20))
+
+# Transporte: 'smtp' (Gmail), 'arquivo:<caminho.mbox>' (grava sem enviar) ou
+# 'falso' (servidor SMTP em memória, para testes de carga) - ver transporte_email.py
+EMAIL_TRANSPORTE = os.environ.get('EMAIL_TRANSPORTE', 'smtp')
+
+enviador_emails = EnviadorEmails(
+    criar_transporte(EMAIL_TRANSPORTE, SMTP_SERVER, SMTP_PORT, EMAIL_REMETENTE, SENHA_EMAIL),
+    EMAIL_REMETENTE,
+    db.reservar_emails_fila, db.concluir_email_fila,
+    envios_por_minuto=EMAIL_ENVIOS_POR_MINUTO
+)
+
+
+def enfileirar_emails(mensagens):
+    """Grava as mensagens na fila e acorda o envio. Retorna o lote_id."""
+    lote_id = db.enfileirar_emails(mensagens)
+    enviador_emails.acordar()
+    return lote_id
+
+
+def _iniciar_fila_emails():
+    """Envio em segundo plano (uma vez por processo)"""
+    db.recuperar_emails_em_envio()
+    enviador_emails.iniciar()
+
 # --- BLOQUEIOS HARDCODED ---
 BLOQUEIO_FINANCEIRO = [
     "M R FERNANDES PRADO"
@@ -1275,6 +1311,24 @@ def health_check():
             'db_error': str(e)
         })
 
+@app.route('/api/diagnostico/render')
+def diagnostico_render():
+    """Keep-warm do Render: janela, últimos pings e cold starts registrados"""
+    return jsonify({
+        'success': True,
+        'timestamp': datetime.now().isoformat(),
+        'aquecimento': aquecedor_render.status()
+    })
+
+@app.route('/api/diagnostico/http')
+def diagnostico_http():
+    """Latência por endpoint e estado do circuit breaker das chamadas de saída (Render/TOTVS)"""
+    return jsonify({
+        'success': True,
+        'timestamp': datetime.now().isoformat(),
+        **cliente_http.metricas()
+    })
+
 
 # =============================================================================
 # API PARA CRIAR COTAÇÃO EXTERNA (CHAMADA PELO SISTEMA LOCAL)
@@ -1454,10 +1508,8 @@ def cotacao_externa_publica(token):
         dados_cotacao = None
         arquivo_json = envio.get('arquivo_json_gerado')
         
-        if arquivo_json and os.path.exists(arquivo_json):
-            with open(arquivo_json, 'r', encoding='utf-8') as f:
-                dados_cotacao = json.load(f)
-        else:
+        dados_cotacao = _ler_json_artefato(arquivo_json)
+        if dados_cotacao is None:
             dados_cotacao = reconstruir_dados_cotacao(envio)
         
         if not dados_cotacao:
@@ -1580,24 +1632,189 @@ def enviar_cotacao_externa(token):
 # Quando encontra uma resposta pendente, sincroniza para o banco local.
 # =============================================================================
 
+# -----------------------------------------------------------------------------
+# SINCRONIZADOR + CANAL DE EVENTOS (SSE)
+# -----------------------------------------------------------------------------
+# O sincronizador (sincronizador_render.py) roda em segundo plano desde o
+# início do processo, com ou sem abas abertas: busca as respostas pendentes no
+# Render, importa no banco local (idempotente por token) e confirma.
+# Cada importação nova vira um evento 'sincronizada' no canal; as abas recebem
+# via /api/cotacoes-externas/eventos e só mostram o aviso e atualizam a tela.
+# -----------------------------------------------------------------------------
+from eventos_cotacoes import CanalEventos, CanalLotado
+from sincronizador_render import SincronizadorRender
+from aquecimento_render import AquecedorRender
+
+# Capacidade: no gunicorn gthread (Procfile) cada aba com o canal aberto ocupa
+# uma das GUNICORN_THREADS threads do worker por até 5 minutos. O canal aceita
+# no máximo SSE_MAXIMO_CONEXOES abas (padrão: metade das threads), para sobrar
+# thread para páginas, APIs e downloads; as demais recebem 503 e usam o polling
+# de /api/cotacoes-externas/eventos/recentes (ver static/js/polling_cotacoes.js).
+# Ex.: 10 compradores com 3 abas = 30 abas → GUNICORN_THREADS=64.
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 32))
+SSE_MAXIMO_CONEXOES = int(os.environ.get('SSE_MAXIMO_CONEXOES', max(1, GUNICORN_THREADS // 2)))
+
+canal_cotacoes = CanalEventos(maximo_assinantes=SSE_MAXIMO_CONEXOES)
+
+SINCRONIZADOR_RENDER_ATIVO = os.environ.get('SINCRONIZADOR_RENDER_ATIVO', '1') != '0'
+SINCRONIZADOR_RENDER_INTERVALO = int(os.environ.get('SINCRONIZADOR_RENDER_INTERVALO', 15))  # segundos
+# Fora da janela do keep-warm o feed vazio espaça os ciclos até este teto, para
+# o Render poder hibernar à noite e no fim de semana
+SINCRONIZADOR_RENDER_OCIOSO = int(os.environ.get('SINCRONIZADOR_RENDER_OCIOSO', 1800))  # segundos
+
+
+def _notificar_sincronizacao(resposta, resultado):
+    """Publica para as abas a resposta que acabou de ser importada"""
+    canal_cotacoes.publicar('sincronizada', {
+        'token': resposta.get('token'),
+        'cotacao_id': resposta.get('cotacao_id'),
+        'fornecedor_id': resposta.get('fornecedor_id'),
+        'fornecedor_nome': resposta.get('fornecedor_nome', 'Fornecedor'),
+        'itens_processados': resultado.get('itens_processados', 0)
+    })
+
+
+# Keep-warm: mantém o Render acordado na janela do expediente (começa antes
+# dos usuários chegarem) e registra os cold starts - ver aquecimento_render.py
+AQUECIMENTO_RENDER_ATIVO = os.environ.get('AQUECIMENTO_RENDER_ATIVO', '1') != '0'
+
+aquecedor_render = AquecedorRender(
+    RENDER_PUBLIC_URL,
+    inicio=os.environ.get('AQUECIMENTO_RENDER_INICIO', '07:00'),
+    fim=os.environ.get('AQUECIMENTO_RENDER_FIM', '19:00'),
+    intervalo_minutos=int(os.environ.get('AQUECIMENTO_RENDER_INTERVALO_MINUTOS', 10))
+)
+
+sincronizador_render = SincronizadorRender(
+    RENDER_PUBLIC_URL,
+    db.importar_resposta_render,
+    ao_sincronizar=_notificar_sincronizacao,
+    intervalo=SINCRONIZADOR_RENDER_INTERVALO,
+    janela=aquecedor_render.dentro_da_janela,
+    intervalo_ocioso=SINCRONIZADOR_RENDER_OCIOSO
+)
+
+
+def _iniciar_tarefas_render():
+    """Sincronizador e keep-warm (uma vez por processo)"""
+    if SINCRONIZADOR_RENDER_ATIVO:
+        sincronizador_render.iniciar()
+    if AQUECIMENTO_RENDER_ATIVO:
+        aquecedor_render.iniciar()
+
+
+@app.route('/api/cotacoes-externas/eventos', methods=['GET'])
+def api_eventos_cotacoes():
+    """
+    Canal Server-Sent Events para as abas do navegador.
+    
+    Eventos:
+    - sincronizada: resposta de fornecedor importada pelo sincronizador
+      (token, cotacao_id, fornecedor_id, fornecedor_nome, itens_processados)
+    
+    O navegador reconecta sozinho (Last-Event-ID) e recebe os eventos perdidos.
+    Com SSE_MAXIMO_CONEXOES abas já conectadas responde 503 (Retry-After) e a
+    aba passa para o polling de /api/cotacoes-externas/eventos/recentes.
+    """
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = None
+    
+    try:
+        fila = canal_cotacoes.assinar(ultimo_id)
+    except CanalLotado:
+        return jsonify({
+            'success': False,
+            'error': 'Canal de eventos lotado, use /api/cotacoes-externas/eventos/recentes'
+        }), 503, {'Retry-After': '60'}
+    
+    resposta = Response(
+        stream_with_context(canal_cotacoes.stream_sse(fila=fila)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Libera a vaga mesmo se o stream nunca chegar a ser iterado
+    resposta.call_on_close(lambda: canal_cotacoes.cancelar(fila))
+    return resposta
+
+
+@app.route('/api/cotacoes-externas/eventos/recentes', methods=['GET'])
+def api_eventos_cotacoes_recentes():
+    """
+    Mesmos eventos do canal SSE, para o polling de fallback das abas.
+    ?desde=<id> retorna os eventos posteriores; sem desde, só o último id
+    (a aba começa a acompanhar a partir de agora).
+    """
+    desde = request.args.get('desde', type=int)
+    if desde is None:
+        return jsonify({'success': True, 'eventos': [], 'ultimo_id': canal_cotacoes.ultimo_id()})
+    
+    eventos = canal_cotacoes.eventos_desde(desde)
+    return jsonify({
+        'success': True,
+        'eventos': [{'id': evento_id, 'tipo': tipo, 'dados': dados} for evento_id, tipo, dados in eventos],
+        'ultimo_id': eventos[-1][0] if eventos else max(desde, canal_cotacoes.ultimo_id())
+    })
+
+
+@app.route('/api/cotacoes-externas/eventos/status', methods=['GET'])
+def api_eventos_cotacoes_status():
+    """Estado do canal de eventos e métricas do sincronizador (última execução, atraso, erros)"""
+    return jsonify({
+        'success': True,
+        'assinantes': canal_cotacoes.total_assinantes(),
+        'maximo_assinantes': canal_cotacoes.maximo_assinantes,
+        'recusados': canal_cotacoes.recusados,
+        'sincronizador': sincronizador_render.status()
+    })
+
+
+@app.route('/api/cotacoes-externas/sincronizador/executar', methods=['POST'])
+def api_executar_sincronizador():
+    """Antecipa o próximo ciclo do sincronizador (botão 'verificar agora')"""
+    _iniciar_tarefas_render()
+    sincronizador_render.acordar()
+    return jsonify({'success': True, 'sincronizador': sincronizador_render.status()})
+
+
 @app.route('/api/cotacoes-externas/polling', methods=['GET'])
 def api_polling_respostas_render():
     """
     Endpoint principal de polling - busca respostas no Render.
     
-    O frontend chama esta rota a cada 20 segundos.
-    Esta rota consulta o Render e retorna respostas pendentes de sincronização.
+    Consulta o Render e retorna respostas pendentes de sincronização.
+    (As abas não chamam mais esta rota: a importação é feita pelo sincronizador
+    e as abas recebem os eventos em /api/cotacoes-externas/eventos.)
+    
+    Feed incremental: ?since=<cursor> e If-None-Match são repassados ao Render;
+    o retorno traz 'cursor' (próximo since) e ETag. Sem novidade → 304.
+    Sem since, retorna todas as pendentes (comportamento anterior).
     
     FALLBACK: Se o Render não tiver o endpoint, busca do banco local.
     """
     try:
         # Primeiro tenta buscar do Render
         try:
-            response = requests.get(
+            params = {}
+            if request.args.get('since'):
+                params['since'] = request.args.get('since')
+            headers = {}
+            if request.headers.get('If-None-Match'):
+                headers['If-None-Match'] = request.headers.get('If-None-Match')
+            
+            response = cliente_http.get(
                 f"{RENDER_PUBLIC_URL}/api/respostas-pendentes",
-                timeout=5
+                params=params,
+                headers=headers,
+                timeout=5,
+                tentativas=1  # quem chama já repete a consulta
             )
             
+            if response.status_code == 304:
+                return '', 304, {'ETag': response.headers.get('ETag', ''), 'Cache-Control': 'no-cache'}
+            
             if response.status_code == 200:
                 dados_render = response.json()
                 
@@ -1607,12 +1824,18 @@ def api_polling_respostas_render():
                     if respostas:
                         print(f"[POLLING] {len(respostas)} resposta(s) do Render")
                     
-                    return jsonify({
+                    resposta_http = jsonify({
                         'success': True,
                         'respostas': respostas,
                         'count': len(respostas),
+                        'cursor': dados_render.get('cursor'),
+                        'tem_mais': dados_render.get('tem_mais', False),
                         'source': 'render'
                     })
+                    if response.headers.get('ETag'):
+                        resposta_http.headers['ETag'] = response.headers['ETag']
+                        resposta_http.headers['Cache-Control'] = 'no-cache'
+                    return resposta_http
         except Exception as e:
             # Silenciosamente ignora erro do Render e usa fallback local
             pass
@@ -1652,6 +1875,9 @@ def api_sincronizar_resposta_render():
     """
     Sincroniza uma resposta do Render com o banco local.
     
+    Normalmente quem faz isso é o sincronizador em segundo plano; a rota fica
+    para sincronização manual/integrações.
+    
     Recebe os dados da resposta e:
     1. Atualiza status do fornecedor para 'Respondido'
     2. Insere/atualiza preços na tabela de respostas
@@ -1673,99 +1899,39 @@ def api_sincronizar_resposta_render():
         
         print(f"[SINCRONIZAÇÃO] Processando resposta: Token={token[:8]}..., Cotação={cotacao_id}, Fornecedor={fornecedor_nome}")
         
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
+        # 1 e 2. Status do fornecedor + preços (idempotente: se o sincronizador
+        # já importou este token, nada é alterado)
+        resultado = db.importar_resposta_render(dados, origem='manual')
+        itens_processados = resultado['itens_processados']
+        if resultado['importada']:
+            _notificar_sincronizacao(dados, resultado)
+        else:
+            print(f"[SINCRONIZAÇÃO] Token já importado anteriormente")
         
+        # 3. Confirma sincronização no Render
         try:
-            # 1. Atualiza status e dados gerais do fornecedor
-            frete_total = float(dados.get('frete_total', 0) or 0)
-            condicao_pagamento = dados.get('condicao_pagamento', '')
-            observacao_geral = dados.get('observacao_geral', '')
-            
-            cursor.execute('''
-                UPDATE cotacao_fornecedores 
-                SET status = 'Respondido',
-                    data_resposta = CURRENT_TIMESTAMP,
-                    frete_total = ?,
-                    condicao_pagamento = ?,
-                    observacao_geral = ?
-                WHERE id = ?
-            ''', (frete_total, condicao_pagamento, observacao_geral, fornecedor_id))
-            
-            print(f"[SINCRONIZAÇÃO] Status do fornecedor {fornecedor_id} atualizado para 'Respondido'")
-            
-            # 2. Processa itens da resposta
-            itens = dados.get('itens', [])
-            itens_processados = 0
-            
-            for item in itens:
-                item_id = item.get('item_id')
-                preco_unitario = float(item.get('preco_unitario', 0) or 0)
-                prazo_entrega = int(item.get('prazo_entrega', 0) or 0)
-                observacao_item = item.get('observacao', '')
-                
-                if not item_id:
-                    continue
-                
-                # Verifica se já existe resposta para este item
-                cursor.execute('''
-                    SELECT id FROM cotacao_respostas 
-                    WHERE cotacao_id = ? AND fornecedor_id = ? AND item_id = ?
-                ''', (cotacao_id, fornecedor_id, item_id))
-                
-                existe = cursor.fetchone()
-                
-                if existe:
-                    # Atualiza resposta existente
-                    cursor.execute('''
-                        UPDATE cotacao_respostas 
-                        SET preco_unitario = ?,
-                            prazo_entrega = ?,
-                            observacao = ?,
-                            data_resposta = CURRENT_TIMESTAMP
-                        WHERE cotacao_id = ? AND fornecedor_id = ? AND item_id = ?
-                    ''', (preco_unitario, prazo_entrega, observacao_item, cotacao_id, fornecedor_id, item_id))
-                else:
-                    # Insere nova resposta
-                    cursor.execute('''
-                        INSERT INTO cotacao_respostas 
-                        (cotacao_id, fornecedor_id, item_id, preco_unitario, prazo_entrega, observacao)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (cotacao_id, fornecedor_id, item_id, preco_unitario, prazo_entrega, observacao_item))
-                
-                itens_processados += 1
-            
-            conn.commit()
-            print(f"[SINCRONIZAÇÃO] {itens_processados} itens processados")
-            
-            # 3. Confirma sincronização no Render
-            try:
-                confirm_response = requests.post(
-                    f"{RENDER_PUBLIC_URL}/api/confirmar-sincronizacao",
-                    json={'token': token},
-                    timeout=5
-                )
-                if confirm_response.status_code == 200:
-                    print(f"[SINCRONIZAÇÃO] Confirmação enviada ao Render")
-                else:
-                    print(f"[SINCRONIZAÇÃO] Aviso: Não foi possível confirmar no Render: {confirm_response.status_code}")
-            except Exception as e:
-                print(f"[SINCRONIZAÇÃO] Aviso: Erro ao confirmar no Render: {e}")
-            
-            return jsonify({
-                'success': True,
-                'message': f'Resposta sincronizada com sucesso!',
-                'cotacao_id': cotacao_id,
-                'fornecedor_id': fornecedor_id,
-                'fornecedor_nome': fornecedor_nome,
-                'itens_processados': itens_processados
-            })
-            
+            confirm_response = cliente_http.post(
+                f"{RENDER_PUBLIC_URL}/api/confirmar-sincronizacao",
+                json={'token': token},
+                timeout=5,
+                idempotente=True
+            )
+            if confirm_response.status_code == 200:
+                print(f"[SINCRONIZAÇÃO] Confirmação enviada ao Render")
+            else:
+                print(f"[SINCRONIZAÇÃO] Aviso: Não foi possível confirmar no Render: {confirm_response.status_code}")
         except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            print(f"[SINCRONIZAÇÃO] Aviso: Erro ao confirmar no Render: {e}")
+        
+        return jsonify({
+            'success': True,
+            'message': f'Resposta sincronizada com sucesso!',
+            'cotacao_id': cotacao_id,
+            'fornecedor_id': fornecedor_id,
+            'fornecedor_nome': fornecedor_nome,
+            'itens_processados': itens_processados,
+            'ja_importada': resultado['ja_importada']
+        })
         
     except Exception as e:
         print(f"[SINCRONIZAÇÃO] Erro: {e}")
@@ -1846,7 +2012,7 @@ def api_importar_resposta_render(fornecedor_id):
             status_url = f"{RENDER_PUBLIC_URL}/api/cotacao-externa/{token}/status"
             print(f"[SINCRONIZAR] URL: {status_url}")
             
-            response = requests.get(status_url, timeout=15)
+            response = cliente_http.get(status_url, timeout=15)
             
             if response.status_code != 200:
                 print(f"[SINCRONIZAR] ⚠ Erro HTTP: {response.status_code}")
@@ -1919,7 +2085,7 @@ def api_importar_resposta_render(fornecedor_id):
         
         try:
             resposta_url = f"{RENDER_PUBLIC_URL}/api/cotacao-externa/{token}/resposta"
-            response = requests.get(resposta_url, timeout=15)
+            response = cliente_http.get(resposta_url, timeout=15)
             
             if response.status_code != 200:
                 conn.close()
@@ -3534,13 +3700,16 @@ def api_verificar_envio_email_lote():
         dados = request.json
         itens = dados.get('itens', [])  # Lista de {tipo, identificador}
         
+        chaves = [(item.get('tipo', 'pedido'), str(item.get('identificador', ''))) for item in itens]
+        
+        # Uma única verificação em lote (cache + consulta por tipo) para todos os itens
+        status_lote = db.verificar_envios_email_lote(chaves)
+        
         resultados = {}
-        for item in itens:
-            tipo = item.get('tipo', 'pedido')
-            identificador = item.get('identificador', '')
+        for tipo, identificador in chaves:
             chave = f"{tipo}_{identificador}"
             
-            status_envio = db.verificar_ultimo_envio_email(tipo, identificador)
+            status_envio = status_lote[(tipo, identificador)]
             resultados[chave] = {
                 'pode_enviar': status_envio['pode_enviar'],
                 'ultimo_envio': status_envio.get('ultimo_envio_formatado'),
@@ -3636,31 +3805,22 @@ Polimáquinas"""
         msg['Subject'] = assunto
         msg.attach(MIMEText(corpo, 'plain', 'utf-8'))
 
-        # Conexão com Gmail (TLS porta 587)
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_REMETENTE, SENHA_EMAIL)
-        
-        # Envia para a LISTA de destinatários
-        text = msg.as_string()
-        server.sendmail(EMAIL_REMETENTE, destinatarios_lista, text)
-        server.quit()
-        
-        # Registra no histórico para controle 24h
-        usuario = session.get('user', 'Sistema')
-        db.registrar_envio_email(
-            tipo=tipo,
-            identificador=identificador,
-            email_destinatario=destinatario_raw,
-            assunto=assunto,
-            corpo=corpo,
-            enviado_por=usuario
-        )
+        # Fila de saída: o histórico (controle 24h) é gravado quando o envio concluir
+        lote_id = enfileirar_emails([{
+            'tipo': tipo,
+            'identificador': identificador,
+            'destinatarios': destinatarios_lista,
+            'assunto': assunto,
+            'corpo': corpo,
+            'mensagem': msg.as_string(),
+            'enviado_por': session.get('user', 'Sistema')
+        }])
 
         return jsonify({
             'success': True, 
-            'message': 'E-mail enviado com sucesso!',
-            'destinatarios': destinatarios_lista
+            'message': 'E-mail adicionado à fila de envio!',
+            'destinatarios': destinatarios_lista,
+            'lote_id': lote_id
         })
 
     except Exception as e:
@@ -5419,50 +5579,28 @@ def terceiros():
 
 
 # ==================== SISTEMA DE ANOTAÇÕES UNIVERSAL ====================
-# Arquivo para salvar anotações no servidor (compartilhado entre todos os usuários)
-ANOTACOES_FILE = os.path.join(os.path.dirname(__file__), 'anotacoes_variacao.json')
-ANOTACOES_OTD_FILE = os.path.join(os.path.dirname(__file__), 'anotacoes_otd.json')
+# Anotações ficam no banco local (tabela anotacoes_indicadores), compartilhadas
+# entre todos os usuários. Os arquivos legados anotacoes_variacao.json e
+# anotacoes_otd.json são importados uma única vez pela migração 2 (database.py).
+ESCOPO_ANOTACOES = 'variacao'
+ESCOPO_ANOTACOES_OTD = 'otd'
 
 def carregar_anotacoes():
-    """Carrega anotações do arquivo JSON"""
+    """Carrega anotações de variação de preço (cache em memória do database.py)"""
     try:
-        if os.path.exists(ANOTACOES_FILE):
-            with open(ANOTACOES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        return db.obter_anotacoes_indicador(ESCOPO_ANOTACOES)
     except Exception as e:
         print(f"Erro ao carregar anotações: {e}")
     return {}
 
-def salvar_anotacoes(anotacoes):
-    """Salva anotações no arquivo JSON"""
-    try:
-        with open(ANOTACOES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(anotacoes, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"Erro ao salvar anotações: {e}")
-        return False
-
 def carregar_anotacoes_otd():
-    """Carrega anotações OTD do arquivo JSON"""
+    """Carrega anotações OTD (cache em memória do database.py)"""
     try:
-        if os.path.exists(ANOTACOES_OTD_FILE):
-            with open(ANOTACOES_OTD_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        return db.obter_anotacoes_indicador(ESCOPO_ANOTACOES_OTD)
     except Exception as e:
         print(f"Erro ao carregar anotações OTD: {e}")
     return {}
 
-def salvar_anotacoes_otd(anotacoes):
-    """Salva anotações OTD no arquivo JSON"""
-    try:
-        with open(ANOTACOES_OTD_FILE, 'w', encoding='utf-8') as f:
-            json.dump(anotacoes, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"Erro ao salvar anotações OTD: {e}")
-        return False
-
 @app.route('/api/anotacoes', methods=['GET'])
 def get_anotacoes():
     """Retorna todas as anotações salvas no servidor"""
@@ -5485,27 +5623,15 @@ def salvar_anotacao():
         
         print(f"[ANOTAÇÕES] POST - Chave: {chave}, Usuário: {usuario}, Texto: {texto[:50] if texto else 'VAZIO'}...")
         
-        anotacoes = carregar_anotacoes()
-        
         if texto:
-            anotacoes[chave] = {
-                'texto': texto,
-                'usuario': usuario,
-                'data': datetime.now().strftime('%d/%m/%Y %H:%M')
-            }
+            db.salvar_anotacao_indicador(ESCOPO_ANOTACOES, chave, texto, usuario)
             print(f"[ANOTAÇÕES] Salvando anotação para chave: {chave}")
         else:
             # Remove anotação se texto vazio
-            if chave in anotacoes:
-                del anotacoes[chave]
+            if db.remover_anotacao_indicador(ESCOPO_ANOTACOES, chave):
                 print(f"[ANOTAÇÕES] Removendo anotação: {chave}")
         
-        if salvar_anotacoes(anotacoes):
-            print(f"[ANOTAÇÕES] Sucesso! Total: {len(anotacoes)} anotações")
-            return jsonify({'success': True, 'message': 'Anotação salva com sucesso!'})
-        else:
-            print(f"[ANOTAÇÕES] ERRO ao salvar arquivo")
-            return jsonify({'success': False, 'message': 'Erro ao salvar anotação no arquivo'})
+        return jsonify({'success': True, 'message': 'Anotação salva com sucesso!'})
     except Exception as e:
         print(f"[ANOTAÇÕES] ERRO POST: {e}")
         return jsonify({'success': False, 'message': str(e)})
@@ -5514,12 +5640,8 @@ def salvar_anotacao():
 def deletar_anotacao(chave):
     """Remove uma anotação específica"""
     try:
-        anotacoes = carregar_anotacoes()
-        
-        if chave in anotacoes:
-            del anotacoes[chave]
-            if salvar_anotacoes(anotacoes):
-                return jsonify({'success': True, 'message': 'Anotação removida!'})
+        if db.remover_anotacao_indicador(ESCOPO_ANOTACOES, chave):
+            return jsonify({'success': True, 'message': 'Anotação removida!'})
         
         return jsonify({'success': False, 'message': 'Anotação não encontrada'})
     except Exception as e:
@@ -5538,24 +5660,12 @@ def importar_anotacoes():
         data = request.get_json()
         anotacoes_importadas = data.get('anotacoes', {})
         
-        anotacoes_atuais = carregar_anotacoes()
-        
         # Mescla as anotações (importadas sobrescrevem existentes com mesma chave)
-        for chave, valor in anotacoes_importadas.items():
-            # Se for formato antigo (só texto), converte para novo formato
-            if isinstance(valor, str):
-                anotacoes_atuais[chave] = {
-                    'texto': valor,
-                    'usuario': 'Importado',
-                    'data': datetime.now().strftime('%d/%m/%Y %H:%M')
-                }
-            else:
-                anotacoes_atuais[chave] = valor
+        # Formato antigo (só texto) é convertido para o novo formato pelo database.py
+        db.importar_anotacoes_indicador(ESCOPO_ANOTACOES, anotacoes_importadas)
+        total = len(carregar_anotacoes())
         
-        if salvar_anotacoes(anotacoes_atuais):
-            return jsonify({'success': True, 'message': f'{len(anotacoes_importadas)} anotações importadas!', 'total': len(anotacoes_atuais), 'importadas': len(anotacoes_importadas)})
-        else:
-            return jsonify({'success': False, 'message': 'Erro ao importar anotações'})
+        return jsonify({'success': True, 'message': f'{len(anotacoes_importadas)} anotações importadas!', 'total': total, 'importadas': len(anotacoes_importadas)})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -5585,27 +5695,15 @@ def salvar_anotacao_otd():
         
         print(f"[ANOTAÇÕES OTD] POST - Chave: {chave}, Usuário: {usuario}, Texto: {texto[:50] if texto else 'VAZIO'}...")
         
-        anotacoes = carregar_anotacoes_otd()
-        
         if texto:
-            anotacoes[chave] = {
-                'texto': texto,
-                'usuario': usuario,
-                'data': datetime.now().strftime('%d/%m/%Y %H:%M')
-            }
+            db.salvar_anotacao_indicador(ESCOPO_ANOTACOES_OTD, chave, texto, usuario)
             print(f"[ANOTAÇÕES OTD] Salvando anotação para chave: {chave}")
         else:
             # Remove anotação se texto vazio
-            if chave in anotacoes:
-                del anotacoes[chave]
+            if db.remover_anotacao_indicador(ESCOPO_ANOTACOES_OTD, chave):
                 print(f"[ANOTAÇÕES OTD] Removendo anotação: {chave}")
         
-        if salvar_anotacoes_otd(anotacoes):
-            print(f"[ANOTAÇÕES OTD] Sucesso! Total: {len(anotacoes)} anotações")
-            return jsonify({'success': True, 'message': 'Anotação salva com sucesso!'})
-        else:
-            print(f"[ANOTAÇÕES OTD] ERRO ao salvar arquivo")
-            return jsonify({'success': False, 'message': 'Erro ao salvar anotação no arquivo'})
+        return jsonify({'success': True, 'message': 'Anotação salva com sucesso!'})
     except Exception as e:
         print(f"[ANOTAÇÕES OTD] ERRO POST: {e}")
         return jsonify({'success': False, 'message': str(e)})
@@ -5614,59 +5712,84 @@ def salvar_anotacao_otd():
 def deletar_anotacao_otd(chave):
     """Remove uma anotação OTD específica"""
     try:
-        anotacoes = carregar_anotacoes_otd()
-        
-        if chave in anotacoes:
-            del anotacoes[chave]
-            if salvar_anotacoes_otd(anotacoes):
-                return jsonify({'success': True, 'message': 'Anotação removida!'})
+        if db.remover_anotacao_indicador(ESCOPO_ANOTACOES_OTD, chave):
+            return jsonify({'success': True, 'message': 'Anotação removida!'})
         
         return jsonify({'success': False, 'message': 'Anotação não encontrada'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
+# =============================================================================
+# ÍNDICE DE FORNECEDORES (SA2010 EM MEMÓRIA)
+# =============================================================================
+# O cadastro de fornecedores ativos fica em memória e é recarregado em segundo
+# plano (INDICE_FORNECEDORES_INTERVALO). A busca do autocomplete, o filtro de
+# Solicitações em Aberto, o teste de conexão e a importação ISO via Excel leem
+# dele em vez de consultar o TOTVS a cada pedido - ver indice_fornecedores.py
+INDICE_FORNECEDORES_ATIVO = os.environ.get('INDICE_FORNECEDORES_ATIVO', '1') != '0'
+INDICE_FORNECEDORES_INTERVALO = int(os.environ.get('INDICE_FORNECEDORES_INTERVALO', 1800))  # segundos
+
+
+def _carregar_fornecedores_totvs():
+    """Todos os fornecedores ativos do SA2010 (uma consulta)"""
+    server = '172.16.45.117\\TOTVS'
+    database = 'TOTVSDB'
+    username = 'excel'
+    password = 'Db_Polimaquinas'
+    
+    conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
+    conn = pyodbc.connect(conn_str, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT
+            RTRIM(A2_COD) AS codigo,
+            RTRIM(LTRIM(A2_NOME)) AS nome,
+            RTRIM(ISNULL(A2_CGC, '')) AS cnpj,
+            RTRIM(ISNULL(A2_EMAIL, '')) AS email,
+            RTRIM(ISNULL(A2_TEL, '')) AS telefone,
+            CASE LTRIM(RTRIM(ISNULL(A2_X_COMPR, '')))
+                WHEN '016' THEN 'Aline Chen'
+                WHEN '007' THEN 'Hélio Doce'
+                WHEN '008' THEN 'Diego Moya'
+                WHEN '018' THEN 'Daniel Amaral'
+                ELSE 'Outros'
+            END AS comprador
+        FROM SA2010 WITH (NOLOCK)
+        WHERE D_E_L_E_T_ = ''
+          AND A2_MSBLQL <> '1'
+          AND RTRIM(LTRIM(ISNULL(A2_NOME, ''))) <> ''
+        """)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+indice_fornecedores = IndiceFornecedores(_carregar_fornecedores_totvs, intervalo=INDICE_FORNECEDORES_INTERVALO)
+
+
+def _iniciar_indice_fornecedores():
+    """Recarga periódica do índice (uma vez por processo)"""
+    if INDICE_FORNECEDORES_ATIVO:
+        indice_fornecedores.iniciar()
+
+
 # =============================================================================
 # SOLICITAÇÕES EM ABERTO (SC1010)
 # =============================================================================
 
-@cache.cached(timeout=1800, key_prefix='todos_fornecedores_cadastrados_v1')  # 30 minutos de cache
 def get_todos_fornecedores_cadastrados():
     """
-    Busca TODOS os fornecedores cadastrados na tabela SA2010 (TOTVS).
+    Nomes de TODOS os fornecedores cadastrados no SA2010 (TOTVS), do índice em memória.
     Esta função é usada para popular o filtro de fornecedores em Solicitações em Aberto,
     permitindo pesquisar qualquer fornecedor cadastrado, independente de ter solicitação aberta.
     
     Retorna: Lista ordenada de nomes de fornecedores
     """
     try:
-        server = r'172.16.45.117\TOTVS' 
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(conn_str, timeout=30)
-        
-        query = """
-        SELECT DISTINCT
-            RTRIM(LTRIM(A2_NOME)) AS NomeFornecedor
-        FROM SA2010
-        WHERE D_E_L_E_T_ = ''
-          AND A2_MSBLQL <> '1'
-          AND RTRIM(LTRIM(ISNULL(A2_NOME, ''))) <> ''
-        ORDER BY NomeFornecedor
-        """
-        
-        df = pd.read_sql(query, conn)
-        conn.close()
-        
-        # Converte para lista e remove vazios
-        fornecedores = [f.strip() for f in df['NomeFornecedor'].tolist() if f and f.strip()]
-        
-        print(f"[FORNECEDORES CADASTRADOS] Carregados {len(fornecedores)} fornecedores do SA2010")
-        return fornecedores
-        
+        return indice_fornecedores.nomes()
     except Exception as e:
         print(f"[ERRO] Falha ao buscar fornecedores cadastrados: {e}")
         return []
@@ -5897,26 +6020,32 @@ def solicitacoes():
     # ========================================
     # BUSCAR ATRIBUIÇÕES MANUAIS
     # ========================================
-    # Busca atribuições manuais do banco local
+    # Busca atribuições manuais do banco local (leitura em cache no database.py)
     atribuicoes_manuais = db.obter_atribuicoes_compradores()
     
+    # Aplica atribuições manuais ao DataFrame com um único merge por (NumeroSC, ItemSC)
+    df_atribuicoes = pd.DataFrame(db.obter_atribuicoes_em_lote(),
+                                  columns=['NumeroSC', 'ItemSC', 'CodCompradorManual', 'CompradorManual'])
+    df_atribuicoes = df_atribuicoes.rename(columns={'NumeroSC': '_ChaveSC', 'ItemSC': '_ChaveItemSC'})
+    df_atribuicoes[['_ChaveSC', '_ChaveItemSC']] = df_atribuicoes[['_ChaveSC', '_ChaveItemSC']].astype(str)
+    
+    indice_original = df.index
+    df['_ChaveSC'] = df['NumeroSC'].astype(str)
+    df['_ChaveItemSC'] = df['ItemSC'].astype(str)
+    df = df.merge(df_atribuicoes, on=['_ChaveSC', '_ChaveItemSC'], how='left', indicator='_OrigemAtribuicao')
+    df.index = indice_original
+    
     # Cria coluna para indicar atribuição manual
-    df['AtribuicaoManual'] = False
-    df['CompradorManual'] = None
-    df['CodCompradorManual'] = None
+    df['AtribuicaoManual'] = df['_OrigemAtribuicao'] == 'both'
+    manual = df['AtribuicaoManual']
+    df['CompradorManual'] = df['CompradorManual'].astype(object).where(manual, None)
+    df['CodCompradorManual'] = df['CodCompradorManual'].astype(object).where(manual, None)
     
-    # Aplica atribuições manuais ao DataFrame
-    if not df.empty:
-        for idx, row in df.iterrows():
-            chave = f"{row['NumeroSC']}-{row['ItemSC']}"
-            if chave in atribuicoes_manuais:
-                atrib = atribuicoes_manuais[chave]
-                df.at[idx, 'AtribuicaoManual'] = True
-                df.at[idx, 'CompradorManual'] = atrib['nome_comprador']
-                df.at[idx, 'CodCompradorManual'] = atrib['cod_comprador']
-                # PRIORIZA atribuição manual sobre o comprador do Totvs
-                df.at[idx, 'NomeComprador'] = atrib['nome_comprador']
-                df.at[idx, 'CodComprador'] = atrib['cod_comprador']
+    # PRIORIZA atribuição manual sobre o comprador do Totvs
+    if manual.any():
+        df.loc[manual, 'NomeComprador'] = df.loc[manual, 'CompradorManual']
+        df.loc[manual, 'CodComprador'] = df.loc[manual, 'CodCompradorManual']
+    df = df.drop(columns=['_ChaveSC', '_ChaveItemSC', '_OrigemAtribuicao'])
     
     # Garantir que NomeComprador está limpo (igual ao Dashboard)
     if not df.empty and 'NomeComprador' in df.columns:
@@ -6457,66 +6586,16 @@ def cotacao_detalhe(cotacao_id):
 def api_buscar_fornecedores():
     """
     Busca fornecedores cadastrados no SA2010 (TOTVS).
-    Permite filtrar por termo de busca (nome ou código).
-    
-    CORREÇÃO: SQL parametrizado para evitar SQL Injection
+    Permite filtrar por termo de busca (código, nome ou CNPJ), sem diferenciar
+    acentos. Lê do índice em memória (indice_fornecedores), sem ir ao TOTVS.
     """
     try:
         termo = request.args.get('termo', '').strip()
         
-        # Log para debug
-        print(f"[BUSCA FORNECEDOR] Termo recebido: '{termo}'")
+        fornecedores = indice_fornecedores.buscar(termo, limite=100)
         
-        server = '172.16.45.117\\TOTVS'
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(conn_str, timeout=30)
-        cursor = conn.cursor()
-        
-        # Query parametrizada para evitar SQL Injection
-        if termo:
-            query = """
-            SELECT TOP 100
-                RTRIM(A2_COD) AS codigo,
-                RTRIM(A2_NOME) AS nome,
-                RTRIM(ISNULL(A2_EMAIL, '')) AS email,
-                RTRIM(ISNULL(A2_TEL, '')) AS telefone
-            FROM SA2010
-            WHERE D_E_L_E_T_ = ''
-              AND A2_MSBLQL <> '1'
-              AND (
-                  UPPER(A2_COD) LIKE UPPER(?) 
-                  OR UPPER(A2_NOME) LIKE UPPER(?)
-              )
-            ORDER BY A2_NOME
-            """
-            # Adiciona wildcards para busca parcial
-            termo_busca = f'%{termo}%'
-            cursor.execute(query, (termo_busca, termo_busca))
-        else:
-            query = """
-            SELECT TOP 100
-                RTRIM(A2_COD) AS codigo,
-                RTRIM(A2_NOME) AS nome,
-                RTRIM(ISNULL(A2_EMAIL, '')) AS email,
-                RTRIM(ISNULL(A2_TEL, '')) AS telefone
-            FROM SA2010
-            WHERE D_E_L_E_T_ = ''
-              AND A2_MSBLQL <> '1'
-            ORDER BY A2_NOME
-            """
-            cursor.execute(query)
-        
-        # Converte resultado para lista de dicionários
-        columns = [column[0] for column in cursor.description]
-        fornecedores = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        print(f"[BUSCA FORNECEDOR] Encontrados: {len(fornecedores)} fornecedores")
+        print(f"[BUSCA FORNECEDOR] '{termo}': {len(fornecedores)} fornecedores "
+              f"em {indice_fornecedores.metricas['ultima_busca_us']} µs")
         
         return jsonify({
             'success': True,
@@ -6524,6 +6603,12 @@ def api_buscar_fornecedores():
             'total': len(fornecedores)
         })
         
+    except Indisponivel as e:
+        # TOTVS fora do ar antes da primeira carga: responde na hora (a recarga tenta de novo)
+        print(f"[BUSCA FORNECEDOR] {e}")
+        resposta = jsonify({'success': False, 'error': str(e), 'fornecedores': [], 'total': 0})
+        resposta.headers['Retry-After'] = '60'
+        return resposta, 503
     except Exception as e:
         print(f"[ERRO] api_buscar_fornecedores: {e}")
         import traceback
@@ -6536,31 +6621,19 @@ def api_testar_conexao_fornecedores():
     """
     Endpoint de diagnóstico para testar conexão com banco TOTVS (SA2010).
     Útil para identificar problemas de rede ou credenciais.
+    
+    O teste é a própria recarga do índice de fornecedores: conecta, lê o
+    cadastro ativo e já deixa a busca atualizada.
     """
+    server = '172.16.45.117\\TOTVS'
+    database = 'TOTVSDB'
     try:
         import time
         inicio = time.time()
         
-        server = '172.16.45.117\\TOTVS'
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
         print(f"[TESTE CONEXÃO] Tentando conectar a {server}...")
         
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(conn_str, timeout=15)
-        cursor = conn.cursor()
-        
-        # Teste simples: contar fornecedores ativos
-        cursor.execute("""
-            SELECT COUNT(*) as total 
-            FROM SA2010 
-            WHERE D_E_L_E_T_ = '' AND A2_MSBLQL <> '1'
-        """)
-        total = cursor.fetchone()[0]
-        
-        conn.close()
+        total = indice_fornecedores.recarregar()
         
         tempo_conexao = round(time.time() - inicio, 2)
         print(f"[TESTE CONEXÃO] Sucesso! {total} fornecedores ativos. Tempo: {tempo_conexao}s")
@@ -6571,7 +6644,8 @@ def api_testar_conexao_fornecedores():
             'total_fornecedores_ativos': total,
             'tempo_conexao_segundos': tempo_conexao,
             'servidor': server,
-            'banco': database
+            'banco': database,
+            'indice': indice_fornecedores.status()
         })
         
     except pyodbc.Error as e:
@@ -6589,7 +6663,8 @@ def api_testar_conexao_fornecedores():
         return jsonify({
             'success': False,
             'error': 'Falha na conexão com banco TOTVS',
-            'detalhe': detalhe
+            'detalhe': detalhe,
+            'indice': indice_fornecedores.status()
         }), 500
         
     except Exception as e:
@@ -6601,102 +6676,157 @@ def api_testar_conexao_fornecedores():
 
 
 # =============================================================================
-# API: BUSCAR PRODUTOS PARA ORÇAMENTO MANUAL
+# CATÁLOGO DE PRODUTOS (SB1010 + ÚLTIMA COMPRA DO SD1010, EM MEMÓRIA)
 # =============================================================================
-@app.route('/api/produtos/buscar')
-def api_buscar_produtos():
-    """
-    Busca produtos cadastrados no SB1010 (TOTVS) com último preço de compra.
-    Permite filtrar por código ou descrição.
+# A busca do orçamento manual e a importação de códigos via Excel leem do
+# catálogo em memória. Atualização incremental pelos R_E_C_N_O_ novos a cada
+# CATALOGO_PRODUTOS_INTERVALO e carga completa a cada
+# CATALOGO_PRODUTOS_INTERVALO_COMPLETO - ver catalogo_produtos.py
+CATALOGO_PRODUTOS_ATIVO = os.environ.get('CATALOGO_PRODUTOS_ATIVO', '1') != '0'
+CATALOGO_PRODUTOS_INTERVALO = int(os.environ.get('CATALOGO_PRODUTOS_INTERVALO', 300))  # segundos
+CATALOGO_PRODUTOS_INTERVALO_COMPLETO = int(os.environ.get('CATALOGO_PRODUTOS_INTERVALO_COMPLETO', 6 * 3600))
+
+
+def _conectar_totvs_catalogo():
+    server = '172.16.45.117\\TOTVS'
+    database = 'TOTVSDB'
+    username = 'excel'
+    password = 'Db_Polimaquinas'
     
-    Retorna:
-        - codigo: Código do produto
-        - descricao: Descrição do produto
-        - unidade: Unidade de medida
-        - ultimo_preco: Último preço unitário pago (da última NF)
-        - ultimo_fornecedor: Nome do último fornecedor
-        - data_ultima_compra: Data da última compra
-    """
+    conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
+    return pyodbc.connect(conn_str, timeout=60)
+
+
+def _carregar_produtos_totvs(recno_desde):
+    """Produtos ativos do SB1010 com R_E_C_N_O_ acima de recno_desde. Retorna (produtos, maior_recno)."""
+    conn = _conectar_totvs_catalogo()
     try:
-        termo = request.args.get('termo', '').strip()
-        
-        print(f"[BUSCA PRODUTO] Termo recebido: '{termo}'")
-        
-        if not termo or len(termo) < 2:
-            return jsonify({
-                'success': False,
-                'message': 'Digite pelo menos 2 caracteres para buscar'
-            })
-        
-        server = '172.16.45.117\\TOTVS'
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(conn_str, timeout=30)
         cursor = conn.cursor()
-        
-        # Query para buscar produtos com último preço de compra
-        # Usa subquery para pegar a NF mais recente de cada produto
-        query = """
-        SELECT TOP 50
+        # O maior R_E_C_N_O_ é lido antes: o que entrar durante a leitura volta na próxima
+        cursor.execute("SELECT ISNULL(MAX(R_E_C_N_O_), 0) FROM SB1010 WITH (NOLOCK)")
+        maior_recno = cursor.fetchone()[0]
+        cursor.execute("""
+        SELECT
             RTRIM(P.B1_COD) AS codigo,
             RTRIM(P.B1_DESC) AS descricao,
             RTRIM(ISNULL(P.B1_UM, 'UN')) AS unidade,
             RTRIM(ISNULL(P.B1_TIPO, '')) AS tipo,
-            RTRIM(ISNULL(P.B1_GRUPO, '')) AS grupo,
-            ISNULL(ULT.ultimo_preco, 0) AS ultimo_preco,
-            ISNULL(ULT.ultimo_fornecedor, '') AS ultimo_fornecedor,
-            ULT.data_ultima_compra
-        FROM SB1010 P
-        LEFT JOIN (
+            RTRIM(ISNULL(P.B1_GRUPO, '')) AS grupo
+        FROM SB1010 P WITH (NOLOCK)
+        WHERE P.D_E_L_E_T_ = ''
+          AND P.B1_MSBLQL <> '1'
+          AND P.R_E_C_N_O_ > ?
+          AND P.R_E_C_N_O_ <= ?
+        """, (recno_desde, maior_recno))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()], maior_recno
+    finally:
+        conn.close()
+
+
+def _carregar_compras_totvs(recno_desde):
+    """
+    Compras (NF de entrada normais) do SD1010. Com recno_desde=0, só a última
+    de cada produto; senão, todas as linhas novas. Retorna (compras, maior_recno).
+    """
+    conn = _conectar_totvs_catalogo()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ISNULL(MAX(R_E_C_N_O_), 0) FROM SD1010 WITH (NOLOCK)")
+        maior_recno = cursor.fetchone()[0]
+        compras_sd1 = """
             SELECT 
-                D1.D1_COD,
-                D1.D1_VUNIT AS ultimo_preco,
-                A2.A2_NOME AS ultimo_fornecedor,
-                D1.D1_DTDIGIT AS data_ultima_compra,
+                RTRIM(D1.D1_COD) AS codigo,
+                D1.D1_VUNIT AS preco,
+                A2.A2_NOME AS fornecedor,
+                D1.D1_DTDIGIT AS data,
+                D1.D1_DOC AS documento,
                 ROW_NUMBER() OVER (PARTITION BY D1.D1_COD ORDER BY D1.D1_DTDIGIT DESC, D1.D1_DOC DESC) AS rn
-            FROM SD1010 D1
-            INNER JOIN SA2010 A2 ON D1.D1_FORNECE = A2.A2_COD AND A2.D_E_L_E_T_ = ''
+            FROM SD1010 D1 WITH (NOLOCK)
+            INNER JOIN SA2010 A2 WITH (NOLOCK) ON D1.D1_FORNECE = A2.A2_COD AND A2.D_E_L_E_T_ = ''
             WHERE D1.D_E_L_E_T_ <> '*'
               AND D1.D1_TIPO = 'N'
               AND D1.D1_VUNIT > 0
               AND D1.D1_QUANT > 0
-        ) ULT ON P.B1_COD = ULT.D1_COD AND ULT.rn = 1
-        WHERE P.D_E_L_E_T_ = ''
-          AND P.B1_MSBLQL <> '1'
-          AND (
-              UPPER(P.B1_COD) LIKE UPPER(?)
-              OR UPPER(P.B1_DESC) LIKE UPPER(?)
-          )
-        ORDER BY 
-            CASE WHEN UPPER(P.B1_COD) = UPPER(?) THEN 0 ELSE 1 END,
-            P.B1_DESC
+              AND D1.R_E_C_N_O_ > ?
+              AND D1.R_E_C_N_O_ <= ?
         """
-        
-        termo_busca = f'%{termo}%'
-        termo_exato = termo.strip()
-        cursor.execute(query, (termo_busca, termo_busca, termo_exato))
-        
+        if recno_desde:
+            query = compras_sd1
+        else:
+            query = f"SELECT codigo, preco, fornecedor, data, documento FROM ({compras_sd1}) ULT WHERE ULT.rn = 1"
+        cursor.execute(query, (recno_desde, maior_recno))
         columns = [column[0] for column in cursor.description]
-        produtos = []
+        return [dict(zip(columns, row)) for row in cursor.fetchall()], maior_recno
+    finally:
+        conn.close()
+
+
+catalogo_produtos = CatalogoProdutos(
+    _carregar_produtos_totvs,
+    _carregar_compras_totvs,
+    intervalo=CATALOGO_PRODUTOS_INTERVALO,
+    intervalo_completo=CATALOGO_PRODUTOS_INTERVALO_COMPLETO
+)
+
+
+def _iniciar_catalogo_produtos():
+    """Cargas do catálogo em segundo plano (uma vez por processo)"""
+    if CATALOGO_PRODUTOS_ATIVO:
+        catalogo_produtos.iniciar()
+
+
+def _formatar_data_protheus(data):
+    """YYYYMMDD → DD/MM/YYYY (outros valores voltam como estão)"""
+    data_str = str(data or '')
+    if len(data_str) == 8 and data_str.isdigit():
+        return f"{data_str[6:8]}/{data_str[4:6]}/{data_str[0:4]}"
+    return data
+
+
+@app.route('/api/diagnostico/indices')
+def api_diagnostico_indices():
+    """Estado do catálogo de produtos e do índice de fornecedores (cargas, tamanho, última busca)"""
+    return jsonify({
+        'success': True,
+        'catalogo_produtos': catalogo_produtos.status(),
+        'indice_fornecedores': indice_fornecedores.status()
+    })
+
+
+# =============================================================================
+# API: BUSCAR PRODUTOS PARA ORÇAMENTO MANUAL
+# =============================================================================
+@app.route('/api/produtos/buscar')
+def api_buscar_produtos():
+    """
+    Busca produtos cadastrados no SB1010 (TOTVS) com último preço de compra.
+    Permite filtrar por código ou descrição (sem diferenciar acentos).
+    Lê do catálogo em memória (catalogo_produtos), sem ir ao TOTVS.
+    
+    Retorna:
+        - codigo: Código do produto
+        - descricao: Descrição do produto
+        - unidade: Unidade de medida
+        - ultimo_preco: Último preço unitário pago (da última NF)
+        - ultimo_fornecedor: Nome do último fornecedor
+        - data_ultima_compra: Data da última compra
+    """
+    try:
+        termo = request.args.get('termo', '').strip()
         
-        for row in cursor.fetchall():
-            produto = dict(zip(columns, row))
-            # Formata data se existir
-            if produto.get('data_ultima_compra'):
-                try:
-                    data_str = str(produto['data_ultima_compra'])
-                    if len(data_str) == 8:  # Formato YYYYMMDD
-                        produto['data_ultima_compra'] = f"{data_str[6:8]}/{data_str[4:6]}/{data_str[0:4]}"
-                except:
-                    pass
-            produtos.append(produto)
+        if not termo or len(termo) < 2:
+            return jsonify({
+                'success': False,
+                'message': 'Digite pelo menos 2 caracteres para buscar'
+            })
         
-        conn.close()
+        produtos = catalogo_produtos.buscar(termo, limite=50)
+        for produto in produtos:
+            produto['data_ultima_compra'] = _formatar_data_protheus(produto['data_ultima_compra'])
         
-        print(f"[BUSCA PRODUTO] Encontrados: {len(produtos)} produtos")
+        print(f"[BUSCA PRODUTO] '{termo}': {len(produtos)} produtos "
+              f"em {catalogo_produtos.metricas['ultima_busca_us']} µs")
         
         return jsonify({
             'success': True,
@@ -6704,6 +6834,12 @@ def api_buscar_produtos():
             'total': len(produtos)
         })
         
+    except Indisponivel as e:
+        # TOTVS fora do ar antes da primeira carga: responde na hora (a atualização tenta de novo)
+        print(f"[BUSCA PRODUTO] {e}")
+        resposta = jsonify({'success': False, 'error': str(e), 'produtos': [], 'total': 0})
+        resposta.headers['Retry-After'] = '60'
+        return resposta, 503
     except Exception as e:
         print(f"[ERRO] api_buscar_produtos: {e}")
         import traceback
@@ -6836,70 +6972,21 @@ def api_importar_produtos_excel():
         print(f"[IMPORT EXCEL] Códigos extraídos e normalizados: {len(codigos_encontrados)}")
         print(f"[IMPORT EXCEL] Exemplos de códigos: {list(codigos_encontrados)[:10]}")
         
-        # Limitar a 500 códigos para evitar queries muito grandes
-        codigos_lista = list(codigos_encontrados)[:500]
-        
-        # Buscar produtos no TOTVS
-        server = '172.16.45.117\\TOTVS'
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(conn_str, timeout=60)
-        cursor = conn.cursor()
-        
-        # Buscar produtos em lotes para melhor performance
-        produtos_encontrados = []
-        codigos_encontrados_set = set()
-        
-        # Processar em lotes de 100
-        batch_size = 100
-        for i in range(0, len(codigos_lista), batch_size):
-            batch = codigos_lista[i:i + batch_size]
-            
-            # Criar placeholders para a query
-            placeholders = ','.join(['?' for _ in batch])
-            
-            query = f"""
-            SELECT 
-                RTRIM(P.B1_COD) AS codigo,
-                RTRIM(P.B1_DESC) AS descricao,
-                RTRIM(ISNULL(P.B1_UM, 'UN')) AS unidade,
-                ISNULL(ULT.ultimo_preco, 0) AS ultimo_preco,
-                ISNULL(ULT.ultimo_fornecedor, '') AS ultimo_fornecedor
-            FROM SB1010 P
-            LEFT JOIN (
-                SELECT 
-                    D1.D1_COD,
-                    D1.D1_VUNIT AS ultimo_preco,
-                    A2.A2_NOME AS ultimo_fornecedor,
-                    ROW_NUMBER() OVER (PARTITION BY D1.D1_COD ORDER BY D1.D1_DTDIGIT DESC, D1.D1_DOC DESC) AS rn
-                FROM SD1010 D1
-                INNER JOIN SA2010 A2 ON D1.D1_FORNECE = A2.A2_COD AND A2.D_E_L_E_T_ = ''
-                WHERE D1.D_E_L_E_T_ <> '*'
-                  AND D1.D1_TIPO = 'N'
-                  AND D1.D1_VUNIT > 0
-            ) ULT ON P.B1_COD = ULT.D1_COD AND ULT.rn = 1
-            WHERE P.D_E_L_E_T_ = ''
-              AND P.B1_MSBLQL <> '1'
-              AND RTRIM(P.B1_COD) IN ({placeholders})
-            """
-            
-            cursor.execute(query, batch)
-            
-            for row in cursor.fetchall():
-                produto = {
-                    'codigo': row[0].strip() if row[0] else '',
-                    'descricao': row[1].strip() if row[1] else '',
-                    'unidade': row[2].strip() if row[2] else 'UN',
-                    'ultimo_preco': float(row[3]) if row[3] else 0,
-                    'ultimo_fornecedor': row[4].strip() if row[4] else ''
-                }
-                produtos_encontrados.append(produto)
-                codigos_encontrados_set.add(produto['codigo'])
+        codigos_lista = sorted(codigos_encontrados)
         
-        conn.close()
+        # Validar no catálogo de produtos em memória (sem consultas ao TOTVS)
+        catalogo = catalogo_produtos.obter_varios(codigos_lista)
+        produtos_encontrados = [
+            {
+                'codigo': produto['codigo'],
+                'descricao': produto['descricao'],
+                'unidade': produto['unidade'] or 'UN',
+                'ultimo_preco': produto['ultimo_preco'],
+                'ultimo_fornecedor': produto['ultimo_fornecedor']
+            }
+            for produto in catalogo.values()
+        ]
+        codigos_encontrados_set = set(catalogo)
         
         # Identificar códigos não encontrados
         codigos_nao_encontrados = [c for c in codigos_lista if c not in codigos_encontrados_set]
@@ -7451,6 +7538,7 @@ def api_excluir_fornecedor(fornecedor_id):
         
         # Executa exclusão (a função já remove respostas associadas)
         resultado = db.excluir_fornecedor_cotacao(fornecedor_id)
+        _coletar_anexos_sem_referencia()
         
         if resultado:
             print(f"[EXCLUIR FORNECEDOR] Fornecedor {fornecedor_id} excluído com sucesso")
@@ -7921,6 +8009,7 @@ def api_excluir_cotacao(cotacao_id):
         
         # Excluir (sem validar fornecedores ou respostas)
         db.excluir_cotacao(cotacao_id)
+        _coletar_anexos_sem_referencia()
         
         return jsonify({'success': True, 'message': 'Cotação excluída com sucesso'})
         
@@ -7993,41 +8082,80 @@ def api_responder_cotacao(token):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Orçamentos dos fornecedores (1ª e 2ª rodada) gravados pelo SHA-256 do conteúdo,
+# com contagem de referências no banco e miniaturas em segundo plano - ver
+# armazenamento_anexos.py. Anexos antigos (uploads/cotacoes/<ano>/<mes>) continuam
+# onde estão.
+ANEXOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'cotacoes', 'conteudo')
+ANEXO_MAX_BYTES = 10 * 1024 * 1024  # 10MB
+
+armazenamento_anexos = ArmazenamentoAnexos(ANEXOS_DIR, ao_gerar_miniatura=db.registrar_miniatura_anexo)
+
+
+def _tipo_arquivo_anexo(filename):
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if ext == 'pdf':
+        return 'PDF'
+    elif ext in {'jpg', 'jpeg', 'png'}:
+        return 'Imagem'
+    elif ext in {'doc', 'docx'}:
+        return 'Word'
+    elif ext in {'xls', 'xlsx'}:
+        return 'Excel'
+    return 'Outro'
+
+
+def _guardar_anexo_cotacao(arquivo, cotacao_id, fornecedor_id, tipo_arquivo, rodada=1):
+    """Grava o upload (uma vez por conteúdo) e registra o anexo. Retorna (hash, registro)."""
+    import mimetypes
+    
+    nome_original = arquivo.filename
+    mime_type = mimetypes.guess_type(nome_original)[0] or 'application/octet-stream'
+    
+    def registrar(hash_conteudo, caminho, tamanho):
+        return db.salvar_anexo_por_conteudo(
+            cotacao_id=cotacao_id,
+            fornecedor_id=fornecedor_id,
+            nome_original=nome_original,
+            hash_conteudo=hash_conteudo,
+            caminho_arquivo=caminho,
+            tipo_arquivo=tipo_arquivo,
+            tamanho_bytes=tamanho,
+            mime_type=mime_type,
+            usuario=session.get('usuario', 'Admin'),
+            rodada=rodada
+        )
+    
+    extensao = os.path.splitext(nome_original)[1].lower()
+    return armazenamento_anexos.guardar(arquivo.stream, extensao, registrar, ANEXO_MAX_BYTES)
+
+
+def _coletar_anexos_sem_referencia():
+    """Remove do disco os anexos que nenhuma cotação usa mais (após exclusões)"""
+    try:
+        armazenamento_anexos.coletar(db.obter_conteudos_anexo_sem_referencia, db.excluir_conteudo_anexo)
+    except Exception as e:
+        print(f"[ANEXOS] Erro na coleta de anexos sem referência: {e}")
+
+
 @app.route('/api/cotacao/fornecedor/<int:fornecedor_id>/anexo', methods=['POST'])
 def api_upload_anexo_fornecedor(fornecedor_id):
     """
     API OTIMIZADA para upload de anexo/orçamento do fornecedor.
     Melhorias:
-    - Upload em streaming (chunks de 8KB) para menor uso de memória
+    - Upload em streaming para menor uso de memória
     - Validação de tipo e tamanho de arquivo
-    - Armazenamento organizado por ano/mês
+    - Armazenamento pelo hash do conteúdo (o mesmo arquivo é gravado uma vez)
     - Metadados persistidos em tabela dedicada (cotacao_anexos)
-    - Nomes únicos evitam sobrescrita
+    - Miniatura gerada em segundo plano (imagens e 1ª página do PDF)
     """
-    import uuid
-    import mimetypes
-    from datetime import datetime
-    
     # Configurações de upload
-    UPLOAD_MAX_SIZE = 10 * 1024 * 1024  # 10MB
-    UPLOAD_CHUNK_SIZE = 8 * 1024  # 8KB para streaming
+    UPLOAD_MAX_SIZE = ANEXO_MAX_BYTES
     ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'doc', 'docx', 'xls', 'xlsx'}
     
     def allowed_file(filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
     
-    def get_file_type(filename):
-        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-        if ext == 'pdf':
-            return 'PDF'
-        elif ext in {'jpg', 'jpeg', 'png'}:
-            return 'Imagem'
-        elif ext in {'doc', 'docx'}:
-            return 'Word'
-        elif ext in {'xls', 'xlsx'}:
-            return 'Excel'
-        return 'Outro'
-    
     try:
         if 'arquivo' not in request.files:
             return jsonify({'success': False, 'error': 'Nenhum arquivo enviado'}), 400
@@ -8058,57 +8186,19 @@ def api_upload_anexo_fornecedor(fornecedor_id):
         cotacao_id = forn_data['cotacao_id']
         conn.close()
         
-        # Cria diretório organizado por ano/mês
-        now = datetime.now()
-        upload_dir = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), 
-            'uploads', 'cotacoes',
-            str(now.year), f'{now.month:02d}'
-        )
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Gera nome único para o arquivo
-        nome_original = arquivo.filename
-        ext = os.path.splitext(nome_original)[1].lower()
-        nome_arquivo = f"anexo_cot{cotacao_id}_forn{fornecedor_id}_{uuid.uuid4().hex[:8]}{ext}"
-        caminho_arquivo = os.path.join(upload_dir, nome_arquivo)
-        
-        # Upload em streaming (salva em chunks para economia de memória)
-        tamanho_total = 0
-        with open(caminho_arquivo, 'wb') as f:
-            while True:
-                chunk = arquivo.stream.read(UPLOAD_CHUNK_SIZE)
-                if not chunk:
-                    break
-                tamanho_total += len(chunk)
-                
-                # Verifica limite de tamanho durante upload
-                if tamanho_total > UPLOAD_MAX_SIZE:
-                    f.close()
-                    os.remove(caminho_arquivo)
-                    return jsonify({
-                        'success': False, 
-                        'error': f'Arquivo muito grande. Máximo permitido: {UPLOAD_MAX_SIZE // (1024*1024)}MB'
-                    }), 400
-                
-                f.write(chunk)
-        
-        # Determina mime type
-        mime_type, _ = mimetypes.guess_type(nome_original)
-        tipo_arquivo = get_file_type(nome_original)
+        tipo_arquivo = _tipo_arquivo_anexo(arquivo.filename)
+        try:
+            _, registro = _guardar_anexo_cotacao(arquivo, cotacao_id, fornecedor_id, tipo_arquivo)
+        except AnexoMuitoGrande:
+            return jsonify({
+                'success': False, 
+                'error': f'Arquivo muito grande. Máximo permitido: {UPLOAD_MAX_SIZE // (1024*1024)}MB'
+            }), 400
         
-        # Salva metadados na tabela dedicada
-        anexo_id = db.salvar_metadados_anexo(
-            cotacao_id=cotacao_id,
-            fornecedor_id=fornecedor_id,
-            nome_original=nome_original,
-            nome_arquivo=nome_arquivo,
-            caminho_arquivo=caminho_arquivo,
-            tipo_arquivo=tipo_arquivo,
-            tamanho_bytes=tamanho_total,
-            mime_type=mime_type or 'application/octet-stream',
-            usuario=session.get('usuario', 'Admin')
-        )
+        anexo_id = registro['anexo_id']
+        caminho_arquivo = registro['caminho_arquivo']
+        nome_arquivo = os.path.basename(caminho_arquivo)
+        tamanho_total = os.path.getsize(caminho_arquivo)
         
         # TAMBÉM atualiza cotacao_respostas para compatibilidade com código legado
         conn = db.get_db_connection()
@@ -8160,6 +8250,34 @@ def api_upload_anexo_fornecedor(fornecedor_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Anexos, documentos ISO e PDFs de pré-visualização saem por aqui: ETag pelo
+# hash do conteúdo (304 na revalidação), Range para o visualizador de PDF e,
+# com ARQUIVOS_SENDFILE, entrega pelo nginx/Apache - ver servir_arquivos.py
+ARQUIVOS_SENDFILE = os.environ.get('ARQUIVOS_SENDFILE')  # 'x-sendfile' ou 'x-accel:<prefixo>'
+servidor_arquivos = ServidorArquivos(app.root_path, sendfile=ARQUIVOS_SENDFILE)
+
+
+@app.route('/api/diagnostico/arquivos')
+def diagnostico_arquivos():
+    """Modo de entrega e contadores de 304/206 da camada de arquivos"""
+    return jsonify({'success': True, **servidor_arquivos.status()})
+
+
+def _buscar_anexo_fornecedor(fornecedor_id):
+    """Caminho (ou URL) do anexo gravado em cotacao_respostas.arquivo_anexo"""
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT arquivo_anexo 
+        FROM cotacao_respostas 
+        WHERE fornecedor_id = ? AND arquivo_anexo IS NOT NULL AND arquivo_anexo != ''
+        LIMIT 1
+    ''', (fornecedor_id,))
+    resultado = cursor.fetchone()
+    conn.close()
+    return resultado['arquivo_anexo'] if resultado else None
+
+
 @app.route('/cotacao/anexo/<int:fornecedor_id>')
 def visualizar_anexo_fornecedor(fornecedor_id):
     """
@@ -8169,44 +8287,16 @@ def visualizar_anexo_fornecedor(fornecedor_id):
     ALTERAÇÃO: Content-Disposition: inline para abrir no navegador
     """
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Busca o anexo do fornecedor
-        cursor.execute('''
-            SELECT arquivo_anexo 
-            FROM cotacao_respostas 
-            WHERE fornecedor_id = ? AND arquivo_anexo IS NOT NULL AND arquivo_anexo != ''
-            LIMIT 1
-        ''', (fornecedor_id,))
-        
-        resultado = cursor.fetchone()
-        conn.close()
+        arquivo_path = _buscar_anexo_fornecedor(fornecedor_id)
         
-        if not resultado or not resultado['arquivo_anexo']:
+        if not arquivo_path:
             flash('Nenhum anexo encontrado para este fornecedor', 'warning')
             return redirect(request.referrer or url_for('cotacoes'))
         
-        arquivo_path = resultado['arquivo_anexo']
-        
         # Verifica se é um caminho de arquivo
-        if os.path.exists(arquivo_path):
-            # Determina o mimetype baseado na extensão
-            import mimetypes
-            mimetype, _ = mimetypes.guess_type(arquivo_path)
-            if not mimetype:
-                mimetype = 'application/octet-stream'
-            
-            # Envia arquivo para VISUALIZAÇÃO (não download)
-            # as_attachment=False + inline = abre no navegador
-            response = send_file(
-                arquivo_path, 
-                mimetype=mimetype,
-                as_attachment=False  # Não forçar download
-            )
-            # Força header inline para abrir no navegador
-            response.headers['Content-Disposition'] = f'inline; filename="{os.path.basename(arquivo_path)}"'
-            return response
+        if servidor_arquivos.existe(arquivo_path):
+            # inline = abre no navegador (não força download)
+            return servidor_arquivos.enviar(arquivo_path, inline=True)
         else:
             # Se for URL externa, redireciona
             return redirect(arquivo_path)
@@ -8216,33 +8306,37 @@ def visualizar_anexo_fornecedor(fornecedor_id):
         return redirect(request.referrer or url_for('cotacoes'))
 
 
+@app.route('/cotacao/anexo/miniatura/<hash_conteudo>')
+def miniatura_anexo(hash_conteudo):
+    """Miniatura (JPEG) de um anexo, gerada em segundo plano no upload"""
+    if not re.fullmatch(r'[0-9a-f]{64}', hash_conteudo):
+        return "Miniatura não encontrada", 404
+    caminho = armazenamento_anexos.caminho_miniatura(hash_conteudo)
+    if not servidor_arquivos.existe(caminho):
+        return "Miniatura não encontrada", 404
+    return servidor_arquivos.enviar(caminho, inline=True, mimetype='image/jpeg')
+
+
+@app.route('/api/diagnostico/anexos')
+def diagnostico_anexos():
+    """Armazenamento por conteúdo: gravados, duplicados evitados, coleta e miniaturas"""
+    return jsonify({'success': True, **armazenamento_anexos.status()})
+
+
 @app.route('/cotacao/anexo/<int:fornecedor_id>/download')
 def download_anexo_fornecedor(fornecedor_id):
     """
     Rota para DOWNLOAD de anexo (quando usuário escolhe baixar explicitamente).
     """
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT arquivo_anexo 
-            FROM cotacao_respostas 
-            WHERE fornecedor_id = ? AND arquivo_anexo IS NOT NULL AND arquivo_anexo != ''
-            LIMIT 1
-        ''', (fornecedor_id,))
+        arquivo_path = _buscar_anexo_fornecedor(fornecedor_id)
         
-        resultado = cursor.fetchone()
-        conn.close()
-        
-        if not resultado or not resultado['arquivo_anexo']:
+        if not arquivo_path:
             flash('Nenhum anexo encontrado para este fornecedor', 'warning')
             return redirect(request.referrer or url_for('cotacoes'))
         
-        arquivo_path = resultado['arquivo_anexo']
-        
-        if os.path.exists(arquivo_path):
-            return send_file(arquivo_path, as_attachment=True)
+        if servidor_arquivos.existe(arquivo_path):
+            return servidor_arquivos.enviar(arquivo_path)
         else:
             return redirect(arquivo_path)
             
@@ -8255,6 +8349,7 @@ def download_anexo_fornecedor(fornecedor_id):
 # COTAÇÃO EXTERNA VIA JSON
 # =============================================================================
 
+import gzip
 import hashlib
 import secrets
 
@@ -8273,366 +8368,68 @@ def validar_hash_json(dados_json, hash_esperado):
     return hash_calculado == hash_esperado
 
 
+# O HTML do fornecedor vem de templates/cotacao_arquivo_fornecedor.html (compilado
+# uma vez pelo Jinja). Os arquivos gerados ficam em uploads/json_cotacoes
+# comprimidos (.json.gz / .html.gz) e são reaproveitados enquanto a cotação, os
+# itens, o fornecedor e o template não mudarem (cotacao_json_envios.versao_conteudo).
+TEMPLATE_ARQUIVO_COTACAO = 'cotacao_arquivo_fornecedor.html'
+
+
+def _calcular_versao_arquivo_cotacao():
+    with open(os.path.join(app.root_path, app.template_folder, TEMPLATE_ARQUIVO_COTACAO), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+VERSAO_ARQUIVO_COTACAO = _calcular_versao_arquivo_cotacao()
+
+
 def gerar_html_cotacao_externa(dados_cotacao):
     """
     Gera um arquivo HTML standalone que o fornecedor pode abrir no navegador,
     preencher os valores e baixar o JSON de resposta.
     Visual idêntico ao modal de cotação do sistema.
     """
-    itens_html = ""
-    for i, item in enumerate(dados_cotacao['itens']):
-        itens_html += f'''
-                <tr data-item-id="{item['id']}" data-index="{i}">
-                    <td class="ps-3"><small class="text-muted">{item['codigo_produto'].strip()}</small></td>
-                    <td><strong>{item['descricao']}</strong></td>
-                    <td class="text-center">{item['quantidade']} {item['unidade']}</td>
-                    <td><input type="number" class="form-control form-control-sm preco-input" step="0.01" min="0" placeholder="0,00" data-index="{i}"></td>
-                    <td><input type="number" class="form-control form-control-sm prazo-input" min="0" placeholder="0" data-index="{i}"></td>
-                    <td><input type="text" class="form-control form-control-sm obs-input" placeholder="Observação do item..." data-index="{i}"></td>
-                </tr>'''
-    
-    html_content = f'''<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Cotação - {dados_cotacao['fornecedor']['nome']}</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" rel="stylesheet">
-    <style>
-        * {{ box-sizing: border-box; }}
-        body {{ 
-            background-color: #f0f0f0; 
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
-            padding: 20px;
-        }}
-        .cotacao-container {{
-            max-width: 900px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            overflow: hidden;
-        }}
-        .cotacao-header {{
-            background: linear-gradient(135deg, #1a5a3c 0%, #2d7a5e 100%);
-            color: white;
-            padding: 15px 20px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }}
-        .cotacao-header h5 {{
-            margin: 0;
-            font-weight: 600;
-        }}
-        .cotacao-header .btn-close {{
-            filter: brightness(0) invert(1);
-            opacity: 0.8;
-        }}
-        .cotacao-body {{
-            padding: 20px;
-        }}
-        .alert-instrucao {{
-            background-color: #e8f4fd;
-            border: 1px solid #b8daff;
-            border-radius: 6px;
-            padding: 12px 15px;
-            margin-bottom: 20px;
-            color: #004085;
-            font-size: 14px;
-        }}
-        .alert-instrucao i {{
-            color: #0066cc;
-        }}
-        .section-title {{
-            font-size: 14px;
-            font-weight: 600;
-            color: #333;
-            margin-bottom: 15px;
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }}
-        .section-title i {{
-            color: #1a5a3c;
-        }}
-        .table {{
-            font-size: 13px;
-            margin-bottom: 0;
-        }}
-        .table thead {{
-            background-color: #f8f9fa;
-        }}
-        .table thead th {{
-            font-weight: 600;
-            color: #495057;
-            border-bottom: 2px solid #dee2e6;
-            padding: 10px 8px;
-            font-size: 12px;
-            text-transform: uppercase;
-        }}
-        .table tbody td {{
-            padding: 10px 8px;
-            vertical-align: middle;
-            border-bottom: 1px solid #eee;
-        }}
-        .table tbody tr:hover {{
-            background-color: #f8f9fa;
-        }}
-        .preco-input, .prazo-input {{
-            width: 90px;
-            text-align: right;
-            border: 1px solid #ced4da;
-            border-radius: 4px;
-            padding: 6px 10px;
-        }}
-        .obs-input {{
-            width: 200px;
-            border: 1px solid #ced4da;
-            border-radius: 4px;
-            padding: 6px 10px;
-        }}
-        .preco-input:focus, .prazo-input:focus, .obs-input:focus {{
-            border-color: #1a5a3c;
-            box-shadow: 0 0 0 2px rgba(26,90,60,0.15);
-            outline: none;
-        }}
-        .info-gerais {{
-            background-color: #f8f9fa;
-            border-radius: 6px;
-            padding: 15px;
-            margin-top: 20px;
-        }}
-        .info-gerais .form-label {{
-            font-weight: 500;
-            font-size: 13px;
-            color: #495057;
-            margin-bottom: 5px;
-        }}
-        .info-gerais .form-control {{
-            font-size: 14px;
-        }}
-        .info-gerais small {{
-            color: #6c757d;
-            font-size: 11px;
-        }}
-        .cotacao-footer {{
-            padding: 15px 20px;
-            background-color: #f8f9fa;
-            border-top: 1px solid #dee2e6;
-            display: flex;
-            justify-content: flex-end;
-            gap: 10px;
-        }}
-        .btn-cancelar {{
-            background-color: #6c757d;
-            border: none;
-            color: white;
-            padding: 10px 25px;
-            border-radius: 5px;
-            font-weight: 500;
-        }}
-        .btn-salvar {{
-            background-color: #1a5a3c;
-            border: none;
-            color: white;
-            padding: 10px 25px;
-            border-radius: 5px;
-            font-weight: 500;
-        }}
-        .btn-salvar:hover {{
-            background-color: #2d7a5e;
-        }}
-        .btn-salvar i {{
-            margin-right: 5px;
-        }}
-        @media print {{
-            body {{ background: white; padding: 0; }}
-            .cotacao-container {{ box-shadow: none; }}
-            .cotacao-footer {{ display: none; }}
-            .preco-input, .prazo-input {{ border: 1px solid #ccc; }}
-            .instrucoes-box {{ display: none; }}
-        }}
-        .instrucoes-box {{
-            background: linear-gradient(135deg, #e8f5e9 0%, #c8e6c9 100%);
-            border: 1px solid #81c784;
-            border-radius: 8px;
-            padding: 15px;
-            margin-bottom: 20px;
-        }}
-        .instrucoes-box h6 {{
-            color: #2e7d32;
-            margin-bottom: 10px;
-        }}
-        .instrucoes-box ol {{
-            margin-bottom: 0;
-            padding-left: 20px;
-        }}
-        .instrucoes-box li {{
-            margin-bottom: 5px;
-            font-size: 13px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="cotacao-container">
-        <!-- Header -->
-        <div class="cotacao-header">
-            <h5><i class="fas fa-file-invoice me-2"></i>Cotação - {dados_cotacao['fornecedor']['nome']}</h5>
-        </div>
-        
-        <!-- Body -->
-        <div class="cotacao-body">
-            <!-- Instruções detalhadas -->
-            <div class="instrucoes-box">
-                <h6><i class="fas fa-clipboard-list me-2"></i>Instruções para Preenchimento</h6>
-                <ol>
-                    <li><strong>Preencha</strong> o preço unitário (R$) e prazo de entrega (dias) para cada item</li>
-                    <li>Use o campo <strong>Observação</strong> para informações específicas de cada item</li>
-                    <li>Preencha as <strong>Informações Gerais</strong> (frete, condição de pagamento)</li>
-                    <li>Clique em <strong>"Salvar Respostas"</strong> - um arquivo JSON será baixado</li>
-                    <li><strong>Envie o arquivo JSON</strong> de volta por e-mail ao comprador</li>
-                </ol>
-            </div>
-            
-            <!-- Instrução resumida -->
-            <div class="alert-instrucao">
-                <i class="fas fa-info-circle me-2"></i>
-                Preencha os valores abaixo e clique em <strong>"Salvar Respostas"</strong> para gerar o arquivo de retorno.
-            </div>
-            
-            <!-- Tabela de Itens -->
-            <div class="section-title">
-                <i class="fas fa-list"></i>
-                Itens da Cotação
-            </div>
-            
-            <div class="table-responsive">
-                <table class="table">
-                    <thead>
-                        <tr>
-                            <th style="width: 100px;">CÓDIGO</th>
-                            <th>DESCRIÇÃO</th>
-                            <th class="text-center" style="width: 80px;">QTD</th>
-                            <th class="text-center" style="width: 120px;">PREÇO UNIT. (R$)</th>
-                            <th class="text-center" style="width: 100px;">PRAZO (DIAS)</th>
-                            <th style="width: 220px;">OBSERVAÇÃO</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {itens_html}
-                    </tbody>
-                </table>
-            </div>
-            
-            <!-- Informações Gerais do Fornecedor -->
-            <div class="info-gerais">
-                <div class="section-title">
-                    <i class="fas fa-truck"></i>
-                    Informações Gerais do Fornecedor
-                </div>
-                <div class="row">
-                    <div class="col-md-4">
-                        <label class="form-label">Frete (R$)</label>
-                        <input type="number" class="form-control" id="freteTotal" step="0.01" min="0" placeholder="0,00">
-                        <small>Valor único para todos os itens</small>
-                    </div>
-                    <div class="col-md-4">
-                        <label class="form-label">Condição de Pagamento</label>
-                        <input type="text" class="form-control" id="condicaoPagamento" placeholder="Ex: 30 DDL, À vista, etc.">
-                    </div>
-                    <div class="col-md-4">
-                        <label class="form-label">Observação</label>
-                        <input type="text" class="form-control" id="observacaoGeral" placeholder="Observações gerais...">
-                    </div>
-                </div>
-            </div>
-        </div>
-        
-        <!-- Footer -->
-        <div class="cotacao-footer">
-            <button class="btn-cancelar" onclick="window.print()">
-                Imprimir
-            </button>
-            <button class="btn-salvar" onclick="salvarRespostas()">
-                <i class="fas fa-save"></i> Salvar Respostas
-            </button>
-        </div>
-    </div>
-    
-    <script>
-        // Dados originais da cotação
-        const dadosCotacao = {json.dumps(dados_cotacao, ensure_ascii=False)};
-        
-        function coletarDados() {{
-            // Coleta respostas dos itens
-            document.querySelectorAll('table tbody tr').forEach((row, index) => {{
-                const precoInput = row.querySelector('.preco-input');
-                const prazoInput = row.querySelector('.prazo-input');
-                const obsInput = row.querySelector('.obs-input');
-                
-                dadosCotacao.itens[index].resposta.preco_unitario = precoInput.value ? parseFloat(precoInput.value) : null;
-                dadosCotacao.itens[index].resposta.prazo_entrega_dias = prazoInput.value ? parseInt(prazoInput.value) : null;
-                dadosCotacao.itens[index].resposta.observacao = obsInput.value || null;
-            }});
-            
-            // Coleta informações gerais
-            dadosCotacao.resposta_geral.frete_total = document.getElementById('freteTotal').value ? parseFloat(document.getElementById('freteTotal').value) : null;
-            dadosCotacao.resposta_geral.condicao_pagamento = document.getElementById('condicaoPagamento').value || null;
-            dadosCotacao.resposta_geral.observacao_geral = document.getElementById('observacaoGeral').value || null;
-            dadosCotacao.resposta_geral.data_resposta = new Date().toISOString();
-            
-            // Muda o tipo para resposta
-            dadosCotacao.tipo = 'RESPOSTA_COTACAO';
-            
-            return dadosCotacao;
-        }}
-        
-        function salvarRespostas() {{
-            const dados = coletarDados();
-            
-            // Verifica se pelo menos um preço foi preenchido
-            const temPreco = dados.itens.some(item => item.resposta.preco_unitario !== null && item.resposta.preco_unitario > 0);
-            if (!temPreco) {{
-                if (!confirm('Nenhum preço foi preenchido. Deseja salvar mesmo assim?')) {{
-                    return;
-                }}
-            }}
-            
-            // Cria o arquivo para download
-            const jsonString = JSON.stringify(dados, null, 2);
-            const blob = new Blob([jsonString], {{ type: 'application/json' }});
-            const url = URL.createObjectURL(blob);
-            
-            // Nome do arquivo de resposta
-            const nomeArquivo = 'RESPOSTA_' + dadosCotacao.token.substring(0, 8) + '.json';
-            
-            // Cria link de download
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = nomeArquivo;
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            URL.revokeObjectURL(url);
-            
-            alert('✅ Respostas salvas com sucesso!\\n\\nArquivo: ' + nomeArquivo + '\\n\\nEnvie este arquivo de volta ao comprador.');
-        }}
-        
-        // Formata inputs de preço ao sair do campo
-        document.querySelectorAll('.preco-input').forEach(input => {{
-            input.addEventListener('blur', function() {{
-                if (this.value) {{
-                    this.value = parseFloat(this.value).toFixed(2);
-                }}
-            }});
-        }});
-    </script>
-</body>
-</html>'''
-    
-    return html_content
+    return render_template(TEMPLATE_ARQUIVO_COTACAO, dados_cotacao=dados_cotacao)
+
+
+def _gravar_gzip(caminho, texto):
+    """Grava texto UTF-8 comprimido (escrita atômica)"""
+    temporario = f'{caminho}.{secrets.token_hex(4)}.tmp'
+    with gzip.open(temporario, 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(texto)
+    os.replace(temporario, caminho)
+
+
+def _ler_json_artefato(caminho):
+    """JSON gerado para o fornecedor (.json.gz ou .json dos envios antigos). None se não existir."""
+    if not caminho or not os.path.exists(caminho):
+        return None
+    abrir = gzip.open if caminho.endswith('.gz') else open
+    with abrir(caminho, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _enviar_artefato(caminho, mimetype):
+    """
+    Download de um arquivo gerado. Os .gz saem como estão, com
+    Content-Encoding: gzip (o navegador descomprime ao salvar); clientes
+    sem gzip recebem o conteúdo descomprimido.
+    """
+    nome_download = os.path.basename(caminho)
+    if not caminho.endswith('.gz'):
+        return servidor_arquivos.enviar(caminho, nome_download=nome_download, mimetype=mimetype)
+    
+    nome_download = nome_download.removesuffix('.gz')
+    if 'gzip' in request.accept_encodings:
+        resposta = servidor_arquivos.enviar(caminho, nome_download=nome_download, mimetype=mimetype)
+        resposta.headers['Content-Encoding'] = 'gzip'
+        resposta.vary.add('Accept-Encoding')
+        return resposta
+    
+    with gzip.open(caminho, 'rb') as f:
+        resposta = send_file(BytesIO(f.read()), mimetype=mimetype, as_attachment=True, download_name=nome_download)
+    resposta.vary.add('Accept-Encoding')
+    return resposta
 
 
 @app.route('/api/cotacao/fornecedor/<int:fornecedor_id>/gerar-json', methods=['POST'])
@@ -8670,6 +8467,34 @@ def api_gerar_json_cotacao(fornecedor_id):
         itens = [dict(item) for item in cursor.fetchall()]
         conn.close()
         
+        # Versão do conteúdo: muda se a cotação, o fornecedor, os itens ou o template mudarem
+        versao_conteudo = gerar_hash_validacao({
+            'cotacao': [fornecedor['cotacao_codigo'], fornecedor['cotacao_observacoes'],
+                        fornecedor['informacao_fornecedor']],
+            'fornecedor': [fornecedor['nome_fornecedor'], fornecedor['email_fornecedor'],
+                           fornecedor['telefone_fornecedor']],
+            'itens': itens,
+            'template': VERSAO_ARQUIVO_COTACAO
+        })[:24]
+        
+        # Mesma versão já gerada e ainda não respondida: reaproveita os arquivos e o token
+        envio = db.obter_envio_json_por_versao(fornecedor_id, versao_conteudo)
+        if envio:
+            caminho_json = envio['arquivo_json_gerado']
+            caminho_html = caminho_json.replace('.json', '.html')
+            if os.path.exists(caminho_json) and os.path.exists(caminho_html):
+                token_envio = envio['token_envio']
+                print(f"[JSON] Arquivos da versão {versao_conteudo[:8]} reaproveitados para fornecedor {fornecedor['nome_fornecedor']}")
+                return jsonify({
+                    'success': True,
+                    'message': 'Arquivos gerados com sucesso',
+                    'arquivo': os.path.basename(caminho_html).removesuffix('.gz'),
+                    'arquivo_json': os.path.basename(caminho_json).removesuffix('.gz'),
+                    'token': token_envio,
+                    'download_url': f'/api/cotacao/html/download/{token_envio}',
+                    'reaproveitado': True
+                })
+        
         # Gera token único e hash
         token_envio = gerar_token_json()
         
@@ -8755,17 +8580,15 @@ def api_gerar_json_cotacao(fornecedor_id):
         nome_arquivo_json = f"{nome_base}.json"
         nome_arquivo_html = f"{nome_base}.html"
         
-        caminho_arquivo_json = os.path.join(json_dir, nome_arquivo_json)
-        caminho_arquivo_html = os.path.join(json_dir, nome_arquivo_html)
+        # Gravados comprimidos; o download sai com Content-Encoding: gzip
+        caminho_arquivo_json = os.path.join(json_dir, f"{nome_arquivo_json}.gz")
+        caminho_arquivo_html = os.path.join(json_dir, f"{nome_arquivo_html}.gz")
         
         # Salva arquivo JSON (backup)
-        with open(caminho_arquivo_json, 'w', encoding='utf-8') as f:
-            json.dump(dados_cotacao, f, ensure_ascii=False, indent=2)
+        _gravar_gzip(caminho_arquivo_json, json.dumps(dados_cotacao, ensure_ascii=False, indent=2))
         
         # Gera e salva arquivo HTML (para o fornecedor)
-        html_content = gerar_html_cotacao_externa(dados_cotacao)
-        with open(caminho_arquivo_html, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        _gravar_gzip(caminho_arquivo_html, gerar_html_cotacao_externa(dados_cotacao))
         
         # Registra no banco
         usuario = session.get('username', 'Admin')
@@ -8775,7 +8598,8 @@ def api_gerar_json_cotacao(fornecedor_id):
             token_envio=token_envio,
             hash_validacao=hash_validacao,
             arquivo_json=caminho_arquivo_json,
-            usuario=usuario
+            usuario=usuario,
+            versao_conteudo=versao_conteudo
         )
         
         print(f"[JSON] Gerado arquivos {nome_arquivo_json} e {nome_arquivo_html} para fornecedor {fornecedor['nome_fornecedor']}")
@@ -8810,7 +8634,7 @@ def api_download_json_cotacao(token):
         if not arquivo_path or not os.path.exists(arquivo_path):
             return jsonify({'success': False, 'error': 'Arquivo não encontrado'}), 404
         
-        return send_file(arquivo_path, as_attachment=True)
+        return _enviar_artefato(arquivo_path, 'application/json')
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -8825,14 +8649,14 @@ def api_download_html_cotacao(token):
         if not envio:
             return jsonify({'success': False, 'error': 'Token inválido'}), 404
         
-        # O arquivo HTML tem o mesmo nome base do JSON, mas com extensão .html
+        # O arquivo HTML tem o mesmo nome base do JSON, mas com extensão .html (.html.gz)
         arquivo_json_path = envio['arquivo_json_gerado']
         arquivo_html_path = arquivo_json_path.replace('.json', '.html')
         
         if not arquivo_html_path or not os.path.exists(arquivo_html_path):
             return jsonify({'success': False, 'error': 'Arquivo HTML não encontrado'}), 404
         
-        return send_file(arquivo_html_path, as_attachment=True)
+        return _enviar_artefato(arquivo_html_path, 'text/html')
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -9008,14 +8832,12 @@ def pagina_cotacao_externa(token):
         # Carrega os dados do JSON gerado
         arquivo_json = envio.get('arquivo_json_gerado')
         
-        if not arquivo_json or not os.path.exists(arquivo_json):
+        dados_cotacao = _ler_json_artefato(arquivo_json)
+        if dados_cotacao is None:
             return render_template('cotacao_erro.html', 
                 erro='Arquivo de cotação não encontrado.',
                 mensagem='Por favor, solicite um novo link ao comprador.')
         
-        with open(arquivo_json, 'r', encoding='utf-8') as f:
-            dados_cotacao = json.load(f)
-        
         return render_template('cotacao_externa.html', 
             dados=dados_cotacao,
             ano_atual=datetime.now().year)
@@ -9206,7 +9028,7 @@ def api_gerar_link_externo(fornecedor_id):
             try:
                 # Consulta o endpoint oficial de status no Render
                 status_url = f"{RENDER_PUBLIC_URL}/api/cotacao-externa/{token_existente}/status"
-                response = requests.get(status_url, timeout=10)
+                response = cliente_http.get(status_url, timeout=10)
                 
                 if response.status_code == 200:
                     status_data = response.json()
@@ -9298,7 +9120,7 @@ def api_gerar_link_externo(fornecedor_id):
         }
         
         try:
-            response = requests.post(
+            response = cliente_http.post(
                 f"{RENDER_PUBLIC_URL}/api/criar-cotacao-externa",
                 json=dados_para_render,
                 headers={'Content-Type': 'application/json'},
@@ -9438,7 +9260,7 @@ def api_verificar_status_render(fornecedor_id):
             status_url = f"{RENDER_PUBLIC_URL}/api/cotacao-externa/{token}/status"
             print(f"[VERIFICAR STATUS] Consultando: {status_url}")
             
-            response = requests.get(status_url, timeout=10)
+            response = cliente_http.get(status_url, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -9516,7 +9338,7 @@ def api_obter_link_externo(fornecedor_id):
         if token:
             try:
                 status_url = f"{RENDER_PUBLIC_URL}/api/cotacao-externa/{token}/status"
-                response = requests.get(status_url, timeout=5)
+                response = cliente_http.get(status_url, timeout=5)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -10380,27 +10202,15 @@ def api_upload_anexo_rodada2(cotacao_id):
         if ext not in extensoes_permitidas:
             return jsonify({'success': False, 'error': f'Extensão {ext} não permitida'}), 400
         
-        # Verificar tamanho (máx 10MB)
-        arquivo.seek(0, 2)
-        tamanho = arquivo.tell()
-        arquivo.seek(0)
-        
-        if tamanho > 10 * 1024 * 1024:
+        # Salvar arquivo (pelo hash do conteúdo; verifica o tamanho durante a gravação)
+        try:
+            _, registro = _guardar_anexo_cotacao(arquivo, cotacao_id, int(fornecedor_id),
+                                                 _tipo_arquivo_anexo(arquivo.filename), rodada=2)
+        except AnexoMuitoGrande:
             return jsonify({'success': False, 'error': 'Arquivo muito grande (máx 10MB)'}), 400
         
-        # Criar diretório se não existir
-        from datetime import datetime
-        ano = datetime.now().strftime('%Y')
-        mes = datetime.now().strftime('%m')
-        diretorio = os.path.join('uploads', 'cotacoes', ano, mes, 'rodada2')
-        os.makedirs(diretorio, exist_ok=True)
-        
-        # Nome único do arquivo
-        nome_arquivo = f"anexo_r2_cot{cotacao_id}_forn{fornecedor_id}_{uuid.uuid4().hex[:8]}{ext}"
-        caminho_completo = os.path.join(diretorio, nome_arquivo)
-        
-        # Salvar arquivo
-        arquivo.save(caminho_completo)
+        caminho_completo = registro['caminho_arquivo']
+        nome_arquivo = os.path.basename(caminho_completo)
         
         # Atualizar todas as rodadas deste fornecedor com o caminho do anexo
         conn = db.get_db_connection()
@@ -10454,6 +10264,33 @@ def api_obter_rodadas_agrupadas(cotacao_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/cotacao/<int:cotacao_id>/historico', methods=['GET'])
+def api_historico_cotacao(cotacao_id):
+    """
+    API paginada do histórico (log de eventos) de uma cotação.
+    Query params: limite (padrão 50, máx 200), cursor (retornado na página anterior)
+    """
+    try:
+        limite = int(request.args.get('limite', 50))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limite deve ser um número inteiro'}), 400
+    limite = min(max(limite, 1), 200)
+
+    # Cursor no formato '<data_hora>|<id>' (proximo_cursor da página anterior)
+    cursor = request.args.get('cursor') or None
+    if cursor:
+        data_hora_cursor, _, id_cursor = cursor.rpartition('|')
+        if not data_hora_cursor or not id_cursor.isdigit():
+            return jsonify({'success': False, 'error': 'cursor inválido'}), 400
+
+    try:
+        pagina = db.listar_eventos_cotacao(cotacao_id, limite=limite, cursor=cursor)
+        return jsonify({'success': True, **pagina})
+    except Exception as e:
+        print(f"[ERRO] api_historico_cotacao: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/cotacao/<int:cotacao_id>/rodada-fornecedor/<int:fornecedor_id>/frete', methods=['POST'])
 def api_atualizar_frete_rodada2(cotacao_id, fornecedor_id):
     """API para atualizar o frete negociado de um fornecedor na rodada 2"""
@@ -10555,6 +10392,9 @@ def api_adicionar_fornecedor_rodada2(cotacao_id):
 import uuid
 import hashlib
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from conversor_pdf import ConversorPDF
+from cache_html_word import CacheHTMLWord
 
 # Pasta para armazenar documentos ISO (PDFs)
 UPLOAD_FOLDER_ISO = os.path.join(os.path.dirname(__file__), 'uploads', 'avaliacao_iso')
@@ -10906,11 +10746,18 @@ def api_importar_excel_avaliacao_iso():
     - Coluna D: Data de Vencimento
     - Coluna E: Possui Certificado ISO (Sim / Não)
     
+    Em fases: lê todas as linhas da planilha, resolve os nomes no índice de
+    fornecedores em memória e grava as novas avaliações em uma única transação.
+    
     Retorna relatório detalhado da importação.
     """
     if 'user' not in session:
         return jsonify({'success': False, 'error': 'Não autenticado'}), 401
     
+    # A mesma URL recebe a lista já processada no navegador (JSON)
+    if request.is_json:
+        return api_importar_excel_iso()
+    
     try:
         if 'arquivo' not in request.files:
             return jsonify({'success': False, 'error': 'Nenhum arquivo enviado'})
@@ -10924,24 +10771,6 @@ def api_importar_excel_avaliacao_iso():
         if not arquivo.filename.lower().endswith(('.xlsx', '.xls')):
             return jsonify({'success': False, 'error': 'Formato inválido. Envie um arquivo Excel (.xlsx ou .xls)'})
         
-        # Ler o arquivo Excel
-        from openpyxl import load_workbook
-        from io import BytesIO
-        
-        conteudo = BytesIO(arquivo.read())
-        wb = load_workbook(conteudo, data_only=True)
-        ws = wb.active
-        
-        # Conectar ao TOTVS para buscar fornecedores
-        server = '172.16.45.117\\TOTVS'
-        database = 'TOTVSDB'
-        username = 'excel'
-        password = 'Db_Polimaquinas'
-        
-        conn_str = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn_totvs = pyodbc.connect(conn_str, timeout=60)
-        cursor_totvs = conn_totvs.cursor()
-        
         # Estatísticas
         total_linhas = 0
         importados = 0
@@ -10949,7 +10778,17 @@ def api_importar_excel_avaliacao_iso():
         nao_encontrados = []
         erros = []
         
-        # Processar linhas (ignorando cabeçalho)
+        # ---------------------------------------------------------------------
+        # Fase 1: ler a planilha inteira (modo somente leitura, em streaming)
+        # ---------------------------------------------------------------------
+        from openpyxl import load_workbook
+        from io import BytesIO
+        
+        conteudo = BytesIO(arquivo.read())
+        wb = load_workbook(conteudo, read_only=True, data_only=True)
+        ws = wb.active
+        
+        linhas = []
         for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
             # Verificar se a linha tem dados
             if not row or not row[0]:
@@ -10960,15 +10799,13 @@ def api_importar_excel_avaliacao_iso():
             # Coluna A: Nome do Fornecedor
             nome_fornecedor = str(row[0]).strip() if row[0] else ''
             
-            # Coluna B: Data de Avaliação
-            data_avaliacao = None
-            if len(row) > 1 and row[1]:
-                data_avaliacao = tratar_data_excel(row[1])
-            
-            # Coluna D: Data de Vencimento (índice 3)
-            data_vencimento = None
-            if len(row) > 3 and row[3]:
-                data_vencimento = tratar_data_excel(row[3])
+            if not nome_fornecedor:
+                erros.append({
+                    'linha': row_num,
+                    'nome': '(vazio)',
+                    'motivo': 'Nome do fornecedor vazio'
+                })
+                continue
             
             # Coluna E: Possui ISO (índice 4)
             possui_iso = 'Nao'
@@ -10977,84 +10814,68 @@ def api_importar_excel_avaliacao_iso():
                 if valor_iso in ['sim', 's', 'yes', 'y', '1', 'true', 'x']:
                     possui_iso = 'Sim'
             
-            if not nome_fornecedor:
-                erros.append({
-                    'linha': row_num,
-                    'nome': '(vazio)',
-                    'motivo': 'Nome do fornecedor vazio'
+            linhas.append({
+                'linha': row_num,
+                'nome': nome_fornecedor,
+                # Coluna B: Data de Avaliação / Coluna D: Data de Vencimento (índice 3)
+                'data_avaliacao': tratar_data_excel(row[1]) if len(row) > 1 and row[1] else None,
+                'data_vencimento': tratar_data_excel(row[3]) if len(row) > 3 and row[3] else None,
+                'possui_iso': possui_iso
+            })
+        wb.close()
+        
+        # ---------------------------------------------------------------------
+        # Fase 2: resolver os nomes no índice de fornecedores (em memória)
+        # ---------------------------------------------------------------------
+        fornecedores_totvs = {}
+        if linhas:
+            fornecedores_totvs = indice_fornecedores.resolver_varios([l['nome'] for l in linhas])
+        
+        # ---------------------------------------------------------------------
+        # Fase 3: gravar as novas avaliações em uma transação
+        # ---------------------------------------------------------------------
+        codigos_existentes = db.obter_codigos_avaliacao_iso()
+        observacao = f'Importado via Excel em {datetime.now().strftime("%d/%m/%Y %H:%M")}'
+        novas = []
+        for linha in linhas:
+            fornecedor = fornecedores_totvs.get(linha['nome'])
+            if not fornecedor:
+                nao_encontrados.append({
+                    'linha': linha['linha'],
+                    'nome': linha['nome'],
+                    'motivo': 'Fornecedor não encontrado no cadastro TOTVS'
                 })
                 continue
             
-            # Buscar fornecedor no TOTVS pelo nome
-            try:
-                # Busca por nome exato ou similar
-                query = """
-                SELECT TOP 1
-                    RTRIM(A2_COD) AS codigo,
-                    RTRIM(A2_NOME) AS nome,
-                    RTRIM(ISNULL(A2_EMAIL, '')) AS email
-                FROM SA2010
-                WHERE D_E_L_E_T_ = ''
-                  AND A2_MSBLQL <> '1'
-                  AND UPPER(A2_NOME) LIKE UPPER(?)
-                ORDER BY 
-                    CASE WHEN UPPER(A2_NOME) = UPPER(?) THEN 0 ELSE 1 END,
-                    A2_NOME
-                """
-                # Busca exata primeiro, depois com %
-                cursor_totvs.execute(query, (f'%{nome_fornecedor}%', nome_fornecedor))
-                fornecedor = cursor_totvs.fetchone()
-                
-                if not fornecedor:
-                    nao_encontrados.append({
-                        'linha': row_num,
-                        'nome': nome_fornecedor,
-                        'motivo': 'Fornecedor não encontrado no cadastro TOTVS'
-                    })
-                    continue
-                
-                cod_fornecedor = fornecedor.codigo
-                nome_totvs = fornecedor.nome
-                email_fornecedor = fornecedor.email if fornecedor.email else None
-                
-                # Verificar se já existe na avaliação ISO
-                existente = db.obter_avaliacao_iso_por_fornecedor(cod_fornecedor)
-                if existente:
-                    ja_existentes += 1
-                    continue
-                
-                # Criar avaliação ISO
-                avaliacao_id = db.criar_avaliacao_iso(
-                    cod_fornecedor=cod_fornecedor,
-                    nome_fornecedor=nome_totvs,
-                    email_fornecedor=email_fornecedor,
-                    data_ultima_avaliacao=data_avaliacao,
-                    data_vencimento=data_vencimento,
-                    possui_iso=possui_iso,
-                    nota=None,
-                    observacao=f'Importado via Excel em {datetime.now().strftime("%d/%m/%Y %H:%M")}',
-                    usuario=session['user']
-                )
-                
-                if avaliacao_id:
-                    importados += 1
-                else:
-                    erros.append({
-                        'linha': row_num,
-                        'nome': nome_fornecedor,
-                        'motivo': 'Erro ao inserir no banco de dados'
-                    })
-                    
-            except Exception as e_linha:
+            # Já existe na avaliação ISO (ou apareceu antes nesta planilha)
+            if fornecedor['codigo'] in codigos_existentes:
+                ja_existentes += 1
+                continue
+            codigos_existentes.add(fornecedor['codigo'])
+            
+            novas.append({
+                'linha': linha['linha'],
+                'nome_planilha': linha['nome'],
+                'cod_fornecedor': fornecedor['codigo'],
+                'nome_fornecedor': fornecedor['nome'],
+                'email_fornecedor': fornecedor['email'] or None,
+                'data_ultima_avaliacao': linha['data_avaliacao'],
+                'data_vencimento': linha['data_vencimento'],
+                'possui_iso': linha['possui_iso'],
+                'nota': None,
+                'observacao': observacao
+            })
+        
+        for avaliacao, avaliacao_id in zip(novas, db.criar_avaliacoes_iso_em_lote(novas, usuario=session['user'])):
+            if avaliacao_id:
+                importados += 1
+            else:
                 erros.append({
-                    'linha': row_num,
-                    'nome': nome_fornecedor,
-                    'motivo': f'Erro: {str(e_linha)}'
+                    'linha': avaliacao['linha'],
+                    'nome': avaliacao['nome_planilha'],
+                    'motivo': 'Erro ao inserir no banco de dados'
                 })
         
-        # Fechar conexão TOTVS
-        conn_totvs.close()
-        
         # Montar relatório
         return jsonify({
             'success': True,
@@ -11186,6 +11007,15 @@ def api_upload_documento_iso(avaliacao_id):
             tamanho_bytes=tamanho_bytes
         )
         
+        # Pré-visualizações (PDF e HTML) geradas em segundo plano (prontas quando alguém abrir)
+        if extensao in ('doc', 'docx'):
+            try:
+                conversor_pdf.agendar(caminho_completo)
+                if extensao == 'docx':
+                    cache_html_word.agendar(caminho_completo)
+            except Exception as e:
+                print(f"[WARN] Pré-visualização não agendada: {e}")
+        
         return jsonify({
             'success': True, 
             'id': doc_id,
@@ -11211,14 +11041,10 @@ def api_download_documento_iso(documento_id):
             return jsonify({'success': False, 'error': 'Documento não encontrado'}), 404
         
         caminho = documento['caminho_arquivo']
-        if not os.path.exists(caminho):
+        if not servidor_arquivos.existe(caminho):
             return jsonify({'success': False, 'error': 'Arquivo não encontrado no servidor'}), 404
         
-        return send_file(
-            caminho,
-            as_attachment=True,
-            download_name=documento['nome_original']
-        )
+        return servidor_arquivos.enviar(caminho, nome_download=documento['nome_original'])
     
     except Exception as e:
         print(f"[ERRO] api_download_documento_iso: {e}")
@@ -11231,6 +11057,7 @@ def api_preview_word_como_html(documento_id):
     API para pré-visualização de documentos Word como HTML.
     Extrai o conteúdo do DOCX e retorna HTML formatado para visualização.
     NUNCA força download - sempre retorna conteúdo para visualização.
+    DOCX: HTML do cache (gerado no upload), com ETag/Last-Modified → 304.
     """
     if 'user' not in session:
         return jsonify({'success': False, 'error': 'Não autenticado'}), 401
@@ -11249,10 +11076,20 @@ def api_preview_word_como_html(documento_id):
         if extensao not in ['doc', 'docx']:
             return jsonify({'success': False, 'error': 'Formato não suportado'}), 400
         
+        # DOCX: validação pelo hash do conteúdo sem ler o HTML
+        chave = cache_html_word.chave(caminho) if extensao == 'docx' else None
+        if chave and chave in request.if_none_match:
+            return Response(status=304, headers={'ETag': f'"{chave}"', 'Cache-Control': 'private, no-cache'})
+        
         # Extrair conteúdo do Word como HTML
+        modificado_em = None
         try:
-            html_content = extrair_conteudo_word_html(caminho)
+            if chave:
+                html_content, chave, modificado_em = cache_html_word.obter(caminho)
+            else:
+                html_content = extrair_conteudo_word_html(caminho)
         except Exception as extract_err:
+            chave = None
             print(f"[WARN] Falha na extração HTML: {extract_err}")
             html_content = f'''<div class="alert alert-warning" style="margin: 20px;">
                 <h5><i class="fas fa-file-word me-2"></i>Documento Word</h5>
@@ -11260,12 +11097,17 @@ def api_preview_word_como_html(documento_id):
                 <p class="mb-0"><strong>Use o botão "Baixar Arquivo"</strong> para abrir no Microsoft Word.</p>
             </div>'''
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'nome': documento['nome_original'],
             'html': html_content,
             'download_url': f'/api/avaliacao-iso/documento/{documento_id}/download'
         })
+        if chave:
+            response.set_etag(chave)
+            response.last_modified = modificado_em
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     except Exception as e:
         print(f"[ERRO] api_preview_word_como_html: {e}")
@@ -11325,16 +11167,6 @@ def extrair_conteudo_word_html(caminho_docx):
         }
         W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
         
-        # Abrir o DOCX como ZIP e ler o document.xml diretamente
-        with zipfile.ZipFile(caminho_docx, 'r') as docx_zip:
-            xml_content = docx_zip.read('word/document.xml')
-        
-        root = etree.fromstring(xml_content)
-        body = root.find('.//w:body', NS)
-        
-        if body is None:
-            return extrair_conteudo_word_simples(caminho_docx)
-        
         html_parts = ['<div class="word-preview-content" style="font-family: Calibri, Arial, sans-serif; line-height: 1.6; color: #333;">']
         
         def get_localname(elem):
@@ -11511,21 +11343,38 @@ def extrair_conteudo_word_html(caminho_docx):
                 return ''.join(parts) if parts else ''
             return ''
         
-        # === PROCESSAR TODOS OS ELEMENTOS DO BODY ===
-        for elem in body:
-            tag = get_localname(elem)
-            
-            if tag == 'p':
-                html_parts.append(process_paragraph(elem))
-            elif tag == 'tbl':
-                html_parts.append(process_table(elem))
-            elif tag == 'sdt':
-                sdt_html = process_sdt(elem)
-                if sdt_html:
-                    html_parts.append(sdt_html)
-            elif tag == 'sectPr':
-                # Propriedades de seção - ignorar
-                pass
+        # === PROCESSAR OS ELEMENTOS DO BODY (streaming) ===
+        # iterparse lê o document.xml direto do ZIP: cada parágrafo/tabela/SDT de
+        # primeiro nível é processado quando termina e descartado em seguida,
+        # sem montar a árvore do documento inteiro na memória
+        BODY_TAG = f'{W_NS}body'
+        encontrou_body = False
+        with zipfile.ZipFile(caminho_docx, 'r') as docx_zip:
+            with docx_zip.open('word/document.xml') as xml_stream:
+                for _, elem in etree.iterparse(xml_stream, events=('end',),
+                                               tag=(f'{W_NS}p', f'{W_NS}tbl', f'{W_NS}sdt', f'{W_NS}sectPr')):
+                    parent = elem.getparent()
+                    if parent is None or parent.tag != BODY_TAG:
+                        continue  # aninhado: processado junto com o elemento de primeiro nível
+                    encontrou_body = True
+                    
+                    tag = get_localname(elem)
+                    if tag == 'p':
+                        html_parts.append(process_paragraph(elem))
+                    elif tag == 'tbl':
+                        html_parts.append(process_table(elem))
+                    elif tag == 'sdt':
+                        sdt_html = process_sdt(elem)
+                        if sdt_html:
+                            html_parts.append(sdt_html)
+                    # sectPr: propriedades de seção - ignorar
+                    
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del parent[0]
+        
+        if not encontrou_body:
+            return extrair_conteudo_word_simples(caminho_docx)
         
         html_parts.append('</div>')
         
@@ -11814,14 +11663,10 @@ def servir_pdf_cache(filename):
     Serve arquivos PDF do cache (para preview de documentos .DOC convertidos).
     """
     pdf_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'pdf_cache')
-    caminho = os.path.join(pdf_cache_dir, filename)
+    caminho = safe_join(pdf_cache_dir, filename)
     
-    if os.path.exists(caminho) and filename.endswith('.pdf'):
-        return send_file(
-            caminho,
-            mimetype='application/pdf',
-            as_attachment=False
-        )
+    if caminho and filename.endswith('.pdf') and servidor_arquivos.existe(caminho):
+        return servidor_arquivos.enviar(caminho, inline=True, mimetype='application/pdf')
     return "Arquivo não encontrado", 404
 
 
@@ -11852,14 +11697,13 @@ def api_preview_word_como_pdf(documento_id):
         pdf_path = converter_word_para_pdf(caminho, documento_id)
         
         if pdf_path and os.path.exists(pdf_path):
-            # Retornar o PDF convertido
-            response = send_file(
+            # Retornar o PDF convertido (ETag/Range: o visualizador pede por partes)
+            return servidor_arquivos.enviar(
                 pdf_path,
-                mimetype='application/pdf',
-                as_attachment=False
+                inline=True,
+                nome_download=f'{documento["nome_original"].rsplit(".", 1)[0]}.pdf',
+                mimetype='application/pdf'
             )
-            response.headers['Content-Disposition'] = f'inline; filename="{documento["nome_original"].rsplit(".", 1)[0]}.pdf"'
-            return response
         else:
             # Fallback: retornar o arquivo Word original
             return jsonify({
@@ -11878,83 +11722,21 @@ def api_preview_word_como_pdf(documento_id):
 def converter_word_para_pdf(caminho_docx, documento_id):
     """
     Converte documento Word para PDF.
-    Usa LibreOffice (soffice) se disponível, senão tenta docx2pdf.
+    Usa o PDF gerado em segundo plano no upload (cache pelo hash do conteúdo);
+    se ainda não existir, converte agora pela fila do conversor_pdf e aguarda.
     """
-    import subprocess
-    import tempfile
-    import shutil
-    
-    # Diretório para PDFs temporários
-    pdf_cache_dir = os.path.join('uploads', 'pdf_cache')
-    os.makedirs(pdf_cache_dir, exist_ok=True)
-    
-    # Nome do arquivo PDF de cache
-    pdf_filename = f"word_preview_{documento_id}.pdf"
-    pdf_path = os.path.join(pdf_cache_dir, pdf_filename)
-    
-    # Se já existe cache e é mais recente que o original, usar cache
-    if os.path.exists(pdf_path):
-        if os.path.getmtime(pdf_path) >= os.path.getmtime(caminho_docx):
-            print(f"[CONVERTER] Usando cache: {pdf_path}")
-            return pdf_path
-    
-    print(f"[CONVERTER] Convertendo {caminho_docx} para PDF...")
-    
-    # Método 1: Tentar LibreOffice (soffice)
-    try:
-        # Procurar LibreOffice
-        soffice_paths = [
-            'soffice',
-            'C:\\Program Files\\LibreOffice\\program\\soffice.exe',
-            'C:\\Program Files (x86)\\LibreOffice\\program\\soffice.exe',
-            '/usr/bin/soffice',
-            '/usr/bin/libreoffice',
-            '/Applications/LibreOffice.app/Contents/MacOS/soffice'
-        ]
-        
-        soffice_cmd = None
-        for path in soffice_paths:
-            if os.path.exists(path) or shutil.which(path):
-                soffice_cmd = path
-                break
-        
-        if soffice_cmd:
-            # Usar diretório temporário para saída
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # Copiar arquivo para tmpdir (evita problemas de path)
-                src_name = os.path.basename(caminho_docx)
-                tmp_src = os.path.join(tmpdir, src_name)
-                shutil.copy2(caminho_docx, tmp_src)
-                
-                # Executar conversão
-                cmd = [
-                    soffice_cmd,
-                    '--headless',
-                    '--convert-to', 'pdf',
-                    '--outdir', tmpdir,
-                    tmp_src
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-                
-                # Procurar PDF gerado
-                expected_pdf = os.path.join(tmpdir, src_name.rsplit('.', 1)[0] + '.pdf')
-                if os.path.exists(expected_pdf):
-                    shutil.move(expected_pdf, pdf_path)
-                    print(f"[CONVERTER] LibreOffice: sucesso -> {pdf_path}")
-                    return pdf_path
-                else:
-                    print(f"[CONVERTER] LibreOffice: PDF não gerado. stderr={result.stderr}")
-    except Exception as e:
-        print(f"[CONVERTER] Erro LibreOffice: {e}")
-    
+    return conversor_pdf.converter(caminho_docx, aguardar=CONVERSOR_PDF_TIMEOUT)
+
+
+def _converter_pdf_alternativo(caminho_docx, pdf_path):
+    """Conversão sem LibreOffice: docx2pdf (MS Office no Windows) ou python-docx + reportlab"""
     # Método 2: Tentar docx2pdf (requer MS Office no Windows)
     try:
         from docx2pdf import convert
         convert(caminho_docx, pdf_path)
         if os.path.exists(pdf_path):
             print(f"[CONVERTER] docx2pdf: sucesso -> {pdf_path}")
-            return pdf_path
+            return True
     except ImportError:
         print("[CONVERTER] docx2pdf não disponível")
     except Exception as e:
@@ -11962,15 +11744,13 @@ def converter_word_para_pdf(caminho_docx, documento_id):
     
     # Método 3: Conversão simplificada usando python-docx + reportlab
     try:
-        pdf_path_simple = converter_docx_simples(caminho_docx, pdf_path)
-        if pdf_path_simple and os.path.exists(pdf_path_simple):
-            print(f"[CONVERTER] Conversão simples: sucesso -> {pdf_path_simple}")
-            return pdf_path_simple
+        if converter_docx_simples(caminho_docx, pdf_path):
+            print(f"[CONVERTER] Conversão simples: sucesso -> {pdf_path}")
+            return True
     except Exception as e:
         print(f"[CONVERTER] Erro conversão simples: {e}")
     
-    print("[CONVERTER] Nenhum método de conversão disponível")
-    return None
+    return False
 
 
 def converter_docx_simples(caminho_docx, pdf_path):
@@ -12076,6 +11856,38 @@ def converter_docx_simples(caminho_docx, pdf_path):
     return None
 
 
+# Pré-visualização em PDF dos documentos Word: convertidos em segundo plano
+# no upload, pool de workers LibreOffice e cache pelo hash do conteúdo com
+# limite de tamanho - ver conversor_pdf.py
+PDF_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'pdf_cache')
+PDF_CACHE_MAX_MB = int(os.environ.get('PDF_CACHE_MAX_MB', 500))
+CONVERSOR_PDF_PROCESSOS = int(os.environ.get('CONVERSOR_PDF_PROCESSOS', 2))
+CONVERSOR_PDF_TIMEOUT = 120  # segundos
+
+conversor_pdf = ConversorPDF(
+    os.path.join(PDF_CACHE_DIR, 'conteudo'),
+    limite_bytes=PDF_CACHE_MAX_MB * 1024 * 1024,
+    processos=CONVERSOR_PDF_PROCESSOS,
+    timeout=CONVERSOR_PDF_TIMEOUT,
+    alternativo=_converter_pdf_alternativo
+)
+
+
+@app.route('/api/diagnostico/conversor-pdf')
+def diagnostico_conversor_pdf():
+    """Fila, cache e tempos do conversor Word → PDF"""
+    return jsonify({'success': True, **conversor_pdf.status()})
+
+
+# Pré-visualização HTML dos DOCX: extraída em segundo plano no upload e guardada
+# por hash do conteúdo + versão do extrator - ver cache_html_word.py.
+# Aumentar VERSAO_EXTRATOR_HTML ao alterar extrair_conteudo_word_html.
+HTML_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'html_cache')
+VERSAO_EXTRATOR_HTML = 2
+
+cache_html_word = CacheHTMLWord(HTML_CACHE_DIR, extrair_conteudo_word_html, VERSAO_EXTRATOR_HTML)
+
+
 @app.route('/api/avaliacao-iso/documento/<int:documento_id>/preview')
 def api_preview_documento_iso(documento_id):
     """API para pré-visualização de documento no navegador (IGUAL COTAÇÕES)"""
@@ -12300,16 +12112,21 @@ def api_enviar_email_iso(avaliacao_id):
                 anexo_part.add_header('Content-Disposition', f'attachment; filename="{secure_filename(anexo.filename)}"')
                 msg.attach(anexo_part)
             
-            # Conectar e enviar
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            server.login(EMAIL_REMETENTE, SENHA_EMAIL)
-            server.sendmail(EMAIL_REMETENTE, email_destinatario, msg.as_string())
-            server.quit()
+            # Fila de saída (envio em segundo plano)
+            lote_id = enfileirar_emails([{
+                'tipo': 'iso_avaliacao',
+                'identificador': avaliacao_id,
+                'destinatarios': [email_destinatario],
+                'assunto': assunto,
+                'corpo': mensagem,
+                'mensagem': msg.as_string(),
+                'enviado_por': session.get('user')
+            }])
             
             return jsonify({
                 'success': True, 
-                'message': f'E-mail enviado com sucesso para {email_destinatario}'
+                'message': f'E-mail para {email_destinatario} adicionado à fila de envio',
+                'lote_id': lote_id
             })
             
         except Exception as e_email:
@@ -12328,6 +12145,7 @@ def api_enviar_email_lote_iso():
     """
     API para enviar e-mails em lote para múltiplos fornecedores.
     Suporta modo individual (um e-mail por fornecedor) ou único (todos em CC).
+    As mensagens vão para a fila de saída; retorna o lote_id na hora.
     """
     if 'user' not in session:
         return jsonify({'success': False, 'error': 'Não autenticado'}), 401
@@ -12352,10 +12170,6 @@ def api_enviar_email_lote_iso():
         if not fornecedores_com_email:
             return jsonify({'success': False, 'error': 'Nenhum fornecedor selecionado possui e-mail cadastrado'})
         
-        enviados = 0
-        erros = 0
-        lista_erros = []
-        
         # Criar corpo HTML
         corpo_html = f"""
         <html>
@@ -12365,102 +12179,78 @@ def api_enviar_email_lote_iso():
         </html>
         """
         
+        usuario = session.get('user')
+        mensagens = []
+        
         if modo == 'unico':
-            # Enviar um único e-mail com todos em CC
-            try:
-                emails = [f['email'].strip() for f in fornecedores_com_email]
-                email_principal = emails[0]
-                emails_cc = emails[1:] if len(emails) > 1 else []
+            # Um único e-mail com todos em CC
+            emails = [f['email'].strip() for f in fornecedores_com_email]
+            email_principal = emails[0]
+            emails_cc = emails[1:] if len(emails) > 1 else []
+            
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = assunto
+            msg['From'] = EMAIL_REMETENTE
+            msg['To'] = email_principal
+            if emails_cc:
+                msg['Cc'] = ', '.join(emails_cc)
+            
+            parte_texto = MIMEText(corpo, 'plain', 'utf-8')
+            parte_html = MIMEText(corpo_html, 'html', 'utf-8')
+            msg.attach(parte_texto)
+            msg.attach(parte_html)
+            
+            mensagens.append({
+                'tipo': tipo,
+                'identificador': 'lote',
+                'destinatarios': emails,
+                'assunto': assunto,
+                'corpo': corpo,
+                'mensagem': msg.as_string(),
+                'enviado_por': usuario
+            })
+        
+        else:
+            # Um e-mail por fornecedor
+            for forn in fornecedores_com_email:
+                email_dest = forn['email'].strip()
+                nome_forn = forn.get('nome', 'Fornecedor')
+                
+                # Personalizar corpo com nome do fornecedor
+                corpo_personalizado = corpo.replace('{nome}', nome_forn).replace('{fornecedor}', nome_forn)
+                corpo_html_personalizado = corpo_html.replace('{nome}', nome_forn).replace('{fornecedor}', nome_forn)
                 
                 msg = MIMEMultipart('alternative')
                 msg['Subject'] = assunto
                 msg['From'] = EMAIL_REMETENTE
-                msg['To'] = email_principal
-                if emails_cc:
-                    msg['Cc'] = ', '.join(emails_cc)
+                msg['To'] = email_dest
                 
-                parte_texto = MIMEText(corpo, 'plain', 'utf-8')
-                parte_html = MIMEText(corpo_html, 'html', 'utf-8')
+                parte_texto = MIMEText(corpo_personalizado, 'plain', 'utf-8')
+                parte_html = MIMEText(corpo_html_personalizado, 'html', 'utf-8')
                 msg.attach(parte_texto)
                 msg.attach(parte_html)
                 
-                # Conectar e enviar
-                server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-                server.starttls()
-                server.login(EMAIL_REMETENTE, SENHA_EMAIL)
-                
-                todos_destinatarios = [email_principal] + emails_cc
-                server.sendmail(EMAIL_REMETENTE, todos_destinatarios, msg.as_string())
-                server.quit()
-                
-                enviados = len(fornecedores_com_email)
-                print(f"[EMAIL LOTE] Enviado e-mail único para {len(todos_destinatarios)} destinatários")
-                
-            except Exception as e_email:
-                print(f"[ERRO EMAIL LOTE] {e_email}")
-                erros = len(fornecedores_com_email)
-                lista_erros.append(str(e_email))
+                mensagens.append({
+                    'tipo': tipo,
+                    'identificador': forn.get('id') or forn.get('codigo') or nome_forn,
+                    'destinatarios': [email_dest],
+                    'assunto': assunto,
+                    'corpo': corpo_personalizado,
+                    'mensagem': msg.as_string(),
+                    'enviado_por': usuario
+                })
         
-        else:
-            # Enviar e-mails individuais
-            try:
-                server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-                server.starttls()
-                server.login(EMAIL_REMETENTE, SENHA_EMAIL)
-                
-                for forn in fornecedores_com_email:
-                    try:
-                        email_dest = forn['email'].strip()
-                        nome_forn = forn.get('nome', 'Fornecedor')
-                        
-                        # Personalizar corpo com nome do fornecedor
-                        corpo_personalizado = corpo.replace('{nome}', nome_forn).replace('{fornecedor}', nome_forn)
-                        corpo_html_personalizado = corpo_html.replace('{nome}', nome_forn).replace('{fornecedor}', nome_forn)
-                        
-                        msg = MIMEMultipart('alternative')
-                        msg['Subject'] = assunto
-                        msg['From'] = EMAIL_REMETENTE
-                        msg['To'] = email_dest
-                        
-                        parte_texto = MIMEText(corpo_personalizado, 'plain', 'utf-8')
-                        parte_html = MIMEText(corpo_html_personalizado, 'html', 'utf-8')
-                        msg.attach(parte_texto)
-                        msg.attach(parte_html)
-                        
-                        server.sendmail(EMAIL_REMETENTE, email_dest, msg.as_string())
-                        enviados += 1
-                        print(f"[EMAIL LOTE] Enviado para {email_dest} ({nome_forn})")
-                        
-                    except Exception as e_ind:
-                        erros += 1
-                        lista_erros.append(f"{forn.get('nome', '?')}: {str(e_ind)}")
-                        print(f"[ERRO EMAIL INDIVIDUAL] {forn.get('nome')}: {e_ind}")
-                
-                server.quit()
-                
-            except Exception as e_server:
-                print(f"[ERRO SERVIDOR EMAIL] {e_server}")
-                return jsonify({'success': False, 'error': f'Erro ao conectar servidor de e-mail: {str(e_server)}'})
-        
-        # Resultado
-        if enviados > 0:
-            mensagem = f'E-mails enviados com sucesso!'
-            if erros > 0:
-                mensagem += f' ({erros} erro(s))'
-            return jsonify({
-                'success': True,
-                'message': mensagem,
-                'enviados': enviados,
-                'erros': erros,
-                'lista_erros': lista_erros[:5]  # Limitar erros retornados
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Nenhum e-mail foi enviado',
-                'erros': erros,
-                'lista_erros': lista_erros[:5]
-            })
+        # Fila de saída: responde na hora; acompanhamento em /api/emails/lote/<lote_id>
+        lote_id = enfileirar_emails(mensagens)
+        print(f"[EMAIL LOTE] {len(mensagens)} e-mail(s) para {len(fornecedores_com_email)} fornecedor(es) na fila (lote {lote_id})")
+        
+        return jsonify({
+            'success': True,
+            'message': 'E-mails adicionados à fila de envio!',
+            'lote_id': lote_id,
+            'enfileirados': len(mensagens),
+            'fornecedores': len(fornecedores_com_email)
+        })
     
     except Exception as e:
         print(f"[ERRO] api_enviar_email_lote_iso: {e}")
@@ -12469,6 +12259,34 @@ def api_enviar_email_lote_iso():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/emails/lote/<lote_id>')
+def api_status_lote_emails(lote_id):
+    """
+    Situação de um lote da fila de e-mails (retornado por /enviar_cobranca e
+    pelas rotas de e-mail ISO): total, pendente, enviando, enviado, erro, concluido e erros.
+    """
+    if 'user' not in session:
+        return jsonify({'success': False, 'error': 'Não autenticado'}), 401
+    
+    lote = db.status_lote_emails(lote_id)
+    if not lote:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    return jsonify({'success': True, **lote})
+
+
+@app.route('/api/emails/fila')
+def api_status_fila_emails():
+    """Contagem da fila de e-mails por status e métricas da thread de envio"""
+    if 'user' not in session:
+        return jsonify({'success': False, 'error': 'Não autenticado'}), 401
+    
+    return jsonify({
+        'success': True,
+        'fila': db.resumo_fila_emails(),
+        'enviador': enviador_emails.status()
+    })
+
+
 @app.route('/api/avaliacao-iso/<int:avaliacao_id>/historico-emails')
 def api_historico_emails_iso(avaliacao_id):
     """API para listar histórico de e-mails de uma avaliação"""
@@ -12573,6 +12391,13 @@ def api_importar_excel_iso():
         erros = 0
         lista_erros = []
         
+        # Avaliações já cadastradas lidas uma vez (nomes e códigos em uso);
+        # as novas entram nos conjuntos à medida que a planilha é percorrida
+        avaliacoes_existentes = db.listar_avaliacoes_iso()
+        nomes_existentes = {av['nome_fornecedor'].upper().strip() for av in avaliacoes_existentes}
+        codigos_existentes = {av['cod_fornecedor'] for av in avaliacoes_existentes}
+        novas = []
+        
         for idx, forn in enumerate(fornecedores, start=2):  # Linha 2 = primeira linha de dados
             nome = forn.get('nome_fornecedor', '').strip()
             if not nome:
@@ -12600,50 +12425,38 @@ def api_importar_excel_iso():
                 cod_base = 'FORN'
             
             # Verificar se já existe pelo nome
-            existente = None
-            avaliacoes_existentes = db.listar_avaliacoes_iso()
-            for av in avaliacoes_existentes:
-                if av['nome_fornecedor'].upper().strip() == nome.upper().strip():
-                    existente = av
-                    break
-            
-            if existente:
+            if nome.upper() in nomes_existentes:
                 ignorados += 1
                 continue
             
             # Gerar código único
             cod_fornecedor = cod_base
             contador = 1
-            while True:
-                existe_cod = False
-                for av in avaliacoes_existentes:
-                    if av['cod_fornecedor'] == cod_fornecedor:
-                        existe_cod = True
-                        break
-                if not existe_cod:
-                    break
+            while cod_fornecedor in codigos_existentes:
                 cod_fornecedor = f"{cod_base}{contador:03d}"
                 contador += 1
             
-            try:
-                # Criar avaliação com datas validadas
-                print(f"[IMPORT ISO] Criando: {nome} | Data Aval: {data_avaliacao} | Data Venc: {data_vencimento}")
-                db.criar_avaliacao_iso(
-                    cod_fornecedor=cod_fornecedor,
-                    nome_fornecedor=nome,
-                    email_fornecedor=forn.get('email_fornecedor'),
-                    data_ultima_avaliacao=data_avaliacao,
-                    data_vencimento=data_vencimento,
-                    possui_iso=forn.get('possui_iso', 'Nao'),
-                    nota=forn.get('nota'),
-                    observacao='Importado via Excel',
-                    usuario=user
-                )
+            nomes_existentes.add(nome.upper())
+            codigos_existentes.add(cod_fornecedor)
+            novas.append({
+                'linha': idx,
+                'cod_fornecedor': cod_fornecedor,
+                'nome_fornecedor': nome,
+                'email_fornecedor': forn.get('email_fornecedor'),
+                'data_ultima_avaliacao': data_avaliacao,
+                'data_vencimento': data_vencimento,
+                'possui_iso': forn.get('possui_iso', 'Nao'),
+                'nota': forn.get('nota'),
+                'observacao': 'Importado via Excel'
+            })
+        
+        # Criar avaliações com datas validadas (uma transação)
+        print(f"[IMPORT ISO] Gravando {len(novas)} avaliação(ões)")
+        for avaliacao, avaliacao_id in zip(novas, db.criar_avaliacoes_iso_em_lote(novas, usuario=user)):
+            if avaliacao_id:
                 importados += 1
-                
-            except Exception as e_insert:
-                print(f"[ERRO] Importar fornecedor {nome}: {e_insert}")
-                lista_erros.append(f"Linha {idx}: Erro ao salvar '{nome}' - {str(e_insert)}")
+            else:
+                lista_erros.append(f"Linha {avaliacao['linha']}: Erro ao salvar '{avaliacao['nome_fornecedor']}'")
                 erros += 1
         
         # Montar mensagem de resposta
@@ -12975,6 +12788,21 @@ def api_status_cotacao_externa():
         })
 
 
+# Servidor WSGI (gunicorn): inicia as tarefas em segundo plano ao importar o módulo
+if __name__ != '__main__':
+    _iniciar_tarefas_render()
+    _iniciar_fila_emails()
+    _iniciar_indice_fornecedores()
+    _iniciar_catalogo_produtos()
+
+
 if __name__ == '__main__':
+    # Com o reloader do modo debug, só o processo filho (que atende as
+    # requisições) inicia as tarefas em segundo plano
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        _iniciar_tarefas_render()
+        _iniciar_fila_emails()
+        _iniciar_indice_fornecedores()
+        _iniciar_catalogo_produtos()
     # Habilitado para acesso externo (0.0.0.0)
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
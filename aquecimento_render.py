@@ -0,0 +1,125 @@
+"""
+=============================================================================
+AQUECIMENTO (KEEP-WARM) - SERVIÇO DE COTAÇÃO EXTERNA NO RENDER
+=============================================================================
+O plano gratuito do Render hiberna o serviço após ~15 minutos sem acesso; o
+primeiro fornecedor (ou a primeira consulta do sistema local) espera o
+container subir.
+
+Esta tarefa chama /api/ping (não consulta o banco) em intervalos regulares
+dentro da janela configurada - começando antes do expediente - para que o
+serviço já esteja acordado quando os usuários chegarem. Cada chamada que
+pega um cold start é registrada com a latência e o tempo de boot do worker.
+
+Uso:
+    aquecedor = AquecedorRender(RENDER_PUBLIC_URL, inicio='07:00', fim='19:00')
+    aquecedor.iniciar()
+    aquecedor.status()
+=============================================================================
+"""
+
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import cliente_http
+from tarefa_periodica import TarefaPeriodica
+
+# Resposta acima disto (ou worker com uptime menor que a própria espera) = cold start
+LIMITE_COLD_START_SEGUNDOS = 5
+# Render pode levar perto de um minuto para subir o container
+TIMEOUT_PING = 90
+
+
+class AquecedorRender:
+    """Ping periódico ao Render dentro da janela de expediente, com registro dos cold starts"""
+
+    def __init__(self, url_base, inicio='07:00', fim='19:00', intervalo_minutos=10, dias_semana=(0, 1, 2, 3, 4)):
+        """
+        Args:
+            url_base: URL pública do serviço no Render
+            inicio/fim: janela diária (HH:MM) em que o serviço deve ficar acordado
+            intervalo_minutos: entre pings (abaixo dos ~15 min de inatividade do Render)
+            dias_semana: 0 = segunda ... 6 = domingo
+        """
+        self.url_base = url_base.rstrip('/')
+        self.inicio = datetime.strptime(inicio, '%H:%M').time()
+        self.fim = datetime.strptime(fim, '%H:%M').time()
+        self.intervalo = intervalo_minutos * 60
+        self.dias_semana = set(dias_semana)
+
+        self.metricas = {
+            'pings': 0,
+            'erros': 0,
+            'ultimo_ping': None,
+            'ultima_latencia_ms': None,
+            'cold_starts': deque(maxlen=20)  # {em, latencia_ms, boot_ms}
+        }
+        self._tarefa = TarefaPeriodica(
+            'aquecimento-render', self._executar_agendado, self.intervalo,
+            rotulo='AQUECIMENTO', metricas=self.metricas
+        )
+
+    def dentro_da_janela(self, agora=None):
+        agora = agora or datetime.now()
+        return agora.weekday() in self.dias_semana and self.inicio <= agora.time() < self.fim
+
+    def _proximo_inicio(self, agora):
+        """Próximo início de janela a partir de agora"""
+        dia = agora.date()
+        for _ in range(8):
+            candidato = datetime.combine(dia, self.inicio)
+            if candidato > agora and candidato.weekday() in self.dias_semana:
+                return candidato
+            dia += timedelta(days=1)
+        return agora + timedelta(days=1)
+
+    def pingar(self):
+        """Uma chamada a /api/ping. Retorna a latência em ms (None em caso de erro)."""
+        self.metricas['pings'] += 1
+        self.metricas['ultimo_ping'] = datetime.now().isoformat()
+        inicio = time.perf_counter()
+        try:
+            response = cliente_http.get(f'{self.url_base}/api/ping', timeout=TIMEOUT_PING, tentativas=1)
+            response.raise_for_status()
+            boot = response.json().get('boot', {})
+        except Exception as e:
+            self.metricas['erros'] += 1
+            self.metricas['ultimo_erro'] = f"{datetime.now().isoformat()} {e}"
+            print(f"[AQUECIMENTO] Erro ao acordar o Render: {e}")
+            return None
+
+        latencia = time.perf_counter() - inicio
+        self.metricas['ultima_latencia_ms'] = round(latencia * 1000, 1)
+
+        uptime = boot.get('uptime_segundos')
+        if latencia > LIMITE_COLD_START_SEGUNDOS or (uptime is not None and uptime <= latencia + 1):
+            self.metricas['cold_starts'].append({
+                'em': datetime.now().isoformat(),
+                'latencia_ms': round(latencia * 1000, 1),
+                'boot_ms': boot.get('total_ms')
+            })
+            print(f"[AQUECIMENTO] Render acordado: resposta em {latencia:.1f}s "
+                  f"(boot do worker {boot.get('total_ms')} ms, banco {boot.get('banco_ms')} ms)")
+        return self.metricas['ultima_latencia_ms']
+
+    def _executar_agendado(self):
+        """Execução da thread: ping na janela; fora dela, espera até o próximo início"""
+        agora = datetime.now()
+        if self.dentro_da_janela(agora):
+            self.pingar()
+            return self.intervalo
+        return (self._proximo_inicio(agora) - agora).total_seconds()
+
+    def iniciar(self):
+        if self._tarefa.iniciar():
+            print(f"[AQUECIMENTO] Janela {self.inicio:%H:%M}-{self.fim:%H:%M}, ping a cada {self.intervalo // 60} min")
+
+    def status(self):
+        return {
+            'ativo': self._tarefa.ativa(),
+            'janela': f'{self.inicio:%H:%M}-{self.fim:%H:%M}',
+            'dentro_da_janela': self.dentro_da_janela(),
+            **self.metricas,
+            'cold_starts': list(self.metricas['cold_starts'])
+        }
@@ -0,0 +1,262 @@
+"""
+=============================================================================
+ARMAZENAMENTO DE ANEXOS POR CONTEÚDO (SHA-256) + MINIATURAS
+=============================================================================
+Os orçamentos enviados pelos fornecedores (1ª e 2ª rodada) são gravados uma
+única vez por conteúdo:
+
+- Arquivo em <pasta>/<hash[:2]>/<hash><ext>: o mesmo PDF enviado para várias
+  cotações ocupa o disco uma vez
+- A contagem de referências fica no banco (anexos_conteudo.referencias, uma
+  por linha de cotacao_anexos); ao excluir cotações/fornecedores a contagem
+  cai e coletar() remove os arquivos que ficaram sem referência
+- Miniatura (<pasta>/miniaturas/<hash>.jpg) gerada em segundo plano: imagens
+  pelo Pillow, 1ª página do PDF pelo PyMuPDF ou pdftoppm (poppler), se houver
+- Gravação + registro no banco e coleta rodam sob o mesmo lock, então um
+  upload do mesmo conteúdo não perde o arquivo para uma coleta simultânea
+
+Uso:
+    armazenamento = ArmazenamentoAnexos(pasta, ao_gerar_miniatura=db.registrar_miniatura_anexo)
+    hash_conteudo, registro = armazenamento.guardar(arquivo.stream, '.pdf', registrar, limite_bytes)
+    armazenamento.coletar(db.obter_conteudos_anexo_sem_referencia, db.excluir_conteudo_anexo)
+=============================================================================
+"""
+
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+TAMANHO_MINIATURA = (320, 320)
+EXTENSOES_IMAGEM = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
+
+class AnexoMuitoGrande(Exception):
+    """O envio passou do limite de bytes (o arquivo parcial já foi descartado)"""
+
+
+class ArmazenamentoAnexos:
+    """Arquivos de anexo endereçados pelo SHA-256 do conteúdo, com miniaturas em segundo plano"""
+
+    def __init__(self, pasta, ao_gerar_miniatura=None, tamanho_bloco=64 * 1024):
+        """
+        Args:
+            pasta: raiz do armazenamento (conteúdo, miniaturas e temporários)
+            ao_gerar_miniatura: função(hash, caminho_miniatura) chamada ao concluir
+            tamanho_bloco: bytes lidos do upload por vez
+        """
+        self.pasta = pasta
+        self.pasta_miniaturas = os.path.join(pasta, 'miniaturas')
+        self.pasta_tmp = os.path.join(pasta, 'tmp')
+        self.ao_gerar_miniatura = ao_gerar_miniatura
+        self.tamanho_bloco = tamanho_bloco
+
+        self.lock = threading.Lock()
+        self._fila = queue.Queue()
+        self._thread = None
+
+        self.metricas = {
+            'gravados': 0,
+            'duplicados': 0,
+            'removidos': 0,
+            'miniaturas': 0,
+            'miniaturas_sem_suporte': 0,
+            'erros_miniatura': 0,
+            'ultima_miniatura_ms': None
+        }
+        for pasta_criar in (self.pasta, self.pasta_miniaturas, self.pasta_tmp):
+            os.makedirs(pasta_criar, exist_ok=True)
+
+    # -------------------------------------------------------------------------
+    # Caminhos
+    # -------------------------------------------------------------------------
+
+    def caminho_conteudo(self, hash_conteudo, extensao):
+        return os.path.join(self.pasta, hash_conteudo[:2], f'{hash_conteudo}{extensao.lower()}')
+
+    def caminho_miniatura(self, hash_conteudo):
+        return os.path.join(self.pasta_miniaturas, f'{hash_conteudo}.jpg')
+
+    # -------------------------------------------------------------------------
+    # Gravação
+    # -------------------------------------------------------------------------
+
+    def _receber(self, stream, limite_bytes):
+        """Copia o upload para um temporário calculando o hash. Retorna (temporario, hash, tamanho)."""
+        h = hashlib.sha256()
+        tamanho = 0
+        descritor, temporario = tempfile.mkstemp(dir=self.pasta_tmp, suffix='.part')
+        try:
+            with os.fdopen(descritor, 'wb') as f:
+                for bloco in iter(lambda: stream.read(self.tamanho_bloco), b''):
+                    tamanho += len(bloco)
+                    if limite_bytes and tamanho > limite_bytes:
+                        raise AnexoMuitoGrande(limite_bytes)
+                    h.update(bloco)
+                    f.write(bloco)
+        except BaseException:
+            os.remove(temporario)
+            raise
+        return temporario, h.hexdigest(), tamanho
+
+    def guardar(self, stream, extensao, registrar, limite_bytes=None):
+        """
+        Grava o conteúdo (se ainda não existir) e registra a referência no banco.
+
+        Args:
+            stream: objeto com read(n) (ex.: request.files['arquivo'].stream)
+            extensao: '.pdf', '.png'... (usada no nome do arquivo e no mimetype)
+            registrar: função(hash, caminho, tamanho) -> dict com 'caminho_arquivo'
+                       (o caminho já registrado para esse hash, se houver)
+            limite_bytes: acima disso levanta AnexoMuitoGrande
+
+        Returns:
+            (hash, retorno de registrar)
+        """
+        temporario, hash_conteudo, tamanho = self._receber(stream, limite_bytes)
+        destino = self.caminho_conteudo(hash_conteudo, extensao)
+
+        with self.lock:
+            novo = not os.path.exists(destino)
+            if novo:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                os.replace(temporario, destino)
+                self.metricas['gravados'] += 1
+            else:
+                os.remove(temporario)
+                self.metricas['duplicados'] += 1
+            try:
+                registro = registrar(hash_conteudo, destino, tamanho)
+            except Exception:
+                if novo:
+                    os.remove(destino)
+                raise
+            # Mesmo conteúdo já registrado com outra extensão: fica o arquivo registrado
+            if novo and os.path.abspath(registro['caminho_arquivo']) != os.path.abspath(destino):
+                os.remove(destino)
+
+        if not os.path.exists(self.caminho_miniatura(hash_conteudo)):
+            self.agendar_miniatura(hash_conteudo, registro['caminho_arquivo'])
+        return hash_conteudo, registro
+
+    # -------------------------------------------------------------------------
+    # Coleta (arquivos sem referência)
+    # -------------------------------------------------------------------------
+
+    def coletar(self, listar, excluir):
+        """
+        Remove do disco os conteúdos que ficaram sem referência.
+
+        Args:
+            listar: função() -> [{hash_conteudo, caminho_arquivo}] com referencias <= 0
+            excluir: função(hash) -> True se apagou o registro (ainda sem referência)
+
+        Returns:
+            Quantos arquivos foram removidos
+        """
+        removidos = 0
+        with self.lock:
+            for conteudo in listar():
+                if not excluir(conteudo['hash_conteudo']):
+                    continue
+                for caminho in (conteudo['caminho_arquivo'], self.caminho_miniatura(conteudo['hash_conteudo'])):
+                    try:
+                        os.remove(caminho)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"[ANEXOS] Aviso: não foi possível remover {caminho}: {e}")
+                removidos += 1
+        self.metricas['removidos'] += removidos
+        if removidos:
+            print(f"[ANEXOS] {removidos} arquivo(s) sem referência removido(s)")
+        return removidos
+
+    # -------------------------------------------------------------------------
+    # Miniaturas
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _miniatura_imagem(origem, destino):
+        from PIL import Image
+        with Image.open(origem) as imagem:
+            imagem.thumbnail(TAMANHO_MINIATURA)
+            imagem.convert('RGB').save(destino, 'JPEG', quality=80)
+        return True
+
+    @staticmethod
+    def _miniatura_pdf(origem, destino):
+        try:
+            import fitz  # PyMuPDF (opcional)
+            with fitz.open(origem) as documento:
+                pagina = documento.load_page(0)
+                escala = min(TAMANHO_MINIATURA[0] / pagina.rect.width, TAMANHO_MINIATURA[1] / pagina.rect.height)
+                pagina.get_pixmap(matrix=fitz.Matrix(escala, escala)).save(destino, 'jpeg')
+            return True
+        except ImportError:
+            pass
+
+        pdftoppm = shutil.which('pdftoppm')
+        if not pdftoppm:
+            return False
+        prefixo = destino[:-len('.jpg')]
+        subprocess.run([pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+                        '-scale-to', str(max(TAMANHO_MINIATURA)), origem, prefixo],
+                       capture_output=True, timeout=60, check=True)
+        return os.path.exists(destino)
+
+    def _gerar_miniatura(self, hash_conteudo, caminho):
+        destino = self.caminho_miniatura(hash_conteudo)
+        if os.path.exists(destino):
+            return
+        extensao = os.path.splitext(caminho)[1].lower()
+        if extensao in EXTENSOES_IMAGEM:
+            gerar = self._miniatura_imagem
+        elif extensao == '.pdf':
+            gerar = self._miniatura_pdf
+        else:
+            return
+
+        inicio = time.perf_counter()
+        temporario = os.path.join(self.pasta_tmp, f'{hash_conteudo}.jpg')
+        try:
+            if not gerar(caminho, temporario):
+                self.metricas['miniaturas_sem_suporte'] += 1
+                return
+            os.replace(temporario, destino)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+        self.metricas['miniaturas'] += 1
+        self.metricas['ultima_miniatura_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        if self.ao_gerar_miniatura:
+            self.ao_gerar_miniatura(hash_conteudo, destino)
+
+    def _loop(self):
+        while True:
+            hash_conteudo, caminho = self._fila.get()
+            try:
+                self._gerar_miniatura(hash_conteudo, caminho)
+            except Exception as e:
+                self.metricas['erros_miniatura'] += 1
+                print(f"[ANEXOS] Erro ao gerar miniatura de {caminho}: {e}")
+
+    def agendar_miniatura(self, hash_conteudo, caminho):
+        """Gera a miniatura em segundo plano (inicia a thread se preciso)"""
+        with self.lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='miniaturas-anexos', daemon=True)
+                self._thread.start()
+        self._fila.put((hash_conteudo, caminho))
+
+    def status(self):
+        return {
+            'pasta': self.pasta,
+            'miniaturas_na_fila': self._fila.qsize(),
+            **self.metricas
+        }
@@ -0,0 +1,103 @@
+"""
+AUDITORIA DE ÍNDICES - BANCO LOCAL (cotacoes.db)
+Executa EXPLAIN QUERY PLAN nas consultas mais frequentes do database.py
+e sinaliza as que fazem varredura completa de tabela (SCAN sem índice).
+
+Uso:
+    python auditoria_indices.py
+"""
+import sys
+
+import database as db
+
+# Consultas representativas emitidas pelo database.py (parâmetros de exemplo)
+CONSULTAS = [
+    ('obter_cotacao: itens',
+     'SELECT * FROM cotacao_itens WHERE cotacao_id = ?', (1,)),
+    ('obter_cotacao: fornecedores',
+     'SELECT * FROM cotacao_fornecedores WHERE cotacao_id = ?', (1,)),
+    ('obter_cotacao: respostas',
+     '''SELECT r.*, f.nome_fornecedor, i.descricao_produto
+        FROM cotacao_respostas r
+        JOIN cotacao_fornecedores f ON r.fornecedor_id = f.id
+        JOIN cotacao_itens i ON r.item_id = i.id
+        WHERE r.cotacao_id = ?''', (1,)),
+    ('obter_cotacao: tem_anexo',
+     '''SELECT COUNT(*) FROM cotacao_respostas r
+        WHERE r.fornecedor_id = ? AND r.arquivo_anexo IS NOT NULL AND r.arquivo_anexo != \'\'''', (1,)),
+    ('obter_cotacao_por_token',
+     'SELECT * FROM cotacao_fornecedores WHERE token_acesso = ?', ('x',)),
+    ('registrar_resposta_fornecedor: existente',
+     '''SELECT id, arquivo_anexo FROM cotacao_respostas
+        WHERE cotacao_id = ? AND fornecedor_id = ? AND item_id = ?''', (1, 1, 1)),
+    ('obter_rodadas_negociacao',
+     '''SELECT rn.* FROM cotacao_rodadas_negociacao rn
+        WHERE rn.cotacao_id = ? ORDER BY rn.rodada, rn.data_negociacao DESC''', (1,)),
+    ('excluir_rodadas_fornecedor',
+     'SELECT id FROM cotacao_rodadas_negociacao WHERE cotacao_id = ? AND fornecedor_id = ?', (1, 1)),
+    ('obter_historico_cotacao',
+     'SELECT * FROM cotacao_historico WHERE cotacao_id = ? ORDER BY data_hora DESC', (1,)),
+    ('obter_anexos_fornecedor',
+     'SELECT * FROM cotacao_anexos WHERE fornecedor_id = ? AND ativo = 1 ORDER BY data_upload DESC', (1,)),
+    ('buscar_cotacoes_por_sc',
+     '''SELECT DISTINCT c.* FROM cotacoes c
+        JOIN cotacao_itens i ON c.id = i.cotacao_id
+        WHERE i.numero_sc = ?''', ('000001',)),
+    ('listar_cotacoes_externas_respondidas_nao_sincronizadas',
+     '''SELECT id FROM cotacoes_externas
+        WHERE status = 'respondida' AND (sincronizada = 0 OR sincronizada IS NULL)
+          AND cotacao_id IS NOT NULL AND fornecedor_id IS NOT NULL
+        ORDER BY respondido_em ASC LIMIT ?''', (50,)),
+    ('obter_cotacao_externa_por_token',
+     'SELECT * FROM cotacoes_externas WHERE token = ?', ('x',)),
+    ('obter_atribuicoes_compradores (por SC)',
+     'SELECT * FROM solicitacao_atribuicoes WHERE numero_sc IN (?, ?)', ('000001', '000002')),
+    ('gerar_numero_pedido',
+     'SELECT numero_pedido FROM pedidos_compra WHERE numero_pedido LIKE ? ORDER BY numero_pedido DESC LIMIT 1', ('PC2026%',)),
+    ('obter_pedido_detalhado: itens',
+     'SELECT * FROM pedido_itens WHERE pedido_id = ? ORDER BY id', (1,)),
+    ('obter_pedido_detalhado: histórico',
+     'SELECT * FROM pedido_historico WHERE pedido_id = ? ORDER BY data_hora DESC', (1,)),
+    ('verificar_solicitacao_tem_pedido',
+     '''SELECT pi.id, p.numero_pedido FROM pedido_itens pi
+        JOIN pedidos_compra p ON p.id = pi.pedido_id
+        WHERE pi.numero_sc = ? AND pi.item_sc = ?''', ('000001', '0001')),
+    ('verificar_ultimo_envio_email',
+     '''SELECT data_envio FROM email_envios_historico
+        WHERE tipo = ? AND identificador = ? AND sucesso = 1
+        ORDER BY data_envio DESC LIMIT 1''', ('pedido', '123456')),
+    ('verificar_envios_email_lote',
+     '''SELECT identificador, MAX(data_envio) AS data_envio, email_destinatario, assunto
+        FROM email_envios_historico
+        WHERE tipo = ? AND identificador IN (?, ?) AND sucesso = 1
+        GROUP BY identificador''', ('pedido', '123456', '123457')),
+]
+
+
+def main():
+    print('=' * 70)
+    print('AUDITORIA DE ÍNDICES - EXPLAIN QUERY PLAN')
+    print(f'Banco: {db.DB_PATH} | Versão do schema: {db.obter_versao_schema()}')
+    print('=' * 70)
+
+    relatorio = db.relatorio_plano_consultas(CONSULTAS)
+    total_varreduras = 0
+
+    for item in relatorio:
+        marcador = '[SCAN]' if item['varredura_completa'] else '[ OK ]'
+        if item['varredura_completa']:
+            total_varreduras += 1
+        print(f"{marcador} {item['nome']}")
+        for linha in item['plano']:
+            print(f'         {linha}')
+
+    print()
+    print('=' * 70)
+    print(f'{len(relatorio)} consultas analisadas, {total_varreduras} com varredura completa')
+    print('=' * 70)
+
+    return 1 if total_varreduras else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+BENCHMARK - ENVIO DE E-MAILS (COBRANÇA E LOTE ISO)
+Dispara as rotas reais contra o servidor SMTP falso (transporte_email.py):
+
+- /enviar_cobranca: uma requisição por destinatário
+- /api/avaliacao-iso/enviar-email-lote: uma requisição com todos os fornecedores
+
+e mede o tempo de resposta das rotas (gravar na fila), a vazão da fila até o
+servidor (mensagens/s) e a latência por mensagem (da resposta da rota até o
+servidor receber). Nenhum e-mail sai: banco temporário e transporte 'falso'.
+
+Uso:
+    python benchmark_email.py [destinatarios] [envios_por_minuto] [latencia_smtp_ms]
+
+    envios_por_minuto = 0 → sem limite de taxa
+"""
+import os
+import sys
+import tempfile
+import time
+
+TOTAL = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+POR_MINUTO = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+LATENCIA_MS = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+# Configuração lida pelo database.py/app.py na importação: o banco temporário
+# precisa estar definido antes do init_database() que roda ao importar o database
+os.environ['COTACOES_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='benchmark_email_'), 'cotacoes.db')
+os.environ['EMAIL_TRANSPORTE'] = 'falso'
+os.environ['EMAIL_ENVIOS_POR_MINUTO'] = str(POR_MINUTO or 10 ** 9)
+os.environ['SINCRONIZADOR_RENDER_ATIVO'] = '0'
+os.environ['AQUECIMENTO_RENDER_ATIVO'] = '0'
+os.environ['INDICE_FORNECEDORES_ATIVO'] = '0'
+os.environ['CATALOGO_PRODUTOS_ATIVO'] = '0'
+
+import database as db
+import app as sistema  # inicia a fila de e-mails com o transporte falso
+
+servidor = sistema.enviador_emails.transporte.servidor_falso
+servidor.latencia = LATENCIA_MS / 1000
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[max(round(len(valores) * p) - 1, 0)]
+
+
+def _aguardar_entrega(esperadas, timeout=600):
+    fim = time.monotonic() + timeout
+    while servidor.total() < esperadas and time.monotonic() < fim:
+        time.sleep(0.05)
+    return servidor.total()
+
+
+def _relatorio(titulo, tempos_rota, enfileirado_em, inicio_recebidas):
+    """enfileirado_em: { destinatário: instante (monotonic) em que a rota respondeu }"""
+    recebidas = servidor.recebidas[inicio_recebidas:]
+    latencias = [
+        (r['recebida_em'] - enfileirado_em[r['destinatarios'][0]]) * 1000
+        for r in recebidas if r['destinatarios'] and r['destinatarios'][0] in enfileirado_em
+    ]
+    duracao = recebidas[-1]['recebida_em'] - min(enfileirado_em.values()) if recebidas else 0
+
+    print('-' * 70)
+    print(titulo)
+    print('-' * 70)
+    print(f'{"requisições":<32} {len(tempos_rota):>10}')
+    print(f'{"resposta da rota (ms) média":<32} {sum(tempos_rota) / len(tempos_rota):>10.1f}')
+    print(f'{"resposta da rota (ms) máximo":<32} {max(tempos_rota):>10.1f}')
+    print(f'{"mensagens entregues":<32} {len(recebidas):>10} de {len(enfileirado_em)}')
+    if latencias:
+        print(f'{"vazão (mensagens/s)":<32} {len(recebidas) / duracao if duracao else 0:>10.1f}')
+        print(f'{"latência por mensagem (ms) p50":<32} {_percentil(latencias, 0.50):>10.1f}')
+        print(f'{"latência por mensagem (ms) p95":<32} {_percentil(latencias, 0.95):>10.1f}')
+        print(f'{"latência por mensagem (ms) máx":<32} {max(latencias):>10.1f}')
+
+
+def benchmark_cobranca(cliente):
+    inicio_recebidas = servidor.total()
+    tempos, enfileirado_em = [], {}
+    for i in range(TOTAL):
+        email = f'fornecedor{i}@benchmark.invalid'
+        inicio = time.perf_counter()
+        resposta = cliente.post('/enviar_cobranca', json={
+            'email': email,
+            'pedido': f'BENCH{i:06d}',
+            'fornecedor': f'Fornecedor {i}',
+            'data': '01/01/2030',
+            'tipo': 'pedido',
+            'identificador': f'BENCH{i:06d}'
+        })
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        enfileirado_em[email] = time.monotonic()
+        if not resposta.get_json().get('success'):
+            raise RuntimeError(f'/enviar_cobranca falhou: {resposta.get_json()}')
+
+    _aguardar_entrega(inicio_recebidas + TOTAL)
+    _relatorio(f'/enviar_cobranca - {TOTAL} requisições', tempos, enfileirado_em, inicio_recebidas)
+
+
+def benchmark_lote_iso(cliente):
+    inicio_recebidas = servidor.total()
+    fornecedores = [
+        {'id': str(i), 'nome': f'Fornecedor {i}', 'codigo': f'{i:06d}', 'email': f'iso{i}@benchmark.invalid'}
+        for i in range(TOTAL)
+    ]
+    inicio = time.perf_counter()
+    resposta = cliente.post('/api/avaliacao-iso/enviar-email-lote', json={
+        'fornecedores': fornecedores,
+        'modo': 'individual',
+        'tipo': 'iso',
+        'assunto': 'Solicitação de Certificado ISO - Benchmark',
+        'corpo': 'Prezado(a) {nome},\n\nSolicitamos o certificado ISO atualizado.\n\nAtenciosamente'
+    })
+    tempos = [(time.perf_counter() - inicio) * 1000]
+    agora = time.monotonic()
+    if not resposta.get_json().get('success'):
+        raise RuntimeError(f'enviar-email-lote falhou: {resposta.get_json()}')
+
+    _aguardar_entrega(inicio_recebidas + TOTAL)
+    _relatorio(f'/api/avaliacao-iso/enviar-email-lote - {TOTAL} fornecedores', tempos,
+               {f['email']: agora for f in fornecedores}, inicio_recebidas)
+
+
+def main():
+    cliente = sistema.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user'] = 'benchmark'
+
+    print('=' * 70)
+    print(f'BENCHMARK E-MAIL - {TOTAL} destinatários, '
+          f'{POR_MINUTO or "sem limite de"} envios/min, latência SMTP {LATENCIA_MS:.0f} ms')
+    print(f'Banco temporário: {db.DB_PATH}')
+    print('=' * 70)
+
+    benchmark_cobranca(cliente)
+    benchmark_lote_iso(cliente)
+
+    print('-' * 70)
+    print(f'{"conexões SMTP abertas":<32} {servidor.conexoes:>10}')
+    print(f'{"fila":<32} {db.resumo_fila_emails()}')
+    print('=' * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+=============================================================================
+CACHE DA PRÉ-VISUALIZAÇÃO HTML DOS DOCUMENTOS WORD
+=============================================================================
+O HTML extraído de um DOCX é gravado em <pasta>/<sha256>_v<versão>.html:
+
+- Chave = hash do conteúdo + versão do extrator: o mesmo arquivo não é
+  reprocessado, e mudar o extrator (aumentar a versão) invalida tudo
+- Gerado em segundo plano no upload (agendar); a pré-visualização só lê o arquivo
+- O hash de cada documento fica em memória por (caminho, mtime, tamanho),
+  então a checagem do ETag não relê o DOCX
+- Pedidos simultâneos do mesmo documento aguardam a mesma extração
+
+Uso:
+    cache = CacheHTMLWord(pasta, extrair_conteudo_word_html, versao=2)
+    cache.agendar(caminho_docx)                      # no upload
+    html, chave, modificado_em = cache.obter(caminho_docx)
+=============================================================================
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from conversor_pdf import hash_arquivo
+
+
+class CacheHTMLWord:
+    """Cache em disco do HTML extraído, por hash do conteúdo e versão do extrator"""
+
+    def __init__(self, pasta, extrair, versao, aguardar=120):
+        """
+        Args:
+            pasta: diretório dos arquivos .html
+            extrair: função(caminho) -> html
+            versao: versão do extrator (faz parte da chave)
+            aguardar: segundos que um pedido espera a extração já em andamento
+        """
+        self.pasta = pasta
+        self.extrair = extrair
+        self.versao = versao
+        self.aguardar = aguardar
+
+        self._hashes = {}  # { caminho: (mtime, tamanho, hash) }
+        self._em_andamento = {}  # { chave: threading.Event }
+        self._lock = threading.Lock()
+        self._fila = queue.Queue()
+        self._thread = None
+
+        self.metricas = {'acertos': 0, 'extraidos': 0, 'erros': 0, 'ultima_duracao_ms': None}
+        os.makedirs(pasta, exist_ok=True)
+        self._remover_versoes_antigas()
+
+    def _remover_versoes_antigas(self):
+        sufixo = f'_v{self.versao}.html'
+        for nome in os.listdir(self.pasta):
+            if nome.endswith('.html') and not nome.endswith(sufixo):
+                try:
+                    os.remove(os.path.join(self.pasta, nome))
+                except OSError:
+                    pass
+
+    def chave(self, caminho):
+        """Hash do conteúdo + versão do extrator (usada como ETag)"""
+        estado = os.stat(caminho)
+        with self._lock:
+            memo = self._hashes.get(caminho)
+        if memo and memo[:2] == (estado.st_mtime, estado.st_size):
+            hash_conteudo = memo[2]
+        else:
+            hash_conteudo = hash_arquivo(caminho)
+            with self._lock:
+                self._hashes[caminho] = (estado.st_mtime, estado.st_size, hash_conteudo)
+        return f'{hash_conteudo}_v{self.versao}'
+
+    def _arquivo(self, chave):
+        return os.path.join(self.pasta, f'{chave}.html')
+
+    def _ler(self, chave):
+        try:
+            arquivo = self._arquivo(chave)
+            with open(arquivo, encoding='utf-8') as f:
+                html = f.read()
+            return html, datetime.fromtimestamp(os.path.getmtime(arquivo))
+        except FileNotFoundError:
+            return None, None
+
+    def _extrair(self, caminho, chave):
+        with self._lock:
+            evento = self._em_andamento.get(chave)
+            dono = evento is None
+            if dono:
+                evento = self._em_andamento[chave] = threading.Event()
+
+        if not dono:
+            evento.wait(self.aguardar)
+            html, modificado_em = self._ler(chave)
+            if html is not None:
+                return html, modificado_em
+            return self.extrair(caminho), datetime.now()
+
+        try:
+            inicio = time.perf_counter()
+            html = self.extrair(caminho)
+            temporario = f'{self._arquivo(chave)}.{threading.get_ident()}.tmp'
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(temporario, self._arquivo(chave))
+            self.metricas['extraidos'] += 1
+            self.metricas['ultima_duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            return html, datetime.now()
+        finally:
+            with self._lock:
+                self._em_andamento.pop(chave, None)
+            evento.set()
+
+    def obter(self, caminho):
+        """(html, chave, modificado_em) - extrai agora se ainda não estiver em cache"""
+        chave = self.chave(caminho)
+        html, modificado_em = self._ler(chave)
+        if html is not None:
+            self.metricas['acertos'] += 1
+            return html, chave, modificado_em
+        html, modificado_em = self._extrair(caminho, chave)
+        return html, chave, modificado_em
+
+    # -------------------------------------------------------------------------
+    # Segundo plano
+    # -------------------------------------------------------------------------
+
+    def _loop(self):
+        while True:
+            caminho = self._fila.get()
+            try:
+                self.obter(caminho)
+            except Exception as e:
+                self.metricas['erros'] += 1
+                print(f"[CACHE HTML] Erro ao extrair {caminho}: {e}")
+
+    def agendar(self, caminho):
+        """Extrai em segundo plano (no upload)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='cache-html-word', daemon=True)
+                self._thread.start()
+        self._fila.put(caminho)
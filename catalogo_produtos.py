@@ -0,0 +1,291 @@
+"""
+=============================================================================
+CATÁLOGO DE PRODUTOS EM MEMÓRIA (SB1010 + ÚLTIMA COMPRA DO SD1010)
+=============================================================================
+A busca de produtos do orçamento manual e a importação de códigos via Excel
+consultavam o TOTVS a cada pedido, com a janela ROW_NUMBER() sobre o SD1010
+para achar a última compra. Aqui o catálogo fica em memória:
+
+- Produto: código, descrição, unidade, tipo, grupo + último preço, último
+  fornecedor e data da última compra
+- Carga completa na primeira vez e a cada `intervalo_completo` (pega
+  alterações de descrição, bloqueios e exclusões)
+- Atualização incremental a cada `intervalo`: só os registros novos do
+  SB1010 e do SD1010 (R_E_C_N_O_ acima do último lido); uma compra nova só
+  substitui a atual se for mais recente (data de digitação, documento)
+- Busca por código ou descrição em qualquer parte do texto, sem diferenciar
+  maiúsculas nem acentos, pelo índice de trigramas (a lista do trigrama mais
+  raro do termo, conferindo o texto de cada candidato)
+- Validação de códigos em lote por dicionário (sem consulta ao TOTVS)
+- Se a primeira carga falhar (TOTVS fora do ar), as consultas levantam
+  tarefa_periodica.Indisponivel na hora por `espera_apos_falha` segundos, em
+  vez de cada pedido tentar carregar de novo - ver tarefa_periodica.py
+
+Uso:
+    catalogo = CatalogoProdutos(carregar_produtos, carregar_compras)
+    catalogo.iniciar()                     # cargas em segundo plano
+    catalogo.buscar('rolamento 6205', limite=50)
+    encontrados = catalogo.obter_varios(['005434', 'FAR000001'])
+=============================================================================
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from indice_fornecedores import normalizar
+from tarefa_periodica import TarefaPeriodica
+
+SEPARADOR = '\x00'  # entre código e descrição (trigramas não atravessam campos)
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class _Catalogo:
+    """Produtos + índice de trigramas. Só cresce; a carga completa monta outro."""
+
+    def __init__(self):
+        self.produtos = []       # dicts (substituídos inteiros ao mudar a última compra)
+        self.codigos = []        # código normalizado
+        self.descricoes = []     # descrição normalizada (ordem do resultado)
+        self.textos = []         # código + SEPARADOR + descrição, normalizados
+        self.posicoes = {}       # { código: posição }
+        self.trigramas = {}      # { trigrama: array de posições }
+        self.compras = {}        # { código: (data, documento) da última compra }
+        self.recno_produtos = 0
+        self.recno_compras = 0
+
+    def adicionar_produto(self, produto):
+        """Inclui (ou atualiza) um produto. Retorna True se era novo."""
+        codigo = produto['codigo']
+        produto = dict(produto, ultimo_preco=0, ultimo_fornecedor='', data_ultima_compra=None)
+        posicao = self.posicoes.get(codigo)
+        if posicao is not None:
+            atual = self.produtos[posicao]
+            for campo in ('ultimo_preco', 'ultimo_fornecedor', 'data_ultima_compra'):
+                produto[campo] = atual[campo]
+
+        codigo_normalizado = normalizar(codigo)
+        descricao = normalizar(produto['descricao'])
+        texto = codigo_normalizado + SEPARADOR + descricao
+
+        novo = posicao is None
+        if novo:
+            posicao = len(self.produtos)
+            self.produtos.append(produto)
+            self.codigos.append(codigo_normalizado)
+            self.descricoes.append(descricao)
+            self.textos.append(texto)
+            self.posicoes[codigo] = posicao
+        else:
+            # Trigramas antigos que sobrarem caem na conferência do texto
+            self.produtos[posicao] = produto
+            self.descricoes[posicao] = descricao
+            self.textos[posicao] = texto
+
+        for trigrama in _trigramas(texto):
+            lista = self.trigramas.get(trigrama)
+            if lista is None:
+                lista = self.trigramas[trigrama] = array('I')
+            if not lista or lista[-1] != posicao:
+                lista.append(posicao)
+        return novo
+
+    def registrar_compra(self, compra):
+        """Aplica uma compra se for a mais recente do produto. Retorna True se aplicou."""
+        posicao = self.posicoes.get(compra['codigo'])
+        if posicao is None:
+            return False  # produto bloqueado/excluído (ou fora do catálogo)
+        chave = (str(compra['data'] or ''), str(compra['documento'] or ''))
+        if chave < self.compras.get(compra['codigo'], ('', '')):
+            return False
+        self.compras[compra['codigo']] = chave
+        self.produtos[posicao] = dict(
+            self.produtos[posicao],
+            ultimo_preco=float(compra['preco'] or 0),
+            ultimo_fornecedor=(compra['fornecedor'] or '').strip(),
+            data_ultima_compra=compra['data']
+        )
+        return True
+
+    def candidatos(self, termo):
+        """Posições cujo código ou descrição contém o termo (já normalizado)"""
+        textos = self.textos
+        if len(termo) < 3:
+            return [p for p in range(len(textos)) if termo in textos[p]]
+        menor = None
+        for trigrama in _trigramas(termo):
+            lista = self.trigramas.get(trigrama)
+            if lista is None:
+                return []
+            if menor is None or len(lista) < len(menor):
+                menor = lista
+        # Um produto atualizado pode aparecer duas vezes na mesma lista
+        return list(dict.fromkeys(p for p in menor if termo in textos[p]))
+
+
+class CatalogoProdutos:
+    """Catálogo de produtos com última compra, em memória, com carga completa e incremental"""
+
+    def __init__(self, carregar_produtos, carregar_compras, intervalo=300, intervalo_completo=6 * 3600,
+                 intervalo_maximo=3600, espera_apos_falha=300):
+        """
+        Args:
+            carregar_produtos: função(recno_desde) -> (produtos, maior_recno)
+                               produtos: [{codigo, descricao, unidade, tipo, grupo}]
+            carregar_compras: função(recno_desde) -> (compras, maior_recno)
+                              compras: [{codigo, preco, fornecedor, data, documento}];
+                              com recno_desde=0, só a última compra de cada produto
+            intervalo: segundos entre atualizações incrementais
+            intervalo_completo: segundos entre cargas completas
+            intervalo_maximo: teto do backoff quando a carga falha
+            espera_apos_falha: sem catálogo carregado, segundos após uma carga com
+                               erro em que as consultas não tentam carregar de novo
+        """
+        self.carregar_produtos = carregar_produtos
+        self.carregar_compras = carregar_compras
+        self.intervalo_completo = intervalo_completo
+
+        self._catalogo = None
+        self._carga_completa_em = 0
+        self._lock = threading.Lock()
+
+        self.metricas = {
+            'produtos': 0,
+            'com_ultima_compra': 0,
+            'cargas_completas': 0,
+            'atualizacoes': 0,
+            'ultima_carga_completa': None,
+            'ultima_carga_completa_ms': None,
+            'ultima_atualizacao': None,
+            'ultima_atualizacao_ms': None,
+            'produtos_novos_ultima': 0,
+            'compras_novas_ultima': 0,
+            'buscas': 0,
+            'ultima_busca_us': None
+        }
+        self._tarefa = TarefaPeriodica(
+            'catalogo-produtos', self.atualizar, intervalo, intervalo_maximo=intervalo_maximo,
+            metricas=self.metricas, lock=self._lock,
+            espera_apos_falha=espera_apos_falha, descricao='Catálogo de produtos'
+        )
+
+    # -------------------------------------------------------------------------
+    # Cargas
+    # -------------------------------------------------------------------------
+
+    def _atualizar_contagens(self, catalogo):
+        self.metricas['produtos'] = len(catalogo.produtos)
+        self.metricas['com_ultima_compra'] = len(catalogo.compras)
+
+    def _carga_completa(self):
+        """Monta um catálogo novo e troca o atual (chamado com o lock)"""
+        inicio = time.perf_counter()
+        catalogo = _Catalogo()
+        produtos, catalogo.recno_produtos = self.carregar_produtos(0)
+        produtos.sort(key=lambda p: normalizar(p['descricao']))
+        for produto in produtos:
+            catalogo.adicionar_produto(produto)
+        compras, catalogo.recno_compras = self.carregar_compras(0)
+        for compra in compras:
+            catalogo.registrar_compra(compra)
+
+        self._catalogo = catalogo
+        self._carga_completa_em = time.time()
+        self._atualizar_contagens(catalogo)
+        self.metricas['cargas_completas'] += 1
+        self.metricas['ultima_carga_completa'] = datetime.now().isoformat()
+        self.metricas['ultima_carga_completa_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        print(f"[CATALOGO PRODUTOS] Carga completa: {len(catalogo.produtos)} produtos, "
+              f"{len(catalogo.compras)} com última compra, em {self.metricas['ultima_carga_completa_ms']:.0f} ms")
+        return catalogo
+
+    def _atualizacao_incremental(self):
+        """Registros novos do SB1010/SD1010 desde a última leitura (chamado com o lock)"""
+        inicio = time.perf_counter()
+        catalogo = self._catalogo
+        produtos, recno_produtos = self.carregar_produtos(catalogo.recno_produtos)
+        novos = sum(1 for produto in produtos if catalogo.adicionar_produto(produto))
+        catalogo.recno_produtos = max(catalogo.recno_produtos, recno_produtos or 0)
+
+        compras, recno_compras = self.carregar_compras(catalogo.recno_compras)
+        aplicadas = sum(1 for compra in compras if catalogo.registrar_compra(compra))
+        catalogo.recno_compras = max(catalogo.recno_compras, recno_compras or 0)
+
+        self._atualizar_contagens(catalogo)
+        self.metricas['atualizacoes'] += 1
+        self.metricas['produtos_novos_ultima'] = novos
+        self.metricas['compras_novas_ultima'] = aplicadas
+        self.metricas['ultima_atualizacao'] = datetime.now().isoformat()
+        self.metricas['ultima_atualizacao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        if novos or aplicadas:
+            print(f"[CATALOGO PRODUTOS] Atualização: {novos} produto(s) novo(s), {aplicadas} última(s) compra(s)")
+
+    def atualizar(self, completa=False):
+        """Carga completa (se pedida, se ainda não houver ou se venceu o prazo) ou incremental"""
+        with self._lock:
+            vencida = time.time() - self._carga_completa_em >= self.intervalo_completo
+            if completa or self._catalogo is None or vencida:
+                self._carga_completa()
+            else:
+                self._atualizacao_incremental()
+
+    def _obter_catalogo(self):
+        """Catálogo atual (carrega na hora se ainda não houver; logo após uma carga com erro, Indisponivel)"""
+        return self._tarefa.carregar_sob_demanda(lambda: self._catalogo, self._carga_completa)
+
+    # -------------------------------------------------------------------------
+    # Consultas
+    # -------------------------------------------------------------------------
+
+    def buscar(self, termo, limite=50):
+        """Produtos cujo código ou descrição contém o termo: código exato primeiro, depois pela descrição"""
+        inicio = time.perf_counter()
+        catalogo = self._obter_catalogo()
+        termo = normalizar(termo)
+        posicoes = heapq.nsmallest(
+            limite, catalogo.candidatos(termo),
+            key=lambda p: (catalogo.codigos[p] != termo, catalogo.descricoes[p])
+        )
+        resultado = [dict(catalogo.produtos[p]) for p in posicoes]
+        self.metricas['buscas'] += 1
+        self.metricas['ultima_busca_us'] = round((time.perf_counter() - inicio) * 1_000_000)
+        return resultado
+
+    def obter_varios(self, codigos):
+        """{ código: produto } dos códigos que existem no catálogo (ativos)"""
+        catalogo = self._obter_catalogo()
+        encontrados = {}
+        for codigo in codigos:
+            posicao = catalogo.posicoes.get(codigo)
+            if posicao is not None:
+                encontrados[codigo] = dict(catalogo.produtos[posicao])
+        return encontrados
+
+    # -------------------------------------------------------------------------
+    # Segundo plano
+    # -------------------------------------------------------------------------
+
+    def iniciar(self):
+        """Inicia a thread de atualização (uma vez por processo; a primeira carga é imediata)"""
+        self._tarefa.iniciar()
+
+    def acordar(self):
+        """Antecipa a próxima atualização"""
+        self._tarefa.acordar()
+
+    def status(self):
+        catalogo = self._catalogo
+        return {
+            'ativo': self._tarefa.ativa(),
+            'carregado': catalogo is not None,
+            'falha_carga': self._tarefa.falha(),
+            'trigramas': len(catalogo.trigramas) if catalogo else 0,
+            'recno_produtos': catalogo.recno_produtos if catalogo else None,
+            'recno_compras': catalogo.recno_compras if catalogo else None,
+            **self.metricas
+        }
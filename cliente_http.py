@@ -0,0 +1,245 @@
+"""
+=============================================================================
+CLIENTE HTTP COMPARTILHADO - CHAMADAS PARA RENDER E TOTVS
+=============================================================================
+Todas as chamadas de saída do sistema local passam por aqui:
+
+- Uma requests.Session por host (pool de conexões keep-alive: o handshake
+  TLS com o onrender.com é feito uma vez, não a cada chamada)
+- Novas tentativas limitadas com backoff exponencial + jitter, apenas para
+  erros de conexão/timeout e 502/503/504; POST só quando idempotente=True
+- Circuit breaker por host: após chamadas seguidas que falharam mesmo com as
+  novas tentativas (ex.: Render hibernando),
+  as chamadas falham na hora por alguns segundos em vez de esperar o timeout
+- Métricas de latência por endpoint (contagem, erros, média, p95, máximo)
+
+As funções devolvem o mesmo requests.Response e lançam as mesmas exceções do
+requests (circuito aberto → CircuitoAberto, subclasse de ConnectionError), então
+os tratamentos existentes (except requests.exceptions.Timeout, ...) continuam
+valendo.
+
+Uso:
+    import cliente_http
+    response = cliente_http.get(url, timeout=10)
+    response = cliente_http.post(url, json=dados, timeout=10, idempotente=True)
+    cliente_http.metricas()
+=============================================================================
+"""
+
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Novas tentativas
+TENTATIVAS_PADRAO = 3  # total de tentativas (1 + 2 novas)
+BACKOFF_BASE = 0.5  # segundos; dobra a cada tentativa, com jitter
+BACKOFF_MAXIMO = 8
+STATUS_REPETIVEIS = {502, 503, 504}
+METODOS_IDEMPOTENTES = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Circuit breaker
+FALHAS_PARA_ABRIR = 5  # falhas seguidas no mesmo host
+TEMPO_CIRCUITO_ABERTO = 30  # segundos até liberar uma chamada de teste
+
+# Pool de conexões por host: uma por thread do gunicorn (GUNICORN_THREADS, o
+# mesmo valor usado no Procfile)
+POOL_CONEXOES = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Latências guardadas por endpoint para o p95
+AMOSTRAS_LATENCIA = 200
+
+
+class CircuitoAberto(requests.exceptions.ConnectionError):
+    """Host com falhas seguidas: chamada recusada sem tocar a rede"""
+
+
+class _Circuito:
+    def __init__(self):
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self.teste_em_andamento = False
+
+    def estado(self):
+        if self.falhas_seguidas < FALHAS_PARA_ABRIR:
+            return 'fechado'
+        return 'aberto' if time.monotonic() < self.aberto_ate else 'meio-aberto'
+
+
+_sessoes = {}
+_circuitos = {}
+_metricas = {}
+_lock = threading.Lock()
+
+# Segmentos variáveis do caminho viram <id> nas métricas. Nomes de rota com
+# hífen (respostas-pendentes, confirmar-sincronizacao) não entram: só números,
+# UUIDs, hex longo, tokens longos sem hífen e base64 urlsafe (dígito + maiúscula
+# + minúscula)
+_SEGMENTO_VARIAVEL = re.compile(
+    r'^(\d+'
+    r'|[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}'
+    r'|[0-9a-fA-F]{16,}'
+    r'|[A-Za-z0-9_]{32,}'
+    r'|(?=.*\d)(?=.*[a-z])(?=.*[A-Z])[A-Za-z0-9_\-]{16,})$'
+)
+
+
+def _host(url):
+    partes = urlsplit(url)
+    return f'{partes.scheme}://{partes.netloc}'
+
+
+def _nome_endpoint(metodo, url):
+    partes = urlsplit(url)
+    caminho = '/'.join('<id>' if _SEGMENTO_VARIAVEL.match(s) else s for s in partes.path.split('/'))
+    return f'{metodo} {partes.netloc}{caminho}'
+
+
+def _sessao(host):
+    with _lock:
+        sessao = _sessoes.get(host)
+        if sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_CONEXOES)
+            sessao.mount('http://', adaptador)
+            sessao.mount('https://', adaptador)
+            _sessoes[host] = sessao
+            _circuitos[host] = _Circuito()
+        return sessao
+
+
+def _liberar_chamada(host):
+    """Verifica o circuit breaker do host. No estado meio-aberto libera uma única chamada de teste."""
+    with _lock:
+        circuito = _circuitos[host]
+        estado = circuito.estado()
+        if estado == 'fechado':
+            return
+        if estado == 'meio-aberto' and not circuito.teste_em_andamento:
+            circuito.teste_em_andamento = True
+            return
+        restante = max(circuito.aberto_ate - time.monotonic(), 0)
+    raise CircuitoAberto(f'{host} indisponível ({FALHAS_PARA_ABRIR}+ falhas seguidas); nova tentativa em {restante:.0f}s')
+
+
+def _registrar_resultado(host, sucesso):
+    with _lock:
+        circuito = _circuitos[host]
+        circuito.teste_em_andamento = False
+        if sucesso:
+            if circuito.falhas_seguidas >= FALHAS_PARA_ABRIR:
+                print(f"[HTTP] Circuito de {host} fechado")
+            circuito.falhas_seguidas = 0
+            return
+        circuito.falhas_seguidas += 1
+        if circuito.falhas_seguidas >= FALHAS_PARA_ABRIR:
+            circuito.aberto_ate = time.monotonic() + TEMPO_CIRCUITO_ABERTO
+            if circuito.falhas_seguidas == FALHAS_PARA_ABRIR:
+                print(f"[HTTP] Circuito de {host} aberto por {TEMPO_CIRCUITO_ABERTO}s após {FALHAS_PARA_ABRIR} falhas seguidas")
+
+
+def _registrar_latencia(endpoint, duracao_ms, erro):
+    with _lock:
+        m = _metricas.get(endpoint)
+        if m is None:
+            m = _metricas[endpoint] = {
+                'chamadas': 0, 'erros': 0, 'novas_tentativas': 0, 'total_ms': 0.0, 'maximo_ms': 0.0,
+                'amostras': deque(maxlen=AMOSTRAS_LATENCIA)
+            }
+        m['chamadas'] += 1
+        m['erros'] += 1 if erro else 0
+        m['total_ms'] += duracao_ms
+        m['maximo_ms'] = max(m['maximo_ms'], duracao_ms)
+        m['amostras'].append(duracao_ms)
+
+
+def _contar_nova_tentativa(endpoint):
+    with _lock:
+        if endpoint in _metricas:
+            _metricas[endpoint]['novas_tentativas'] += 1
+
+
+def request(metodo, url, tentativas=None, idempotente=None, **kwargs):
+    """
+    Faz a requisição pela sessão do host com novas tentativas e circuit breaker.
+
+    Args:
+        metodo: 'GET', 'POST', ...
+        url: URL completa
+        tentativas: total de tentativas (padrão TENTATIVAS_PADRAO; 1 = sem repetição)
+        idempotente: permite repetir a chamada; padrão True para GET/HEAD/OPTIONS/PUT/DELETE
+        **kwargs: repassados ao requests (timeout, json, params, headers, auth, ...)
+
+    Returns:
+        requests.Response (a última recebida, mesmo que 502/503/504)
+    """
+    metodo = metodo.upper()
+    host = _host(url)
+    endpoint = _nome_endpoint(metodo, url)
+    sessao = _sessao(host)
+    if idempotente is None:
+        idempotente = metodo in METODOS_IDEMPOTENTES
+    total = (tentativas or TENTATIVAS_PADRAO) if idempotente else 1
+
+    # O circuit breaker conta uma falha por chamada (não por tentativa) e a
+    # chamada de teste do estado meio-aberto inclui as suas novas tentativas
+    _liberar_chamada(host)
+    for tentativa in range(1, total + 1):
+        inicio = time.perf_counter()
+        try:
+            response = sessao.request(metodo, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            _registrar_latencia(endpoint, (time.perf_counter() - inicio) * 1000, erro=True)
+            if tentativa == total:
+                _registrar_resultado(host, sucesso=False)
+                raise
+        except Exception:
+            # Erro que não indica host fora do ar (URL inválida, etc.): só libera a chamada de teste
+            with _lock:
+                _circuitos[host].teste_em_andamento = False
+            raise
+        else:
+            falhou = response.status_code in STATUS_REPETIVEIS
+            _registrar_latencia(endpoint, (time.perf_counter() - inicio) * 1000, erro=falhou)
+            if not falhou or tentativa == total:
+                _registrar_resultado(host, sucesso=not falhou)
+                return response
+
+        espera = min(BACKOFF_BASE * 2 ** (tentativa - 1), BACKOFF_MAXIMO)
+        _contar_nova_tentativa(endpoint)
+        time.sleep(random.uniform(espera / 2, espera))
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def metricas():
+    """Latência por endpoint e estado dos circuitos por host"""
+    with _lock:
+        endpoints = {}
+        for endpoint, m in _metricas.items():
+            amostras = sorted(m['amostras'])
+            endpoints[endpoint] = {
+                'chamadas': m['chamadas'],
+                'erros': m['erros'],
+                'novas_tentativas': m['novas_tentativas'],
+                'media_ms': round(m['total_ms'] / m['chamadas'], 1),
+                'p95_ms': round(amostras[max(round(len(amostras) * 0.95) - 1, 0)], 1),
+                'maximo_ms': round(m['maximo_ms'], 1)
+            }
+        circuitos = {
+            host: {'estado': c.estado(), 'falhas_seguidas': c.falhas_seguidas}
+            for host, c in _circuitos.items()
+        }
+    return {'endpoints': endpoints, 'circuitos': circuitos}
@@ -0,0 +1,284 @@
+"""
+=============================================================================
+CONVERSOR WORD → PDF - FILA EM SEGUNDO PLANO COM CACHE POR CONTEÚDO
+=============================================================================
+Gera o PDF de pré-visualização dos documentos ISO (DOC/DOCX) fora da
+requisição:
+
+- A conversão é agendada no upload; quando alguém abre a pré-visualização
+  o PDF normalmente já está pronto
+- Cache por hash SHA-256 do conteúdo (<pasta>/<hash>.pdf): o mesmo arquivo
+  enviado duas vezes (ou para vários fornecedores) é convertido uma vez
+- Pool de threads, cada uma com o seu perfil do LibreOffice já inicializado
+  (instâncias soffice simultâneas com o mesmo perfil falham, e criar o perfil
+  é a parte mais lenta do cold start)
+- Pedidos do mesmo conteúdo em andamento aguardam a mesma conversão
+- Limite de tamanho da pasta: remove os PDFs usados há mais tempo (LRU pelo mtime),
+  nunca o que acabou de ser gerado; se o PDF de um pedido sumir antes de ser
+  entregue, converter() agenda de novo
+
+Uso:
+    conversor = ConversorPDF(pasta, alternativo=funcao(origem, destino) -> bool)
+    conversor.agendar(caminho_docx)             # no upload (inicia o pool se preciso)
+    conversor.converter(caminho_docx, 120)      # na pré-visualização (aguarda)
+=============================================================================
+"""
+
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+CAMINHOS_SOFFICE = [
+    'soffice',
+    'C:\\Program Files\\LibreOffice\\program\\soffice.exe',
+    'C:\\Program Files (x86)\\LibreOffice\\program\\soffice.exe',
+    '/usr/bin/soffice',
+    '/usr/bin/libreoffice',
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice'
+]
+
+
+def localizar_soffice():
+    for caminho in CAMINHOS_SOFFICE:
+        if os.path.exists(caminho) or shutil.which(caminho):
+            return caminho
+    return None
+
+
+def hash_arquivo(caminho, tamanho_bloco=1024 * 1024):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+class _Tarefa:
+    def __init__(self, chave, caminho):
+        self.chave = chave
+        self.caminho = caminho
+        self.concluida = threading.Event()
+        self.pdf = None
+        self.erro = None
+
+
+class ConversorPDF:
+    """Fila de conversão Word → PDF com pool de workers e cache por hash do conteúdo"""
+
+    def __init__(self, pasta_cache, limite_bytes=500 * 1024 * 1024, processos=2,
+                 timeout=120, alternativo=None):
+        """
+        Args:
+            pasta_cache: onde ficam <hash>.pdf e os perfis do LibreOffice
+            limite_bytes: tamanho máximo dos PDFs em cache
+            processos: conversões simultâneas (uma instância soffice por worker)
+            timeout: segundos por conversão no LibreOffice
+            alternativo: função(origem, destino_pdf) -> bool, usada sem LibreOffice
+                         ou quando ele falha
+        """
+        self.pasta_cache = pasta_cache
+        self.limite_bytes = limite_bytes
+        self.processos = processos
+        self.timeout = timeout
+        self.alternativo = alternativo
+        self.soffice = localizar_soffice()
+
+        self._fila = queue.Queue()
+        self._em_andamento = {}  # { hash: _Tarefa }
+        self._lock = threading.Lock()
+        self._threads = []
+
+        self.metricas = {
+            'agendadas': 0,
+            'convertidas': 0,
+            'acertos_cache': 0,
+            'erros': 0,
+            'removidos_limite': 0,
+            'ultima_duracao_ms': None,
+            'ultimo_erro': None
+        }
+        os.makedirs(pasta_cache, exist_ok=True)
+
+    # -------------------------------------------------------------------------
+    # Cache
+    # -------------------------------------------------------------------------
+
+    def caminho_pdf(self, chave):
+        return os.path.join(self.pasta_cache, f'{chave}.pdf')
+
+    def _em_cache(self, chave):
+        caminho = self.caminho_pdf(chave)
+        if not os.path.exists(caminho):
+            return None
+        os.utime(caminho)  # marca o uso (ordem de remoção pelo limite de tamanho)
+        return caminho
+
+    def _aplicar_limite(self, preservar=None):
+        """Remove os PDFs menos usados até caber no limite (exceto o da chave `preservar`)"""
+        arquivos = []
+        manter = self.caminho_pdf(preservar) if preservar else None
+        for nome in os.listdir(self.pasta_cache):
+            if nome.endswith('.pdf'):
+                caminho = os.path.join(self.pasta_cache, nome)
+                if caminho == manter:
+                    continue
+                estado = os.stat(caminho)
+                arquivos.append((estado.st_mtime, estado.st_size, caminho))
+        total = sum(a[1] for a in arquivos)
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+                total -= tamanho
+                self.metricas['removidos_limite'] += 1
+            except OSError:
+                pass
+
+    # -------------------------------------------------------------------------
+    # Agendamento
+    # -------------------------------------------------------------------------
+
+    def agendar(self, caminho, chave=None):
+        """Coloca o arquivo na fila (se ainda não houver PDF). Retorna a tarefa ou None se já em cache."""
+        if not self._threads:
+            self.iniciar()
+        chave = chave or hash_arquivo(caminho)
+        with self._lock:
+            tarefa = self._em_andamento.get(chave)
+            if tarefa:
+                return tarefa
+            if self._em_cache(chave):
+                self.metricas['acertos_cache'] += 1
+                return None
+            tarefa = self._em_andamento[chave] = _Tarefa(chave, caminho)
+            self.metricas['agendadas'] += 1
+        self._fila.put(tarefa)
+        return tarefa
+
+    def converter(self, caminho, aguardar=120):
+        """
+        Caminho do PDF do arquivo, aguardando a conversão (agendada agora ou no
+        upload) por até `aguardar` segundos. Retorna None se falhar ou demorar.
+        """
+        chave = hash_arquivo(caminho)
+        limite = time.monotonic() + aguardar
+        for _ in range(3):
+            tarefa = self.agendar(caminho, chave)
+            if tarefa is None:
+                pdf = self.caminho_pdf(chave)
+            else:
+                tarefa.concluida.wait(max(limite - time.monotonic(), 0))
+                pdf = tarefa.pdf
+                if pdf is None:
+                    return None
+            # O limite de tamanho pode ter removido o PDF entre a conversão e aqui
+            if os.path.exists(pdf):
+                return pdf
+            if time.monotonic() >= limite:
+                break
+        return None
+
+    # -------------------------------------------------------------------------
+    # Conversão
+    # -------------------------------------------------------------------------
+
+    def _perfil(self, indice):
+        pasta = os.path.abspath(os.path.join(self.pasta_cache, 'perfis', f'worker_{indice}'))
+        return 'file:///' + pasta.replace('\\', '/').lstrip('/')
+
+    def _inicializar_perfil(self, indice):
+        """Cria o perfil do LibreOffice do worker antes da primeira conversão"""
+        if not self.soffice:
+            return
+        try:
+            subprocess.run([self.soffice, f'-env:UserInstallation={self._perfil(indice)}',
+                            '--headless', '--terminate_after_init'],
+                           capture_output=True, timeout=self.timeout)
+        except Exception as e:
+            print(f"[CONVERSOR PDF] Aviso: perfil do worker {indice} não inicializado: {e}")
+
+    def _converter_soffice(self, origem, destino, indice):
+        with tempfile.TemporaryDirectory() as pasta_tmp:
+            nome = os.path.basename(origem)
+            copia = os.path.join(pasta_tmp, nome)
+            shutil.copy2(origem, copia)
+            resultado = subprocess.run([
+                self.soffice, f'-env:UserInstallation={self._perfil(indice)}',
+                '--headless', '--convert-to', 'pdf', '--outdir', pasta_tmp, copia
+            ], capture_output=True, text=True, timeout=self.timeout)
+            gerado = os.path.join(pasta_tmp, nome.rsplit('.', 1)[0] + '.pdf')
+            if not os.path.exists(gerado):
+                print(f"[CONVERSOR PDF] LibreOffice: PDF não gerado. stderr={resultado.stderr}")
+                return False
+            shutil.move(gerado, destino)
+            return True
+
+    def _processar(self, tarefa, indice=0):
+        inicio = time.perf_counter()
+        destino = self.caminho_pdf(tarefa.chave)
+        temporario = f'{destino}.{indice}.tmp'
+        try:
+            convertido = False
+            if self.soffice:
+                try:
+                    convertido = self._converter_soffice(tarefa.caminho, temporario, indice)
+                except Exception as e:
+                    print(f"[CONVERSOR PDF] Erro LibreOffice: {e}")
+            if not convertido and self.alternativo:
+                convertido = self.alternativo(tarefa.caminho, temporario)
+            if convertido and os.path.exists(temporario):
+                os.replace(temporario, destino)
+                tarefa.pdf = destino
+                self.metricas['convertidas'] += 1
+                self.metricas['ultima_duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+                print(f"[CONVERSOR PDF] {os.path.basename(tarefa.caminho)} → {tarefa.chave[:12]}.pdf "
+                      f"em {self.metricas['ultima_duracao_ms']:.0f} ms")
+                self._aplicar_limite(preservar=tarefa.chave)
+            else:
+                raise RuntimeError('nenhum método de conversão disponível')
+        except Exception as e:
+            tarefa.erro = str(e)
+            self.metricas['erros'] += 1
+            self.metricas['ultimo_erro'] = f"{os.path.basename(tarefa.caminho)}: {e}"
+            print(f"[CONVERSOR PDF] Falha ao converter {tarefa.caminho}: {e}")
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            with self._lock:
+                self._em_andamento.pop(tarefa.chave, None)
+            tarefa.concluida.set()
+
+    def _loop(self, indice):
+        self._inicializar_perfil(indice)
+        while True:
+            self._processar(self._fila.get(), indice)
+
+    def iniciar(self):
+        """Inicia o pool de workers (uma vez por processo; agendar() inicia se preciso)"""
+        with self._lock:
+            if self._threads:
+                return
+            for indice in range(self.processos):
+                thread = threading.Thread(target=self._loop, args=(indice,), name=f'conversor-pdf-{indice}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"[CONVERSOR PDF] {self.processos} worker(s), LibreOffice: {self.soffice or 'não encontrado'}")
+
+    def status(self):
+        pdfs = [os.path.join(self.pasta_cache, n) for n in os.listdir(self.pasta_cache) if n.endswith('.pdf')]
+        return {
+            'workers': sum(1 for t in self._threads if t.is_alive()),
+            'soffice': self.soffice,
+            'na_fila': self._fila.qsize(),
+            'em_andamento': len(self._em_andamento),
+            'pdfs_em_cache': len(pdfs),
+            'bytes_em_cache': sum(os.path.getsize(p) for p in pdfs),
+            'limite_bytes': self.limite_bytes,
+            **self.metricas
+        }
@@ -10,7 +10,10 @@ Aplicação externa para fornecedores preencherem cotações via link.
 =============================================================================
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+import time
+_INICIO_BOOT = time.perf_counter()  # medição do cold start (antes dos demais imports)
+
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
 from flask_cors import CORS
 from datetime import datetime, timedelta
 import hashlib
@@ -18,9 +21,12 @@ import hmac
 import json
 import os
 import secrets
-import time
+import threading
 from functools import wraps
 
+from armazenamento import RepositorioCotacoes
+from cache_paginas import CachePaginas, escolher_codificacao
+
 # =============================================================================
 # CONFIGURAÇÃO DA APLICAÇÃO
 # =============================================================================
@@ -43,119 +49,42 @@ API_SECRET_KEY = os.environ.get('API_SECRET_KEY', 'chave-secreta-compartilhada-t
 # Tempo de expiração do token em horas (padrão: 72 horas)
 TOKEN_EXPIRATION_HOURS = int(os.environ.get('TOKEN_EXPIRATION_HOURS', 72))
 
+# Máximo de tokens por chamada nas rotas em lote
+LIMITE_TOKENS_LOTE = 500
+
 # =============================================================================
-# ARMAZENAMENTO COM PERSISTÊNCIA EM ARQUIVO JSON
+# ARMAZENAMENTO COMPARTILHADO EM SQLITE (WAL)
 # =============================================================================
-# Para sobreviver reinícios do Render (plano gratuito hiberna após inatividade)
-# Em produção, considere Redis ou PostgreSQL para maior confiabilidade
+# Para sobreviver reinícios do Render (plano gratuito hiberna após inatividade).
+# Cada alteração grava apenas o token envolvido (ver armazenamento.py); o antigo
+# cotacoes_storage.json é importado uma única vez e renomeado para .migrado.
+#
+# O estado NÃO fica em memória: cada requisição lê do banco. Assim, um token
+# registrado em um worker do gunicorn é visto imediatamente pelos demais
+# (Procfile: --workers 2 --threads 4).
+#
+# Estruturas devolvidas pelo repositório:
+#   cotação:  { dados, created_at, expires_at, status }
+#   resposta: { dados, submitted_at }
 
 STORAGE_FILE = os.environ.get('STORAGE_FILE', 'cotacoes_storage.json')
+STORAGE_DB = os.environ.get('STORAGE_DB', 'cotacoes_storage.db')
 
-# Dicionário para armazenar cotações ativas
-# Estrutura: { token: { dados_cotacao, created_at, expires_at, status } }
-cotacoes_ativas = {}
-
-# Dicionário para armazenar respostas
-# Estrutura: { token: { resposta_json, submitted_at } }
-respostas_enviadas = {}
-
-# Set para controlar respostas já sincronizadas com o sistema local
-# IMPORTANTE: Também precisa ser persistido para não duplicar sincronizações após reinício
-respostas_sincronizadas = set()
-
-
-def salvar_dados_persistentes():
-    """
-    Salva cotações, respostas E tokens sincronizados em arquivo JSON para persistência.
-    Chamado após cada alteração nos dicionários.
-    """
-    try:
-        dados = {
-            'cotacoes_ativas': {},
-            'respostas_enviadas': {},
-            'respostas_sincronizadas': list(respostas_sincronizadas),  # Set → List para JSON
-            'salvo_em': datetime.now().isoformat()
-        }
-        
-        # Converte cotações (datetime para string)
-        for token, cotacao in cotacoes_ativas.items():
-            dados['cotacoes_ativas'][token] = {
-                'dados': cotacao['dados'],
-                'created_at': cotacao['created_at'].isoformat() if isinstance(cotacao['created_at'], datetime) else cotacao['created_at'],
-                'expires_at': cotacao['expires_at'].isoformat() if isinstance(cotacao['expires_at'], datetime) else cotacao['expires_at'],
-                'status': cotacao.get('status', 'ativa')
-            }
-        
-        # Converte respostas (datetime para string)
-        for token, resposta in respostas_enviadas.items():
-            dados['respostas_enviadas'][token] = {
-                'dados': resposta.get('dados', resposta),
-                'submitted_at': resposta['submitted_at'].isoformat() if isinstance(resposta.get('submitted_at'), datetime) else resposta.get('submitted_at', datetime.now().isoformat())
-            }
-        
-        with open(STORAGE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(dados, f, ensure_ascii=False, indent=2)
-        
-        print(f"[PERSISTÊNCIA] Dados salvos em {STORAGE_FILE}: {len(cotacoes_ativas)} cotações, {len(respostas_enviadas)} respostas, {len(respostas_sincronizadas)} sincronizadas")
-        return True
-        
-    except Exception as e:
-        print(f"[PERSISTÊNCIA] ERRO ao salvar dados: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+_TEMPOS_BOOT = {'imports_ms': round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)}
+_inicio_banco = time.perf_counter()
+repositorio = RepositorioCotacoes(STORAGE_DB)
 
 
 def carregar_dados_persistentes():
     """
-    Carrega cotações, respostas e tokens sincronizados do arquivo JSON na inicialização.
+    Migra o JSON legado (se existir) e registra no log o estado do banco na inicialização.
     """
-    global cotacoes_ativas, respostas_enviadas, respostas_sincronizadas
-    
     try:
-        if not os.path.exists(STORAGE_FILE):
-            print(f"[PERSISTÊNCIA] Arquivo {STORAGE_FILE} não existe. Iniciando vazio.")
-            return
-        
-        with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
-            dados = json.load(f)
-        
-        # Carrega cotações (string para datetime)
-        cotacoes_carregadas = dados.get('cotacoes_ativas', {})
-        for token, cotacao in cotacoes_carregadas.items():
-            try:
-                cotacoes_ativas[token] = {
-                    'dados': cotacao['dados'],
-                    'created_at': datetime.fromisoformat(cotacao['created_at']) if isinstance(cotacao['created_at'], str) else cotacao['created_at'],
-                    'expires_at': datetime.fromisoformat(cotacao['expires_at']) if isinstance(cotacao['expires_at'], str) else cotacao['expires_at'],
-                    'status': cotacao.get('status', 'ativa')
-                }
-            except Exception as e:
-                print(f"[PERSISTÊNCIA] Erro ao carregar cotação {token[:20]}...: {e}")
-        
-        # Carrega respostas (string para datetime)
-        respostas_carregadas = dados.get('respostas_enviadas', {})
-        for token, resposta in respostas_carregadas.items():
-            try:
-                respostas_enviadas[token] = {
-                    'dados': resposta.get('dados', resposta),
-                    'submitted_at': datetime.fromisoformat(resposta['submitted_at']) if isinstance(resposta.get('submitted_at'), str) else datetime.now()
-                }
-            except Exception as e:
-                print(f"[PERSISTÊNCIA] Erro ao carregar resposta {token[:20]}...: {e}")
-        
-        # Carrega tokens já sincronizados (List → Set)
-        sincronizadas_carregadas = dados.get('respostas_sincronizadas', [])
-        respostas_sincronizadas.clear()
-        respostas_sincronizadas.update(sincronizadas_carregadas)
-        
-        salvo_em = dados.get('salvo_em', 'desconhecido')
-        print(f"[PERSISTÊNCIA] Dados carregados de {STORAGE_FILE}")
-        print(f"[PERSISTÊNCIA] - {len(cotacoes_ativas)} cotações ativas")
-        print(f"[PERSISTÊNCIA] - {len(respostas_enviadas)} respostas")
-        print(f"[PERSISTÊNCIA] - {len(respostas_sincronizadas)} sincronizadas")
-        print(f"[PERSISTÊNCIA] - Último salvamento: {salvo_em}")
-        
+        migrados = repositorio.migrar_json(STORAGE_FILE)
+        if migrados:
+            print(f"[PERSISTÊNCIA] {STORAGE_FILE} migrado para {STORAGE_DB}: "
+                  f"{migrados['cotacoes']} cotações, {migrados['respostas']} respostas, "
+                  f"{migrados['sincronizadas']} sincronizadas")
     except json.JSONDecodeError as e:
         print(f"[PERSISTÊNCIA] ERRO: Arquivo JSON corrompido: {e}")
         # Faz backup do arquivo corrompido
@@ -163,6 +92,17 @@ def carregar_dados_persistentes():
             backup_name = f"{STORAGE_FILE}.backup.{int(time.time())}"
             os.rename(STORAGE_FILE, backup_name)
             print(f"[PERSISTÊNCIA] Backup criado: {backup_name}")
+    except Exception as e:
+        print(f"[PERSISTÊNCIA] ERRO ao migrar {STORAGE_FILE}: {e}")
+    
+    try:
+        totais = repositorio.contar()
+        
+        print(f"[PERSISTÊNCIA] Banco {STORAGE_DB} (pid {os.getpid()})")
+        print(f"[PERSISTÊNCIA] - {totais['cotacoes']} cotações ativas")
+        print(f"[PERSISTÊNCIA] - {totais['respostas']} respostas")
+        print(f"[PERSISTÊNCIA] - {totais['sincronizadas']} sincronizadas")
+        
     except Exception as e:
         print(f"[PERSISTÊNCIA] ERRO ao carregar dados: {e}")
         import traceback
@@ -171,6 +111,57 @@ def carregar_dados_persistentes():
 
 # Carrega dados ao iniciar a aplicação
 carregar_dados_persistentes()
+_TEMPOS_BOOT['banco_ms'] = round((time.perf_counter() - _inicio_banco) * 1000, 1)
+
+# =============================================================================
+# LIMPEZA PERIÓDICA (ARQUIVAMENTO DE TOKENS ANTIGOS)
+# =============================================================================
+# Mantém o conjunto "quente" do banco limitado: tokens expirados (sem resposta
+# pendente) e respostas já sincronizadas com o sistema local são movidos para
+# um arquivo frio compactado após o período de retenção.
+
+RETENCAO_EXPIRADAS_HORAS = int(os.environ.get('RETENCAO_EXPIRADAS_HORAS', 24 * 7))
+RETENCAO_SINCRONIZADAS_HORAS = int(os.environ.get('RETENCAO_SINCRONIZADAS_HORAS', 72))
+INTERVALO_LIMPEZA_MINUTOS = int(os.environ.get('INTERVALO_LIMPEZA_MINUTOS', 30))
+# A primeira limpeza espera o serviço acordar e atender as primeiras requisições
+ATRASO_PRIMEIRA_LIMPEZA_SEGUNDOS = int(os.environ.get('ATRASO_PRIMEIRA_LIMPEZA_SEGUNDOS', 300))
+ARQUIVO_FRIO = os.environ.get('ARQUIVO_FRIO', 'cotacoes_arquivo.jsonl.gz')
+
+_ultima_limpeza = {'em': None, 'arquivadas': 0}
+
+
+def executar_limpeza():
+    """Arquiva tokens antigos em lotes até não restar nenhum. Retorna o total arquivado."""
+    total = 0
+    try:
+        while True:
+            arquivadas = repositorio.arquivar_antigos(ARQUIVO_FRIO, RETENCAO_EXPIRADAS_HORAS,
+                                                      RETENCAO_SINCRONIZADAS_HORAS)
+            total += arquivadas
+            if not arquivadas:
+                break
+        if total:
+            repositorio.compactar()
+            print(f"[LIMPEZA] {total} token(s) arquivado(s) em {ARQUIVO_FRIO}")
+    except Exception as e:
+        print(f"[LIMPEZA] ERRO ao arquivar tokens: {e}")
+    
+    _ultima_limpeza['em'] = datetime.now().isoformat()
+    _ultima_limpeza['arquivadas'] = total
+    return total
+
+
+def _loop_limpeza():
+    time.sleep(ATRASO_PRIMEIRA_LIMPEZA_SEGUNDOS)
+    while True:
+        executar_limpeza()
+        time.sleep(INTERVALO_LIMPEZA_MINUTOS * 60)
+
+
+# Uma thread por worker; o arquivamento roda em BEGIN IMMEDIATE, então os
+# workers não arquivam o mesmo token duas vezes
+if INTERVALO_LIMPEZA_MINUTOS > 0:
+    threading.Thread(target=_loop_limpeza, name='limpeza-tokens', daemon=True).start()
 
 # =============================================================================
 # FUNÇÕES DE SEGURANÇA
@@ -208,6 +199,19 @@ def gerar_assinatura(dados: dict) -> str:
     ).hexdigest()
 
 
+def obter_tokens_lote():
+    """
+    Lê {"tokens": [...]} do corpo das rotas em lote.
+    Retorna (tokens, None) ou (None, resposta de erro 400).
+    """
+    tokens = (request.get_json(silent=True) or {}).get('tokens')
+    if not isinstance(tokens, list) or not all(isinstance(t, str) and t for t in tokens):
+        return None, (jsonify({'success': False, 'error': 'tokens deve ser uma lista de tokens'}), 400)
+    if len(tokens) > LIMITE_TOKENS_LOTE:
+        return None, (jsonify({'success': False, 'error': f'Máximo de {LIMITE_TOKENS_LOTE} tokens por chamada'}), 400)
+    return list(dict.fromkeys(tokens)), None
+
+
 def api_key_required(f):
     """Decorator para validar API Key nas rotas protegidas"""
     @wraps(f)
@@ -219,6 +223,74 @@ def api_key_required(f):
     return decorated_function
 
 
+# =============================================================================
+# CACHE DA PÁGINA DO FORNECEDOR
+# =============================================================================
+# O HTML de /cotar e /externo/<token> é renderizado uma vez por versão da
+# cotação (ver cache_paginas.py) e servido já comprimido. O ETag combina a
+# versão no banco com o conteúdo dos templates, então um deploy com template
+# alterado também invalida as páginas. Páginas de erro/expiradas não entram.
+
+CACHE_PAGINAS_MAX_MB = int(os.environ.get('CACHE_PAGINAS_MAX_MB', 20))
+cache_paginas = CachePaginas(max_bytes=CACHE_PAGINAS_MAX_MB * 1024 * 1024)
+
+
+def _calcular_versao_templates():
+    pasta = os.path.join(app.root_path, app.template_folder)
+    h = hashlib.sha256()
+    for nome in sorted(os.listdir(pasta)):
+        with open(os.path.join(pasta, nome), 'rb') as f:
+            h.update(nome.encode() + f.read())
+    return h.hexdigest()[:12]
+
+
+VERSAO_TEMPLATES = _calcular_versao_templates()
+
+
+def _renderizar_pagina_fornecedor(token):
+    """Renderiza ja_respondida.html ou cotacao.html (lê o JSON da cotação)"""
+    cotacao = repositorio.obter_cotacao(token)
+    resposta = repositorio.obter_resposta(token)
+    if resposta:
+        return render_template('ja_respondida.html',
+                             cotacao=cotacao['dados'],
+                             resposta=resposta,
+                             data_envio=resposta['submitted_at'].strftime('%d/%m/%Y às %H:%M'))
+
+    print(f"[EXTERNO] Renderizando cotação para: {cotacao['dados'].get('fornecedor', {}).get('nome', 'N/A')}")
+    return render_template('cotacao.html',
+                         token=token,
+                         cotacao=cotacao['dados'],
+                         expires_at=cotacao['expires_at'].strftime('%d/%m/%Y às %H:%M'))
+
+
+def _resposta_pagina_fornecedor(token, versao):
+    """
+    Página do fornecedor com ETag forte por codificação: If-None-Match igual → 304;
+    senão serve o HTML do cache (renderizando só se a versão mudou).
+    """
+    etag = hashlib.sha256(f"{token}|{versao['versao']}|{VERSAO_TEMPLATES}".encode()).hexdigest()[:24]
+
+    codificacao = escolher_codificacao(request.accept_encodings)
+    etag_codificacao = etag if codificacao == 'identity' else f'{etag}-{codificacao}'
+
+    headers = {
+        'ETag': f'"{etag_codificacao}"',
+        'Cache-Control': 'private, no-cache',  # sempre revalida: resposta/invalidação refletem na hora
+        'Vary': 'Accept-Encoding'
+    }
+    if etag_codificacao in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    entrada = cache_paginas.obter(token, etag)
+    if entrada is None:
+        entrada = cache_paginas.guardar(token, etag, _renderizar_pagina_fornecedor(token))
+
+    if codificacao != 'identity':
+        headers['Content-Encoding'] = codificacao
+    return Response(entrada[codificacao], mimetype='text/html', headers=headers)
+
+
 # =============================================================================
 # ROTAS PÚBLICAS (ACESSO DO FORNECEDOR)
 # =============================================================================
@@ -249,35 +321,23 @@ def cotar():
                              mensagem='O link de cotação está incompleto.',
                              detalhes='Verifique se copiou o link completo ou solicite um novo ao comprador.')
     
-    # Verifica se o token existe
-    if token not in cotacoes_ativas:
+    # Verifica se o token existe (consulta leve, sem decodificar o JSON)
+    versao = repositorio.versao_pagina(token)
+    if not versao:
         return render_template('erro.html',
                              titulo='Cotação Não Encontrada',
                              mensagem='Esta cotação não existe ou o link é inválido.',
                              detalhes='Solicite um novo link ao comprador.')
     
-    cotacao = cotacoes_ativas[token]
-    
     # Verifica expiração
-    if datetime.now() > cotacao['expires_at']:
+    if datetime.now() > versao['expires_at']:
         return render_template('erro.html',
                              titulo='Cotação Expirada',
                              mensagem='O prazo para responder esta cotação expirou.',
-                             detalhes=f'A cotação expirou em {cotacao["expires_at"].strftime("%d/%m/%Y às %H:%M")}.')
+                             detalhes=f'A cotação expirou em {versao["expires_at"].strftime("%d/%m/%Y às %H:%M")}.')
     
-    # Verifica se já foi respondida
-    if token in respostas_enviadas:
-        resposta = respostas_enviadas[token]
-        return render_template('ja_respondida.html',
-                             cotacao=cotacao['dados'],
-                             resposta=resposta,
-                             data_envio=resposta['submitted_at'].strftime('%d/%m/%Y às %H:%M'))
-    
-    # Renderiza página de cotação
-    return render_template('cotacao.html',
-                         token=token,
-                         cotacao=cotacao['dados'],
-                         expires_at=cotacao['expires_at'].strftime('%d/%m/%Y às %H:%M'))
+    # Página de cotação (ou "já respondida") via cache
+    return _resposta_pagina_fornecedor(token, versao)
 
 
 @app.route('/api/responder', methods=['POST'])
@@ -294,17 +354,16 @@ def api_responder():
         
         token = dados.get('token')
         
-        if not token or token not in cotacoes_ativas:
+        cotacao = repositorio.obter_cotacao(token) if token else None
+        if not cotacao:
             return jsonify({'success': False, 'error': 'Token inválido'}), 400
         
-        cotacao = cotacoes_ativas[token]
-        
         # Verifica expiração
         if datetime.now() > cotacao['expires_at']:
             return jsonify({'success': False, 'error': 'Cotação expirada'}), 400
         
         # Verifica se já foi respondida
-        if token in respostas_enviadas:
+        if repositorio.tem_resposta(token):
             return jsonify({'success': False, 'error': 'Esta cotação já foi respondida'}), 400
         
         # Valida estrutura da resposta
@@ -334,17 +393,15 @@ def api_responder():
         # Adiciona assinatura para validação pelo sistema interno
         resposta_final['assinatura'] = gerar_assinatura(resposta_final)
         
-        # Armazena resposta
-        respostas_enviadas[token] = {
+        resposta_registro = {
             'dados': resposta_final,
             'submitted_at': datetime.now()
         }
         
-        # Atualiza status da cotação
-        cotacoes_ativas[token]['status'] = 'respondida'
-        
-        # *** PERSISTE DADOS APÓS RESPOSTA ***
-        salvar_dados_persistentes()
+        # *** PERSISTE A RESPOSTA (atômico: falha se outra requisição respondeu antes) ***
+        if not repositorio.registrar_resposta(token, resposta_registro):
+            return jsonify({'success': False, 'error': 'Esta cotação já foi respondida'}), 400
+        cache_paginas.invalidar(token)
         
         return jsonify({
             'success': True,
@@ -393,7 +450,7 @@ def api_registrar_cotacao():
         expires_at = datetime.now() + timedelta(hours=expiration_hours)
         
         # Armazena cotação
-        cotacoes_ativas[token] = {
+        cotacao = {
             'dados': dados,
             'created_at': datetime.now(),
             'expires_at': expires_at,
@@ -401,7 +458,7 @@ def api_registrar_cotacao():
         }
         
         # *** PERSISTE DADOS APÓS CRIAR COTAÇÃO ***
-        salvar_dados_persistentes()
+        repositorio.salvar_cotacao(token, cotacao)
         
         # Monta URL do link
         base_url = os.environ.get('BASE_URL', request.host_url.rstrip('/'))
@@ -427,15 +484,16 @@ def api_status_cotacao(token):
     API para o sistema interno verificar status de uma cotação.
     Retorna se foi respondida, expirada, etc.
     """
-    if token not in cotacoes_ativas:
+    cotacao = repositorio.obter_cotacao(token)
+    if not cotacao:
         return jsonify({'success': False, 'error': 'Token não encontrado'}), 404
     
-    cotacao = cotacoes_ativas[token]
+    respondida = repositorio.tem_resposta(token)
     
     status = 'ativa'
     if datetime.now() > cotacao['expires_at']:
         status = 'expirada'
-    elif token in respostas_enviadas:
+    elif respondida:
         status = 'respondida'
     
     return jsonify({
@@ -444,7 +502,7 @@ def api_status_cotacao(token):
         'status': status,
         'created_at': cotacao['created_at'].isoformat(),
         'expires_at': cotacao['expires_at'].isoformat(),
-        'respondida': token in respostas_enviadas
+        'respondida': respondida
     })
 
 
@@ -468,7 +526,8 @@ def api_status_cotacao_externa(token):
     print(f"[STATUS] Verificando status do token: {token[:20]}...")
     
     # Token não existe no Render
-    if token not in cotacoes_ativas:
+    cotacao = repositorio.obter_cotacao(token)
+    if not cotacao:
         print(f"[STATUS] Token NÃO ENCONTRADO: {token[:20]}...")
         return jsonify({
             'success': True,
@@ -478,11 +537,9 @@ def api_status_cotacao_externa(token):
             'pode_gerar_novo': True
         })
     
-    cotacao = cotacoes_ativas[token]
-    
     # Verifica se já foi respondida
-    if token in respostas_enviadas:
-        resposta = respostas_enviadas[token]
+    resposta = repositorio.obter_resposta(token)
+    if resposta:
         print(f"[STATUS] Token RESPONDIDO: {token[:20]}...")
         return jsonify({
             'success': True,
@@ -527,23 +584,22 @@ def api_obter_resposta_externa(token):
     """
     print(f"[RESPOSTA] Buscando resposta do token: {token[:20]}...")
     
-    if token not in cotacoes_ativas:
+    cotacao = repositorio.obter_cotacao(token)
+    if not cotacao:
         return jsonify({
             'success': False, 
             'error': 'Token não encontrado',
             'status': 'nao_existe'
         }), 404
     
-    if token not in respostas_enviadas:
+    resposta = repositorio.obter_resposta(token)
+    if not resposta:
         return jsonify({
             'success': False, 
             'error': 'Cotação ainda não foi respondida',
             'status': 'aguardando'
         }), 404
     
-    resposta = respostas_enviadas[token]
-    cotacao = cotacoes_ativas[token]
-    
     print(f"[RESPOSTA] Resposta encontrada para token: {token[:20]}...")
     
     return jsonify({
@@ -566,38 +622,54 @@ def api_obter_resposta(token):
     API para o sistema interno obter a resposta de uma cotação.
     Retorna o JSON completo da resposta do fornecedor.
     """
-    if token not in cotacoes_ativas:
+    if not repositorio.obter_cotacao(token):
         return jsonify({'success': False, 'error': 'Token não encontrado'}), 404
     
-    if token not in respostas_enviadas:
+    resposta = repositorio.obter_resposta(token)
+    if not resposta:
         return jsonify({'success': False, 'error': 'Cotação ainda não foi respondida'}), 404
     
-    resposta = respostas_enviadas[token]
-    
     return jsonify({
         'success': True,
         'resposta': resposta['dados']
     })
 
 
+@app.route('/api/respostas/lote', methods=['POST'])
+@api_key_required
+def api_obter_respostas_lote():
+    """
+    Respostas de vários tokens em uma chamada (equivale a N x /api/cotacao/<token>/resposta).
+    
+    Body: {"tokens": ["...", ...]} (máx. LIMITE_TOKENS_LOTE)
+    """
+    tokens, erro = obter_tokens_lote()
+    if erro:
+        return erro
+    
+    respostas = repositorio.obter_respostas(tokens)
+    
+    return jsonify({
+        'success': True,
+        'total': len(respostas),
+        'respostas': {
+            token: {'resposta': resposta['dados'], 'data_resposta': resposta['submitted_at'].isoformat()}
+            for token, resposta in respostas.items()
+        },
+        'nao_respondidos': [token for token in tokens if token not in respostas]
+    })
+
+
 @app.route('/api/cotacao/<token>/invalidar', methods=['POST'])
 @api_key_required
 def api_invalidar_cotacao(token):
     """
     API para o sistema interno invalidar uma cotação (cancelar link).
     """
-    if token not in cotacoes_ativas:
+    # *** PERSISTE DADOS APÓS INVALIDAR (remove cotação e resposta) ***
+    if not repositorio.remover_cotacao(token):
         return jsonify({'success': False, 'error': 'Token não encontrado'}), 404
-    
-    # Remove a cotação
-    del cotacoes_ativas[token]
-    
-    # Remove resposta se existir
-    if token in respostas_enviadas:
-        del respostas_enviadas[token]
-    
-    # *** PERSISTE DADOS APÓS INVALIDAR ***
-    salvar_dados_persistentes()
+    cache_paginas.invalidar(token)
     
     return jsonify({
         'success': True,
@@ -611,16 +683,9 @@ def api_respostas_pendentes():
     """
     API para o sistema interno listar todas as respostas pendentes de importação.
     """
-    pendentes = []
-    
-    for token, resposta in respostas_enviadas.items():
-        pendentes.append({
-            'token': token,
-            'cotacao_id': resposta['dados']['cotacao_id'],
-            'fornecedor_id': resposta['dados']['fornecedor_id'],
-            'fornecedor_nome': resposta['dados']['fornecedor_nome'],
-            'submitted_at': resposta['submitted_at'].isoformat()
-        })
+    # Índice leve: o JSON completo de cada resposta é baixado sob demanda
+    # (/api/cotacao/<token>/resposta ou /api/respostas/lote)
+    pendentes = repositorio.listar_indice_respostas()
     
     return jsonify({
         'success': True,
@@ -636,11 +701,12 @@ def api_respostas_pendentes():
 @app.route('/health')
 def health_check():
     """Health check para o Render"""
+    totais = repositorio.contar()
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'cotacoes_ativas': len(cotacoes_ativas),
-        'respostas_pendentes': len(respostas_enviadas)
+        'cotacoes_ativas': totais['cotacoes'],
+        'respostas_pendentes': totais['respostas']
     })
 
 
@@ -699,7 +765,7 @@ def api_criar_cotacao_externa():
         }
         
         # Armazena cotação
-        cotacoes_ativas[token] = {
+        cotacao = {
             'dados': dados_cotacao,
             'created_at': datetime.now(),
             'expires_at': expires_at,
@@ -707,7 +773,7 @@ def api_criar_cotacao_externa():
         }
         
         # *** PERSISTE DADOS APÓS CRIAR COTAÇÃO EXTERNA ***
-        salvar_dados_persistentes()
+        repositorio.salvar_cotacao(token, cotacao)
         
         # Monta URL do link usando o domínio correto
         # Usa BASE_URL do ambiente ou constrói a partir do host
@@ -743,80 +809,66 @@ def pagina_cotacao_externa(token):
     """
     print(f"[EXTERNO] Acesso à cotação externa - Token: {token}")
     
-    # Verifica se o token existe
-    if token not in cotacoes_ativas:
+    # Verifica se o token existe (consulta leve, sem decodificar o JSON)
+    versao = repositorio.versao_pagina(token)
+    if not versao:
         print(f"[EXTERNO] Token não encontrado: {token}")
         return render_template('erro.html',
                              titulo='Cotação Não Encontrada',
                              mensagem='Esta cotação não existe ou o link é inválido.',
                              detalhes='Solicite um novo link ao comprador.'), 404
     
-    cotacao = cotacoes_ativas[token]
-    
     # Verifica expiração
-    if datetime.now() > cotacao['expires_at']:
+    if datetime.now() > versao['expires_at']:
         print(f"[EXTERNO] Cotação expirada: {token}")
         return render_template('erro.html',
                              titulo='Cotação Expirada',
                              mensagem='O prazo para responder esta cotação expirou.',
-                             detalhes=f'A cotação expirou em {cotacao["expires_at"].strftime("%d/%m/%Y às %H:%M")}.'), 400
-    
-    # Verifica se já foi respondida
-    if token in respostas_enviadas:
-        resposta = respostas_enviadas[token]
-        return render_template('ja_respondida.html',
-                             cotacao=cotacao['dados'],
-                             resposta=resposta,
-                             data_envio=resposta['submitted_at'].strftime('%d/%m/%Y às %H:%M'))
+                             detalhes=f'A cotação expirou em {versao["expires_at"].strftime("%d/%m/%Y às %H:%M")}.'), 400
     
-    # Renderiza página de cotação
-    print(f"[EXTERNO] Renderizando cotação para: {cotacao['dados'].get('fornecedor', {}).get('nome', 'N/A')}")
-    return render_template('cotacao.html',
-                         token=token,
-                         cotacao=cotacao['dados'],
-                         expires_at=cotacao['expires_at'].strftime('%d/%m/%Y às %H:%M'))
+    # Página de cotação (ou "já respondida") via cache
+    return _resposta_pagina_fornecedor(token, versao)
 
 
 @app.route('/debug-token/<token>')
 def debug_token(token):
     """Rota de debug para verificar se um token existe"""
-    existe = token in cotacoes_ativas
+    cotacao = repositorio.obter_cotacao(token)
+    existe = cotacao is not None
     dados = None
     if existe:
-        cotacao = cotacoes_ativas[token]
         dados = {
             'status': cotacao.get('status'),
             'created_at': cotacao['created_at'].isoformat(),
             'expires_at': cotacao['expires_at'].isoformat(),
             'fornecedor': cotacao['dados'].get('fornecedor', {}).get('nome', 'N/A'),
-            'respondida': token in respostas_enviadas
+            'respondida': repositorio.tem_resposta(token)
         }
     
     return jsonify({
         'token': token,
         'existe': existe,
         'dados': dados,
-        'total_cotacoes_ativas': len(cotacoes_ativas)
+        'total_cotacoes_ativas': repositorio.contar()['cotacoes']
     })
 
 
 @app.route('/api/stats')
 @api_key_required
 def api_stats():
-    """Estatísticas do sistema (protegido)"""
-    ativas = sum(1 for c in cotacoes_ativas.values() 
-                 if datetime.now() <= c['expires_at'] and c['status'] == 'ativa')
-    expiradas = sum(1 for c in cotacoes_ativas.values() 
-                    if datetime.now() > c['expires_at'])
-    respondidas = len(respostas_enviadas)
+    """Estatísticas do sistema (protegido) - contadores mantidos no banco"""
+    totais = repositorio.contar()
+    validade = repositorio.contar_por_validade()
     
     return jsonify({
         'success': True,
         'stats': {
-            'total_cotacoes': len(cotacoes_ativas),
-            'ativas': ativas,
-            'expiradas': expiradas,
-            'respondidas': respondidas
+            'total_cotacoes': totais['cotacoes'],
+            'ativas': validade['ativas'],
+            'expiradas': validade['expiradas'],
+            'respondidas': totais['respostas'],
+            'pendentes_sincronizacao': totais['pendentes'],
+            'arquivadas': totais['arquivadas']
         }
     })
 
@@ -825,8 +877,8 @@ def api_stats():
 # API PARA SINCRONIZAÇÃO COM SISTEMA LOCAL (POLLING)
 # =============================================================================
 
-# NOTA: respostas_sincronizadas foi movido para o topo do arquivo junto com as outras
-# variáveis globais e é persistido/carregado pelo sistema de persistência JSON
+# NOTA: as confirmações de sincronização ficam na tabela 'sincronizacoes' do
+# repositório (ver armazenamento.py) e são compartilhadas entre os workers
 
 @app.route('/api/respostas-pendentes', methods=['GET'])
 def api_respostas_pendentes_v2():
@@ -834,20 +886,41 @@ def api_respostas_pendentes_v2():
     Retorna lista de respostas que ainda não foram sincronizadas com o sistema local.
     O sistema local faz polling nesta rota a cada 20 segundos.
     
+    Feed incremental:
+    - Cada resposta tem um número de sequência crescente ('seq')
+    - ?since=<cursor> retorna apenas respostas com seq > cursor (sem since = todas as pendentes)
+    - 'cursor' no retorno é o valor a enviar no próximo since
+    - ETag muda só quando chega resposta nova ou alguma é confirmada;
+      If-None-Match igual → 304 sem consultar as respostas
+    
     IMPORTANTE: Rota pública para facilitar integração (sistema local pode não ter IP fixo)
     """
     try:
+        try:
+            since = max(int(request.args.get('since', 0)), 0)
+            limite = min(max(int(request.args.get('limite', 500)), 1), 500)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'since/limite devem ser inteiros', 'respostas': []}), 400
+        
+        ultima_seq, confirmacoes = repositorio.versao_feed()
+        if since > ultima_seq:
+            # Cursor de outro banco (ex.: disco recriado) - recomeça do início
+            since = 0
+        versao = f'{since}-{limite}-{ultima_seq}-{confirmacoes}'
+        etag = f'"{versao}"'
+        if versao in request.if_none_match:
+            return '', 304, {'ETag': etag, 'Cache-Control': 'no-cache'}
+        
         respostas = []
+        pendentes = repositorio.listar_respostas_desde(since, limite)
         
-        for token, resposta_data in respostas_enviadas.items():
-            # Pula se já foi sincronizada
-            if token in respostas_sincronizadas:
-                continue
-            
+        # Apenas respostas ainda não confirmadas pelo sistema local
+        for seq, token, resposta_data in pendentes:
             resposta = resposta_data.get('dados', {})
             
             # Monta dados para o sistema local
             respostas.append({
+                'seq': seq,
                 'token': token,
                 'cotacao_id': resposta.get('cotacao_id'),
                 'fornecedor_id': resposta.get('fornecedor_id'),
@@ -868,13 +941,18 @@ def api_respostas_pendentes_v2():
             })
         
         if respostas:
-            print(f"[POLLING] {len(respostas)} resposta(s) pendente(s) de sincronização")
+            print(f"[POLLING] {len(respostas)} resposta(s) pendente(s) de sincronização (since={since})")
         
-        return jsonify({
+        resposta_http = jsonify({
             'success': True,
             'respostas': respostas,
-            'count': len(respostas)
+            'count': len(respostas),
+            'cursor': respostas[-1]['seq'] if respostas else since,
+            'tem_mais': len(respostas) == limite
         })
+        resposta_http.headers['ETag'] = etag
+        resposta_http.headers['Cache-Control'] = 'no-cache'
+        return resposta_http
         
     except Exception as e:
         print(f"[ERRO] api_respostas_pendentes: {e}")
@@ -897,38 +975,63 @@ def api_confirmar_sincronizacao():
             return jsonify({'success': False, 'error': 'Token é obrigatório'}), 400
         
         # Marca como sincronizada
-        respostas_sincronizadas.add(token)
-        print(f"[SINCRONIZAÇÃO] Resposta {token[:20]}... marcada como sincronizada")
-        
         # *** PERSISTE DADOS APÓS CONFIRMAR SINCRONIZAÇÃO ***
-        salvar_dados_persistentes()
+        repositorio.marcar_sincronizada(token)
+        print(f"[SINCRONIZAÇÃO] Resposta {token[:20]}... marcada como sincronizada")
         
         return jsonify({
             'success': True,
             'message': f'Resposta confirmada como sincronizada',
-            'total_sincronizadas': len(respostas_sincronizadas)
+            'total_sincronizadas': repositorio.contar()['sincronizadas']
         })
         
     except Exception as e:
         print(f"[ERRO] api_confirmar_sincronizacao: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/confirmar-sincronizacao/lote', methods=['POST'])
+def api_confirmar_sincronizacao_lote():
+    """
+    Confirma a sincronização de vários tokens em uma única gravação.
+    
+    Body: {"tokens": ["...", ...]} (máx. LIMITE_TOKENS_LOTE)
+    Tokens já confirmados são aceitos sem erro (a chamada pode ser repetida).
+    """
+    try:
+        tokens, erro = obter_tokens_lote()
+        if erro:
+            return erro
+        
+        novos = repositorio.marcar_sincronizadas(tokens)
+        print(f"[SINCRONIZAÇÃO] {len(novos)} resposta(s) marcada(s) como sincronizada(s) em lote ({len(tokens)} recebida(s))")
+        
+        return jsonify({
+            'success': True,
+            'confirmados': len(tokens),
+            'novos': len(novos),
+            'total_sincronizadas': repositorio.contar()['sincronizadas']
+        })
+        
+    except Exception as e:
+        print(f"[ERRO] api_confirmar_sincronizacao_lote: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/status-cotacao/<token>', methods=['GET'])
-def api_status_cotacao(token):
+def api_status_cotacao_sincronizacao(token):
     """
     Retorna status de uma cotação específica.
     Útil para verificar se uma cotação já foi respondida.
     """
-    if token not in cotacoes_ativas:
+    cotacao = repositorio.obter_cotacao(token)
+    if not cotacao:
         return jsonify({
             'success': False,
             'existe': False,
             'error': 'Token não encontrado'
         }), 404
     
-    cotacao = cotacoes_ativas[token]
-    respondida = token in respostas_enviadas
-    sincronizada = token in respostas_sincronizadas
+    respondida = repositorio.tem_resposta(token)
+    sincronizada = repositorio.esta_sincronizada(token)
     
     return jsonify({
         'success': True,
@@ -959,46 +1062,57 @@ def api_diagnostico():
     - Status da persistência
     """
     try:
-        # Lista cotações ativas (com tokens truncados por segurança)
+        # Lista cotações ativas (com tokens truncados por segurança) - só o índice, sem o JSON de cada token
+        totais = repositorio.contar()
+        
         cotacoes_info = []
-        for token, cotacao in cotacoes_ativas.items():
+        for cotacao in repositorio.listar_indice():
             cotacoes_info.append({
-                'token_preview': token[:20] + '...',
-                'fornecedor': cotacao['dados'].get('fornecedor', {}).get('nome', 'N/A'),
-                'cotacao_id': cotacao['dados'].get('cotacao_id'),
-                'status': cotacao.get('status', 'ativa'),
-                'created_at': cotacao['created_at'].isoformat() if isinstance(cotacao['created_at'], datetime) else str(cotacao['created_at']),
-                'expires_at': cotacao['expires_at'].isoformat() if isinstance(cotacao['expires_at'], datetime) else str(cotacao['expires_at']),
-                'respondida': token in respostas_enviadas,
-                'sincronizada': token in respostas_sincronizadas
+                'token_preview': cotacao['token'][:20] + '...',
+                'fornecedor': cotacao['fornecedor_nome'] or 'N/A',
+                'cotacao_id': cotacao['cotacao_id'],
+                'status': cotacao['status'] or 'ativa',
+                'created_at': cotacao['created_at'],
+                'expires_at': cotacao['expires_at'],
+                'respondida': cotacao['respondida'],
+                'sincronizada': cotacao['sincronizada']
             })
         
-        # Verifica arquivo de persistência
-        persistencia_ok = os.path.exists(STORAGE_FILE)
-        persistencia_tamanho = os.path.getsize(STORAGE_FILE) if persistencia_ok else 0
+        # Verifica banco de persistência
+        persistencia_ok = os.path.exists(STORAGE_DB)
+        persistencia_tamanho = repositorio.tamanho_bytes() if persistencia_ok else 0
         
-        # Lê última data de salvamento do arquivo
+        # Última gravação = última modificação do banco/WAL
         ultima_gravacao = None
         if persistencia_ok:
-            try:
-                with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
-                    dados_arquivo = json.load(f)
-                    ultima_gravacao = dados_arquivo.get('salvo_em', 'desconhecido')
-            except:
-                pass
+            arquivos = [STORAGE_DB, STORAGE_DB + '-wal']
+            ultima_gravacao = datetime.fromtimestamp(
+                max(os.path.getmtime(a) for a in arquivos if os.path.exists(a))).isoformat()
         
         return jsonify({
             'success': True,
             'status': 'online',
             'timestamp': datetime.now().isoformat(),
+            'worker_pid': os.getpid(),
+            'boot': _info_boot(),
+            'cache_paginas': cache_paginas.estatisticas(),
             'estatisticas': {
-                'cotacoes_ativas': len(cotacoes_ativas),
-                'respostas_enviadas': len(respostas_enviadas),
-                'respostas_sincronizadas': len(respostas_sincronizadas),
-                'respostas_pendentes': len(respostas_enviadas) - len(respostas_sincronizadas.intersection(respostas_enviadas.keys()))
+                'cotacoes_ativas': totais['cotacoes'],
+                'respostas_enviadas': totais['respostas'],
+                'respostas_sincronizadas': totais['sincronizadas'],
+                'respostas_pendentes': totais['pendentes']
+            },
+            'limpeza': {
+                'arquivo_frio': ARQUIVO_FRIO,
+                'retencao_expiradas_horas': RETENCAO_EXPIRADAS_HORAS,
+                'retencao_sincronizadas_horas': RETENCAO_SINCRONIZADAS_HORAS,
+                'intervalo_minutos': INTERVALO_LIMPEZA_MINUTOS,
+                'ultima_execucao': _ultima_limpeza['em'],
+                'ultima_arquivadas': _ultima_limpeza['arquivadas'],
+                'total_arquivadas': totais['arquivadas']
             },
             'persistencia': {
-                'arquivo': STORAGE_FILE,
+                'arquivo': STORAGE_DB,
                 'existe': persistencia_ok,
                 'tamanho_bytes': persistencia_tamanho,
                 'ultima_gravacao': ultima_gravacao
@@ -1019,17 +1133,41 @@ def api_diagnostico():
         }), 500
 
 
+def _info_boot():
+    return {
+        'iniciado_em': INICIADO_EM,
+        'uptime_segundos': round(time.time() - _INICIADO_TIMESTAMP),
+        **_TEMPOS_BOOT
+    }
+
+
+@app.route('/api/ping', methods=['GET'])
+def api_ping():
+    """
+    Health check leve para aquecimento (keep-warm): acorda o serviço sem
+    consultar o banco. Informa quando o processo subiu e quanto o boot levou;
+    uptime baixo indica que a chamada pegou um cold start.
+    """
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'worker_pid': os.getpid(),
+        'boot': _info_boot()
+    })
+
+
 @app.route('/api/health', methods=['GET'])
 def api_health():
     """
     Endpoint simples de health check.
     Usado pelo Render para verificar se a aplicação está rodando.
     """
+    totais = repositorio.contar()
     return jsonify({
         'status': 'ok',
         'timestamp': datetime.now().isoformat(),
-        'cotacoes_ativas': len(cotacoes_ativas),
-        'respostas_pendentes': len(respostas_enviadas)
+        'cotacoes_ativas': totais['cotacoes'],
+        'respostas_pendentes': totais['respostas']
     })
 
 
@@ -1037,6 +1175,14 @@ def api_health():
 # INICIALIZAÇÃO
 # =============================================================================
 
+# Tempo de boot do worker (imports + banco + registro das rotas), exposto em
+# /api/ping e /api/diagnostico para acompanhar o cold start do plano gratuito
+_TEMPOS_BOOT['total_ms'] = round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)
+_INICIADO_TIMESTAMP = time.time()
+INICIADO_EM = datetime.now().isoformat()
+print(f"[BOOT] Worker {os.getpid()} pronto em {_TEMPOS_BOOT['total_ms']} ms "
+      f"(imports {_TEMPOS_BOOT['imports_ms']} ms, banco {_TEMPOS_BOOT['banco_ms']} ms)")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
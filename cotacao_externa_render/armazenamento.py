@@ -0,0 +1,569 @@
+"""
+=============================================================================
+ARMAZENAMENTO - COTAÇÃO EXTERNA (RENDER)
+=============================================================================
+Repositório das cotações, respostas e confirmações de sincronização em
+SQLite (modo WAL).
+- Cada gravação afeta apenas o token envolvido, em uma transação própria
+- Leituras por token usam a chave primária (sem varrer o histórico)
+- Seguro para vários workers/threads do gunicorn (uma conexão por thread)
+- Migração única do antigo cotacoes_storage.json
+- Contadores mantidos por triggers (estatísticas sem varrer as tabelas)
+- Arquivamento de tokens expirados/sincronizados em arquivo frio (.jsonl.gz)
+- Número de sequência por resposta para o feed incremental (since=<cursor>)
+- Leitura e confirmação em lote (uma consulta / uma transação para N tokens)
+- Índices leves (json_extract no SQLite) para listagens que não precisam do
+  JSON completo de cada token
+=============================================================================
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# Tokens por comando SQL nas operações em lote (limite de parâmetros do SQLite)
+TAMANHO_LOTE_SQL = 500
+
+
+def _para_iso(valor):
+    """datetime -> string ISO (strings são mantidas)"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def _de_iso(valor):
+    """string ISO -> datetime (None é mantido)"""
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    return valor
+
+
+class RepositorioCotacoes:
+    """
+    Interface de persistência usada pelo app.py.
+
+    Formatos devolvidos (os mesmos dos antigos dicionários em memória):
+        cotação:  {'dados', 'created_at', 'expires_at', 'status'}
+        resposta: {'dados', 'submitted_at'}
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        self._criar_tabelas()
+
+    # -------------------------------------------------------------------------
+    # Conexão
+    # -------------------------------------------------------------------------
+
+    def _conexao(self):
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA busy_timeout=10000')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transacao(self, operacoes):
+        """Executa operacoes(conn) em uma transação (BEGIN IMMEDIATE ... COMMIT)"""
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = operacoes(conn)
+            conn.execute('COMMIT')
+            return resultado
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _criar_tabelas(self):
+        conn = self._conexao()
+        # Só tem efeito em banco novo (antes da primeira tabela); permite o incremental_vacuum
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS cotacoes (
+                token TEXT PRIMARY KEY,
+                dados TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                expires_at TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ativa'
+            );
+
+            CREATE TABLE IF NOT EXISTS respostas (
+                token TEXT PRIMARY KEY,
+                dados TEXT NOT NULL,
+                submitted_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS sincronizacoes (
+                token TEXT PRIMARY KEY,
+                confirmado_em TEXT NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_cotacoes_expires ON cotacoes(expires_at);
+            CREATE INDEX IF NOT EXISTS idx_cotacoes_status_expires ON cotacoes(status, expires_at);
+            CREATE INDEX IF NOT EXISTS idx_sincronizacoes_confirmado ON sincronizacoes(confirmado_em);
+
+            -- Contadores mantidos pelos triggers abaixo (valem para todos os workers)
+            CREATE TABLE IF NOT EXISTS contadores (
+                nome TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0
+            );
+
+            INSERT OR IGNORE INTO contadores (nome, valor) SELECT 'cotacoes', COUNT(*) FROM cotacoes;
+            INSERT OR IGNORE INTO contadores (nome, valor) SELECT 'respostas', COUNT(*) FROM respostas;
+            INSERT OR IGNORE INTO contadores (nome, valor) SELECT 'sincronizadas', COUNT(*) FROM sincronizacoes;
+            INSERT OR IGNORE INTO contadores (nome, valor)
+                SELECT 'pendentes', COUNT(*) FROM respostas r
+                WHERE NOT EXISTS (SELECT 1 FROM sincronizacoes s WHERE s.token = r.token);
+            INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('arquivadas', 0);
+
+            CREATE TRIGGER IF NOT EXISTS trg_cotacoes_ins AFTER INSERT ON cotacoes BEGIN
+                UPDATE contadores SET valor = valor + 1 WHERE nome = 'cotacoes';
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_cotacoes_del AFTER DELETE ON cotacoes BEGIN
+                UPDATE contadores SET valor = valor - 1 WHERE nome = 'cotacoes';
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_respostas_ins AFTER INSERT ON respostas BEGIN
+                UPDATE contadores SET valor = valor + 1 WHERE nome = 'respostas';
+                UPDATE contadores SET valor = valor + 1 WHERE nome = 'pendentes'
+                    AND NOT EXISTS (SELECT 1 FROM sincronizacoes WHERE token = NEW.token);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_respostas_del AFTER DELETE ON respostas BEGIN
+                UPDATE contadores SET valor = valor - 1 WHERE nome = 'respostas';
+                UPDATE contadores SET valor = valor - 1 WHERE nome = 'pendentes'
+                    AND NOT EXISTS (SELECT 1 FROM sincronizacoes WHERE token = OLD.token);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_sincronizacoes_ins AFTER INSERT ON sincronizacoes BEGIN
+                UPDATE contadores SET valor = valor + 1 WHERE nome = 'sincronizadas';
+                UPDATE contadores SET valor = valor - 1 WHERE nome = 'pendentes'
+                    AND EXISTS (SELECT 1 FROM respostas WHERE token = NEW.token);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_sincronizacoes_del AFTER DELETE ON sincronizacoes BEGIN
+                UPDATE contadores SET valor = valor - 1 WHERE nome = 'sincronizadas';
+                UPDATE contadores SET valor = valor + 1 WHERE nome = 'pendentes'
+                    AND EXISTS (SELECT 1 FROM respostas WHERE token = OLD.token);
+            END;
+        ''')
+        # Em transação: vários workers podem iniciar ao mesmo tempo
+        self._transacao(self._garantir_sequencia_respostas)
+
+    def _garantir_sequencia_respostas(self, conn):
+        """
+        Coluna respostas.seq: número crescente atribuído na gravação, nunca
+        reutilizado (o último valor fica em contadores.seq_respostas, mesmo
+        após o arquivamento). Bancos antigos recebem a coluna e a numeração
+        pela ordem de envio.
+        """
+        colunas = [c['name'] for c in conn.execute('PRAGMA table_info(respostas)').fetchall()]
+        if 'seq' not in colunas:
+            conn.execute('ALTER TABLE respostas ADD COLUMN seq INTEGER')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_respostas_seq ON respostas(seq)')
+        conn.execute('''
+            INSERT OR IGNORE INTO contadores (nome, valor)
+            SELECT 'seq_respostas', COALESCE(MAX(seq), 0) FROM respostas
+        ''')
+        conn.execute("INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('seq_confirmacoes', 0)")
+        self._numerar_respostas(conn)
+
+    def _numerar_respostas(self, conn):
+        """Atribui seq às respostas que ainda não têm (migração/bancos antigos)"""
+        sem_seq = conn.execute(
+            'SELECT token FROM respostas WHERE seq IS NULL ORDER BY submitted_at, token').fetchall()
+        for linha in sem_seq:
+            conn.execute("UPDATE contadores SET valor = valor + 1 WHERE nome = 'seq_respostas'")
+            conn.execute('''
+                UPDATE respostas SET seq = (SELECT valor FROM contadores WHERE nome = 'seq_respostas')
+                WHERE token = ?
+            ''', (linha['token'],))
+
+    # -------------------------------------------------------------------------
+    # Cotações
+    # -------------------------------------------------------------------------
+
+    def salvar_cotacao(self, token, cotacao):
+        """Insere ou substitui a cotação de um token"""
+        self._conexao().execute('''
+            INSERT INTO cotacoes (token, dados, created_at, expires_at, status)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(token) DO UPDATE SET
+                dados = excluded.dados,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at,
+                status = excluded.status
+        ''', (token, json.dumps(cotacao['dados'], ensure_ascii=False),
+              _para_iso(cotacao['created_at']), _para_iso(cotacao['expires_at']),
+              cotacao.get('status', 'ativa')))
+
+    def obter_cotacao(self, token):
+        linha = self._conexao().execute('SELECT * FROM cotacoes WHERE token = ?', (token,)).fetchone()
+        if not linha:
+            return None
+        return {
+            'dados': json.loads(linha['dados']),
+            'created_at': _de_iso(linha['created_at']),
+            'expires_at': _de_iso(linha['expires_at']),
+            'status': linha['status']
+        }
+
+    def versao_pagina(self, token):
+        """
+        Validade da página do fornecedor sem decodificar o JSON:
+        { expires_at, versao } ou None. versao muda quando a cotação é
+        regravada ou respondida (usada como ETag do cache de páginas).
+        """
+        linha = self._conexao().execute('''
+            SELECT c.created_at, c.expires_at, c.status, length(c.dados) AS tamanho, r.submitted_at
+            FROM cotacoes c LEFT JOIN respostas r ON r.token = c.token
+            WHERE c.token = ?
+        ''', (token,)).fetchone()
+        if not linha:
+            return None
+        return {
+            'expires_at': _de_iso(linha['expires_at']),
+            'versao': '|'.join(str(linha[c] or '') for c in ('created_at', 'expires_at', 'status', 'tamanho', 'submitted_at'))
+        }
+
+    def listar_cotacoes(self):
+        """Todas as cotações: { token: cotação }"""
+        linhas = self._conexao().execute('SELECT * FROM cotacoes ORDER BY created_at').fetchall()
+        return {
+            l['token']: {
+                'dados': json.loads(l['dados']),
+                'created_at': _de_iso(l['created_at']),
+                'expires_at': _de_iso(l['expires_at']),
+                'status': l['status']
+            }
+            for l in linhas
+        }
+
+    def listar_indice(self):
+        """
+        Índice leve das cotações, sem carregar o JSON completo de cada uma:
+        lista de dicts com token, cotacao_id, fornecedor_nome, status,
+        created_at, expires_at, respondida e sincronizada.
+        """
+        linhas = self._conexao().execute('''
+            SELECT c.token,
+                   json_extract(c.dados, '$.cotacao_id') AS cotacao_id,
+                   json_extract(c.dados, '$.fornecedor.nome') AS fornecedor_nome,
+                   c.status, c.created_at, c.expires_at,
+                   EXISTS (SELECT 1 FROM respostas r WHERE r.token = c.token) AS respondida,
+                   EXISTS (SELECT 1 FROM sincronizacoes s WHERE s.token = c.token) AS sincronizada
+            FROM cotacoes c
+            ORDER BY c.created_at
+        ''').fetchall()
+        return [dict(l, respondida=bool(l['respondida']), sincronizada=bool(l['sincronizada'])) for l in linhas]
+
+    def remover_cotacao(self, token):
+        """Remove a cotação e a resposta do token. Retorna True se a cotação existia."""
+        def operacoes(conn):
+            removida = conn.execute('DELETE FROM cotacoes WHERE token = ?', (token,)).rowcount > 0
+            conn.execute('DELETE FROM respostas WHERE token = ?', (token,))
+            return removida
+        return self._transacao(operacoes)
+
+    # -------------------------------------------------------------------------
+    # Respostas
+    # -------------------------------------------------------------------------
+
+    def registrar_resposta(self, token, resposta):
+        """
+        Grava a resposta e marca a cotação como 'respondida' na mesma transação.
+        Retorna False se o token já tinha resposta (não sobrescreve).
+        """
+        def operacoes(conn):
+            if conn.execute('SELECT 1 FROM respostas WHERE token = ?', (token,)).fetchone():
+                return False
+            conn.execute("UPDATE contadores SET valor = valor + 1 WHERE nome = 'seq_respostas'")
+            conn.execute('''
+                INSERT INTO respostas (token, dados, submitted_at, seq)
+                VALUES (?, ?, ?, (SELECT valor FROM contadores WHERE nome = 'seq_respostas'))
+            ''', (token, json.dumps(resposta['dados'], ensure_ascii=False),
+                  _para_iso(resposta['submitted_at'])))
+            conn.execute("UPDATE cotacoes SET status = 'respondida' WHERE token = ?", (token,))
+            return True
+        return self._transacao(operacoes)
+
+    def obter_resposta(self, token):
+        linha = self._conexao().execute('SELECT * FROM respostas WHERE token = ?', (token,)).fetchone()
+        if not linha:
+            return None
+        return {'dados': json.loads(linha['dados']), 'submitted_at': _de_iso(linha['submitted_at'])}
+
+    def obter_respostas(self, tokens):
+        """Respostas de vários tokens: { token: resposta } (tokens sem resposta ficam de fora)"""
+        tokens = list(dict.fromkeys(tokens))
+        respostas = {}
+        for i in range(0, len(tokens), TAMANHO_LOTE_SQL):
+            bloco = tokens[i:i + TAMANHO_LOTE_SQL]
+            linhas = self._conexao().execute(
+                f'SELECT * FROM respostas WHERE token IN ({",".join("?" * len(bloco))})', bloco).fetchall()
+            for l in linhas:
+                respostas[l['token']] = {'dados': json.loads(l['dados']), 'submitted_at': _de_iso(l['submitted_at'])}
+        return respostas
+
+    def tem_resposta(self, token):
+        return self._conexao().execute(
+            'SELECT 1 FROM respostas WHERE token = ?', (token,)).fetchone() is not None
+
+    def tokens_respondidos(self):
+        return {l['token'] for l in self._conexao().execute('SELECT token FROM respostas').fetchall()}
+
+    def listar_respostas(self, somente_pendentes=False):
+        """
+        Respostas em ordem de envio: { token: resposta }.
+        somente_pendentes=True exclui as já confirmadas pelo sistema local.
+        """
+        sql = 'SELECT r.* FROM respostas r'
+        if somente_pendentes:
+            sql += ' WHERE NOT EXISTS (SELECT 1 FROM sincronizacoes s WHERE s.token = r.token)'
+        sql += ' ORDER BY r.submitted_at'
+        return {
+            l['token']: {'dados': json.loads(l['dados']), 'submitted_at': _de_iso(l['submitted_at'])}
+            for l in self._conexao().execute(sql).fetchall()
+        }
+
+    def listar_indice_respostas(self):
+        """Índice leve das respostas (token, cotacao_id, fornecedor_id, fornecedor_nome, submitted_at)"""
+        linhas = self._conexao().execute('''
+            SELECT token,
+                   json_extract(dados, '$.cotacao_id') AS cotacao_id,
+                   json_extract(dados, '$.fornecedor_id') AS fornecedor_id,
+                   json_extract(dados, '$.fornecedor_nome') AS fornecedor_nome,
+                   submitted_at
+            FROM respostas
+            ORDER BY submitted_at
+        ''').fetchall()
+        return [dict(l) for l in linhas]
+
+    def listar_respostas_desde(self, cursor=0, limite=500):
+        """
+        Feed incremental: respostas ainda não sincronizadas com seq > cursor, em ordem de seq.
+
+        Returns:
+            lista de (seq, token, resposta)
+        """
+        linhas = self._conexao().execute('''
+            SELECT r.* FROM respostas r
+            WHERE r.seq > ?
+              AND NOT EXISTS (SELECT 1 FROM sincronizacoes s WHERE s.token = r.token)
+            ORDER BY r.seq
+            LIMIT ?
+        ''', (cursor, limite)).fetchall()
+        return [
+            (l['seq'], l['token'], {'dados': json.loads(l['dados']), 'submitted_at': _de_iso(l['submitted_at'])})
+            for l in linhas
+        ]
+
+    def versao_feed(self):
+        """
+        (última seq de resposta, nº de confirmações já feitas): muda sempre que
+        uma resposta é gravada ou confirmada. Usado como base do ETag do feed.
+        """
+        linhas = self._conexao().execute(
+            "SELECT nome, valor FROM contadores WHERE nome IN ('seq_respostas', 'seq_confirmacoes')").fetchall()
+        valores = {l['nome']: l['valor'] for l in linhas}
+        return valores.get('seq_respostas', 0), valores.get('seq_confirmacoes', 0)
+
+    # -------------------------------------------------------------------------
+    # Sincronização com o sistema local
+    # -------------------------------------------------------------------------
+
+    def marcar_sincronizada(self, token):
+        def operacoes(conn):
+            inserida = conn.execute('''
+                INSERT OR IGNORE INTO sincronizacoes (token, confirmado_em) VALUES (?, ?)
+            ''', (token, datetime.now().isoformat())).rowcount > 0
+            if inserida:
+                conn.execute("UPDATE contadores SET valor = valor + 1 WHERE nome = 'seq_confirmacoes'")
+            return inserida
+        return self._transacao(operacoes)
+
+    def marcar_sincronizadas(self, tokens):
+        """
+        Confirma vários tokens em uma única transação.
+        Retorna a lista dos tokens que ainda não estavam confirmados.
+        """
+        tokens = list(dict.fromkeys(tokens))
+
+        def operacoes(conn):
+            agora = datetime.now().isoformat()
+            novos = []
+            for token in tokens:
+                if conn.execute('INSERT OR IGNORE INTO sincronizacoes (token, confirmado_em) VALUES (?, ?)',
+                                (token, agora)).rowcount > 0:
+                    novos.append(token)
+            if novos:
+                conn.execute("UPDATE contadores SET valor = valor + ? WHERE nome = 'seq_confirmacoes'", (len(novos),))
+            return novos
+        return self._transacao(operacoes)
+
+    def esta_sincronizada(self, token):
+        return self._conexao().execute(
+            'SELECT 1 FROM sincronizacoes WHERE token = ?', (token,)).fetchone() is not None
+
+    def listar_sincronizadas(self):
+        return {l['token'] for l in self._conexao().execute('SELECT token FROM sincronizacoes').fetchall()}
+
+    # -------------------------------------------------------------------------
+    # Estatísticas e migração
+    # -------------------------------------------------------------------------
+
+    def contar(self):
+        """Contadores mantidos pelos triggers: cotacoes, respostas, sincronizadas, pendentes, arquivadas"""
+        linhas = self._conexao().execute('SELECT nome, valor FROM contadores').fetchall()
+        return {l['nome']: l['valor'] for l in linhas}
+
+    def contar_por_validade(self, agora=None):
+        """
+        Cotações ativas (status 'ativa' e dentro do prazo) e expiradas.
+        Dependem do horário, então são contadas pelos índices de expires_at.
+        """
+        agora = _para_iso(agora or datetime.now())
+        conn = self._conexao()
+        return {
+            'ativas': conn.execute(
+                "SELECT COUNT(*) FROM cotacoes WHERE status = 'ativa' AND expires_at >= ?", (agora,)).fetchone()[0],
+            'expiradas': conn.execute(
+                'SELECT COUNT(*) FROM cotacoes WHERE expires_at < ?', (agora,)).fetchone()[0]
+        }
+
+    # -------------------------------------------------------------------------
+    # Arquivamento (limpeza do conjunto "quente")
+    # -------------------------------------------------------------------------
+
+    def arquivar_antigos(self, caminho_arquivo, retencao_expiradas_horas, retencao_sincronizadas_horas,
+                         limite=500, agora=None):
+        """
+        Move para o arquivo frio (JSON lines + gzip, um membro gzip por lote) e
+        apaga do banco:
+        - cotações expiradas há mais de retencao_expiradas_horas, desde que não
+          tenham resposta pendente de sincronização;
+        - cotações cuja resposta foi confirmada pelo sistema local há mais de
+          retencao_sincronizadas_horas.
+        Confirmações órfãs (sem cotação) mais antigas que a retenção também são removidas.
+
+        Roda dentro de BEGIN IMMEDIATE: apenas um worker arquiva por vez.
+
+        Returns:
+            Quantidade de tokens arquivados neste lote
+        """
+        agora = agora or datetime.now()
+        limite_expiradas = (agora - timedelta(hours=retencao_expiradas_horas)).isoformat()
+        limite_sincronizadas = (agora - timedelta(hours=retencao_sincronizadas_horas)).isoformat()
+
+        def operacoes(conn):
+            linhas = conn.execute('''
+                SELECT c.token, c.dados, c.created_at, c.expires_at, c.status,
+                       r.dados AS resposta_dados, r.submitted_at, s.confirmado_em
+                FROM cotacoes c
+                LEFT JOIN respostas r ON r.token = c.token
+                LEFT JOIN sincronizacoes s ON s.token = c.token
+                WHERE (c.expires_at < ? AND (r.token IS NULL OR s.token IS NOT NULL))
+                   OR (s.confirmado_em < ? AND r.token IS NOT NULL)
+                LIMIT ?
+            ''', (limite_expiradas, limite_sincronizadas, limite)).fetchall()
+
+            if linhas:
+                arquivado_em = datetime.now().isoformat()
+                with gzip.open(caminho_arquivo, 'at', encoding='utf-8') as f:
+                    for l in linhas:
+                        f.write(json.dumps({
+                            'token': l['token'],
+                            'cotacao': {
+                                'dados': json.loads(l['dados']),
+                                'created_at': l['created_at'],
+                                'expires_at': l['expires_at'],
+                                'status': l['status']
+                            },
+                            'resposta': {
+                                'dados': json.loads(l['resposta_dados']),
+                                'submitted_at': l['submitted_at']
+                            } if l['resposta_dados'] else None,
+                            'sincronizada_em': l['confirmado_em'],
+                            'arquivado_em': arquivado_em
+                        }, ensure_ascii=False) + '\n')
+
+                tokens = [(l['token'],) for l in linhas]
+                conn.executemany('DELETE FROM cotacoes WHERE token = ?', tokens)
+                conn.executemany('DELETE FROM respostas WHERE token = ?', tokens)
+                conn.executemany('DELETE FROM sincronizacoes WHERE token = ?', tokens)
+                conn.execute("UPDATE contadores SET valor = valor + ? WHERE nome = 'arquivadas'", (len(linhas),))
+
+            conn.execute('''
+                DELETE FROM sincronizacoes
+                WHERE confirmado_em < ? AND NOT EXISTS (SELECT 1 FROM cotacoes c WHERE c.token = sincronizacoes.token)
+            ''', (limite_sincronizadas,))
+            return len(linhas)
+
+        return self._transacao(operacoes)
+
+    def compactar(self):
+        """Devolve ao sistema de arquivos o espaço liberado pelo arquivamento"""
+        conn = self._conexao()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA incremental_vacuum')
+
+    def migrar_json(self, caminho_json):
+        """
+        Importa o antigo cotacoes_storage.json (uma única transação) e renomeia
+        o arquivo para '<arquivo>.migrado'. Tokens já existentes no banco são mantidos.
+
+        Returns:
+            dict com as quantidades importadas, ou None se não havia arquivo
+        """
+        try:
+            with open(caminho_json, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+        except FileNotFoundError:
+            # Não há arquivo (ou outro worker já migrou)
+            return None
+
+        agora = datetime.now().isoformat()
+        cotacoes = [
+            (token, json.dumps(c['dados'], ensure_ascii=False), _para_iso(c['created_at']),
+             _para_iso(c['expires_at']), c.get('status', 'ativa'))
+            for token, c in dados.get('cotacoes_ativas', {}).items()
+        ]
+        respostas = [
+            (token, json.dumps(r.get('dados', r), ensure_ascii=False), r.get('submitted_at') or agora)
+            for token, r in dados.get('respostas_enviadas', {}).items()
+        ]
+        sincronizadas = [(token, agora) for token in dados.get('respostas_sincronizadas', [])]
+
+        def operacoes(conn):
+            conn.executemany('''
+                INSERT OR IGNORE INTO cotacoes (token, dados, created_at, expires_at, status)
+                VALUES (?, ?, ?, ?, ?)
+            ''', cotacoes)
+            conn.executemany(
+                'INSERT OR IGNORE INTO respostas (token, dados, submitted_at) VALUES (?, ?, ?)', respostas)
+            conn.executemany(
+                'INSERT OR IGNORE INTO sincronizacoes (token, confirmado_em) VALUES (?, ?)', sincronizadas)
+            self._numerar_respostas(conn)
+        self._transacao(operacoes)
+
+        try:
+            os.replace(caminho_json, caminho_json + '.migrado')
+        except FileNotFoundError:
+            pass
+        return {'cotacoes': len(cotacoes), 'respostas': len(respostas), 'sincronizadas': len(sincronizadas)}
+
+    def tamanho_bytes(self):
+        """Tamanho do banco + WAL em disco"""
+        total = 0
+        for sufixo in ('', '-wal'):
+            if os.path.exists(self.caminho + sufixo):
+                total += os.path.getsize(self.caminho + sufixo)
+        return total
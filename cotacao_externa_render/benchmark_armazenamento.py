@@ -0,0 +1,94 @@
+"""
+BENCHMARK - ARMAZENAMENTO DA COTAÇÃO EXTERNA
+Compara a latência de gravação do antigo modelo (reescrever todo o JSON a cada
+alteração) com o repositório SQLite (gravação por token), à medida que o
+histórico cresce.
+
+Uso:
+    python benchmark_armazenamento.py [total_tokens] [tamanho_bloco]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from armazenamento import RepositorioCotacoes
+
+
+def _cotacao_exemplo(i):
+    agora = datetime.now()
+    return {
+        'dados': {
+            'cotacao_id': i,
+            'codigo': f'COT-{i:06d}',
+            'fornecedor': {'id': i, 'nome': f'Fornecedor {i}', 'email': f'f{i}@exemplo.com'},
+            'itens': [
+                {'id': j, 'descricao': f'Produto {j} da cotação {i}', 'quantidade': 10, 'unidade': 'UN'}
+                for j in range(5)
+            ]
+        },
+        'created_at': agora,
+        'expires_at': agora + timedelta(hours=72),
+        'status': 'ativa'
+    }
+
+
+def _gravar_json(caminho, cotacoes):
+    """Reproduz o antigo salvar_dados_persistentes(): reescreve tudo com indent=2"""
+    dados = {
+        'cotacoes_ativas': {
+            token: {
+                'dados': c['dados'],
+                'created_at': c['created_at'].isoformat(),
+                'expires_at': c['expires_at'].isoformat(),
+                'status': c['status']
+            }
+            for token, c in cotacoes.items()
+        },
+        'respostas_enviadas': {},
+        'respostas_sincronizadas': [],
+        'salvo_em': datetime.now().isoformat()
+    }
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    bloco = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_json = os.path.join(pasta, 'cotacoes_storage.json')
+        repositorio = RepositorioCotacoes(os.path.join(pasta, 'cotacoes_storage.db'))
+        cotacoes = {}
+
+        print('=' * 70)
+        print(f'BENCHMARK ARMAZENAMENTO - {total} tokens, média por bloco de {bloco}')
+        print('=' * 70)
+        print(f'{"histórico":>10} | {"JSON (ms/gravação)":>20} | {"SQLite (ms/gravação)":>22}')
+        print('-' * 70)
+
+        tempo_json = tempo_sqlite = 0.0
+        for i in range(1, total + 1):
+            token = f'token-{i:08d}'
+            cotacoes[token] = _cotacao_exemplo(i)
+
+            inicio = time.perf_counter()
+            _gravar_json(caminho_json, cotacoes)
+            tempo_json += time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            repositorio.salvar_cotacao(token, cotacoes[token])
+            tempo_sqlite += time.perf_counter() - inicio
+
+            if i % bloco == 0:
+                print(f'{i:>10} | {tempo_json / bloco * 1000:>20.2f} | {tempo_sqlite / bloco * 1000:>22.3f}')
+                tempo_json = tempo_sqlite = 0.0
+
+        print('=' * 70)
+
+
+if __name__ == '__main__':
+    main()
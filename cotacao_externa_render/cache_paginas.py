@@ -0,0 +1,96 @@
+"""
+=============================================================================
+CACHE DE PÁGINAS - COTAÇÃO EXTERNA (RENDER)
+=============================================================================
+Guarda o HTML já renderizado da página do fornecedor, por token, junto com as
+versões comprimidas (gzip e, se o pacote brotli estiver instalado, br).
+
+- A chave de validade (ETag) vem do banco (ver RepositorioCotacoes.versao_pagina):
+  muda quando a cotação é regravada ou respondida, então cada worker do gunicorn
+  descarta sozinho a versão antiga mesmo sem ter recebido a resposta
+- Recarregar a página com o mesmo ETag → 304 sem renderizar nem ler o JSON
+- Limite de memória por worker (LRU por bytes)
+=============================================================================
+"""
+
+import gzip
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # opcional: sem o pacote, só gzip
+    brotli = None
+
+
+class CachePaginas:
+    """LRU em memória: { token: {'etag', 'identity', 'gzip', 'br'} }"""
+
+    def __init__(self, max_bytes=20 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.renderizacoes = 0
+
+    @staticmethod
+    def _tamanho(entrada):
+        return sum(len(entrada[c]) for c in ('identity', 'gzip', 'br') if entrada[c])
+
+    def obter(self, token, etag):
+        """Entrada do token se ainda estiver na versão etag"""
+        with self._lock:
+            entrada = self._entradas.get(token)
+            if entrada is None or entrada['etag'] != etag:
+                return None
+            self._entradas.move_to_end(token)
+            self.acertos += 1
+            return entrada
+
+    def guardar(self, token, etag, html):
+        """Comprime e guarda o HTML renderizado. Retorna a entrada."""
+        corpo = html.encode('utf-8')
+        entrada = {
+            'etag': etag,
+            'identity': corpo,
+            'gzip': gzip.compress(corpo, compresslevel=6),
+            'br': brotli.compress(corpo) if brotli else None
+        }
+        with self._lock:
+            self.renderizacoes += 1
+            self._remover(token)
+            self._entradas[token] = entrada
+            self._bytes += self._tamanho(entrada)
+            while self._bytes > self.max_bytes and len(self._entradas) > 1:
+                self._remover(next(iter(self._entradas)))
+        return entrada
+
+    def _remover(self, token):
+        entrada = self._entradas.pop(token, None)
+        if entrada:
+            self._bytes -= self._tamanho(entrada)
+
+    def invalidar(self, token):
+        with self._lock:
+            self._remover(token)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'paginas': len(self._entradas),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'acertos': self.acertos,
+                'renderizacoes': self.renderizacoes,
+                'brotli': brotli is not None
+            }
+
+
+def escolher_codificacao(aceitas):
+    """'br', 'gzip' ou 'identity' conforme o Accept-Encoding (werkzeug Accept)"""
+    if brotli and 'br' in aceitas:
+        return 'br'
+    if 'gzip' in aceitas:
+        return 'gzip'
+    return 'identity'
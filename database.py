@@ -11,12 +11,17 @@
 
 import sqlite3
 import os
+import atexit
+import queue
+import socket
+import threading
+import time
 from datetime import datetime
 import uuid
 import json
 
-# Caminho do banco de dados
-DB_PATH = os.path.join(os.path.dirname(__file__), 'cotacoes.db')
+# Caminho do banco de dados (COTACOES_DB_PATH permite usar outro arquivo, ex.: benchmarks)
+DB_PATH = os.environ.get('COTACOES_DB_PATH') or os.path.join(os.path.dirname(__file__), 'cotacoes.db')
 
 def get_db_connection():
     """Retorna uma conexão com o banco de dados SQLite"""
@@ -451,7 +456,7 @@ def init_database():
     
     # Índice para busca rápida de cotações não sincronizadas
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_cotacoes_externas_sync ON cotacoes_externas(sincronizada, status)')
-
+    
     # ==========================================================================
     # TABELA: PEDIDOS DE COMPRA
     # ==========================================================================
@@ -539,11 +544,285 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_pedido_itens_sc ON pedido_itens(numero_sc, item_sc)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_envio_tipo_id ON email_envios_historico(tipo, identificador)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_envio_data ON email_envios_historico(data_envio)')
-
+    
     conn.commit()
+
+    # Migrações versionadas (índices e ajustes de schema posteriores)
+    aplicar_migracoes(conn)
+    otimizar_banco(conn)
+
     conn.close()
     print("[DB] Banco de dados inicializado com sucesso!")
 
+
+# =============================================================================
+# MIGRAÇÕES VERSIONADAS DO SCHEMA
+# =============================================================================
+# Cada migração tem um número de versão crescente, uma descrição e a lista de
+# comandos SQL. A versão aplicada fica registrada na tabela schema_versao, de
+# modo que cada migração roda uma única vez por banco.
+# Para adicionar uma nova migração, acrescente uma tupla ao final da lista
+# com o próximo número de versão. NUNCA altere migrações já publicadas.
+# Cada comando pode ser uma string SQL ou uma função que recebe o cursor.
+# =============================================================================
+
+def _adicionar_coluna_se_nao_existir(tabela, coluna, definicao):
+    """Gera um passo de migração que adiciona a coluna apenas se ela ainda não existir"""
+    def passo(cursor):
+        cursor.execute(f'PRAGMA table_info({tabela})')
+        colunas = [row[1] for row in cursor.fetchall()]
+        if coluna not in colunas:
+            cursor.execute(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}')
+    return passo
+
+
+# Arquivos legados das anotações dos indicadores (lidos só pela migração 2;
+# ficam no repositório, a migração não os altera)
+ANOTACOES_JSON_LEGADO = [
+    ('variacao', os.path.join(os.path.dirname(__file__), 'anotacoes_variacao.json')),
+    ('otd', os.path.join(os.path.dirname(__file__), 'anotacoes_otd.json')),
+]
+
+
+def _importar_anotacoes_json_legado(cursor):
+    """
+    Passo da migração 2: importa os arquivos JSON legados. Roda uma vez por
+    banco (schema_versao) e não sobrescreve anotações já gravadas.
+    """
+    for escopo, caminho in ANOTACOES_JSON_LEGADO:
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                anotacoes = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            print(f"[DB] Aviso: {caminho} não importado: {e}")
+            continue
+        registros = _registros_anotacoes(escopo, anotacoes or {})
+        cursor.executemany('''
+            INSERT INTO anotacoes_indicadores (escopo, chave, texto, usuario, data, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(escopo, chave) DO NOTHING
+        ''', registros)
+        print(f"[DB] Anotações '{escopo}' importadas de {os.path.basename(caminho)}: {len(registros)} registros")
+
+
+MIGRACOES = [
+    (1, 'Índices para consultas frequentes (respostas, rodadas, externas, histórico)', [
+        # Bancos antigos criaram cotacao_anexos sem a coluna de soft delete
+        _adicionar_coluna_se_nao_existir('cotacao_anexos', 'ativo', 'INTEGER DEFAULT 1'),
+        'CREATE INDEX IF NOT EXISTS idx_respostas_fornecedor_item ON cotacao_respostas(fornecedor_id, item_id)',
+        'CREATE INDEX IF NOT EXISTS idx_respostas_cotacao ON cotacao_respostas(cotacao_id)',
+        'CREATE INDEX IF NOT EXISTS idx_rodadas_cotacao_fornecedor ON cotacao_rodadas_negociacao(cotacao_id, fornecedor_id)',
+        'CREATE INDEX IF NOT EXISTS idx_cotacoes_externas_status_sync ON cotacoes_externas(status, sincronizada)',
+        'CREATE INDEX IF NOT EXISTS idx_pedido_numero ON pedidos_compra(numero_pedido)',
+        'CREATE INDEX IF NOT EXISTS idx_cotacao_itens_cotacao ON cotacao_itens(cotacao_id)',
+        'CREATE INDEX IF NOT EXISTS idx_cotacao_fornecedores_cotacao ON cotacao_fornecedores(cotacao_id)',
+        'CREATE INDEX IF NOT EXISTS idx_historico_cotacao_data ON cotacao_historico(cotacao_id, data_hora)',
+        'CREATE INDEX IF NOT EXISTS idx_anexos_fornecedor ON cotacao_anexos(fornecedor_id, ativo)',
+        'CREATE INDEX IF NOT EXISTS idx_pedido_historico_pedido ON pedido_historico(pedido_id)',
+    ]),
+    (2, 'Tabela de anotações dos indicadores (substitui anotacoes_variacao.json / anotacoes_otd.json)', [
+        '''
+        CREATE TABLE IF NOT EXISTS anotacoes_indicadores (
+            escopo TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            usuario TEXT,
+            data TEXT,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (escopo, chave)
+        )
+        ''',
+        _importar_anotacoes_json_legado,
+    ]),
+    (3, 'Anexos endereçados pelo conteúdo (SHA-256) com contagem de referências', [
+        _adicionar_coluna_se_nao_existir('cotacao_anexos', 'hash_conteudo', 'TEXT'),
+        _adicionar_coluna_se_nao_existir('cotacao_anexos', 'rodada', 'INTEGER DEFAULT 1'),
+        '''
+        CREATE TABLE IF NOT EXISTS anexos_conteudo (
+            hash_conteudo TEXT PRIMARY KEY,
+            caminho_arquivo TEXT NOT NULL,
+            tamanho_bytes INTEGER,
+            mime_type TEXT,
+            referencias INTEGER NOT NULL DEFAULT 0,
+            miniatura TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_anexos_hash ON cotacao_anexos(hash_conteudo)',
+        'CREATE INDEX IF NOT EXISTS idx_anexos_cotacao ON cotacao_anexos(cotacao_id)',
+        'CREATE INDEX IF NOT EXISTS idx_anexos_conteudo_referencias ON anexos_conteudo(referencias)',
+    ]),
+    (4, 'Versão do conteúdo dos arquivos JSON/HTML gerados para o fornecedor (reaproveitamento)', [
+        _adicionar_coluna_se_nao_existir('cotacao_json_envios', 'versao_conteudo', 'TEXT'),
+        'CREATE INDEX IF NOT EXISTS idx_json_envio_versao ON cotacao_json_envios(fornecedor_id, versao_conteudo)',
+    ]),
+    (5, 'Fila de saída de e-mails (enviada em segundo plano - fila_email.py), com reserva por dono e prazo', [
+        '''
+        CREATE TABLE IF NOT EXISTS email_fila (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lote_id TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            identificador TEXT NOT NULL,
+            destinatarios TEXT NOT NULL,
+            assunto TEXT,
+            corpo TEXT,
+            mensagem TEXT NOT NULL,
+            enviado_por TEXT,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER DEFAULT 0,
+            proxima_tentativa TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            erro TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            enviado_em TIMESTAMP,
+            reservado_em TIMESTAMP,
+            reservado_por TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_email_fila_status ON email_fila(status, proxima_tentativa)',
+        'CREATE INDEX IF NOT EXISTS idx_email_fila_lote ON email_fila(lote_id)',
+        # Regra de 24h: mensagens ainda na fila contam como enviadas
+        'CREATE INDEX IF NOT EXISTS idx_email_fila_tipo_id ON email_fila(tipo, identificador, status)',
+    ]),
+    (6, 'Importações de respostas do Render (uma linha por token; importação idempotente)', [
+        # Garante que cada resposta do Render seja importada uma única vez, mesmo
+        # com o sincronizador e uma aba (ou dois workers) processando ao mesmo tempo
+        '''
+        CREATE TABLE IF NOT EXISTS cotacao_importacoes_render (
+            token TEXT PRIMARY KEY,
+            cotacao_id INTEGER,
+            fornecedor_id INTEGER,
+            respondido_em TEXT,
+            itens_processados INTEGER DEFAULT 0,
+            origem TEXT,
+            importado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+]
+
+
+def obter_versao_schema(conn=None):
+    """Retorna a versão atual do schema (0 se nenhuma migração foi aplicada)"""
+    fechar = conn is None
+    if conn is None:
+        conn = get_db_connection()
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_versao (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT,
+            aplicado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT MAX(versao) FROM schema_versao')
+    versao = cursor.fetchone()[0] or 0
+
+    if fechar:
+        conn.close()
+    return versao
+
+
+def aplicar_migracoes(conn=None):
+    """
+    Aplica as migrações pendentes em ordem de versão.
+    Cada migração roda em sua própria transação junto com o registro da versão,
+    então uma falha no meio não deixa o banco marcado como migrado.
+
+    Returns:
+        Lista com as versões aplicadas nesta chamada
+    """
+    fechar = conn is None
+    if conn is None:
+        conn = get_db_connection()
+
+    versao_atual = obter_versao_schema(conn)
+    aplicadas = []
+
+    for versao, descricao, comandos in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            for comando in comandos:
+                if callable(comando):
+                    comando(cursor)
+                else:
+                    cursor.execute(comando)
+            cursor.execute('INSERT INTO schema_versao (versao, descricao) VALUES (?, ?)', (versao, descricao))
+            conn.commit()
+            aplicadas.append(versao)
+            print(f"[DB] Migração {versao} aplicada: {descricao}")
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB] ERRO na migração {versao}: {e}")
+            break
+
+    # Estatísticas novas são necessárias para o planejador usar os índices criados
+    if aplicadas:
+        conn.execute('ANALYZE')
+        conn.commit()
+
+    if fechar:
+        conn.close()
+    return aplicadas
+
+
+def otimizar_banco(conn=None):
+    """
+    Executa PRAGMA optimize para atualizar estatísticas do planejador de consultas.
+    Barato quando não há nada a fazer; recomendado pelo SQLite na abertura/fechamento.
+    """
+    fechar = conn is None
+    if conn is None:
+        conn = get_db_connection()
+
+    try:
+        conn.execute('PRAGMA optimize')
+    except sqlite3.Error as e:
+        print(f"[DB] Aviso: PRAGMA optimize falhou: {e}")
+
+    if fechar:
+        conn.close()
+
+
+def relatorio_plano_consultas(consultas):
+    """
+    Executa EXPLAIN QUERY PLAN nas consultas informadas e sinaliza varreduras completas.
+
+    Args:
+        consultas: Lista de tuplas (nome, sql, parametros)
+
+    Returns:
+        Lista de dicts com: nome, plano (lista de linhas), varredura_completa (bool)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    relatorio = []
+
+    for nome, sql, params in consultas:
+        try:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plano = [row['detail'] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            relatorio.append({'nome': nome, 'plano': [f'ERRO: {e}'], 'varredura_completa': False})
+            continue
+
+        # "SCAN tabela" sem índice = leitura da tabela inteira
+        # ("SCAN ... USING INDEX" / "USING COVERING INDEX" percorre apenas o índice)
+        varredura = any(
+            linha.startswith('SCAN ') and 'USING' not in linha and 'CONSTANT ROW' not in linha
+            for linha in plano
+        )
+        relatorio.append({'nome': nome, 'plano': plano, 'varredura_completa': varredura})
+
+    conn.close()
+    return relatorio
+
 # =============================================================================
 # FUNÇÕES: COTAÇÕES
 # =============================================================================
@@ -609,16 +888,13 @@ def criar_cotacao(comprador, observacoes='', usuario='Admin', nome_customizado=N
     
     cotacao_id = cursor.lastrowid
     
-    # Registrar no histórico
-    descricao_hist = 'Cotação criada' if tipo_origem == 'Solicitacao' else 'Orçamento Manual criado'
-    cursor.execute('''
-        INSERT INTO cotacao_historico (cotacao_id, acao, descricao, usuario)
-        VALUES (?, 'CRIACAO', ?, ?)
-    ''', (cotacao_id, descricao_hist, usuario))
-    
     conn.commit()
     conn.close()
     
+    # Registrar no histórico
+    descricao_hist = 'Cotação criada' if tipo_origem == 'Solicitacao' else 'Orçamento Manual criado'
+    registrar_evento_cotacao(cotacao_id, 'CRIACAO', descricao_hist, usuario)
+    
     return cotacao_id, codigo
 
 def adicionar_itens_cotacao(cotacao_id, itens):
@@ -653,6 +929,8 @@ def adicionar_itens_cotacao(cotacao_id, itens):
     
     conn.commit()
     conn.close()
+    
+    registrar_evento_cotacao(cotacao_id, 'ITENS', f'{len(itens)} item(ns) adicionado(s)')
 
 def listar_cotacoes(status=None, comprador=None, busca=None, tipo_origem=None, limit=100):
     """
@@ -729,7 +1007,11 @@ def obter_cotacao(cotacao_id):
     cursor.execute('''
         SELECT f.*, 
                (SELECT COUNT(*) FROM cotacao_respostas r 
-                WHERE r.fornecedor_id = f.id AND r.arquivo_anexo IS NOT NULL AND r.arquivo_anexo != '') as tem_anexo
+                WHERE r.fornecedor_id = f.id AND r.arquivo_anexo IS NOT NULL AND r.arquivo_anexo != '') as tem_anexo,
+               (SELECT CASE WHEN c.miniatura IS NOT NULL THEN c.hash_conteudo END
+                FROM cotacao_anexos a LEFT JOIN anexos_conteudo c ON c.hash_conteudo = a.hash_conteudo
+                WHERE a.fornecedor_id = f.id AND a.ativo = 1 AND a.rodada = 1
+                ORDER BY a.id DESC LIMIT 1) as miniatura_anexo
         FROM cotacao_fornecedores f 
         WHERE f.cotacao_id = ?
     ''', (cotacao_id,))
@@ -779,14 +1061,11 @@ def atualizar_status_cotacao(cotacao_id, novo_status, usuario='Admin'):
         UPDATE cotacoes SET status = ?, atualizado_em = ? WHERE id = ?
     ''', (novo_status, datetime.now(), cotacao_id))
     
-    # Histórico
-    cursor.execute('''
-        INSERT INTO cotacao_historico (cotacao_id, acao, descricao, usuario)
-        VALUES (?, 'STATUS', ?, ?)
-    ''', (cotacao_id, f'Status alterado para: {novo_status}', usuario))
-    
     conn.commit()
     conn.close()
+    
+    # Histórico
+    registrar_evento_cotacao(cotacao_id, 'STATUS', f'Status alterado para: {novo_status}', usuario)
 
 
 def atualizar_cotacao(cotacao_id, codigo=None, comprador=None, observacoes=None, informacao_fornecedor=None, usuario='Admin'):
@@ -821,14 +1100,10 @@ def atualizar_cotacao(cotacao_id, codigo=None, comprador=None, observacoes=None,
         
         query = f"UPDATE cotacoes SET {', '.join(campos)} WHERE id = ?"
         cursor.execute(query, valores)
+        conn.commit()
         
         # Histórico
-        cursor.execute('''
-            INSERT INTO cotacao_historico (cotacao_id, acao, descricao, usuario)
-            VALUES (?, 'EDICAO', 'Cotação editada', ?)
-        ''', (cotacao_id, usuario))
-        
-        conn.commit()
+        registrar_evento_cotacao(cotacao_id, 'EDICAO', 'Cotação editada', usuario)
     
     conn.close()
 
@@ -838,12 +1113,20 @@ def excluir_cotacao(cotacao_id, usuario='Admin'):
     Exclui uma cotação e todos os seus dados relacionados.
     IMPORTANTE: Só chamar após verificar que a cotação pode ser excluída.
     """
+    # Grava os eventos pendentes antes de abrir a transação: o escritor usa outra
+    # conexão e, com esta transação aberta, esperaria o lock e regravaria o lote
+    # depois do DELETE (histórico órfão)
+    descarregar_eventos()
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Excluir respostas
     cursor.execute('DELETE FROM cotacao_respostas WHERE cotacao_id = ?', (cotacao_id,))
     
+    # Excluir anexos (os arquivos sem referência são removidos pela coleta - ver armazenamento_anexos.py)
+    _liberar_anexos(cursor, 'cotacao_id = ?', (cotacao_id,))
+    
     # Excluir fornecedores
     cursor.execute('DELETE FROM cotacao_fornecedores WHERE cotacao_id = ?', (cotacao_id,))
     
@@ -947,6 +1230,9 @@ def excluir_fornecedor_cotacao(fornecedor_id):
     # Excluir respostas deste fornecedor
     cursor.execute('DELETE FROM cotacao_respostas WHERE fornecedor_id = ?', (fornecedor_id,))
     
+    # Excluir anexos deste fornecedor (libera as referências ao conteúdo)
+    _liberar_anexos(cursor, 'fornecedor_id = ?', (fornecedor_id,))
+    
     # Excluir o fornecedor da cotação
     cursor.execute('DELETE FROM cotacao_fornecedores WHERE id = ?', (fornecedor_id,))
     
@@ -1058,6 +1344,9 @@ def registrar_resposta_fornecedor(cotacao_id, fornecedor_id, item_id, preco, pra
     
     conn.commit()
     conn.close()
+    
+    registrar_evento_cotacao(cotacao_id, 'RESPOSTA', 'Resposta de fornecedor registrada',
+                             dados={'fornecedor_id': fornecedor_id, 'item_id': item_id, 'preco': preco, 'prazo': prazo})
 
 
 def atualizar_resposta_fornecedor(resposta_id, preco=None, prazo=None, condicao=None, frete=None, observacao=None, allow_null=False):
@@ -1156,6 +1445,39 @@ def obter_resposta_por_id(resposta_id):
 # =============================================================================
 # FUNÇÕES: ANOTAÇÕES DAS SOLICITAÇÕES (Cores e Observações)
 # =============================================================================
+# As tabelas solicitacao_anotacoes e solicitacao_atribuicoes são lidas inteiras
+# a cada renderização de /solicitacoes. As leituras completas passam por um
+# cache em memória, invalidado nas escritas deste processo e com TTL curto
+# para enxergar escritas de outros workers.
+# =============================================================================
+
+SOLICITACOES_CACHE_TTL = 30  # segundos
+_solicitacoes_cache = {}  # { tabela: (timestamp, [linhas]) }
+_solicitacoes_lock = threading.Lock()
+
+
+def _invalidar_cache_solicitacoes(tabela):
+    with _solicitacoes_lock:
+        _solicitacoes_cache.pop(tabela, None)
+
+
+def _ler_tabela_solicitacoes(tabela):
+    """Retorna todas as linhas (dicts) de solicitacao_anotacoes/solicitacao_atribuicoes via cache"""
+    with _solicitacoes_lock:
+        em_cache = _solicitacoes_cache.get(tabela)
+        if em_cache and time.monotonic() - em_cache[0] < SOLICITACOES_CACHE_TTL:
+            return em_cache[1]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT * FROM {tabela}')
+    linhas = [dict(l) for l in cursor.fetchall()]
+    conn.close()
+
+    with _solicitacoes_lock:
+        _solicitacoes_cache[tabela] = (time.monotonic(), linhas)
+    return linhas
+
 
 def salvar_anotacao_sc(numero_sc, item_sc='', cor=None, observacao=None, usuario='Admin'):
     """Salva ou atualiza anotação de uma solicitação"""
@@ -1180,18 +1502,18 @@ def salvar_anotacao_sc(numero_sc, item_sc='', cor=None, observacao=None, usuario
     
     conn.commit()
     conn.close()
+    _invalidar_cache_solicitacoes('solicitacao_anotacoes')
 
 def obter_anotacoes_sc(numeros_sc=None):
-    """Obtém anotações de solicitações. Se numeros_sc for None, retorna todas."""
+    """Obtém anotações de solicitações. Se numeros_sc for None, retorna todas (via cache)."""
+    if not numeros_sc:
+        anotacoes = _ler_tabela_solicitacoes('solicitacao_anotacoes')
+        return {f"{a['numero_sc']}-{a['item_sc']}": dict(a) for a in anotacoes}
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    if numeros_sc:
-        placeholders = ','.join(['?' for _ in numeros_sc])
-        cursor.execute(f'SELECT * FROM solicitacao_anotacoes WHERE numero_sc IN ({placeholders})', numeros_sc)
-    else:
-        cursor.execute('SELECT * FROM solicitacao_anotacoes')
-    
+    placeholders = ','.join(['?' for _ in numeros_sc])
+    cursor.execute(f'SELECT * FROM solicitacao_anotacoes WHERE numero_sc IN ({placeholders})', numeros_sc)
     anotacoes = cursor.fetchall()
     conn.close()
     
@@ -1205,6 +1527,7 @@ def remover_anotacao_sc(numero_sc, item_sc=''):
     cursor.execute('DELETE FROM solicitacao_anotacoes WHERE numero_sc = ? AND item_sc = ?', (numero_sc, item_sc or ''))
     conn.commit()
     conn.close()
+    _invalidar_cache_solicitacoes('solicitacao_anotacoes')
 
 # =============================================================================
 # FUNÇÕES: ATRIBUIÇÕES MANUAIS DE COMPRADORES
@@ -1238,30 +1561,43 @@ def salvar_atribuicao_comprador(numero_sc, item_sc, cod_comprador, nome_comprado
     
     conn.commit()
     conn.close()
+    _invalidar_cache_solicitacoes('solicitacao_atribuicoes')
 
 def obter_atribuicoes_compradores(numeros_sc=None):
     """
     Obtém atribuições manuais de compradores.
-    Se numeros_sc for None, retorna todas as atribuições.
+    Se numeros_sc for None, retorna todas as atribuições (via cache).
     
     Returns:
         Dicionário indexado por 'numero_sc-item_sc' com dados da atribuição
     """
+    if not numeros_sc:
+        atribuicoes = _ler_tabela_solicitacoes('solicitacao_atribuicoes')
+        return {f"{a['numero_sc']}-{a['item_sc']}": dict(a) for a in atribuicoes}
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    if numeros_sc:
-        placeholders = ','.join(['?' for _ in numeros_sc])
-        cursor.execute(f'SELECT * FROM solicitacao_atribuicoes WHERE numero_sc IN ({placeholders})', numeros_sc)
-    else:
-        cursor.execute('SELECT * FROM solicitacao_atribuicoes')
-    
+    placeholders = ','.join(['?' for _ in numeros_sc])
+    cursor.execute(f'SELECT * FROM solicitacao_atribuicoes WHERE numero_sc IN ({placeholders})', numeros_sc)
     atribuicoes = cursor.fetchall()
     conn.close()
     
     # Retorna como dicionário indexado por numero_sc-item_sc
     return {f"{a['numero_sc']}-{a['item_sc']}": dict(a) for a in atribuicoes}
 
+def obter_atribuicoes_em_lote():
+    """
+    Todas as atribuições manuais em formato colunar, pronto para pd.DataFrame(...)
+    e merge com o DataFrame de solicitações pelas chaves (NumeroSC, ItemSC).
+    """
+    atribuicoes = _ler_tabela_solicitacoes('solicitacao_atribuicoes')
+    return {
+        'NumeroSC': [a['numero_sc'] for a in atribuicoes],
+        'ItemSC': [a['item_sc'] for a in atribuicoes],
+        'CodCompradorManual': [a['cod_comprador'] for a in atribuicoes],
+        'CompradorManual': [a['nome_comprador'] for a in atribuicoes],
+    }
+
 def remover_atribuicao_comprador(numero_sc, item_sc):
     """Remove atribuição manual de comprador de uma solicitação"""
     conn = get_db_connection()
@@ -1269,6 +1605,7 @@ def remover_atribuicao_comprador(numero_sc, item_sc):
     cursor.execute('DELETE FROM solicitacao_atribuicoes WHERE numero_sc = ? AND item_sc = ?', (numero_sc, item_sc))
     conn.commit()
     conn.close()
+    _invalidar_cache_solicitacoes('solicitacao_atribuicoes')
 
 def obter_atribuicoes_por_comprador(cod_comprador):
     """Obtém todas as atribuições para um comprador específico"""
@@ -1279,19 +1616,288 @@ def obter_atribuicoes_por_comprador(cod_comprador):
     conn.close()
     return atribuicoes
 
+# =============================================================================
+# FUNÇÕES: ANOTAÇÕES DOS INDICADORES (Variação de Preço / OTD)
+# =============================================================================
+# Cada anotação é identificada por (escopo, chave), onde escopo é 'variacao'
+# ou 'otd' e chave é a mesma string usada pelo front-end. As leituras passam
+# por um cache em memória por escopo, invalidado a cada escrita deste processo
+# e com TTL curto para enxergar escritas de outros workers.
+# =============================================================================
+
+ANOTACOES_CACHE_TTL = 30  # segundos
+_anotacoes_cache = {}  # { escopo: (timestamp, dict) }
+_anotacoes_lock = threading.Lock()
+
+
+def _invalidar_cache_anotacoes(escopo):
+    with _anotacoes_lock:
+        _anotacoes_cache.pop(escopo, None)
+
+
+def obter_anotacoes_indicador(escopo):
+    """
+    Obtém todas as anotações de um escopo.
+
+    Returns:
+        Dicionário { chave: {'texto', 'usuario', 'data'} } (mesmo formato do antigo JSON)
+    """
+    with _anotacoes_lock:
+        em_cache = _anotacoes_cache.get(escopo)
+        if em_cache and time.monotonic() - em_cache[0] < ANOTACOES_CACHE_TTL:
+            return dict(em_cache[1])
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT chave, texto, usuario, data FROM anotacoes_indicadores WHERE escopo = ?', (escopo,))
+    anotacoes = {
+        a['chave']: {'texto': a['texto'], 'usuario': a['usuario'], 'data': a['data']}
+        for a in cursor.fetchall()
+    }
+    conn.close()
+
+    with _anotacoes_lock:
+        _anotacoes_cache[escopo] = (time.monotonic(), anotacoes)
+    return dict(anotacoes)
+
+
+def salvar_anotacao_indicador(escopo, chave, texto, usuario=None, data=None):
+    """Salva ou atualiza uma anotação (upsert por escopo + chave)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO anotacoes_indicadores (escopo, chave, texto, usuario, data, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(escopo, chave) DO UPDATE SET
+            texto = excluded.texto,
+            usuario = excluded.usuario,
+            data = excluded.data,
+            atualizado_em = excluded.atualizado_em
+    ''', (escopo, chave, texto, usuario, data or datetime.now().strftime('%d/%m/%Y %H:%M'), datetime.now()))
+    conn.commit()
+    conn.close()
+    _invalidar_cache_anotacoes(escopo)
+
+
+def remover_anotacao_indicador(escopo, chave):
+    """Remove uma anotação. Retorna True se existia."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM anotacoes_indicadores WHERE escopo = ? AND chave = ?', (escopo, chave))
+    removida = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    _invalidar_cache_anotacoes(escopo)
+    return removida
+
+
+def _registros_anotacoes(escopo, anotacoes, usuario_padrao='Importado'):
+    """Linhas (escopo, chave, texto, usuario, data, atualizado_em) a partir do formato JSON das anotações"""
+    agora = datetime.now()
+    data_padrao = agora.strftime('%d/%m/%Y %H:%M')
+    registros = []
+    for chave, valor in anotacoes.items():
+        if isinstance(valor, str):
+            valor = {'texto': valor, 'usuario': usuario_padrao, 'data': data_padrao}
+        if not valor.get('texto'):
+            continue
+        registros.append((escopo, chave, valor['texto'], valor.get('usuario'), valor.get('data') or data_padrao, agora))
+    return registros
+
+
+def importar_anotacoes_indicador(escopo, anotacoes, usuario_padrao='Importado'):
+    """
+    Importa várias anotações em uma única transação (importadas sobrescrevem existentes).
+    Aceita o formato antigo (chave -> texto) e o atual (chave -> {texto, usuario, data}).
+
+    Returns:
+        Quantidade de anotações importadas
+    """
+    registros = _registros_anotacoes(escopo, anotacoes, usuario_padrao)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO anotacoes_indicadores (escopo, chave, texto, usuario, data, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(escopo, chave) DO UPDATE SET
+            texto = excluded.texto,
+            usuario = excluded.usuario,
+            data = excluded.data,
+            atualizado_em = excluded.atualizado_em
+    ''', registros)
+    conn.commit()
+    conn.close()
+    _invalidar_cache_anotacoes(escopo)
+    return len(registros)
+
+
 # =============================================================================
 # FUNÇÕES: AUDITORIA E RASTREABILIDADE
 # =============================================================================
 
+# O histórico da cotação é um log append-only (tabela cotacao_historico).
+# As funções de escrita apenas enfileiram o evento em memória; uma thread em
+# segundo plano grava os eventos em lote, fora do caminho da requisição.
+# O horário é capturado no momento do enfileiramento (UTC, mesmo formato do
+# CURRENT_TIMESTAMP usado pelos registros antigos).
+
+EVENTOS_LOTE_MAXIMO = 200
+EVENTOS_INTERVALO_FLUSH = 1.0  # segundos
+
+_fila_eventos = queue.Queue()
+_sinal_eventos = threading.Event()
+_escritor_eventos = None
+_escritor_eventos_lock = threading.Lock()
+_flush_eventos_lock = threading.Lock()
+
+
+def registrar_evento_cotacao(cotacao_id, acao, descricao=None, usuario=None, dados=None):
+    """
+    Enfileira um evento de auditoria da cotação (não bloqueia a requisição).
+
+    Args:
+        cotacao_id: ID da cotação
+        acao: Código da ação (ex: 'CRIACAO', 'STATUS', 'EDICAO', 'RESPOSTA')
+        descricao: Texto descritivo
+        usuario: Usuário responsável
+        dados: Dict opcional serializado em dados_json
+    """
+    data_hora = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    dados_json = json.dumps(dados, ensure_ascii=False, default=str) if dados is not None else None
+    _fila_eventos.put((cotacao_id, acao, descricao, usuario, data_hora, dados_json))
+    _sinal_eventos.set()
+    _iniciar_escritor_eventos()
+
+
+def _iniciar_escritor_eventos():
+    global _escritor_eventos
+    if _escritor_eventos is not None and _escritor_eventos.is_alive():
+        return
+    with _escritor_eventos_lock:
+        if _escritor_eventos is None or not _escritor_eventos.is_alive():
+            _escritor_eventos = threading.Thread(target=_loop_escritor_eventos, name='escritor-eventos', daemon=True)
+            _escritor_eventos.start()
+
+
+def _loop_escritor_eventos():
+    while True:
+        try:
+            _sinal_eventos.wait()
+            time.sleep(EVENTOS_INTERVALO_FLUSH)  # acumula eventos para gravar em lote
+            _sinal_eventos.clear()
+            descarregar_eventos()
+        except Exception as e:
+            print(f"[DB] Erro no escritor de eventos: {e}")
+
+
+def _gravar_lote_eventos():
+    """Retira até EVENTOS_LOTE_MAXIMO eventos da fila e grava em uma transação"""
+    with _flush_eventos_lock:
+        lote = []
+        while len(lote) < EVENTOS_LOTE_MAXIMO:
+            try:
+                lote.append(_fila_eventos.get_nowait())
+            except queue.Empty:
+                break
+
+        if not lote:
+            return 0
+
+        conn = get_db_connection()
+        try:
+            conn.executemany('''
+                INSERT INTO cotacao_historico (cotacao_id, acao, descricao, usuario, data_hora, dados_json)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', lote)
+            conn.commit()
+        except Exception as e:
+            # Devolve à fila para nova tentativa no próximo ciclo
+            print(f"[DB] Erro ao gravar {len(lote)} eventos: {e}")
+            for evento in lote:
+                _fila_eventos.put(evento)
+            _sinal_eventos.set()
+            return 0
+        finally:
+            conn.close()
+
+        return len(lote)
+
+
+def descarregar_eventos():
+    """
+    Grava imediatamente todos os eventos pendentes na fila.
+    Também aguarda um lote que o escritor em segundo plano esteja gravando.
+    """
+    total = 0
+    while True:
+        gravados = _gravar_lote_eventos()
+        if not gravados:
+            break
+        total += gravados
+    return total
+
+
+atexit.register(descarregar_eventos)
+
+
+def listar_eventos_cotacao(cotacao_id, limite=50, cursor=None):
+    """
+    Página de eventos de uma cotação, do mais recente para o mais antigo.
+    Paginação por chave (data_hora, id), servida pelo índice idx_historico_cotacao_data.
+
+    Args:
+        cotacao_id: ID da cotação
+        limite: Tamanho da página
+        cursor: Valor 'proximo_cursor' da página anterior (None = primeira página)
+
+    Returns:
+        Dict com 'eventos' e 'proximo_cursor' (None quando não há mais páginas)
+    """
+    descarregar_eventos()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    if cursor:
+        data_hora_cursor, id_cursor = cursor.rsplit('|', 1)
+        cur.execute('''
+            SELECT * FROM cotacao_historico
+            WHERE cotacao_id = ?
+              AND (data_hora < ? OR (data_hora = ? AND id < ?))
+            ORDER BY data_hora DESC, id DESC
+            LIMIT ?
+        ''', (cotacao_id, data_hora_cursor, data_hora_cursor, int(id_cursor), limite + 1))
+    else:
+        cur.execute('''
+            SELECT * FROM cotacao_historico
+            WHERE cotacao_id = ?
+            ORDER BY data_hora DESC, id DESC
+            LIMIT ?
+        ''', (cotacao_id, limite + 1))
+
+    eventos = [dict(e) for e in cur.fetchall()]
+    conn.close()
+
+    proximo_cursor = None
+    if len(eventos) > limite:
+        eventos = eventos[:limite]
+        proximo_cursor = f"{eventos[-1]['data_hora']}|{eventos[-1]['id']}"
+
+    return {'eventos': eventos, 'proximo_cursor': proximo_cursor}
+
+
 def obter_historico_cotacao(cotacao_id):
     """Obtém histórico completo de uma cotação"""
+    descarregar_eventos()
+
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
         SELECT * FROM cotacao_historico 
         WHERE cotacao_id = ? 
-        ORDER BY data_hora DESC
+        ORDER BY data_hora DESC, id DESC
     ''', (cotacao_id,))
     
     historico = [dict(h) for h in cursor.fetchall()]
@@ -1321,6 +1927,10 @@ def criar_rodada_negociacao(cotacao_id, fornecedor_id, item_id, preco_original,
     rodada_id = cursor.lastrowid
     conn.close()
     
+    registrar_evento_cotacao(cotacao_id, 'NEGOCIACAO', 'Rodada de negociação criada', usuario,
+                             dados={'rodada_id': rodada_id, 'fornecedor_id': fornecedor_id, 'item_id': item_id,
+                                    'preco_original': preco_original, 'preco_negociado': preco_negociado})
+    
     print(f"[NEGOCIAÇÃO] Rodada criada: ID={rodada_id}, Fornecedor={fornecedor_id}, Item={item_id}, Desconto={desconto_percentual}%")
     return rodada_id
 
@@ -1465,6 +2075,9 @@ def excluir_rodadas_fornecedor(cotacao_id, fornecedor_id):
     conn.commit()
     conn.close()
     
+    registrar_evento_cotacao(cotacao_id, 'NEGOCIACAO', f'{linhas_excluidas} rodada(s) do fornecedor excluída(s)',
+                             dados={'fornecedor_id': fornecedor_id})
+    
     print(f"[NEGOCIAÇÃO] Excluídas {linhas_excluidas} rodadas do fornecedor {fornecedor_id} na cotação {cotacao_id}")
     return linhas_excluidas
 
@@ -1523,6 +2136,9 @@ def atualizar_frete_fornecedor_rodada2(cotacao_id, fornecedor_id, frete_negociad
     conn.commit()
     conn.close()
     
+    registrar_evento_cotacao(cotacao_id, 'NEGOCIACAO', f'Frete negociado alterado para R${frete_negociado}',
+                             dados={'fornecedor_id': fornecedor_id, 'frete_negociado': frete_negociado})
+    
     print(f"[NEGOCIAÇÃO] Frete atualizado para R${frete_negociado} - Fornecedor {fornecedor_id}, Cotação {cotacao_id}")
     return linhas_atualizadas
 
@@ -1559,6 +2175,92 @@ def salvar_metadados_anexo(cotacao_id, fornecedor_id, nome_original, nome_arquiv
     print(f"[ANEXO] Metadados salvos: ID={anexo_id}, Fornecedor={fornecedor_id}")
     return anexo_id
 
+def salvar_anexo_por_conteudo(cotacao_id, fornecedor_id, nome_original, hash_conteudo, caminho_arquivo,
+                              tipo_arquivo, tamanho_bytes, mime_type, usuario='Admin', rodada=1):
+    """
+    Registra um anexo armazenado pelo hash do conteúdo e soma uma referência.
+    Se o conteúdo já existia, o anexo aponta para o arquivo já registrado.
+    
+    Returns:
+        dict com anexo_id, caminho_arquivo (o registrado) e referencias
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            INSERT OR IGNORE INTO anexos_conteudo (hash_conteudo, caminho_arquivo, tamanho_bytes, mime_type)
+            VALUES (?, ?, ?, ?)
+        ''', (hash_conteudo, caminho_arquivo, tamanho_bytes, mime_type))
+        cursor.execute('UPDATE anexos_conteudo SET referencias = referencias + 1 WHERE hash_conteudo = ?',
+                       (hash_conteudo,))
+        cursor.execute('SELECT caminho_arquivo, referencias FROM anexos_conteudo WHERE hash_conteudo = ?',
+                       (hash_conteudo,))
+        conteudo = cursor.fetchone()
+        
+        cursor.execute('''
+            INSERT INTO cotacao_anexos 
+            (cotacao_id, fornecedor_id, nome_original, nome_arquivo, caminho_arquivo, 
+             tipo_arquivo, tamanho_bytes, mime_type, usuario_upload, hash_conteudo, rodada)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (cotacao_id, fornecedor_id, nome_original, os.path.basename(conteudo['caminho_arquivo']),
+              conteudo['caminho_arquivo'], tipo_arquivo, tamanho_bytes, mime_type, usuario, hash_conteudo, rodada))
+        anexo_id = cursor.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    print(f"[ANEXO] Metadados salvos: ID={anexo_id}, Fornecedor={fornecedor_id}, "
+          f"conteúdo {hash_conteudo[:12]} ({conteudo['referencias']} referência(s))")
+    return {
+        'anexo_id': anexo_id,
+        'caminho_arquivo': conteudo['caminho_arquivo'],
+        'referencias': conteudo['referencias']
+    }
+
+def _liberar_anexos(cursor, condicao, parametros):
+    """Apaga as linhas de cotacao_anexos da condição e desconta as referências ao conteúdo"""
+    cursor.execute(f'''
+        SELECT hash_conteudo, COUNT(*) AS quantidade FROM cotacao_anexos
+        WHERE {condicao} AND hash_conteudo IS NOT NULL
+        GROUP BY hash_conteudo
+    ''', parametros)
+    liberados = [(r['quantidade'], r['hash_conteudo']) for r in cursor.fetchall()]
+    cursor.executemany('UPDATE anexos_conteudo SET referencias = referencias - ? WHERE hash_conteudo = ?', liberados)
+    cursor.execute(f'DELETE FROM cotacao_anexos WHERE {condicao}', parametros)
+
+def obter_conteudos_anexo_sem_referencia():
+    """Conteúdos de anexo que nenhuma cotação usa mais (para a coleta dos arquivos)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT hash_conteudo, caminho_arquivo FROM anexos_conteudo WHERE referencias <= 0')
+    conteudos = [dict(r) for r in cursor.fetchall()]
+    conn.close()
+    return conteudos
+
+def excluir_conteudo_anexo(hash_conteudo):
+    """Apaga o registro do conteúdo se continuar sem referência. Retorna True se apagou."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM anexos_conteudo WHERE hash_conteudo = ? AND referencias <= 0', (hash_conteudo,))
+    apagado = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return apagado
+
+def registrar_miniatura_anexo(hash_conteudo, caminho_miniatura):
+    """Grava o caminho da miniatura gerada em segundo plano"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE anexos_conteudo SET miniatura = ? WHERE hash_conteudo = ?',
+                   (caminho_miniatura, hash_conteudo))
+    conn.commit()
+    conn.close()
+
 def obter_anexos_fornecedor(fornecedor_id):
     """Obtém todos os anexos de um fornecedor"""
     conn = get_db_connection()
@@ -1631,7 +2333,8 @@ def buscar_cotacoes_por_sc(numero_sc):
 # FUNÇÕES: COTAÇÃO EXTERNA VIA JSON
 # =============================================================================
 
-def criar_envio_json(cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json=None, usuario=None, observacao=None):
+def criar_envio_json(cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json=None, usuario=None, observacao=None,
+                     versao_conteudo=None):
     """
     Registra um novo envio de JSON para cotação externa.
     
@@ -1643,6 +2346,7 @@ def criar_envio_json(cotacao_id, fornecedor_id, token_envio, hash_validacao, arq
         arquivo_json: Caminho do arquivo JSON gerado
         usuario: Usuário que gerou o envio
         observacao: Observação opcional
+        versao_conteudo: Hash dos dados usados nos arquivos (permite reaproveitá-los)
     
     Returns:
         ID do registro criado
@@ -1652,9 +2356,10 @@ def criar_envio_json(cotacao_id, fornecedor_id, token_envio, hash_validacao, arq
     
     cursor.execute('''
         INSERT INTO cotacao_json_envios 
-        (cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json_gerado, usuario_geracao, observacao)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json, usuario, observacao))
+        (cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json_gerado, usuario_geracao, observacao,
+         versao_conteudo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (cotacao_id, fornecedor_id, token_envio, hash_validacao, arquivo_json, usuario, observacao, versao_conteudo))
     
     envio_id = cursor.lastrowid
     conn.commit()
@@ -1674,6 +2379,22 @@ def obter_envio_json_por_token(token_envio):
     return dict(envio) if envio else None
 
 
+def obter_envio_json_por_versao(fornecedor_id, versao_conteudo):
+    """Envio ainda não respondido do fornecedor gerado com a mesma versão do conteúdo"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT * FROM cotacao_json_envios 
+        WHERE fornecedor_id = ? AND versao_conteudo = ? AND status = 'Gerado'
+        ORDER BY id DESC LIMIT 1
+    ''', (fornecedor_id, versao_conteudo))
+    envio = cursor.fetchone()
+    conn.close()
+    
+    return dict(envio) if envio else None
+
+
 def obter_envios_json_fornecedor(fornecedor_id):
     """Obtém todos os envios de JSON de um fornecedor"""
     conn = get_db_connection()
@@ -1772,6 +2493,63 @@ def obter_avaliacao_iso_por_fornecedor(cod_fornecedor):
     return dict(avaliacao) if avaliacao else None
 
 
+def obter_codigos_avaliacao_iso():
+    """Códigos de fornecedor que já têm avaliação ISO"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT cod_fornecedor FROM avaliacao_fornecedores_iso')
+    codigos = {r['cod_fornecedor'] for r in cursor.fetchall()}
+    conn.close()
+    return codigos
+
+
+def criar_avaliacoes_iso_em_lote(avaliacoes, usuario=None):
+    """
+    Cria várias avaliações ISO em uma única transação (importação do Excel).
+    
+    Args:
+        avaliacoes: lista de dicts com as chaves de criar_avaliacao_iso
+                    (cod_fornecedor, nome_fornecedor, email_fornecedor,
+                    data_ultima_avaliacao, data_vencimento, possui_iso, nota, observacao)
+        usuario: Usuário que criou os registros
+    
+    Returns:
+        Lista de IDs na mesma ordem (None onde o fornecedor já existia)
+    """
+    if not avaliacoes:
+        return []
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    ids = []
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for av in avaliacoes:
+            try:
+                cursor.execute('''
+                    INSERT INTO avaliacao_fornecedores_iso 
+                    (cod_fornecedor, nome_fornecedor, email_fornecedor, data_ultima_avaliacao, 
+                     data_vencimento, possui_iso, nota, observacao, criado_por)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (av['cod_fornecedor'], av['nome_fornecedor'], av.get('email_fornecedor'),
+                      av.get('data_ultima_avaliacao'), av.get('data_vencimento'), av.get('possui_iso', 'Nao'),
+                      av.get('nota'), av.get('observacao'), usuario))
+                ids.append(cursor.lastrowid)
+            except sqlite3.IntegrityError:
+                # Fornecedor já existe (só esta linha é descartada)
+                ids.append(None)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    print(f"[DB] Avaliações ISO importadas: {sum(1 for i in ids if i)} de {len(avaliacoes)}")
+    return ids
+
+
 def criar_avaliacao_iso(cod_fornecedor, nome_fornecedor, email_fornecedor=None, 
                         data_ultima_avaliacao=None, data_vencimento=None,
                         possui_iso='Nao', nota=None, observacao=None, usuario=None):
@@ -2381,6 +3159,103 @@ def sincronizar_resposta_cotacao_externa(cotacao_externa_id, cotacao_id, fornece
         return False
 
 
+def importar_resposta_render(dados, origem='sincronizador'):
+    """
+    Importa uma resposta vinda do Render (formato de /api/respostas-pendentes)
+    para cotacao_fornecedores/cotacao_respostas.
+    
+    Idempotente: o token é registrado em cotacao_importacoes_render na mesma
+    transação (BEGIN IMMEDIATE) dos preços; uma segunda chamada com o mesmo
+    token não altera nada e retorna ja_importada=True.
+    
+    Args:
+        dados: dict com token, cotacao_id, fornecedor_id, frete_total,
+               condicao_pagamento, observacao_geral e itens
+        origem: quem importou ('sincronizador', 'manual', ...)
+    
+    Returns:
+        dict com: importada, ja_importada, itens_processados
+    """
+    token = dados.get('token')
+    cotacao_id = dados.get('cotacao_id')
+    fornecedor_id = dados.get('fornecedor_id')
+    
+    if not all([token, cotacao_id, fornecedor_id]):
+        raise ValueError('token, cotacao_id e fornecedor_id são obrigatórios')
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # Trava de escrita já no início: quem chegar depois espera e vê o token registrado
+        cursor.execute('BEGIN IMMEDIATE')
+        
+        cursor.execute('SELECT itens_processados FROM cotacao_importacoes_render WHERE token = ?', (token,))
+        existente = cursor.fetchone()
+        if existente:
+            conn.rollback()
+            return {'importada': False, 'ja_importada': True, 'itens_processados': existente['itens_processados']}
+        
+        # 1. Atualiza status e dados gerais do fornecedor
+        cursor.execute('''
+            UPDATE cotacao_fornecedores 
+            SET status = 'Respondido',
+                data_resposta = CURRENT_TIMESTAMP,
+                frete_total = ?,
+                condicao_pagamento = ?,
+                observacao_geral = ?
+            WHERE id = ?
+        ''', (float(dados.get('frete_total', 0) or 0), dados.get('condicao_pagamento', ''),
+              dados.get('observacao_geral', ''), fornecedor_id))
+        
+        # 2. Processa itens da resposta
+        itens_processados = 0
+        for item in dados.get('itens', []):
+            item_id = item.get('item_id')
+            if not item_id:
+                continue
+            
+            preco_unitario = float(item.get('preco_unitario', 0) or 0)
+            prazo_entrega = int(item.get('prazo_entrega', 0) or 0)
+            observacao_item = item.get('observacao', '')
+            
+            cursor.execute('''
+                UPDATE cotacao_respostas 
+                SET preco_unitario = ?,
+                    prazo_entrega = ?,
+                    observacao = ?,
+                    data_resposta = CURRENT_TIMESTAMP
+                WHERE cotacao_id = ? AND fornecedor_id = ? AND item_id = ?
+            ''', (preco_unitario, prazo_entrega, observacao_item, cotacao_id, fornecedor_id, item_id))
+            
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                    INSERT INTO cotacao_respostas 
+                    (cotacao_id, fornecedor_id, item_id, preco_unitario, prazo_entrega, observacao)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (cotacao_id, fornecedor_id, item_id, preco_unitario, prazo_entrega, observacao_item))
+            
+            itens_processados += 1
+        
+        # 3. Registra a importação e marca a cotação externa (se existir localmente)
+        cursor.execute('''
+            INSERT INTO cotacao_importacoes_render 
+            (token, cotacao_id, fornecedor_id, respondido_em, itens_processados, origem)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (token, cotacao_id, fornecedor_id, dados.get('respondido_em'), itens_processados, origem))
+        cursor.execute('UPDATE cotacoes_externas SET sincronizada = 1 WHERE token = ?', (token,))
+        
+        conn.commit()
+        print(f"[DB] Resposta do Render importada: Token={token[:8]}..., Cotacao={cotacao_id}, Fornecedor={fornecedor_id}, Itens={itens_processados}")
+        return {'importada': True, 'ja_importada': False, 'itens_processados': itens_processados}
+        
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
 def atualizar_cotacao_externa_com_ids(token, cotacao_id, fornecedor_id, fornecedor_nome):
     """
     Atualiza uma cotação externa existente com os IDs de referência.
@@ -2885,6 +3760,25 @@ def excluir_pedido_compra(pedido_id, usuario='Admin'):
 # =============================================================================
 # FUNÇÕES: HISTÓRICO DE ENVIO DE E-MAILS (Controle 24h)
 # =============================================================================
+# O último envio de cada (tipo, identificador) fica em um cache em memória com
+# TTL curto. registrar_envio_email atualiza a entrada na hora, então a regra de
+# 24h continua valendo para envios feitos por este processo; o TTL cobre os
+# envios feitos por outros workers.
+# =============================================================================
+
+EMAIL_ENVIO_CACHE_TTL = 60  # segundos
+EMAIL_ENVIO_CACHE_MAXIMO = 5000  # entradas
+EMAIL_ENVIO_LOTE_CONSULTA = 500  # identificadores por consulta (limite de parâmetros do SQLite)
+_ultimo_envio_cache = {}  # { (tipo, identificador): (timestamp, linha ou None) }
+_ultimo_envio_lock = threading.Lock()
+
+
+def _guardar_ultimo_envio_cache(chave, linha):
+    with _ultimo_envio_lock:
+        if len(_ultimo_envio_cache) >= EMAIL_ENVIO_CACHE_MAXIMO and chave not in _ultimo_envio_cache:
+            _ultimo_envio_cache.clear()
+        _ultimo_envio_cache[chave] = (time.monotonic(), linha)
+
 
 def registrar_envio_email(tipo, identificador, email_destinatario, assunto=None, corpo=None, enviado_por=None):
     """
@@ -2906,11 +3800,20 @@ def registrar_envio_email(tipo, identificador, email_destinatario, assunto=None,
             INSERT INTO email_envios_historico 
             (tipo, identificador, email_destinatario, assunto, corpo, enviado_por)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (tipo, identificador, email_destinatario, assunto, corpo, enviado_por))
+        ''', (tipo, str(identificador), email_destinatario, assunto, corpo, enviado_por))
         
         conn.commit()
         envio_id = cursor.lastrowid
+        
+        # Atualiza o cache com a data gravada pelo banco (CURRENT_TIMESTAMP)
+        cursor.execute('''
+            SELECT data_envio, email_destinatario, assunto
+            FROM email_envios_historico WHERE id = ?
+        ''', (envio_id,))
+        linha = cursor.fetchone()
         conn.close()
+        # Mesma chave da leitura (verificar_envios_email_lote usa str(identificador))
+        _guardar_ultimo_envio_cache((tipo, str(identificador)), dict(linha) if linha else None)
         
         print(f"[DB] E-mail registrado: {tipo}/{identificador} -> {email_destinatario}")
         return {'success': True, 'id': envio_id}
@@ -2920,79 +3823,145 @@ def registrar_envio_email(tipo, identificador, email_destinatario, assunto=None,
         return {'success': False, 'error': str(e)}
 
 
-def verificar_ultimo_envio_email(tipo, identificador):
+def _status_envio_email(resultado):
+    """Aplica a regra de 24h sobre o último envio (linha do histórico ou None)"""
+    if not resultado:
+        return {
+            'pode_enviar': True,
+            'ultimo_envio': None,
+            'horas_passadas': None,
+            'minutos_restantes': 0
+        }
+    
+    # Calcula diferença de tempo
+    data_envio_str = resultado['data_envio']
+    
+    # Parse da data (formato SQLite: YYYY-MM-DD HH:MM:SS)
+    data_envio = datetime.strptime(data_envio_str, '%Y-%m-%d %H:%M:%S')
+    agora = datetime.now()
+    diferenca = agora - data_envio
+    
+    horas_passadas = diferenca.total_seconds() / 3600
+    pode_enviar = horas_passadas >= 24
+    
+    # Calcula minutos restantes para poder enviar
+    if pode_enviar:
+        minutos_restantes = 0
+    else:
+        segundos_restantes = (24 * 3600) - diferenca.total_seconds()
+        minutos_restantes = int(segundos_restantes / 60)
+    
+    return {
+        'pode_enviar': pode_enviar,
+        'ultimo_envio': data_envio_str,
+        'ultimo_envio_formatado': data_envio.strftime('%d/%m/%Y às %H:%M'),
+        'email_ultimo': resultado['email_destinatario'],
+        'horas_passadas': round(horas_passadas, 1),
+        'minutos_restantes': minutos_restantes
+    }
+
+
+def verificar_envios_email_lote(chaves):
     """
-    Verifica o último envio de e-mail para um pedido/item.
-    Retorna informações sobre se pode reenviar (regra 24h).
+    Verifica a regra de 24h para vários pedidos/itens de uma vez.
+    Entradas fora do cache são buscadas com uma consulta por tipo (em blocos
+    de EMAIL_ENVIO_LOTE_CONSULTA identificadores), usando o índice (tipo, identificador).
     
     Args:
-        tipo: 'pedido' ou 'item' ou 'terceiros'
-        identificador: número do pedido ou pedido-item
+        chaves: lista de tuplas (tipo, identificador)
         
     Returns:
-        dict com: pode_enviar, ultimo_envio, horas_passadas, minutos_restantes
+        dict { (tipo, identificador): mesmo retorno de verificar_ultimo_envio_email }
     """
+    chaves = list(dict.fromkeys((tipo, str(identificador)) for tipo, identificador in chaves))
+    ultimos = {}
+    faltantes = {}  # { tipo: [identificadores] }
+    
+    agora = time.monotonic()
+    with _ultimo_envio_lock:
+        for chave in chaves:
+            em_cache = _ultimo_envio_cache.get(chave)
+            if em_cache and agora - em_cache[0] < EMAIL_ENVIO_CACHE_TTL:
+                ultimos[chave] = em_cache[1]
+            else:
+                faltantes.setdefault(chave[0], []).append(chave[1])
+    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Busca o último envio bem-sucedido
-        cursor.execute('''
-            SELECT data_envio, email_destinatario, assunto
-            FROM email_envios_historico
-            WHERE tipo = ? AND identificador = ? AND sucesso = 1
-            ORDER BY data_envio DESC
-            LIMIT 1
-        ''', (tipo, identificador))
+        if faltantes:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            for tipo, identificadores in faltantes.items():
+                for inicio in range(0, len(identificadores), EMAIL_ENVIO_LOTE_CONSULTA):
+                    bloco = identificadores[inicio:inicio + EMAIL_ENVIO_LOTE_CONSULTA]
+                    placeholders = ','.join(['?' for _ in bloco])
+                    # MAX() com colunas "soltas": o SQLite devolve as colunas da linha do máximo
+                    cursor.execute(f'''
+                        SELECT identificador, MAX(data_envio) AS data_envio, email_destinatario, assunto
+                        FROM email_envios_historico
+                        WHERE tipo = ? AND identificador IN ({placeholders}) AND sucesso = 1
+                        GROUP BY identificador
+                    ''', [tipo] + bloco)
+                    encontrados = {
+                        r['identificador']: {
+                            'data_envio': r['data_envio'],
+                            'email_destinatario': r['email_destinatario'],
+                            'assunto': r['assunto']
+                        }
+                        for r in cursor.fetchall()
+                    }
+                    # Mensagens ainda na fila (pendente/enviando) contam como enviadas:
+                    # o histórico só é gravado quando o envio termina
+                    cursor.execute(f'''
+                        SELECT identificador, MAX(criado_em) AS data_envio, destinatarios, assunto
+                        FROM email_fila
+                        WHERE tipo = ? AND identificador IN ({placeholders})
+                          AND status IN ('pendente', 'enviando')
+                        GROUP BY identificador
+                    ''', [tipo] + bloco)
+                    for r in cursor.fetchall():
+                        atual = encontrados.get(r['identificador'])
+                        if atual is None or r['data_envio'] > atual['data_envio']:
+                            encontrados[r['identificador']] = {
+                                'data_envio': r['data_envio'],
+                                'email_destinatario': ', '.join(json.loads(r['destinatarios'])),
+                                'assunto': r['assunto']
+                            }
+                    for identificador in bloco:
+                        linha = encontrados.get(identificador)
+                        ultimos[(tipo, identificador)] = linha
+                        _guardar_ultimo_envio_cache((tipo, identificador), linha)
+            conn.close()
         
-        resultado = cursor.fetchone()
-        conn.close()
+        return {chave: _status_envio_email(ultimos.get(chave)) for chave in chaves}
         
-        if not resultado:
-            return {
+    except Exception as e:
+        print(f"[DB] Erro ao verificar envios em lote: {e}")
+        # Em caso de erro, permite enviar
+        return {
+            chave: {
                 'pode_enviar': True,
                 'ultimo_envio': None,
                 'horas_passadas': None,
-                'minutos_restantes': 0
+                'minutos_restantes': 0,
+                'error': str(e)
             }
-        
-        # Calcula diferença de tempo
-        data_envio_str = resultado['data_envio']
-        
-        # Parse da data (formato SQLite: YYYY-MM-DD HH:MM:SS)
-        data_envio = datetime.strptime(data_envio_str, '%Y-%m-%d %H:%M:%S')
-        agora = datetime.now()
-        diferenca = agora - data_envio
-        
-        horas_passadas = diferenca.total_seconds() / 3600
-        pode_enviar = horas_passadas >= 24
-        
-        # Calcula minutos restantes para poder enviar
-        if pode_enviar:
-            minutos_restantes = 0
-        else:
-            segundos_restantes = (24 * 3600) - diferenca.total_seconds()
-            minutos_restantes = int(segundos_restantes / 60)
-        
-        return {
-            'pode_enviar': pode_enviar,
-            'ultimo_envio': data_envio_str,
-            'ultimo_envio_formatado': data_envio.strftime('%d/%m/%Y às %H:%M'),
-            'email_ultimo': resultado['email_destinatario'],
-            'horas_passadas': round(horas_passadas, 1),
-            'minutos_restantes': minutos_restantes
+            for chave in chaves
         }
+
+
+def verificar_ultimo_envio_email(tipo, identificador):
+    """
+    Verifica o último envio de e-mail para um pedido/item.
+    Retorna informações sobre se pode reenviar (regra 24h).
+    
+    Args:
+        tipo: 'pedido' ou 'item' ou 'terceiros'
+        identificador: número do pedido ou pedido-item
         
-    except Exception as e:
-        print(f"[DB] Erro ao verificar último envio: {e}")
-        # Em caso de erro, permite enviar
-        return {
-            'pode_enviar': True,
-            'ultimo_envio': None,
-            'horas_passadas': None,
-            'minutos_restantes': 0,
-            'error': str(e)
-        }
+    Returns:
+        dict com: pode_enviar, ultimo_envio, horas_passadas, minutos_restantes
+    """
+    return verificar_envios_email_lote([(tipo, identificador)])[(tipo, str(identificador))]
 
 
 def listar_historico_envios(tipo=None, identificador=None, limite=50):
@@ -3037,6 +4006,226 @@ def listar_historico_envios(tipo=None, identificador=None, limite=50):
         return []
 
 
+# =============================================================================
+# FILA DE SAÍDA DE E-MAILS
+# =============================================================================
+# As rotas gravam a mensagem pronta (MIME) e respondem na hora com o lote_id;
+# o EnviadorEmails (fila_email.py) envia em segundo plano e grava o resultado
+# em email_envios_historico.
+#
+# status: pendente → enviando → enviado | erro (após as tentativas)
+#
+# A reserva ('enviando') leva o dono (host:pid) e o horário. Só reservas com
+# mais de EMAIL_RESERVA_TIMEOUT segundos (processo que morreu no meio do envio)
+# voltam para a fila; as de processos vivos não são tocadas.
+
+EMAIL_RESERVA_TIMEOUT = 30 * 60  # segundos (um lote de 20 a 20/min leva ~1 min)
+
+
+def _dono_reserva_email():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def enfileirar_emails(mensagens, lote_id=None):
+    """
+    Grava mensagens na fila de saída (uma transação).
+    
+    Args:
+        mensagens: lista de dicts com tipo, identificador, destinatarios (lista),
+                   assunto, corpo, mensagem (texto MIME completo) e enviado_por
+        lote_id: identificador do lote (gerado se não informado)
+    
+    Returns:
+        lote_id
+    """
+    lote_id = lote_id or uuid.uuid4().hex[:12]
+    conn = get_db_connection()
+    try:
+        conn.executemany('''
+            INSERT INTO email_fila
+            (lote_id, tipo, identificador, destinatarios, assunto, corpo, mensagem, enviado_por)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (lote_id, m['tipo'], str(m['identificador']), json.dumps(m['destinatarios']),
+             m.get('assunto'), m.get('corpo'), m['mensagem'], m.get('enviado_por'))
+            for m in mensagens
+        ])
+        conn.commit()
+        criado_em = conn.execute('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+    finally:
+        conn.close()
+    
+    # Regra de 24h: a mensagem na fila já conta como envio (ver verificar_envios_email_lote)
+    for m in mensagens:
+        _guardar_ultimo_envio_cache((m['tipo'], str(m['identificador'])), {
+            'data_envio': criado_em,
+            'email_destinatario': ', '.join(m['destinatarios']),
+            'assunto': m.get('assunto')
+        })
+    
+    print(f"[DB] {len(mensagens)} e-mail(s) na fila (lote {lote_id})")
+    return lote_id
+
+
+def reservar_emails_fila(limite=20):
+    """
+    Marca como 'enviando' (com dono e horário da reserva) e devolve as próximas
+    mensagens prontas para envio, em ordem de chegada: pendentes com
+    proxima_tentativa vencida e reservas vencidas (EMAIL_RESERVA_TIMEOUT).
+    """
+    dono = _dono_reserva_email()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT * FROM email_fila
+            WHERE (status = 'pendente' AND proxima_tentativa <= CURRENT_TIMESTAMP)
+               OR (status = 'enviando' AND (reservado_em IS NULL OR reservado_em <= datetime('now', ?)))
+            ORDER BY id LIMIT ?
+        ''', (f'-{EMAIL_RESERVA_TIMEOUT} seconds', limite))
+        linhas = [dict(l) for l in cursor.fetchall()]
+        if linhas:
+            ids = [l['id'] for l in linhas]
+            cursor.execute(f'''
+                UPDATE email_fila
+                SET status = 'enviando', tentativas = tentativas + 1,
+                    reservado_em = CURRENT_TIMESTAMP, reservado_por = ?
+                WHERE id IN ({','.join('?' for _ in ids)})
+            ''', [dono] + ids)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    for linha in linhas:
+        linha['destinatarios'] = json.loads(linha['destinatarios'])
+        linha['tentativas'] += 1
+        linha['status'] = 'enviando'
+        linha['reservado_por'] = dono
+    return linhas
+
+
+def concluir_email_fila(email_id, sucesso, erro=None, nova_tentativa_em_segundos=None):
+    """
+    Registra o resultado de um envio da fila.
+    
+    - sucesso: status 'enviado' e linha em email_envios_historico (controle 24h)
+    - falha com nova_tentativa_em_segundos: volta para 'pendente' com atraso
+    - falha definitiva: status 'erro' e linha no histórico com sucesso = 0
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if not sucesso and nova_tentativa_em_segundos is not None:
+            cursor.execute('''
+                UPDATE email_fila
+                SET status = 'pendente', erro = ?, reservado_em = NULL, reservado_por = NULL,
+                    proxima_tentativa = datetime('now', ?)
+                WHERE id = ?
+            ''', (erro, f'+{int(nova_tentativa_em_segundos)} seconds', email_id))
+            conn.commit()
+            return
+        
+        cursor.execute('''
+            UPDATE email_fila
+            SET status = ?, erro = ?, enviado_em = CASE WHEN ? THEN CURRENT_TIMESTAMP END
+            WHERE id = ?
+        ''', ('enviado' if sucesso else 'erro', erro, sucesso, email_id))
+        cursor.execute('SELECT * FROM email_fila WHERE id = ?', (email_id,))
+        email = cursor.fetchone()
+        cursor.execute('''
+            INSERT INTO email_envios_historico
+            (tipo, identificador, email_destinatario, assunto, corpo, enviado_por, sucesso)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (email['tipo'], email['identificador'], ', '.join(json.loads(email['destinatarios'])),
+              email['assunto'], email['corpo'], email['enviado_por'], 1 if sucesso else 0))
+        envio_id = cursor.lastrowid
+        cursor.execute('''
+            SELECT tipo, identificador, data_envio, email_destinatario, assunto
+            FROM email_envios_historico WHERE id = ?
+        ''', (envio_id,))
+        linha = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if sucesso and linha:
+        _guardar_ultimo_envio_cache((linha['tipo'], linha['identificador']), {
+            'data_envio': linha['data_envio'],
+            'email_destinatario': linha['email_destinatario'],
+            'assunto': linha['assunto']
+        })
+
+
+def recuperar_emails_em_envio():
+    """
+    Devolve à fila mensagens que ficaram 'enviando' com a reserva vencida
+    (processo encerrado no meio do envio). Reservas dentro do prazo são de
+    outro worker ainda vivo e ficam como estão.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE email_fila SET status = 'pendente', reservado_em = NULL, reservado_por = NULL
+        WHERE status = 'enviando' AND (reservado_em IS NULL OR reservado_em <= datetime('now', ?))
+    """, (f'-{EMAIL_RESERVA_TIMEOUT} seconds',))
+    recuperadas = cursor.rowcount
+    conn.commit()
+    conn.close()
+    if recuperadas:
+        print(f"[DB] {recuperadas} e-mail(s) devolvido(s) à fila")
+    return recuperadas
+
+
+def status_lote_emails(lote_id):
+    """
+    Situação de um lote da fila.
+    
+    Returns:
+        dict com total, contagem por status e erros ({identificador, destinatarios, erro}),
+        ou None se o lote não existir
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, identificador, destinatarios, status, tentativas, erro, criado_em, enviado_em
+        FROM email_fila WHERE lote_id = ? ORDER BY id
+    ''', (lote_id,))
+    linhas = [dict(l) for l in cursor.fetchall()]
+    conn.close()
+    
+    if not linhas:
+        return None
+    
+    por_status = {'pendente': 0, 'enviando': 0, 'enviado': 0, 'erro': 0}
+    for linha in linhas:
+        por_status[linha['status']] = por_status.get(linha['status'], 0) + 1
+    
+    return {
+        'lote_id': lote_id,
+        'total': len(linhas),
+        **por_status,
+        'concluido': por_status['pendente'] + por_status['enviando'] == 0,
+        'erros': [
+            {'identificador': l['identificador'], 'destinatarios': json.loads(l['destinatarios']),
+             'tentativas': l['tentativas'], 'erro': l['erro']}
+            for l in linhas if l['status'] == 'erro' or (l['status'] == 'pendente' and l['erro'])
+        ]
+    }
+
+
+def resumo_fila_emails():
+    """Contagem da fila por status"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT status, COUNT(*) AS total FROM email_fila GROUP BY status')
+    resumo = {l['status']: l['total'] for l in cursor.fetchall()}
+    cursor.execute("SELECT MIN(criado_em) FROM email_fila WHERE status = 'pendente'")
+    resumo['pendente_mais_antigo'] = cursor.fetchone()[0]
+    conn.close()
+    return resumo
+
+
 # =============================================================================
 # INICIALIZAÇÃO
 # =============================================================================
@@ -0,0 +1,135 @@
+"""
+=============================================================================
+CANAL DE EVENTOS - COTAÇÕES EXTERNAS (SERVER-SENT EVENTS)
+=============================================================================
+Distribui eventos do servidor (ex.: "chegou resposta de fornecedor") para as
+abas abertas do navegador, no lugar do polling de 20s de cada aba.
+
+- O servidor sincroniza com o Render e publica; as abas apenas escutam
+- Cada aba recebe uma fila própria; aba lenta/travada é desconectada
+- Histórico curto em memória para reenvio após reconexão (Last-Event-ID)
+- Limite de conexões simultâneas (maximo_assinantes): com o gunicorn gthread
+  cada aba conectada ocupa uma thread enquanto o stream estiver aberto; acima
+  do limite assinar() levanta CanalLotado e a rota responde 503 (a aba passa
+  para o polling de /api/cotacoes-externas/eventos/recentes)
+
+Uso:
+    canal = CanalEventos(maximo_assinantes=8)
+    canal.publicar('sincronizada', {...})
+    fila = canal.assinar(ultimo_id)            # CanalLotado → 503
+    resposta = Response(canal.stream_sse(fila=fila), mimetype='text/event-stream')
+    resposta.call_on_close(lambda: canal.cancelar(fila))
+=============================================================================
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+
+class CanalLotado(Exception):
+    """Já há maximo_assinantes conexões abertas"""
+
+
+class CanalEventos:
+    """Publicação/assinatura em memória (um processo) com saída em formato SSE"""
+
+    def __init__(self, tamanho_fila=100, tamanho_historico=200, maximo_assinantes=None):
+        """
+        Args:
+            maximo_assinantes: conexões simultâneas aceitas (None = sem limite)
+        """
+        self.tamanho_fila = tamanho_fila
+        self.maximo_assinantes = maximo_assinantes
+        self.recusados = 0
+        self._assinantes = set()
+        self._historico = deque(maxlen=tamanho_historico)
+        self._ultimo_id = 0
+        self._lock = threading.Lock()
+
+    def publicar(self, tipo, dados):
+        """Envia um evento para todos os assinantes. Retorna o id do evento."""
+        with self._lock:
+            self._ultimo_id += 1
+            evento = (self._ultimo_id, tipo, dados)
+            self._historico.append(evento)
+            assinantes = list(self._assinantes)
+
+        for fila in assinantes:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                # Assinante não está consumindo: desconecta (o navegador reconecta
+                # com Last-Event-ID e recupera o que perdeu pelo histórico)
+                self.cancelar(fila)
+                try:
+                    fila.get_nowait()
+                    fila.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+        return evento[0]
+
+    def assinar(self, desde_id=None):
+        """
+        Registra um assinante. Se desde_id for informado (reconexão), reenvia
+        os eventos do histórico posteriores a ele.
+        Levanta CanalLotado se já houver maximo_assinantes conexões.
+        """
+        fila = queue.Queue(maxsize=self.tamanho_fila)
+        with self._lock:
+            if self.maximo_assinantes is not None and len(self._assinantes) >= self.maximo_assinantes:
+                self.recusados += 1
+                raise CanalLotado(self.maximo_assinantes)
+            if desde_id is not None:
+                for evento in self._historico:
+                    if evento[0] > desde_id and not fila.full():
+                        fila.put_nowait(evento)
+            self._assinantes.add(fila)
+        return fila
+
+    def eventos_desde(self, desde_id):
+        """Eventos do histórico posteriores a desde_id (polling de fallback)"""
+        with self._lock:
+            return [evento for evento in self._historico if evento[0] > desde_id]
+
+    def ultimo_id(self):
+        with self._lock:
+            return self._ultimo_id
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def total_assinantes(self):
+        with self._lock:
+            return len(self._assinantes)
+
+    def stream_sse(self, desde_id=None, heartbeat=15, duracao_maxima=300, fila=None):
+        """
+        Gerador de texto no formato text/event-stream.
+        Envia um comentário a cada `heartbeat` segundos (mantém proxies abertos)
+        e encerra após `duracao_maxima` segundos; o EventSource reconecta sozinho
+        enviando Last-Event-ID.
+        
+        fila: assinatura já feita (assinar() antes de montar a resposta, para
+        poder responder 503); sem ela a assinatura é feita aqui.
+        """
+        if fila is None:
+            fila = self.assinar(desde_id)
+        fim = time.monotonic() + duracao_maxima
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < fim:
+                try:
+                    evento = fila.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if evento is None:
+                    break
+                evento_id, tipo, dados = evento
+                yield f'id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n'
+        finally:
+            self.cancelar(fila)
@@ -0,0 +1,212 @@
+"""
+=============================================================================
+FILA DE SAÍDA DE E-MAILS - ENVIO EM SEGUNDO PLANO
+=============================================================================
+As rotas de envio (cobrança, e-mails ISO) apenas gravam a mensagem pronta na
+tabela email_fila e respondem na hora com o lote_id. Esta thread:
+
+1. Reserva as próximas mensagens pendentes (database.reservar_emails_fila)
+2. Envia por UMA conexão do transporte reaproveitada entre mensagens
+   (STARTTLS + login uma vez, não a cada e-mail); reconecta se o servidor
+   derrubar e fecha a conexão depois de um tempo ociosa. O transporte pode
+   ser o SMTP real, um arquivo mbox ou um servidor falso (transporte_email.py)
+3. Respeita o limite de envios por minuto (Gmail bloqueia rajadas)
+4. Falha temporária → nova tentativa com backoff exponencial;
+   recusa definitiva (5xx) ou tentativas esgotadas → status 'erro'
+5. Grava o resultado (database.concluir_email_fila → email_envios_historico)
+
+Uso:
+    transporte = criar_transporte('smtp', SMTP_SERVER, SMTP_PORT, EMAIL_REMETENTE, SENHA_EMAIL)
+    enviador = EnviadorEmails(transporte, EMAIL_REMETENTE,
+                              db.reservar_emails_fila, db.concluir_email_fila)
+    enviador.iniciar()
+    enviador.acordar()   # após enfileirar
+    enviador.status()
+=============================================================================
+"""
+
+import smtplib
+import time
+from datetime import datetime
+
+from tarefa_periodica import TarefaPeriodica
+
+
+class EnviadorEmails:
+    """Consome a fila de e-mails com conexão SMTP persistente, limite de taxa e novas tentativas"""
+
+    def __init__(self, transporte, remetente, reservar, concluir,
+                 envios_por_minuto=20, tentativas_maximas=5, espera_inicial=60,
+                 ocioso_maximo=60, lote=20, intervalo_verificacao=15):
+        """
+        Args:
+            transporte: objeto com conectar() -> conexão no formato do smtplib.SMTP
+            remetente: endereço do envelope (MAIL FROM)
+            reservar: função(limite) -> lista de e-mails da fila (marcados como 'enviando')
+            concluir: função(email_id, sucesso, erro=None, nova_tentativa_em_segundos=None)
+            envios_por_minuto: limite de taxa do envio
+            tentativas_maximas: antes de marcar o e-mail como 'erro'
+            espera_inicial: segundos até a 1ª nova tentativa (dobra a cada falha, teto 1h)
+            ocioso_maximo: segundos sem envio até fechar a conexão SMTP
+            intervalo_verificacao: segundos entre consultas à fila quando ninguém acorda a thread
+        """
+        self.transporte = transporte
+        self.remetente = remetente
+        self.reservar = reservar
+        self.concluir = concluir
+        self.intervalo_envio = 60.0 / envios_por_minuto
+        self.tentativas_maximas = tentativas_maximas
+        self.espera_inicial = espera_inicial
+        self.ocioso_maximo = ocioso_maximo
+        self.lote = lote
+        self.intervalo_verificacao = intervalo_verificacao
+
+        self._smtp = None
+        self._ultimo_uso = 0.0
+        self._proximo_envio = 0.0
+
+        self.metricas = {
+            'enviados': 0,
+            'falhas_temporarias': 0,
+            'falhas_definitivas': 0,
+            'conexoes_abertas': 0,
+            'ultimo_envio': None,
+            'ultimo_erro': None,
+            'ultima_duracao_ms': None
+        }
+        # Erro ao ler a fila (banco ocupado, etc.): tenta de novo na próxima verificação
+        self._tarefa = TarefaPeriodica(
+            'fila-email', self._executar_agendado, intervalo_verificacao,
+            intervalo_maximo=intervalo_verificacao, rotulo='EMAIL', metricas=self.metricas
+        )
+
+    # -------------------------------------------------------------------------
+    # Conexão
+    # -------------------------------------------------------------------------
+
+    def _conectar(self):
+        smtp = self.transporte.conectar()
+        self.metricas['conexoes_abertas'] += 1
+        return smtp
+
+    def _conexao(self):
+        """Conexão aberta e autenticada (reaproveitada enquanto o servidor mantiver)"""
+        if self._smtp is not None:
+            return self._smtp
+        self._smtp = self._conectar()
+        return self._smtp
+
+    def _fechar(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+    def _fechar_se_ociosa(self):
+        if self._smtp is not None and time.monotonic() - self._ultimo_uso > self.ocioso_maximo:
+            self._fechar()
+
+    # -------------------------------------------------------------------------
+    # Envio
+    # -------------------------------------------------------------------------
+
+    def _aguardar_vaga(self):
+        """Limite de taxa: no máximo envios_por_minuto, espaçados igualmente"""
+        espera = self._proximo_envio - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self._proximo_envio = time.monotonic() + self.intervalo_envio
+
+    def _enviar(self, email):
+        """Envia pela conexão atual; se o servidor derrubou a conexão ociosa, reconecta uma vez"""
+        try:
+            recusados = self._conexao().sendmail(self.remetente, email['destinatarios'], email['mensagem'])
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = None
+            recusados = self._conexao().sendmail(self.remetente, email['destinatarios'], email['mensagem'])
+        self._ultimo_uso = time.monotonic()
+        return recusados
+
+    @staticmethod
+    def _erro_definitivo(e):
+        """Recusas 5xx do servidor não adiantam repetir; o resto (rede, 4xx, login) é temporário"""
+        if isinstance(e, smtplib.SMTPRecipientsRefused):
+            return all(codigo >= 500 for codigo, _ in e.recipients.values())
+        if isinstance(e, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+            return e.smtp_code >= 500
+        return False
+
+    def _processar(self, email):
+        self._aguardar_vaga()
+        try:
+            recusados = self._enviar(email)
+        except Exception as e:
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+                # Conexão em estado desconhecido: a próxima mensagem abre outra
+                self._fechar()
+            erro = f"{type(e).__name__}: {e}"
+            self.metricas['ultimo_erro'] = f"{datetime.now().isoformat()} {erro}"
+            if self._erro_definitivo(e) or email['tentativas'] >= self.tentativas_maximas:
+                self.metricas['falhas_definitivas'] += 1
+                self.concluir(email['id'], False, erro=erro)
+                print(f"[EMAIL] Falha definitiva para {', '.join(email['destinatarios'])}: {erro}")
+            else:
+                espera = min(self.espera_inicial * 2 ** (email['tentativas'] - 1), 3600)
+                self.metricas['falhas_temporarias'] += 1
+                self.concluir(email['id'], False, erro=erro, nova_tentativa_em_segundos=espera)
+                print(f"[EMAIL] Falha ao enviar para {', '.join(email['destinatarios'])} "
+                      f"(tentativa {email['tentativas']}), nova tentativa em {espera}s: {erro}")
+            return
+
+        # Recusa parcial: enviado aos demais, registra quem ficou de fora
+        erro = f"Recusados: {', '.join(recusados)}" if recusados else None
+        self.concluir(email['id'], True, erro=erro)
+        self.metricas['enviados'] += 1
+        self.metricas['ultimo_envio'] = datetime.now().isoformat()
+
+    def processar_pendentes(self):
+        """Envia tudo que estiver pronto na fila. Retorna quantos e-mails foram processados."""
+        inicio = time.perf_counter()
+        total = 0
+        while True:
+            emails = self.reservar(self.lote)
+            if not emails:
+                break
+            for email in emails:
+                self._processar(email)
+                total += 1
+        if total:
+            self.metricas['ultima_duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            print(f"[EMAIL] {total} e-mail(s) processado(s) em {self.metricas['ultima_duracao_ms']:.0f} ms")
+        return total
+
+    # -------------------------------------------------------------------------
+    # Agendamento
+    # -------------------------------------------------------------------------
+
+    def _executar_agendado(self):
+        """Execução da thread: processa a fila e fecha a conexão se ficou ociosa"""
+        try:
+            self.processar_pendentes()
+        finally:
+            self._fechar_se_ociosa()
+
+    def iniciar(self):
+        """Inicia a thread de envio (uma vez por processo)"""
+        if self._tarefa.iniciar():
+            print(f"[EMAIL] Fila de envio iniciada ({60 / self.intervalo_envio:.0f} e-mails/min)")
+
+    def acordar(self):
+        """Antecipa o processamento (chamado logo após enfileirar)"""
+        self._tarefa.acordar()
+
+    def status(self):
+        return {
+            'ativo': self._tarefa.ativa(),
+            'transporte': self.transporte.descricao(),
+            'conexao_aberta': self._smtp is not None,
+            **self.metricas
+        }
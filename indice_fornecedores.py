@@ -0,0 +1,253 @@
+"""
+=============================================================================
+ÍNDICE DE FORNECEDORES EM MEMÓRIA (SA2010)
+=============================================================================
+O cadastro de fornecedores muda pouco e era consultado no TOTVS a cada tecla
+do autocomplete. Aqui ele é carregado uma vez e recarregado periodicamente:
+
+- Campos: código, nome, CNPJ, e-mail, telefone e comprador
+- Busca por código, nome ou CNPJ, em qualquer parte do texto, sem diferenciar
+  maiúsculas nem acentos ("CONSTRUCAO" acha "CONSTRUÇÃO")
+- Índice de n-gramas (2 e 3 caracteres) → posições dos fornecedores: a busca
+  pega a lista do n-grama mais raro do termo e só confere o texto desses
+- Ordem do resultado: código exato, nome que começa com o termo, palavra que
+  começa com o termo, demais; empate pela ordem alfabética
+- A recarga monta um índice novo e troca a referência de uma vez; as buscas
+  em andamento continuam no anterior
+- Se a recarga falhar, o índice atual continua valendo (nova tentativa com
+  backoff)
+- Se a primeira carga falhar (TOTVS fora do ar), as consultas levantam
+  tarefa_periodica.Indisponivel na hora por `espera_apos_falha` segundos, em
+  vez de cada pedido tentar carregar de novo - ver tarefa_periodica.py
+
+Uso:
+    indice = IndiceFornecedores(carregar=funcao() -> [{codigo, nome, cnpj, ...}])
+    indice.iniciar()                          # recarga periódica em segundo plano
+    indice.buscar('construcao', limite=100)
+    indice.resolver_varios(['ACME LTDA', ...])
+=============================================================================
+"""
+
+import threading
+import time
+import unicodedata
+from datetime import datetime
+
+from tarefa_periodica import TarefaPeriodica
+
+SEPARADOR = '\x00'  # entre os campos do texto pesquisável (n-gramas não atravessam campos)
+
+
+def normalizar(texto):
+    """Maiúsculas, sem acentos e com espaços simples"""
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.upper().split())
+
+
+def _ngramas(texto, tamanho):
+    return {texto[i:i + tamanho] for i in range(len(texto) - tamanho + 1)}
+
+
+class _Dados:
+    """Um índice completo (imutável depois de montado)"""
+
+    def __init__(self, registros):
+        registros = sorted(registros, key=lambda r: (normalizar(r['nome']), r['codigo']))
+        self.registros = registros
+        self.codigos = [normalizar(r['codigo']) for r in registros]
+        self.nomes = [normalizar(r['nome']) for r in registros]
+        self.textos = [
+            SEPARADOR.join((codigo, nome, ''.join(c for c in (r.get('cnpj') or '') if c.isdigit())))
+            for codigo, nome, r in zip(self.codigos, self.nomes, registros)
+        ]
+
+        # { código: [posições] } - o código exato vai primeiro sem depender da varredura
+        self.por_codigo = {}
+        for posicao, codigo in enumerate(self.codigos):
+            self.por_codigo.setdefault(codigo, []).append(posicao)
+
+        # { n-grama: [posições em ordem crescente = ordem alfabética] }
+        self.ngramas = {}
+        for posicao, texto in enumerate(self.textos):
+            for tamanho in (2, 3):
+                for ngrama in _ngramas(texto, tamanho):
+                    self.ngramas.setdefault(ngrama, []).append(posicao)
+
+    def candidatos(self, termo):
+        """Posições cujo texto contém o termo (já normalizado), em ordem alfabética"""
+        if len(termo) < 2:
+            return [p for p, texto in enumerate(self.textos) if termo in texto]
+
+        # Lista do n-grama mais raro do termo; o texto de cada candidato é conferido
+        menor = None
+        for ngrama in (_ngramas(termo, 3) if len(termo) >= 3 else {termo}):
+            lista = self.ngramas.get(ngrama)
+            if not lista:
+                return []
+            if menor is None or len(lista) < len(menor):
+                menor = lista
+        textos = self.textos
+        return [p for p in menor if termo in textos[p]]
+
+    def ordenar(self, candidatos, termo, limite):
+        """
+        Os `limite` mais relevantes: código exato, nome (ou código) que começa
+        com o termo, palavra que começa com o termo, demais. Os candidatos já
+        vêm em ordem alfabética, que é o desempate.
+        """
+        exatos = self.por_codigo.get(termo, [])
+        faixas = (exatos, [], [], [])
+        palavra = ' ' + termo
+        for p in candidatos:
+            codigo = self.codigos[p]
+            nome = self.nomes[p]
+            if codigo == termo:
+                continue
+            elif nome.startswith(termo) or codigo.startswith(termo):
+                faixas[1].append(p)
+                if len(faixas[0]) + len(faixas[1]) >= limite:
+                    break
+            elif palavra in nome:
+                faixas[2].append(p)
+            else:
+                faixas[3].append(p)
+        return (faixas[0] + faixas[1] + faixas[2] + faixas[3])[:limite]
+
+
+class IndiceFornecedores:
+    """Cadastro de fornecedores em memória com busca por n-gramas e recarga periódica"""
+
+    def __init__(self, carregar, intervalo=1800, intervalo_maximo=3600, espera_apos_falha=300):
+        """
+        Args:
+            carregar: função() -> [{codigo, nome, cnpj, email, telefone, comprador}]
+            intervalo: segundos entre recargas
+            intervalo_maximo: teto do backoff quando a recarga falha
+            espera_apos_falha: sem índice carregado, segundos após uma carga com
+                               erro em que as consultas não tentam carregar de novo
+        """
+        self.carregar = carregar
+
+        self._dados = None
+        self._lock = threading.Lock()
+
+        self.metricas = {
+            'fornecedores': 0,
+            'ngramas': 0,
+            'recargas': 0,
+            'ultima_recarga': None,
+            'ultima_recarga_ms': None,
+            'buscas': 0,
+            'ultima_busca_us': None
+        }
+        self._tarefa = TarefaPeriodica(
+            'indice-fornecedores', self._recarga_agendada, intervalo, intervalo_maximo=intervalo_maximo,
+            backoff_base=60, metricas=self.metricas, lock=self._lock,
+            espera_apos_falha=espera_apos_falha, descricao='Cadastro de fornecedores'
+        )
+
+    # -------------------------------------------------------------------------
+    # Carga
+    # -------------------------------------------------------------------------
+
+    def _montar(self):
+        """Carrega e troca o índice (chamado com o lock)"""
+        inicio = time.perf_counter()
+        dados = _Dados(self.carregar())
+        self._dados = dados
+        self.metricas['fornecedores'] = len(dados.registros)
+        self.metricas['ngramas'] = len(dados.ngramas)
+        self.metricas['recargas'] += 1
+        self.metricas['ultima_recarga'] = datetime.now().isoformat()
+        self.metricas['ultima_recarga_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        print(f"[INDICE FORNECEDORES] {len(dados.registros)} fornecedores indexados "
+              f"em {self.metricas['ultima_recarga_ms']:.0f} ms")
+        return dados
+
+    def recarregar(self):
+        """Carrega o cadastro e troca o índice. Retorna a quantidade de fornecedores."""
+        with self._lock:
+            return len(self._montar().registros)
+
+    def _recarga_agendada(self):
+        """Execução da thread (retorna None: próxima recarga no intervalo)"""
+        self.recarregar()
+
+    def _obter_dados(self):
+        """Índice atual (carrega na hora se ainda não houver; logo após uma carga com erro, Indisponivel)"""
+        return self._tarefa.carregar_sob_demanda(lambda: self._dados, self._montar)
+
+    # -------------------------------------------------------------------------
+    # Consultas
+    # -------------------------------------------------------------------------
+
+    def buscar(self, termo='', limite=100):
+        """
+        Fornecedores cujo código, nome ou CNPJ contém o termo (sem termo: os
+        primeiros em ordem alfabética). Lista de dicts, os mais relevantes primeiro.
+        """
+        inicio = time.perf_counter()
+        dados = self._obter_dados()
+        termo = normalizar(termo)
+        if not termo:
+            posicoes = range(min(limite, len(dados.registros)))
+        else:
+            candidatos = dados.candidatos(termo)
+            digitos = ''.join(c for c in termo if c.isdigit())
+            if len(digitos) >= 2 and digitos != termo and not candidatos:
+                # CNPJ digitado com pontuação (12.345.678/0001-90)
+                candidatos = dados.candidatos(digitos)
+            posicoes = dados.ordenar(candidatos, termo, limite)
+
+        resultado = [dict(dados.registros[p]) for p in posicoes]
+        self.metricas['buscas'] += 1
+        self.metricas['ultima_busca_us'] = round((time.perf_counter() - inicio) * 1_000_000)
+        return resultado
+
+    def resolver_varios(self, nomes):
+        """
+        Fornecedor de cada nome, pela regra da importação ISO: nome contido no
+        cadastro, preferindo o nome igual e depois a ordem alfabética.
+
+        Returns:
+            { nome: dict do fornecedor } (nomes não encontrados ficam de fora)
+        """
+        dados = self._obter_dados()
+        encontrados = {}
+        for nome in dict.fromkeys(nomes):
+            termo = normalizar(nome)
+            if not termo:
+                continue
+            posicoes = [p for p in dados.candidatos(termo) if termo in dados.nomes[p]]
+            if posicoes:
+                melhor = min(posicoes, key=lambda p: (dados.nomes[p] != termo, p))
+                encontrados[nome] = dict(dados.registros[melhor])
+        return encontrados
+
+    def nomes(self):
+        """Nomes distintos em ordem alfabética"""
+        return list(dict.fromkeys(r['nome'] for r in self._obter_dados().registros))
+
+    def total(self):
+        return len(self._obter_dados().registros)
+
+    # -------------------------------------------------------------------------
+    # Recarga periódica
+    # -------------------------------------------------------------------------
+
+    def iniciar(self):
+        """Inicia a thread de recarga (uma vez por processo; a primeira carga é imediata)"""
+        self._tarefa.iniciar()
+
+    def acordar(self):
+        """Antecipa a próxima recarga"""
+        self._tarefa.acordar()
+
+    def status(self):
+        return {
+            'ativo': self._tarefa.ativa(),
+            'carregado': self._dados is not None,
+            'falha_carga': self._tarefa.falha(),
+            **self.metricas
+        }
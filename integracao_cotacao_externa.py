@@ -16,6 +16,7 @@ Uso:
 """
 
 import requests
+import cliente_http  # Sessão por host, novas tentativas e circuit breaker
 import hashlib
 import hmac
 import json
@@ -23,6 +24,9 @@ import os
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 
+# Máximo de tokens aceito pelo Render por chamada nas rotas em lote
+LIMITE_TOKENS_LOTE = 500
+
 
 class CotacaoExternaClient:
     """
@@ -122,7 +126,7 @@ class CotacaoExternaClient:
         payload['assinatura'] = self._gerar_assinatura(payload)
         
         try:
-            response = requests.post(
+            response = cliente_http.post(
                 f"{self.base_url}/api/cotacao/registrar",
                 json=payload,
                 headers=self._get_headers(),
@@ -162,7 +166,7 @@ class CotacaoExternaClient:
             Dict com status, datas e se foi respondida
         """
         try:
-            response = requests.get(
+            response = cliente_http.get(
                 f"{self.base_url}/api/cotacao/{token}/status",
                 headers=self._get_headers(),
                 timeout=self.timeout
@@ -184,7 +188,7 @@ class CotacaoExternaClient:
             Dict com a resposta completa do fornecedor
         """
         try:
-            response = requests.get(
+            response = cliente_http.get(
                 f"{self.base_url}/api/cotacao/{token}/resposta",
                 headers=self._get_headers(),
                 timeout=self.timeout
@@ -214,6 +218,49 @@ class CotacaoExternaClient:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def obter_respostas_lote(self, tokens: List[str]) -> Dict[str, Any]:
+        """
+        Obtém as respostas de vários tokens (uma chamada a cada LIMITE_TOKENS_LOTE).
+        
+        Args:
+            tokens: Lista de tokens
+        
+        Returns:
+            Dict com 'respostas' ({token: resposta}) e 'nao_respondidos' (tokens sem resposta)
+        """
+        tokens = list(dict.fromkeys(tokens))
+        respostas = {}
+        nao_respondidos = []
+        
+        try:
+            for i in range(0, len(tokens), LIMITE_TOKENS_LOTE):
+                response = cliente_http.post(
+                    f"{self.base_url}/api/respostas/lote",
+                    json={'tokens': tokens[i:i + LIMITE_TOKENS_LOTE]},
+                    headers=self._get_headers(),
+                    timeout=self.timeout,
+                    idempotente=True
+                )
+                
+                data = response.json()
+                if not data.get('success'):
+                    return data
+                
+                for token, item in data.get('respostas', {}).items():
+                    resposta = item['resposta']
+                    resposta.pop('assinatura', None)
+                    respostas[token] = resposta
+                nao_respondidos.extend(data.get('nao_respondidos', []))
+            
+            return {
+                'success': True,
+                'respostas': respostas,
+                'nao_respondidos': nao_respondidos
+            }
+            
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
     def invalidar_cotacao(self, token: str) -> Dict[str, Any]:
         """
         Invalida/cancela uma cotação (expira o link).
@@ -225,10 +272,11 @@ class CotacaoExternaClient:
             Dict com resultado da operação
         """
         try:
-            response = requests.post(
+            response = cliente_http.post(
                 f"{self.base_url}/api/cotacao/{token}/invalidar",
                 headers=self._get_headers(),
-                timeout=self.timeout
+                timeout=self.timeout,
+                idempotente=True
             )
             
             return response.json()
@@ -244,7 +292,7 @@ class CotacaoExternaClient:
             Dict com lista de respostas pendentes
         """
         try:
-            response = requests.get(
+            response = cliente_http.get(
                 f"{self.base_url}/api/respostas/pendentes",
                 headers=self._get_headers(),
                 timeout=self.timeout
@@ -255,6 +303,42 @@ class CotacaoExternaClient:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def confirmar_sincronizacao_lote(self, tokens: List[str]) -> Dict[str, Any]:
+        """
+        Confirma no Render que as respostas dos tokens já foram importadas,
+        para que deixem de aparecer como pendentes. Pode ser repetida.
+        
+        Args:
+            tokens: Lista de tokens importados
+        
+        Returns:
+            Dict com 'confirmados' (aceitos) e 'novos' (ainda não confirmados antes)
+        """
+        tokens = list(dict.fromkeys(tokens))
+        confirmados = novos = 0
+        
+        try:
+            for i in range(0, len(tokens), LIMITE_TOKENS_LOTE):
+                response = cliente_http.post(
+                    f"{self.base_url}/api/confirmar-sincronizacao/lote",
+                    json={'tokens': tokens[i:i + LIMITE_TOKENS_LOTE]},
+                    headers=self._get_headers(),
+                    timeout=self.timeout,
+                    idempotente=True
+                )
+                
+                data = response.json()
+                if not data.get('success'):
+                    return {**data, 'confirmados': confirmados}
+                
+                confirmados += data.get('confirmados', 0)
+                novos += data.get('novos', 0)
+            
+            return {'success': True, 'confirmados': confirmados, 'novos': novos}
+            
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'confirmados': confirmados}
+    
     def health_check(self) -> bool:
         """
         Verifica se a aplicação externa está online.
@@ -263,9 +347,10 @@ class CotacaoExternaClient:
             True se online, False caso contrário
         """
         try:
-            response = requests.get(
+            response = cliente_http.get(
                 f"{self.base_url}/health",
-                timeout=5
+                timeout=5,
+                tentativas=1
             )
             return response.status_code == 200
         except:
@@ -0,0 +1,139 @@
+"""
+=============================================================================
+ENTREGA DE ARQUIVOS - ETAG POR CONTEÚDO, 304, RANGE E X-SENDFILE
+=============================================================================
+Camada única usada pelas rotas que servem arquivos de uploads/ (anexos de
+fornecedores, documentos ISO, PDFs de pré-visualização):
+
+- ETag = SHA-256 do conteúdo: o navegador revalida e recebe 304 sem corpo
+  em vez de baixar o PDF inteiro de novo a cada visualização
+- HTTP Range (206): o visualizador de PDF pede só as páginas que mostra
+- Índice de metadados em memória por caminho (tamanho, mtime, hash, mimetype),
+  validado por os.stat: o arquivo só é relido para o hash quando muda
+- Opcional: entrega pelo servidor da frente (ARQUIVOS_SENDFILE), liberando a
+  thread do gunicorn em vez de ocupá-la enviando bytes
+    'x-sendfile'          → Apache mod_xsendfile / lighttpd (caminho absoluto)
+    'x-accel:<prefixo>'   → nginx; <prefixo> é a location internal que aponta
+                            para a pasta base (ex.: x-accel:/_arquivos/)
+  Nesses modos o Range é atendido pelo próprio servidor da frente.
+
+Uso:
+    arquivos = ServidorArquivos(pasta_base, sendfile=os.getenv('ARQUIVOS_SENDFILE'))
+    return arquivos.enviar(caminho, inline=True)
+    return arquivos.enviar(caminho, nome_download='Relatorio.pdf')
+=============================================================================
+"""
+
+import mimetypes
+import os
+import threading
+
+from flask import request
+from werkzeug.utils import send_file
+
+from conversor_pdf import hash_arquivo
+
+
+class ServidorArquivos:
+    """Respostas condicionais (ETag/304/Range) para arquivos locais"""
+
+    def __init__(self, pasta_base, sendfile=None):
+        """
+        Args:
+            pasta_base: raiz dos caminhos relativos gravados no banco (e da
+                        location do nginx no modo x-accel)
+            sendfile: None, 'x-sendfile' ou 'x-accel:<prefixo>'
+        """
+        self.pasta_base = os.path.abspath(pasta_base)
+        self.modo, _, self.prefixo_accel = (sendfile or '').partition(':')
+        if self.modo not in ('', 'x-sendfile', 'x-accel'):
+            raise ValueError(f"ARQUIVOS_SENDFILE inválido: {sendfile!r} (use 'x-sendfile' ou 'x-accel:<prefixo>')")
+        if self.modo == 'x-accel':
+            self.prefixo_accel = '/' + (self.prefixo_accel or '/_arquivos/').strip('/') + '/'
+
+        self._indice = {}  # { caminho absoluto: {tamanho, mtime, etag, mimetype} }
+        self._lock = threading.Lock()
+        self.metricas = {'respostas': 0, 'nao_modificados': 0, 'parciais': 0, 'hashes_calculados': 0}
+
+    def caminho_absoluto(self, caminho):
+        return caminho if os.path.isabs(caminho) else os.path.join(self.pasta_base, caminho)
+
+    def metadados(self, caminho):
+        """Entrada do índice (recalcula o hash só se tamanho/mtime mudarem). None se não existir."""
+        caminho = self.caminho_absoluto(caminho)
+        try:
+            estado = os.stat(caminho)
+        except OSError:
+            return None
+        with self._lock:
+            entrada = self._indice.get(caminho)
+        if entrada and (entrada['mtime'], entrada['tamanho']) == (estado.st_mtime, estado.st_size):
+            return entrada
+
+        entrada = {
+            'caminho': caminho,
+            'tamanho': estado.st_size,
+            'mtime': estado.st_mtime,
+            'etag': hash_arquivo(caminho),
+            'mimetype': mimetypes.guess_type(caminho)[0] or 'application/octet-stream'
+        }
+        with self._lock:
+            self._indice[caminho] = entrada
+        self.metricas['hashes_calculados'] += 1
+        return entrada
+
+    def existe(self, caminho):
+        return bool(caminho) and os.path.isfile(self.caminho_absoluto(caminho))
+
+    def enviar(self, caminho, inline=False, nome_download=None, mimetype=None):
+        """
+        Resposta do arquivo com ETag, Last-Modified, 304 e Range.
+
+        Args:
+            inline: True abre no navegador (Content-Disposition: inline)
+            nome_download: nome sugerido (padrão: nome do arquivo em disco)
+            mimetype: padrão pelo nome do arquivo
+        """
+        entrada = self.metadados(caminho)
+        if entrada is None:
+            raise FileNotFoundError(caminho)
+
+        environ = request.environ
+        if self.modo:
+            # O servidor da frente lê o arquivo e atende o Range sozinho
+            environ = {k: v for k, v in environ.items() if k != 'HTTP_RANGE'}
+
+        resposta = send_file(
+            entrada['caminho'],
+            environ,
+            mimetype=mimetype or entrada['mimetype'],
+            as_attachment=not inline,
+            download_name=nome_download or os.path.basename(entrada['caminho']),
+            conditional=True,
+            etag=entrada['etag'],
+            last_modified=entrada['mtime'],
+            use_x_sendfile=bool(self.modo)
+        )
+        resposta.cache_control.private = True
+
+        if self.modo == 'x-accel' and 'X-Sendfile' in resposta.headers:
+            relativo = os.path.relpath(entrada['caminho'], self.pasta_base).replace(os.sep, '/')
+            if relativo.startswith('..'):
+                raise ValueError(f'{caminho} está fora de {self.pasta_base} (x-accel)')
+            del resposta.headers['X-Sendfile']
+            resposta.headers['X-Accel-Redirect'] = self.prefixo_accel + relativo
+
+        self.metricas['respostas'] += 1
+        if resposta.status_code == 304:
+            self.metricas['nao_modificados'] += 1
+        elif resposta.status_code == 206:
+            self.metricas['parciais'] += 1
+        return resposta
+
+    def status(self):
+        return {
+            'modo': self.modo or 'gunicorn',
+            'prefixo_accel': self.prefixo_accel if self.modo == 'x-accel' else None,
+            'arquivos_indexados': len(self._indice),
+            **self.metricas
+        }
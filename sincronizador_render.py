@@ -0,0 +1,306 @@
+"""
+=============================================================================
+SINCRONIZADOR - RESPOSTAS DE COTAÇÕES EXTERNAS (RENDER → BANCO LOCAL)
+=============================================================================
+Roda em segundo plano no sistema local, independente de haver abas abertas:
+
+1. Busca no Render um lote de respostas pendentes (/api/respostas-pendentes,
+   com ETag: sem novidade → 304)
+2. Importa cada resposta no banco local (uma transação por resposta,
+   idempotente por token)
+3. Confirma no Render todas as respostas importadas do lote em uma chamada
+4. Avisa as abas (callback) e repete no intervalo configurado, com backoff
+   exponencial quando o Render falha
+5. Resposta que falha na importação fica pendente e volta nos próximos ciclos;
+   depois de `maximo_falhas` tentativas ela é estacionada (não é mais importada
+   neste processo) e o cursor do feed passa por ela, para não travar as
+   seguintes. Ciclo que não confirma nada espera o intervalo normal.
+6. Fora da janela de expediente (função `janela`, a mesma do keep-warm), cada
+   ciclo seguido sem nenhuma resposta dobra a espera até `intervalo_ocioso`,
+   acima dos ~15 min de inatividade do Render: à noite o serviço pode hibernar.
+
+Uso:
+    sincronizador = SincronizadorRender(RENDER_PUBLIC_URL, db.importar_resposta_render)
+    sincronizador.iniciar()
+    sincronizador.status()
+    sincronizador.reprocessar_estacionadas()   # após corrigir a causa da falha
+=============================================================================
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+import cliente_http
+from tarefa_periodica import TarefaPeriodica
+
+
+class SincronizadorRender:
+    """Laço de sincronização Render → banco local com métricas da última execução"""
+
+    def __init__(self, url_base, importar, ao_sincronizar=None, intervalo=15,
+                 intervalo_maximo=300, lote=100, timeout=15, maximo_falhas=5,
+                 janela=None, intervalo_ocioso=1800):
+        """
+        Args:
+            url_base: URL pública do serviço no Render
+            importar: função(resposta) -> dict com 'importada'/'ja_importada'
+            ao_sincronizar: função(resposta, resultado) chamada a cada importação nova
+            intervalo: segundos entre ciclos sem erro
+            intervalo_maximo: teto do backoff em caso de erro
+            lote: respostas buscadas por ciclo (máx. 500 no Render)
+            maximo_falhas: tentativas de importação antes de estacionar a resposta
+            janela: função() -> bool, True no expediente (intervalo fixo); sem ela
+                    o intervalo é sempre o fixo
+            intervalo_ocioso: teto da espera fora da janela quando o feed vem vazio
+        """
+        self.url_base = url_base.rstrip('/')
+        self.importar = importar
+        self.ao_sincronizar = ao_sincronizar
+        self.intervalo = intervalo
+        self.lote = lote
+        self.timeout = timeout
+        self.maximo_falhas = maximo_falhas
+        self.janela = janela
+        self.intervalo_ocioso = intervalo_ocioso
+
+        self._etag = None
+        self._cursor = 0          # seq já percorrida no feed (só avança por estacionadas)
+        self._falhas = {}         # { token: tentativas de importação que falharam }
+        self._estacionadas = {}   # { token: {'seq', 'tentativas', 'erro', 'desde'} }
+        self._lock = threading.Lock()
+
+        self.metricas = {
+            'ciclos': 0,
+            'ultima_execucao': None,
+            'ultimo_sucesso': None,
+            'ultima_duracao_ms': None,
+            'ciclos_vazios_seguidos': 0,
+            'pendentes_ultimo_lote': 0,
+            'importadas': 0,
+            'ja_importadas': 0,
+            'falhas_importacao': 0,
+            'estacionadas': 0,
+            'confirmadas': 0,
+            'atraso_ultima_segundos': None,
+            'atraso_maximo_segundos': None
+        }
+        self._tarefa = TarefaPeriodica(
+            'sincronizador-render', self._executar_agendado, intervalo,
+            intervalo_maximo=intervalo_maximo, rotulo='SINCRONIZADOR', metricas=self.metricas
+        )
+
+    # -------------------------------------------------------------------------
+    # Ciclo
+    # -------------------------------------------------------------------------
+
+    def _buscar_pendentes(self):
+        """Retorna (respostas, tem_mais). Lista vazia quando o Render responde 304."""
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = cliente_http.get(
+            f'{self.url_base}/api/respostas-pendentes',
+            params={'since': self._cursor, 'limite': self.lote},
+            headers=headers,
+            timeout=self.timeout,
+            tentativas=1  # o laço já faz backoff entre ciclos
+        )
+        if response.status_code == 304:
+            return [], False
+        response.raise_for_status()
+
+        dados = response.json()
+        if not dados.get('success'):
+            raise RuntimeError(dados.get('error', 'Resposta inválida do Render'))
+
+        self._etag = response.headers.get('ETag')
+        return dados.get('respostas', []), dados.get('tem_mais', False)
+
+    def _confirmar(self, tokens):
+        """
+        Confirma no Render os tokens importados em uma única chamada
+        (/api/confirmar-sincronizacao/lote). Retorna quantos foram aceitos.
+        """
+        try:
+            response = cliente_http.post(
+                f'{self.url_base}/api/confirmar-sincronizacao/lote',
+                json={'tokens': tokens},
+                timeout=self.timeout,
+                idempotente=True
+            )
+            if response.status_code == 404:
+                # Render ainda sem a rota em lote: confirma um a um
+                return self._confirmar_individual(tokens)
+            response.raise_for_status()
+            return response.json().get('confirmados', 0)
+        except requests.RequestException as e:
+            # Ficam pendentes no Render; a importação é idempotente e o próximo ciclo confirma
+            print(f"[SINCRONIZADOR] Aviso: erro ao confirmar {len(tokens)} token(s): {e}")
+            self._etag = None
+            return 0
+
+    def _confirmar_individual(self, tokens):
+        confirmados = 0
+        for token in tokens:
+            try:
+                response = cliente_http.post(
+                    f'{self.url_base}/api/confirmar-sincronizacao',
+                    json={'token': token},
+                    timeout=self.timeout,
+                    idempotente=True
+                )
+                if response.status_code == 200:
+                    confirmados += 1
+                else:
+                    print(f"[SINCRONIZADOR] Aviso: confirmação de {token[:8]}... recusada: {response.status_code}")
+            except requests.RequestException as e:
+                print(f"[SINCRONIZADOR] Aviso: erro ao confirmar {token[:8]}...: {e}")
+        if confirmados < len(tokens):
+            # Algum token continua pendente no Render: não confiar no ETag atual
+            self._etag = None
+        return confirmados
+
+    def _registrar_atraso(self, respondido_em):
+        try:
+            atraso = (datetime.now() - datetime.fromisoformat(str(respondido_em))).total_seconds()
+        except (TypeError, ValueError):
+            return
+        self.metricas['atraso_ultima_segundos'] = round(atraso, 1)
+        maior = self.metricas['atraso_maximo_segundos']
+        self.metricas['atraso_maximo_segundos'] = round(max(atraso, maior or 0), 1)
+
+    def _registrar_falha(self, resposta, token, erro):
+        """Conta a falha do token; na `maximo_falhas`-ésima a resposta é estacionada"""
+        self.metricas['falhas_importacao'] += 1
+        tentativas = self._falhas.get(token, 0) + 1
+        if tentativas < self.maximo_falhas:
+            self._falhas[token] = tentativas
+            print(f"[SINCRONIZADOR] Erro ao importar {token[:8]}... ({tentativas}x): {erro}")
+            return
+
+        self._falhas.pop(token, None)
+        self._estacionadas[token] = {
+            'seq': resposta.get('seq'),
+            'tentativas': tentativas,
+            'erro': str(erro),
+            'desde': datetime.now().isoformat()
+        }
+        self.metricas['estacionadas'] = len(self._estacionadas)
+        print(f"[SINCRONIZADOR] Resposta {token[:8]}... estacionada após {tentativas} falhas: {erro}")
+
+    def _avancar_cursor(self, respostas, confirmados):
+        """
+        Avança o cursor do feed pelas respostas do início do lote que já foram
+        confirmadas ou estacionadas; a primeira ainda pendente (em nova tentativa
+        ou com confirmação falha) segura o cursor. Retorna True se ele andou.
+        """
+        cursor = self._cursor
+        for resposta in respostas:
+            seq = resposta.get('seq')
+            token = resposta.get('token') or ''
+            if seq is None or (token not in confirmados and token not in self._estacionadas):
+                break
+            cursor = max(cursor, seq)
+        if cursor == self._cursor:
+            return False
+        self._cursor = cursor
+        self._etag = None
+        return True
+
+    def reprocessar_estacionadas(self):
+        """Volta o cursor ao início e devolve as estacionadas à importação. Retorna quantas eram."""
+        with self._lock:
+            total = len(self._estacionadas)
+            self._estacionadas.clear()
+            self._cursor = 0
+            self._etag = None
+            self.metricas['estacionadas'] = 0
+        self.acordar()
+        return total
+
+    def executar_ciclo(self):
+        """
+        Um ciclo completo (buscar → importar → confirmar).
+        Retorna True se o Render indicou que há mais respostas pendentes e o
+        ciclo andou (confirmou ou estacionou alguma); senão o laço espera o
+        intervalo, em vez de buscar de novo o mesmo lote na hora.
+        """
+        with self._lock:
+            inicio = time.perf_counter()
+            self.metricas['ciclos'] += 1
+            self.metricas['ultima_execucao'] = datetime.now().isoformat()
+
+            respostas, tem_mais = self._buscar_pendentes()
+            self.metricas['pendentes_ultimo_lote'] = len(respostas)
+
+            para_confirmar = []
+            for resposta in respostas:
+                token = resposta.get('token') or ''
+                if token in self._estacionadas:
+                    continue
+                try:
+                    resultado = self.importar(resposta)
+                except Exception as e:
+                    # Fica pendente no Render e volta no próximo ciclo
+                    self._etag = None
+                    self._registrar_falha(resposta, token, e)
+                    continue
+
+                self._falhas.pop(token, None)
+                para_confirmar.append(token)
+                if resultado.get('ja_importada'):
+                    self.metricas['ja_importadas'] += 1
+                    continue
+
+                self.metricas['importadas'] += 1
+                self._registrar_atraso(resposta.get('respondido_em'))
+                if self.ao_sincronizar:
+                    self.ao_sincronizar(resposta, resultado)
+
+            confirmadas = 0
+            if para_confirmar:
+                confirmadas = self._confirmar(para_confirmar)
+                self.metricas['confirmadas'] += confirmadas
+                print(f"[SINCRONIZADOR] {len(para_confirmar)} resposta(s) sincronizada(s) com o Render")
+            cursor_andou = self._avancar_cursor(
+                respostas, set(para_confirmar) if confirmadas == len(para_confirmar) else set())
+
+            self.metricas['ultimo_sucesso'] = datetime.now().isoformat()
+            self.metricas['ultima_duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            return tem_mais and (confirmadas > 0 or cursor_andou)
+
+    # -------------------------------------------------------------------------
+    # Agendamento
+    # -------------------------------------------------------------------------
+
+    def _espera_sem_erro(self):
+        """Intervalo fixo; fora da janela, backoff enquanto o feed vier vazio"""
+        if self.metricas['pendentes_ultimo_lote']:
+            self.metricas['ciclos_vazios_seguidos'] = 0
+            return self.intervalo
+        self.metricas['ciclos_vazios_seguidos'] += 1
+        if self.janela is None or self.janela():
+            return self.intervalo
+        return min(self.intervalo * 2 ** self.metricas['ciclos_vazios_seguidos'], self.intervalo_ocioso)
+
+    def _executar_agendado(self):
+        """Execução da thread: sem espera quando o Render tem mais respostas e o ciclo andou"""
+        return 0 if self.executar_ciclo() else self._espera_sem_erro()
+
+    def iniciar(self):
+        """Inicia a thread do laço (uma vez por processo)"""
+        if self._tarefa.iniciar():
+            print(f"[SINCRONIZADOR] Iniciado (intervalo {self.intervalo}s, lote {self.lote})")
+
+    def acordar(self):
+        """Antecipa o próximo ciclo (ex.: usuário clicou em 'verificar agora')"""
+        self._tarefa.acordar()
+
+    def status(self):
+        return {
+            'ativo': self._tarefa.ativa(),
+            'cursor': self._cursor,
+            'estacionadas_tokens': {token[:8]: info for token, info in self._estacionadas.items()},
+            **self.metricas
+        }
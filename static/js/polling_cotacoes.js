@@ -3,11 +3,16 @@
  * POLLING GLOBAL - SINCRONIZAÇÃO AUTOMÁTICA DE COTAÇÕES EXTERNAS
  * =============================================================================
  * 
- * Este script roda em TODAS as páginas do sistema e monitora automaticamente
- * as respostas de cotações externas, sincronizando-as com o banco local.
+ * Este script roda em TODAS as páginas do sistema e avisa quando respostas de
+ * cotações externas são sincronizadas com o banco local.
+ * 
+ * A sincronização em si é feita no servidor (sincronizador em segundo plano);
+ * as abas apenas escutam e atualizam a tela.
  * 
  * Funcionalidades:
- * - Polling a cada 20 segundos
+ * - Canal de eventos do servidor (SSE em /api/cotacoes-externas/eventos)
+ * - Fallback: polling a cada 20 segundos em /api/cotacoes-externas/eventos/recentes
+ *   quando o navegador não suporta EventSource ou o canal falha repetidamente
  * - Notificação toast quando uma resposta chega
  * - Atualização automática se estiver na página de cotação
  * - Armazenamento de notificações pendentes
@@ -24,6 +29,10 @@
     
     const CONFIG = {
         POLLING_INTERVAL: 20000,  // 20 segundos
+        SSE_URL: '/api/cotacoes-externas/eventos',
+        EVENTOS_RECENTES_URL: '/api/cotacoes-externas/eventos/recentes',
+        SSE_MAX_FALHAS: 3,        // falhas seguidas antes de cair para polling
+        SSE_NOVA_TENTATIVA: 300000, // 5 minutos em polling antes de tentar o SSE de novo
         TOAST_DURATION: 5000,     // 5 segundos
         MAX_RETRIES: 3,
         RETRY_DELAY: 5000
@@ -35,6 +44,14 @@
     let retryCount = 0;
     let toastContainer = null;
     
+    // Último evento recebido (SSE ou polling) - o fallback continua a partir dele
+    let ultimoEventoId = null;
+    
+    // Canal SSE / polling de fallback
+    let eventSource = null;
+    let falhasSSE = 0;
+    let pollingTimer = null;
+    
     // =========================================================================
     // INICIALIZAÇÃO
     // =========================================================================
@@ -265,13 +282,68 @@
     // =========================================================================
     
     function iniciarPolling() {
+        if (window.EventSource) {
+            conectarSSE();
+        } else {
+            iniciarPollingFallback();
+        }
+    }
+    
+    function conectarSSE() {
+        console.log('[POLLING GLOBAL] Conectando ao canal de eventos (SSE)...');
+        
+        eventSource = new EventSource(CONFIG.SSE_URL);
+        
+        eventSource.onopen = function() {
+            falhasSSE = 0;
+            console.log('[POLLING GLOBAL] Canal de eventos conectado');
+        };
+        
+        eventSource.addEventListener('sincronizada', function(e) {
+            ultimoEventoId = parseInt(e.lastEventId, 10) || ultimoEventoId;
+            if (!pollingAtivo) return;
+            try {
+                notificarSincronizacao(JSON.parse(e.data));
+            } catch (error) {
+                console.error('[POLLING GLOBAL] Evento inválido:', error);
+            }
+        });
+        
+        eventSource.onerror = function() {
+            // O EventSource reconecta sozinho; após várias falhas seguidas cai para polling.
+            // Conexão recusada (503: canal lotado) fecha o EventSource sem reconectar:
+            // vai direto para o polling.
+            falhasSSE++;
+            if (falhasSSE >= CONFIG.SSE_MAX_FALHAS || eventSource.readyState === EventSource.CLOSED) {
+                console.warn('[POLLING GLOBAL] Canal de eventos indisponível, usando polling');
+                eventSource.close();
+                eventSource = null;
+                iniciarPollingFallback();
+                setTimeout(function() {
+                    pararPollingFallback();
+                    falhasSSE = 0;
+                    conectarSSE();
+                }, CONFIG.SSE_NOVA_TENTATIVA);
+            }
+        };
+    }
+    
+    function iniciarPollingFallback() {
+        if (pollingTimer) return;
         console.log('[POLLING GLOBAL] Iniciando verificações periódicas...');
         
         // Executa imediatamente
         verificarRespostas();
         
         // Agenda verificações periódicas
-        setInterval(verificarRespostas, CONFIG.POLLING_INTERVAL);
+        pollingTimer = setInterval(verificarRespostas, CONFIG.POLLING_INTERVAL);
+    }
+    
+    function pararPollingFallback() {
+        if (pollingTimer) {
+            clearInterval(pollingTimer);
+            pollingTimer = null;
+        }
     }
     
     async function verificarRespostas() {
@@ -280,8 +352,10 @@
         pollingEmAndamento = true;
         
         try {
-            // Consulta endpoint de polling
-            const response = await fetch('/api/cotacoes-externas/polling');
+            const url = ultimoEventoId === null
+                ? CONFIG.EVENTOS_RECENTES_URL
+                : `${CONFIG.EVENTOS_RECENTES_URL}?desde=${ultimoEventoId}`;
+            const response = await fetch(url);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
@@ -294,21 +368,14 @@
                 return;
             }
             
-            const respostas = data.respostas || [];
-            
-            if (respostas.length === 0) {
-                retryCount = 0; // Reset retry counter on success
-                return;
-            }
-            
-            console.log(`[POLLING GLOBAL] ${respostas.length} resposta(s) pendente(s)`);
-            
-            // Processa cada resposta
-            for (const resposta of respostas) {
-                await sincronizarResposta(resposta);
+            for (const evento of data.eventos || []) {
+                if (evento.tipo === 'sincronizada') {
+                    notificarSincronizacao(evento.dados);
+                }
             }
             
-            retryCount = 0;
+            ultimoEventoId = data.ultimo_id;
+            retryCount = 0; // Reset retry counter on success
             
         } catch (error) {
             console.error('[POLLING GLOBAL] Erro:', error);
@@ -322,34 +389,14 @@
         }
     }
     
-    async function sincronizarResposta(resposta) {
-        try {
-            console.log(`[POLLING GLOBAL] Sincronizando resposta de ${resposta.fornecedor_nome}...`);
-            
-            const syncResponse = await fetch('/api/cotacoes-externas/sincronizar-render', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(resposta)
-            });
-            
-            const syncData = await syncResponse.json();
-            
-            if (syncData.success) {
-                console.log(`[POLLING GLOBAL] ✓ Resposta sincronizada: ${resposta.fornecedor_nome}`);
-                
-                // Mostra notificação toast
-                mostrarToast(resposta.fornecedor_nome, resposta.cotacao_id);
-                
-                // Verifica se estamos na página da cotação e atualiza
-                atualizarPaginaSeNecessario(resposta);
-                
-            } else {
-                console.error('[POLLING GLOBAL] Erro ao sincronizar:', syncData.error);
-            }
-            
-        } catch (error) {
-            console.error('[POLLING GLOBAL] Erro ao sincronizar resposta:', error);
-        }
+    function notificarSincronizacao(resposta) {
+        console.log(`[POLLING GLOBAL] ✓ Resposta sincronizada: ${resposta.fornecedor_nome}`);
+        
+        // Mostra notificação toast
+        mostrarToast(resposta.fornecedor_nome, resposta.cotacao_id);
+        
+        // Verifica se estamos na página da cotação e atualiza
+        atualizarPaginaSeNecessario(resposta);
     }
     
     // =========================================================================
@@ -406,12 +453,16 @@
             console.log('[POLLING GLOBAL] Polling retomado');
         },
         verificarAgora: function() {
-            verificarRespostas();
+            // Antecipa o ciclo do sincronizador; o resultado chega pelo canal
+            fetch('/api/cotacoes-externas/sincronizador/executar', { method: 'POST' })
+                .then(() => { if (pollingTimer) verificarRespostas(); })
+                .catch((error) => console.error('[POLLING GLOBAL] Erro:', error));
         },
         status: function() {
             return {
                 ativo: pollingAtivo,
                 emAndamento: pollingEmAndamento,
+                canal: eventSource ? 'sse' : (pollingTimer ? 'polling' : 'inativo'),
                 intervalo: CONFIG.POLLING_INTERVAL
             };
         }
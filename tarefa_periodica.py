@@ -0,0 +1,146 @@
+"""
+=============================================================================
+TAREFA PERIÓDICA EM SEGUNDO PLANO
+=============================================================================
+Base comum das rotinas que rodam em uma thread própria do processo (índice
+de fornecedores, catálogo de produtos, sincronizador e keep-warm do Render,
+fila de e-mails):
+
+- Uma thread daemon por processo (iniciar() pode ser chamado várias vezes)
+- acordar() antecipa a próxima execução
+- `executar()` retorna a espera até a próxima execução (None = `intervalo`);
+  se levantar exceção, a espera dobra a cada erro seguido até `intervalo_maximo`
+- Métricas comuns no dict do dono: proxima_execucao, erros_seguidos, ultimo_erro
+- Primeira carga sob demanda (carregar_sob_demanda): pedidos simultâneos
+  aguardam a mesma carga; depois de uma falha, levantam Indisponivel na hora
+  por `espera_apos_falha` segundos em vez de cada um tentar de novo (e esperar
+  o timeout do TOTVS) - a thread continua tentando
+
+Uso:
+    tarefa = TarefaPeriodica('catalogo-produtos', executar=funcao() -> espera ou None,
+                             intervalo=300, intervalo_maximo=3600, metricas=self.metricas)
+    tarefa.iniciar()
+    tarefa.acordar()
+    dados = tarefa.carregar_sob_demanda(lambda: self._dados, self._montar)
+=============================================================================
+"""
+
+import threading
+import time
+from datetime import datetime
+
+
+class Indisponivel(Exception):
+    """Dados ainda não carregados e a última carga falhou há pouco"""
+
+
+class TarefaPeriodica:
+    """Thread em segundo plano com intervalo, acordar, backoff nos erros e métricas"""
+
+    def __init__(self, nome, executar, intervalo, intervalo_maximo=3600, backoff_base=None,
+                 rotulo=None, metricas=None, lock=None, espera_apos_falha=300, descricao='Dados'):
+        """
+        Args:
+            nome: nome da thread
+            executar: função() -> segundos até a próxima execução (None = intervalo)
+            intervalo: espera padrão entre execuções
+            intervalo_maximo: teto do backoff em caso de erro
+            backoff_base: primeira espera após erro, antes de dobrar (padrão: intervalo)
+            rotulo: prefixo dos logs (padrão: nome em maiúsculas)
+            metricas: dict do dono onde as métricas comuns são gravadas
+            lock: lock do dono que protege a carga (carregar_sob_demanda)
+            espera_apos_falha: segundos em que carregar_sob_demanda não tenta de novo
+            descricao: nome dos dados na mensagem de Indisponivel
+        """
+        self.nome = nome
+        self.executar = executar
+        self.intervalo = intervalo
+        self.intervalo_maximo = intervalo_maximo
+        self.backoff_base = backoff_base or intervalo
+        self.rotulo = rotulo or nome.replace('-', ' ').upper()
+        self.lock = lock or threading.Lock()
+        self.espera_apos_falha = espera_apos_falha
+        self.descricao = descricao
+
+        self.metricas = metricas if metricas is not None else {}
+        self.metricas.update({'proxima_execucao': None, 'erros_seguidos': 0, 'ultimo_erro': None})
+
+        self._thread = None
+        self._acordar = threading.Event()
+        self._falha = None  # (time.monotonic(), erro) da última execução/carga que falhou
+
+    # -------------------------------------------------------------------------
+    # Thread
+    # -------------------------------------------------------------------------
+
+    def _registrar_falha(self, erro):
+        self._falha = (time.monotonic(), str(erro))
+        self.metricas['erros_seguidos'] += 1
+        self.metricas['ultimo_erro'] = f"{datetime.now().isoformat()} {erro}"
+
+    def _loop(self):
+        while True:
+            try:
+                espera = self.executar()
+                self.metricas['erros_seguidos'] = 0
+                self._falha = None
+                if espera is None:
+                    espera = self.intervalo
+            except Exception as e:
+                self._registrar_falha(e)
+                erros = self.metricas['erros_seguidos']
+                espera = min(self.backoff_base * 2 ** erros, self.intervalo_maximo)
+                print(f"[{self.rotulo}] Erro ({erros}x), nova tentativa em {espera:.0f}s: {e}")
+
+            self.metricas['proxima_execucao'] = datetime.fromtimestamp(time.time() + espera).isoformat()
+            self._acordar.wait(espera)
+            self._acordar.clear()
+
+    def iniciar(self):
+        """Inicia a thread (uma vez por processo). Retorna True se iniciou agora."""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+        self._thread.start()
+        return True
+
+    def acordar(self):
+        """Antecipa a próxima execução"""
+        self._acordar.set()
+
+    def ativa(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def falha(self):
+        """Mensagem da última falha (None depois de uma execução com sucesso)"""
+        return self._falha[1] if self._falha else None
+
+    # -------------------------------------------------------------------------
+    # Primeira carga sob demanda
+    # -------------------------------------------------------------------------
+
+    def _verificar_falha(self):
+        falha = self._falha
+        if falha and time.monotonic() - falha[0] < self.espera_apos_falha:
+            raise Indisponivel(f'{self.descricao} indisponível: {falha[1]}')
+
+    def carregar_sob_demanda(self, atual, carregar):
+        """
+        atual() se já houver dados; senão carregar() com o lock (quem chega
+        durante a carga aguarda a mesma). Logo após uma carga com erro levanta
+        Indisponivel sem tentar de novo.
+        """
+        dados = atual()
+        if dados is None:
+            self._verificar_falha()
+            with self.lock:
+                dados = atual()
+                if dados is None:
+                    self._verificar_falha()  # quem aguardava a carga que falhou
+                    try:
+                        dados = carregar()
+                    except Exception as e:
+                        self._falha = (time.monotonic(), str(e))
+                        raise Indisponivel(f'{self.descricao} indisponível: {e}') from e
+                    self._falha = None
+        return dados
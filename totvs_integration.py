@@ -7,6 +7,7 @@
 
 import requests
 from requests.auth import HTTPBasicAuth
+import cliente_http  # Sessão por host, novas tentativas e circuit breaker
 import json
 from datetime import datetime
 
@@ -45,10 +46,11 @@ def testar_conexao_totvs():
     try:
         url = f"{TOTVS_API_URL}/api/oauth2/v1/token"
         
-        response = requests.get(
+        response = cliente_http.get(
             url,
             auth=HTTPBasicAuth(TOTVS_API_USER, TOTVS_API_PASSWORD),
-            timeout=5
+            timeout=5,
+            tentativas=1
         )
         
         if response.status_code in [200, 401]:  # 401 também indica que o servidor respondeu
@@ -152,7 +154,7 @@ def enviar_pedido_para_totvs(pedido):
         print(f"[TOTVS] Payload: {json.dumps(payload_totvs, indent=2)}")
         
         # Faz a requisição POST
-        response = requests.post(
+        response = cliente_http.post(
             url,
             json=payload_totvs,
             auth=HTTPBasicAuth(TOTVS_API_USER, TOTVS_API_PASSWORD),
@@ -216,7 +218,7 @@ def consultar_pedido_totvs(numero_pedido):
     try:
         url = f"{TOTVS_API_URL}{TOTVS_ENDPOINT_PEDIDO}/{numero_pedido}"
         
-        response = requests.get(
+        response = cliente_http.get(
             url,
             auth=HTTPBasicAuth(TOTVS_API_USER, TOTVS_API_PASSWORD),
             timeout=REQUEST_TIMEOUT
@@ -0,0 +1,232 @@
+"""
+=============================================================================
+TRANSPORTE DE E-MAIL - SMTP REAL, ARQUIVO (MBOX) OU SERVIDOR FALSO
+=============================================================================
+A fila de saída (fila_email.py) não abre smtplib.SMTP diretamente: pede uma
+conexão ao transporte configurado. Toda conexão tem a interface do
+smtplib.SMTP usada pela fila: sendmail(de, para, mensagem), quit(), close().
+
+- TransporteSMTP: servidor real (Gmail, STARTTLS + login) ou qualquer SMTP
+- TransporteArquivo: grava as mensagens em um arquivo mbox, sem enviar nada
+- ServidorSMTPFalso: servidor SMTP em memória no próprio processo, para testes
+  de carga sem disparar e-mails para fornecedores (latência configurável)
+
+Configuração (EMAIL_TRANSPORTE no app.py):
+    'smtp'              → SMTP_SERVER/SMTP_PORT com a conta do remetente
+    'arquivo:<caminho>' → mbox em <caminho>
+    'falso'             → sobe um ServidorSMTPFalso em 127.0.0.1 (porta livre)
+=============================================================================
+"""
+
+import mailbox
+import smtplib
+import socketserver
+import threading
+import time
+from email import message_from_string
+
+
+class TransporteSMTP:
+    """Conexões SMTP; starttls/login desligáveis para servidores locais"""
+
+    def __init__(self, servidor, porta, usuario=None, senha=None, starttls=True, timeout=30):
+        self.servidor = servidor
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def conectar(self):
+        smtp = smtplib.SMTP(self.servidor, self.porta, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.senha)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def descricao(self):
+        return f'smtp://{self.servidor}:{self.porta}'
+
+
+class _ConexaoArquivo:
+    def __init__(self, transporte):
+        self.transporte = transporte
+
+    def sendmail(self, de, para, mensagem):
+        self.transporte.gravar(de, para, mensagem)
+        return {}
+
+    def quit(self):
+        pass
+
+    close = quit
+
+
+class TransporteArquivo:
+    """Grava cada mensagem em um mbox (destinatários do envelope em X-Envelope-To)"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+    def conectar(self):
+        return _ConexaoArquivo(self)
+
+    def gravar(self, de, para, mensagem):
+        msg = message_from_string(mensagem)
+        msg['X-Envelope-To'] = ', '.join([para] if isinstance(para, str) else para)
+        with self._lock:
+            caixa = mailbox.mbox(self.caminho)
+            try:
+                caixa.lock()
+                caixa.add(mailbox.mboxMessage(msg))
+                caixa.flush()
+            finally:
+                caixa.unlock()
+                caixa.close()
+
+    def descricao(self):
+        return f'arquivo:{self.caminho}'
+
+
+# =============================================================================
+# SERVIDOR SMTP FALSO (em memória)
+# =============================================================================
+
+class _SessaoSMTP(socketserver.StreamRequestHandler):
+    """Subconjunto do SMTP suficiente para o smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def _responder(self, linha):
+        self.wfile.write((linha + '\r\n').encode())
+
+    def handle(self):
+        servidor = self.server.falso
+        servidor._contar_conexao()
+        self._responder('220 servidor-falso ESMTP')
+        remetente, destinatarios = None, []
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            linha = linha.decode('utf-8', 'replace').rstrip('\r\n')
+            comando = linha[:4].upper()
+
+            if comando in ('EHLO', 'HELO'):
+                self._responder('250-servidor-falso')
+                self._responder('250-8BITMIME')
+                self._responder('250 AUTH PLAIN LOGIN')
+            elif comando == 'AUTH':
+                self._responder('235 2.7.0 Autenticado')
+            elif comando == 'MAIL':
+                remetente, destinatarios = linha.split(':', 1)[1].strip(' <>'), []
+                self._responder('250 OK')
+            elif comando == 'RCPT':
+                endereco = linha.split(':', 1)[1].strip(' <>')
+                if endereco in servidor.recusar:
+                    self._responder('550 5.1.1 Destinatário inexistente')
+                else:
+                    destinatarios.append(endereco)
+                    self._responder('250 OK')
+            elif comando == 'DATA':
+                self._responder('354 Fim com <CRLF>.<CRLF>')
+                partes = []
+                while True:
+                    parte = self.rfile.readline()
+                    if not parte or parte in (b'.\r\n', b'.\n'):
+                        break
+                    partes.append(parte[1:] if parte.startswith(b'..') else parte)
+                if servidor.latencia:
+                    time.sleep(servidor.latencia)
+                servidor._registrar(remetente, destinatarios, b''.join(partes))
+                self._responder('250 OK')
+            elif comando == 'QUIT':
+                self._responder('221 Até logo')
+                return
+            else:  # RSET, NOOP e demais
+                self._responder('250 OK')
+
+
+class _ServidorTCP(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ServidorSMTPFalso:
+    """
+    Servidor SMTP local que aceita tudo e só registra.
+
+    Args:
+        latencia: segundos de espera por mensagem (simula o servidor real)
+        recusar: endereços respondidos com 550 (testa o caminho de erro)
+        guardar_conteudo: guarda o texto de cada mensagem em recebidas
+    """
+
+    def __init__(self, host='127.0.0.1', porta=0, latencia=0.0, recusar=(), guardar_conteudo=False):
+        self.latencia = latencia
+        self.recusar = set(recusar)
+        self.guardar_conteudo = guardar_conteudo
+        self.recebidas = []  # { recebida_em (monotonic), remetente, destinatarios, tamanho[, conteudo] }
+        self.conexoes = 0
+        self._lock = threading.Lock()
+        self._tcp = _ServidorTCP((host, porta), _SessaoSMTP)
+        self._tcp.falso = self
+        self.host, self.porta = self._tcp.server_address
+        self._thread = None
+
+    def _contar_conexao(self):
+        with self._lock:
+            self.conexoes += 1
+
+    def _registrar(self, remetente, destinatarios, conteudo):
+        registro = {
+            'recebida_em': time.monotonic(),
+            'remetente': remetente,
+            'destinatarios': destinatarios,
+            'tamanho': len(conteudo)
+        }
+        if self.guardar_conteudo:
+            registro['conteudo'] = conteudo
+        with self._lock:
+            self.recebidas.append(registro)
+
+    def iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._tcp.serve_forever, name='smtp-falso', daemon=True)
+            self._thread.start()
+            print(f"[EMAIL] Servidor SMTP falso em {self.host}:{self.porta}")
+        return self
+
+    def parar(self):
+        self._tcp.shutdown()
+        self._tcp.server_close()
+        self._thread = None
+
+    def total(self):
+        with self._lock:
+            return len(self.recebidas)
+
+    def transporte(self):
+        """TransporteSMTP apontando para este servidor (sem STARTTLS)"""
+        transporte = TransporteSMTP(self.host, self.porta, starttls=False)
+        transporte.servidor_falso = self
+        return transporte
+
+
+def criar_transporte(configuracao, servidor, porta, usuario, senha):
+    """
+    Transporte a partir de EMAIL_TRANSPORTE ('smtp', 'arquivo:<caminho>' ou 'falso').
+    servidor/porta/usuario/senha valem para 'smtp'.
+    """
+    tipo, _, parametro = (configuracao or 'smtp').partition(':')
+    if tipo == 'smtp':
+        return TransporteSMTP(servidor, porta, usuario, senha)
+    if tipo == 'arquivo':
+        return TransporteArquivo(parametro or 'emails_enviados.mbox')
+    if tipo == 'falso':
+        return ServidorSMTPFalso().iniciar().transporte()
+    raise ValueError(f"EMAIL_TRANSPORTE inválido: {configuracao!r} (use 'smtp', 'arquivo:<caminho>' ou 'falso')")